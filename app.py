@@ -2,6 +2,7 @@ import streamlit as st
 from pathlib import Path
 import os
 from PIL import Image
+from core.profiling import PROFILE_PARAM, get_profile_store, is_admin_token
 
 # Impostazioni di base della pagina
 st.set_page_config(
@@ -39,9 +40,27 @@ st.markdown("---")
 col1, col2 = st.columns(2)
 
 with col1:
-    if st.button("🔴 CONTROLLO ACQUA", use_container_width=True):
+    if st.button("🔴 CONTROLLO ACQUA", width='stretch'):
         st.switch_page("pages/controllo_qualita.py")
 
 with col2:
-    if st.button("🔵 OSMOSI", use_container_width=True):
-        st.switch_page("pages/osmosi.py")
\ No newline at end of file
+    if st.button("🔵 OSMOSI", width='stretch'):
+        st.switch_page("pages/osmosi.py")
+# Profili delle esecuzioni più lente, visibili solo con ?profile=<AVS_PROFILE_TOKEN>
+if is_admin_token(st.query_params.get(PROFILE_PARAM)):
+    st.markdown("---")
+    st.subheader("Richieste più lente")
+    store = get_profile_store()
+    entries = store.entries()
+    if not entries:
+        st.info("Nessun profilo salvato. Attiva la profilazione con AVS_PROFILE=1 o aprendo una pagina con ?profile=<token>.")
+    for entry in entries:
+        with st.expander(f"{entry['duration']:.3f} s · {entry['name']} · {entry['started']}"):
+            if entry['details']:
+                st.code(entry['details'], language=None)
+            for kind in entry['kinds']:
+                path = store.path(entry['id'], kind)
+                if path is not None:
+                    with open(path, 'rb') as handle:
+                        st.download_button(f"Scarica .{kind}", handle.read(), file_name=f"{entry['id']}.{kind}",
+                                           key=f"{entry['id']}-{kind}")
@@ -1,18 +1,58 @@
 import pandas as pd
 import plotly.express as px
 import dash_bootstrap_components as dbc
-from dash import Dash, dcc, html, Input, Output, State, dash_table, no_update
+from dash import Dash, dcc, html, Input, Output, State, MATCH, Patch, dash_table, no_update, ctx
 import base64
+import hashlib
+import html as html_escape
 import io
+import json
+import logging
+import math
 import os
 import shutil
+import threading
+from collections import OrderedDict
+from concurrent.futures import CancelledError, ThreadPoolExecutor
 # Import ThemeSwitchAIO for light/dark mode functionality
 from dash_bootstrap_templates import ThemeSwitchAIO
+from flask import abort, g, jsonify, request, send_file
+from core.aggregation import AGGREGATED_CHART_TYPES, aggregate_results, band_figure, choose_bucket
+from core.approximate import APPROX_MIN_ROWS, QualitySketch
+from core.anomaly import ANOMALY_CONTEXT, ANOMALY_KINDS, add_anomaly_points, score_anomalies, update_anomalies
+from core.compliance import (add_out_of_limit_points, apply_limits, compliance_counts, compliance_summary,
+                             exceedance_figure, exceedance_rates, load_limits)
+from core.correlation import correlation_figure, correlation_matrix, pair_figure, pivot_tests, strongest_pair
+from core.filters import filter_quality, quality_options, quality_summary
+from core.ingestion import (add_merged_duplicates, append_quality_rows, iter_quality_csv, list_columns, list_excel_sheets,
+                            load_quality_files, repeated_keys)
+from core.live import LIVE_INTERVAL_MS, open_live_feed
+from core.memory import MODE_SAMPLED, MODE_STORE, estimate_bytes, frame_bytes, get_memory_governor, sampled_notice
+from core.panels import PANEL_BY, PANEL_BY_LABELS, PANEL_COLUMNS, PANEL_HEIGHT, PanelSet
+from core.prewarm import normalize_view, record_view, start_prewarm, view_key
+from core.profiling import (PROFILE_PARAM, discard_profile, finish_profile, get_profile_store, is_admin_token,
+                            profiling_enabled, start_profile)
+from core.store import QUALITY_TABLE, open_store
+from core.tasks import TaskGraph, get_task_pool
+from core.transport import compact_figure, epoch_ms, hover_columns, hover_rows, use_fast_json
+from core.schema import QUALITY_DEDUP_KEYS
+from core.validation import MAX_EXAMPLES, ValidationReport, add_duplicates, validate_quality
+from core.versions import (ADDED, CHANGED, REMOVED, get_version_store, previous_version, record_version,
+                           version_label)
+
+try:
+    import flask_compress
+except ImportError:  # flask-compress is optional: responses are sent uncompressed
+    flask_compress = None
+
+logger = logging.getLogger(__name__)
 
 # -------------------- 1. Data and Cache Initialization --------------------
 # This dictionary holds a placeholder for the dataframe.
 # We will load the data from a file uploaded by the user.
-DATA = {'df': pd.DataFrame(), 'filename': None}
+# 'validation' is the data-check report of the loaded dataset, built once while it is parsed,
+# and 'version' the dataset version it was recorded as (core/versions.py).
+DATA = {'df': pd.DataFrame(), 'filename': None, 'options': None, 'validation': None, 'version': None}
 
 # Define column names for clarity and error handling
 COLUMN_NAMES = {
@@ -25,14 +65,773 @@ COLUMN_NAMES = {
     'abs': 'ABS'
 }
 
+# Optional embedded analytical store (DuckDB/SQLite), enabled with AVS_STORE_PATH.
+# When active, uploads are persisted there and filters, summaries, table pages
+# and exports run as SQL instead of on the in-memory dataframe.
+STORE = open_store()
+
+# Last filtered dataframe, so table pages and exports don't filter again.
+# Key and rows are kept together in one tuple so concurrent requests never mix them.
+FILTER_CACHE = {'entry': None}
+# Daily compliance counts of the last filtered dataframe, for the exceedance-rate chart
+COUNTS_CACHE = {'entry': None}
+# Readings pivoted to (sample, period) x test and their correlation matrix, for the last filters
+CORRELATION_CACHE = {'entry': None}
+# Small-multiples panels of the last filters: panel list, shared axes and colors (core/panels.py)
+PANEL_CACHE = {'entry': None}
+# Cards, compliance chart and main chart of the most recent views, keyed by normalized view
+# (core/prewarm.py). Besides the callbacks, the background pre-warm fills it with the most
+# requested views at startup and after each upload. The generation changes with the data,
+# so a pre-warm still running on the previous data can't store stale results. With the
+# embedded store, 'data_version' is the store's version shared by all worker processes:
+# a write from another worker (an upload, live readings) clears this worker's caches too.
+VIEW_CACHE = {'generation': 0, 'entries': OrderedDict(),
+              'data_version': STORE.data_version() if STORE is not None else None}
+VIEW_CACHE_SIZE = 16
+# Guards VIEW_CACHE, the caches of the last filters above and SKETCH: callbacks run on many threads
+VIEW_CACHE_LOCK = threading.Lock()
+
+# Approximate-first answers for large in-memory datasets (core/approximate.py): strata counts,
+# quantile sketches and a stratified sample, built once per dataset on the task pool. A view
+# that is not cached yet is answered from it at once, and its exact results are computed on
+# the refine pool and swapped in by refine_dashboard_content. A separate pool, because
+# get_view_results waits on a TaskGraph, which must not run on the task pool itself.
+# 'waiters' counts the browsers waiting for each refinement, so one is only dropped when
+# nobody needs it any more.
+SKETCH = {'future': None}
+REFINE = {'futures': OrderedDict(), 'waiters': {}, 'pool': None}
+REFINE_SIZE = 8
+REFINE_WORKERS = 2
+REFINE_LOCK = threading.Lock()
+# How often a browser checks whether the exact results of its view are ready
+REFINE_POLL_MS = 300
+
+# Every full load is recorded as a dataset version (AVS_VERSIONS_PATH): only the rows that
+# changed since the previous load are stored, and any two versions can be compared.
+VERSIONS = get_version_store('quality', QUALITY_DEDUP_KEYS)
+# Rows of the version comparison table sent to the browser
+VERSION_ROWS_SHOWN = 1000
+
+# Regulatory limits per test (AVS_LIMITS_PATH, default documents/limiti.csv), versioned by date.
+# Every reading gets its limits and compliance status once, when it is loaded. A malformed
+# table is logged and ignored, as in the Streamlit pages, so the dashboard still starts.
+try:
+    LIMITS = load_limits()
+except ValueError as e:
+    logger.error("Tabella dei limiti ignorata: %s", e)
+    LIMITS = None
+
+# Optional live feed (AVS_LIVE_SOURCE): a CSV the instruments append to, or a spool
+# directory new files are moved into. New readings are pushed to the open charts.
+LIVE = open_live_feed()
+# Chart types whose traces can be extended point by point in live mode
+LIVE_CHART_TYPES = ('line', 'scatter')
+
+# Memory held by the dataset and the filtered rows (core/memory.py). The Dash app has one
+# process-wide dataset shared by every browser, so it is accounted to a single owner; CSV uploads
+# too large for the budget are streamed into the embedded store when enabled, other files sampled.
+MEMORY = get_memory_governor()
+MEMORY_OWNER = 'dash'
+
+# Default dataset(s) loaded at startup, separated by os.pathsep (e.g. documents/controllo_qualita.xlsx)
+DEFAULT_DATA_ENV = 'AVS_DEFAULT_DATA'
+# Set once the default datasets are loaded; reported by the readiness endpoint
+STATUS = {'ready': False, 'error': None}
+
+
+def decode_uploads(contents, filenames):
+    """Decode the base64 payloads of dcc.Upload into named in-memory files."""
+    sources = []
+    for content, filename in zip(contents, filenames):
+        source = io.BytesIO(base64.b64decode(content.split(',')[1]))
+        source.name = filename
+        sources.append(source)
+    return sources
+
+def plan_loading(sources, filenames=None):
+    """
+    How to load new data, from its estimated in-memory size: MODE_FULL, MODE_STORE (streamed into
+    the embedded store) or MODE_SAMPLED. Returns the mode, the sample fraction (None: every
+    reading) and the estimate, for the notice shown when the data is sampled.
+    """
+    estimated = estimate_bytes(sources, filenames)
+    names = filenames or [getattr(source, 'name', source) for source in sources]
+    # Only CSV files can be read one chunk at a time: larger Excel files are sampled even with a store
+    streamable = STORE is not None and all(str(name).lower().endswith('.csv') for name in names)
+    mode, fraction = MEMORY.plan(MEMORY_OWNER, estimated, store_available=streamable,
+                                 replaces=MEMORY.slot_bytes(MEMORY_OWNER, 'dataset'))
+    return mode, (round(fraction, 3) if mode == MODE_SAMPLED else None), estimated
+
+
+def stream_to_store(sources, usecols=None, report=None):
+    """
+    Write CSV files too large for memory into the embedded store one chunk at a time, so the
+    whole dataset is never parsed in memory. Limits and anomaly scores are attached per chunk,
+    the anomalies scored against the tail of each series already written (as for live readings).
+
+    Repeated keys follow merge_quality_frames however the files are split into chunks: a single
+    file is written as it is, while with several files every reading replaces the earlier ones
+    with the same key, within a file too, so the last one wins. Each chunk is validated into a
+    report of its own, merged into `report`; repeated readings are counted once at the end, on
+    the store. Returns the rows kept in the store.
+    """
+    deduplicate = len(sources) > 1
+    read = 0
+    for source in sources:
+        for chunk in iter_quality_csv(source, usecols=usecols, report=report):
+            if chunk.empty:
+                continue
+            history = pd.DataFrame()
+            if read:
+                history = STORE.quality_tail(chunk[COLUMN_NAMES['sample_id']].unique().tolist(),
+                                             chunk[COLUMN_NAMES['test_name']].unique().tolist(), ANOMALY_CONTEXT)
+            first = not read
+            read += len(chunk)
+            if deduplicate:
+                # A keyed append replaces the rows already stored, not the repeats within the chunk
+                chunk = chunk[~repeated_keys(chunk)].reset_index(drop=True)
+            rows = update_anomalies(history, apply_limits(chunk, LIMITS))
+            if report is not None:
+                report.merge(validate_quality(rows, ValidationReport(), duplicates=False))
+            if first:
+                STORE.write_quality(rows)
+            elif deduplicate:
+                STORE.write_quality(rows, mode='append')
+            else:
+                STORE.write_table(QUALITY_TABLE, rows, mode='append')
+    kept = STORE.quality_summary({})['tests'] if read else 0
+    if report is not None:
+        if deduplicate:
+            add_merged_duplicates(report, read - kept)
+        elif read:
+            add_duplicates(report, list(QUALITY_DEDUP_KEYS), *STORE.quality_duplicates(MAX_EXAMPLES))
+        report.rows_kept = kept
+    return kept
+
+
+def hold_dataset(df, filename):
+    """Account the in-memory dataset (nothing once it lives in the embedded store)."""
+    MEMORY.hold(MEMORY_OWNER, ('dataset', filename), frame_bytes(df), slot='dataset')
+
+
+def has_data():
+    if STORE is not None:
+        return STORE.has_table(QUALITY_TABLE)
+    return not DATA['df'].empty
+
+
+def current_options():
+    """Filter options of the loaded data, computed once per dataset."""
+    options = DATA['options']
+    if options is None:
+        options = STORE.quality_options() if STORE is not None else quality_options(DATA['df'])
+        DATA['options'] = options
+    return options
+
+
+def filter_rows(filters):
+    """Filtered rows from the embedded store when enabled, otherwise from the in-memory dataframe."""
+    if STORE is not None:
+        return STORE.quality_rows(filters)
+    return filter_quality(DATA['df'], **filters)
+
+
+def _last_filters_entry(cache, key, build):
+    """
+    The value of a last-filters cache for `key`, built outside the lock on a miss. A value built
+    while clear_filter_caches ran (on the previous data) is returned but not kept.
+    """
+    with VIEW_CACHE_LOCK:
+        entry, generation = cache['entry'], VIEW_CACHE['generation']
+    if entry is not None and entry[0] == key:
+        return entry[1], False
+    value = build()
+    with VIEW_CACHE_LOCK:
+        kept = VIEW_CACHE['generation'] == generation
+        if kept:
+            cache['entry'] = (key, value)
+    return value, kept
+
+
+def get_filtered_data(filters):
+    """Filtered rows, reused until the filters change."""
+    key = json.dumps(filters, sort_keys=True, default=str)
+    df, built = _last_filters_entry(FILTER_CACHE, key, lambda: filter_rows(filters))
+    if built:
+        MEMORY.hold(MEMORY_OWNER, ('filtered', key), frame_bytes(df), slot='filtered')
+    return df
+
+
+def get_compliance_counts(filters):
+    """Daily checked/out-of-limit counts for the filtered rows, reused until the filters change."""
+    key = json.dumps(filters, sort_keys=True, default=str)
+    return _last_filters_entry(COUNTS_CACHE, key, lambda: compliance_counts(get_filtered_data(filters)))[0]
+
+
+def get_correlation(filters):
+    """Pivoted readings, correlations and shared-period counts for the filtered rows, reused until the filters change."""
+    def build():
+        bucket = choose_bucket(filters.get('start_date'), filters.get('end_date')) or 'D'
+        wide = pivot_tests(get_filtered_data(filters), bucket)
+        return (bucket, wide, *correlation_matrix(wide))
+
+    return _last_filters_entry(CORRELATION_CACHE, json.dumps(filters, sort_keys=True, default=str), build)[0]
+
+
+def get_panel_set(filters, by, shared_y):
+    """
+    Small-multiples panels of the filtered rows, reused until the filters or the panel options
+    change. Returns the panel set and a token naming this selection, used in the panel slot ids.
+    """
+    key = json.dumps([filters, by, bool(shared_y)], sort_keys=True, default=str)
+    token = hashlib.sha1(key.encode()).hexdigest()[:10]
+    return token, _last_filters_entry(PANEL_CACHE, key, lambda: PanelSet(get_filtered_data(filters), by, shared_y))[0]
+
+
+def clear_filter_caches():
+    """Drop what was derived from the previous data: last-filters caches, cached views and the sketch."""
+    with VIEW_CACHE_LOCK:
+        for cache in (FILTER_CACHE, COUNTS_CACHE, CORRELATION_CACHE, PANEL_CACHE):
+            cache['entry'] = None
+        SKETCH['future'] = None
+        VIEW_CACHE['generation'] += 1
+        VIEW_CACHE['entries'] = OrderedDict()
+        if STORE is not None:
+            VIEW_CACHE['data_version'] = STORE.data_version()
+    MEMORY.drop(MEMORY_OWNER, 'filtered')
+
+
+def sync_data_version():
+    """Drop the caches and filter options of this worker when another process has changed the store."""
+    if STORE is None or STORE.data_version() == VIEW_CACHE['data_version']:
+        return
+    DATA['options'] = None
+    clear_filter_caches()
+
+
+def prepare_live_rows(new_rows):
+    """Limits and anomaly scores for new live readings, scored against the tail of their series only."""
+    new_rows = apply_limits(new_rows, LIMITS)
+    if STORE is not None:
+        history = pd.DataFrame()
+        if has_data():
+            history = STORE.quality_tail(new_rows[COLUMN_NAMES['sample_id']].unique().tolist(),
+                                         new_rows[COLUMN_NAMES['test_name']].unique().tolist(), ANOMALY_CONTEXT)
+    else:
+        history = DATA['df']
+    return update_anomalies(history, new_rows)
+
+
+def poll_live():
+    """Read new live readings and fold them into the dataset used by full re-renders."""
+    new_rows = LIVE.poll(prepare=prepare_live_rows)
+    if not new_rows.empty:
+        if STORE is not None:
+            STORE.write_quality(new_rows, mode='append')
+        else:
+            DATA['df'] = append_quality_rows(DATA['df'], new_rows)
+        DATA['options'] = None
+        clear_filter_caches()
+    return new_rows
+
+
+def preload_default_data(paths=None):
+    """
+    Load the default dataset(s) once, before the WSGI server forks its workers.
+
+    Run in the master process (gunicorn --preload), the parsed dataframe and its
+    filter options are shared copy-on-write by every worker instead of being
+    parsed again per worker. With the embedded store enabled the data is only
+    written (and indexed) when the store is still empty.
+    """
+    if paths is None:
+        paths = [path for path in os.environ.get(DEFAULT_DATA_ENV, '').split(os.pathsep) if path]
+    try:
+        if paths and not has_data():
+            report = ValidationReport()
+            mode, sample, _ = plan_loading(paths)
+            if mode == MODE_STORE:
+                # Too large for memory: streamed into the store, without a version of its own
+                stream_to_store(paths, report=report)
+                DATA.update(validation=report, version=None)
+                clear_filter_caches()
+            else:
+                df = load_quality_files(paths, report=report, sample=sample)
+                filename = ', '.join(os.path.basename(path) for path in paths)
+                DATA.update(validation=report,
+                            version=record_version(VERSIONS, df, filename) if sample is None else None)
+                df = score_anomalies(apply_limits(df, LIMITS))
+                if STORE is not None:
+                    STORE.write_quality(df)
+                    clear_filter_caches()
+                else:
+                    DATA.update(df=df, filename=filename, options=quality_options(df))
+                    hold_dataset(df, filename)
+        STATUS.update(ready=True, error=None)
+    except Exception as e:
+        STATUS.update(ready=False, error=str(e))
+    return STATUS['ready']
+
+
+def validation_alert(report):
+    """Data checks of the loaded dataset: a one-line summary that expands into the issues table."""
+    if report is None or not report.issues:
+        return None
+    return dbc.Alert(
+        html.Details([
+            html.Summary(f"Controllo dei Dati: {report.summary()}"),
+            dbc.Table.from_dataframe(report.to_frame(), size='sm', striped=True, className='mt-2 mb-0'),
+        ]),
+        color='warning' if report.warnings else 'info', className='mb-4'
+    )
+
+
+def to_table_records(df):
+    """Rename columns for a cleaner table view and convert to DataTable records."""
+    df_table_data = df.rename(columns={
+        COLUMN_NAMES['date_time']: 'Ora',
+        COLUMN_NAMES['sample_id']: 'ID Campione',
+        COLUMN_NAMES['test_name']: 'Nome Test',
+        COLUMN_NAMES['result']: 'Risultato',
+        COLUMN_NAMES['user_id']: 'ID Operatore',
+        COLUMN_NAMES['abs']: 'ABS'
+    })
+    return df_table_data.to_dict('records')
+
+
+def results_figure(df_filtered, chart_type, bucket, template, live=False):
+    """
+    Build the main results chart. Returns the figure as plain data and, in live mode,
+    the index and hover columns of each sample's trace (None otherwise).
+    """
+    # Now we include all columns in the graph's tooltip
+    hover_cols = df_filtered.columns.tolist()
+
+    fig = {}
+    if bucket is not None:
+        fig = band_figure(aggregate_results(df_filtered, bucket), bucket,
+                          title="Andamento dei Risultati dei Test", template=template)
+    elif chart_type == 'scatter':
+        fig = px.scatter(df_filtered, x=COLUMN_NAMES['date'], y=COLUMN_NAMES['result'], color=COLUMN_NAMES['sample_id'],
+                         hover_data=hover_cols, title="Grafico a Dispersione dei Risultati dei Test", template=template)
+    elif chart_type == 'line':
+        fig = px.line(df_filtered, x=COLUMN_NAMES['date'], y=COLUMN_NAMES['result'], color=COLUMN_NAMES['sample_id'],
+                      hover_data=hover_cols, title="Grafico a Linee dei Risultati dei Test", template=template)
+        fig.update_traces(mode='lines+markers')
+    elif chart_type == 'box':
+        fig = px.box(df_filtered, x=COLUMN_NAMES['sample_id'], y=COLUMN_NAMES['result'], color=COLUMN_NAMES['test_name'],
+                     hover_data=hover_cols, title="Box Plot dei Risultati per ID Campione", template=template)
+    elif chart_type == 'histogram':
+        fig = px.histogram(df_filtered, x=COLUMN_NAMES['date'], y=COLUMN_NAMES['result'], color=COLUMN_NAMES['sample_id'],
+                           title="Istogramma dei Risultati dei Test",
+                           barmode="group", template=template)
+        fig.update_traces(hovertemplate='<b>Data:</b> %{x|%Y-%m-%d}<br><b>Risultato:</b> %{y}<br><b>ID Campione:</b> %{color}<extra></extra>')
+    elif chart_type == 'density_histogram':
+        fig = px.histogram(df_filtered, x=COLUMN_NAMES['result'], color=COLUMN_NAMES['test_name'],
+                           nbins=20, histnorm='probability density', marginal='rug',
+                           title='Istogramma di Densità dei Risultati', template=template)
+    elif chart_type == 'scatter_matrix' and COLUMN_NAMES['abs'] in df_filtered.columns:
+        fig = px.scatter_matrix(df_filtered, dimensions=[COLUMN_NAMES['result'], COLUMN_NAMES['abs']],
+                                color=COLUMN_NAMES['test_name'],
+                                title="Matrice di Correlazione tra Risultato e ABS", template=template)
+        fig.update_traces(diagonal_visible=False)
+
+
+    # Update graph layout for a clean, professional look (the band chart sets its own)
+    if bucket is None and chart_type in ['scatter', 'line', 'box', 'histogram']:
+        fig.update_layout(
+            xaxis_title="Data",
+            yaxis_title="Risultato",
+            legend_title="ID Campione",
+            hovermode='closest',
+            template=template
+        )
+    elif chart_type == 'density_histogram':
+        fig.update_layout(
+            xaxis_title="Risultato",
+            yaxis_title="Densità",
+            template=template
+        )
+    
+    # Readings over their limits and suspicious readings are highlighted on the point charts
+    series_traces = len(fig.data) if not isinstance(fig, dict) else 0
+    if bucket is None and chart_type in ('line', 'scatter'):
+        add_out_of_limit_points(fig, df_filtered, x=COLUMN_NAMES['date'])
+        add_anomaly_points(fig, df_filtered, x=COLUMN_NAMES['date'])
+
+    if isinstance(fig, dict):
+        return fig, None
+
+    # Dates and hover columns go out as compact typed arrays instead of per-point JSON values
+    compact_figure(fig, extendable=live)
+
+    # Live mode: the trace of each sample, so new points can be appended to it
+    traces = None
+    if live and bucket is None and chart_type in LIVE_CHART_TYPES:
+        traces = {str(trace.name): {'index': i, 'columns': hover_columns(trace)}
+                  for i, trace in enumerate(fig.data[:series_traces])}
+    # Converted to plain data here, on the task pool, rather than while Dash encodes the response
+    return fig.to_plotly_json(), traces
+
+
+def dashboard_results(filters, df_filtered, chart_type, aggregate, template, live=False, prewarm=False):
+    """
+    Summary, compliance and main chart of one view. They only depend on the filtered rows,
+    so each is a task on the shared pool: the slowest one sets the response time instead
+    of the sum of all of them. A pre-warm leaves the caches of the last filters alone.
+    """
+    graph = TaskGraph()
+    if STORE is not None:
+        graph.add('summary', STORE.quality_summary, filters)
+    else:
+        graph.add('summary', quality_summary, df_filtered)
+
+    # Out-of-limit readings (status precomputed at load time) and exceedance rates per period,
+    # re-aggregated from daily counts (cached for the current filters)
+    graph.add('compliance', compliance_summary, df_filtered)
+    if LIMITS is not None:
+        rates_bucket = choose_bucket(filters['start_date'], filters['end_date']) or 'D'
+        if prewarm:
+            graph.add('compliance_counts', compliance_counts, df_filtered)
+        else:
+            graph.add('compliance_counts', get_compliance_counts, filters)
+        graph.add('compliance_rates', exceedance_rates, rates_bucket, deps=['compliance_counts'])
+        graph.add('compliance_fig', exceedance_figure, rates_bucket, template=template, deps=['compliance_rates'])
+
+    # Long date ranges are drawn as per-period mean/percentile bands instead of every row
+    bucket = None
+    if aggregate and chart_type in AGGREGATED_CHART_TYPES:
+        bucket = choose_bucket(filters['start_date'], filters['end_date'])
+    graph.add('figure', results_figure, df_filtered, chart_type, bucket, template, live)
+    return graph.results()
+
+
+def dashboard_defaults():
+    """The dashboard as it opens on the loaded data: whole date and result ranges, every sample and test."""
+    options = current_options()
+    return {
+        'start_date': options['min_date'], 'end_date': options['max_date'],
+        'results_range': [options['min_result'], options['max_result']],
+        'operators': None, 'samples': options['samples'], 'tests': options['tests'], 'anomalies': None,
+        'chart_type': 'line', 'aggregate': True, 'light_theme': True,
+    }
+
+
+def view_filters(state):
+    """The filters of a dashboard state (see dashboard_defaults)."""
+    return {name: state[name] for name in
+            ('start_date', 'end_date', 'results_range', 'operators', 'samples', 'tests', 'anomalies')}
+
+
+def get_view_results(view, filters, chart_type, aggregate, template, prewarm=False):
+    """Outputs of a normalized view from VIEW_CACHE, built on a miss (None when no rows match)."""
+    key = view_key(view)
+    with VIEW_CACHE_LOCK:
+        generation = VIEW_CACHE['generation']
+        entries = VIEW_CACHE['entries']
+        if key in entries:
+            entries.move_to_end(key)
+            return entries[key]
+
+    df_filtered = filter_rows(filters) if prewarm else get_filtered_data(filters)
+    results = None if df_filtered.empty else dashboard_results(filters, df_filtered, chart_type, aggregate, template,
+                                                               prewarm=prewarm)
+    with VIEW_CACHE_LOCK:
+        if VIEW_CACHE['generation'] == generation:
+            entries[key] = results
+            while len(entries) > VIEW_CACHE_SIZE:
+                entries.popitem(last=False)
+    return results
+
+
+def is_cached_view(view):
+    """Whether the view's exact results are already in VIEW_CACHE."""
+    with VIEW_CACHE_LOCK:
+        return view_key(view) in VIEW_CACHE['entries']
+
+
+def get_sketch():
+    """
+    The QualitySketch of the in-memory dataset, or None while it is being built (it is started
+    on the first call), for datasets small enough to answer exactly and with the embedded store.
+    """
+    with VIEW_CACHE_LOCK:
+        future = SKETCH['future']
+        if future is None:
+            df = DATA['df']
+            if STORE is not None or len(df) < APPROX_MIN_ROWS:
+                return None
+            future = SKETCH['future'] = get_task_pool().submit(QualitySketch, df)
+    if not future.done() or future.exception() is not None:
+        return None
+    return future.result()
+
+
+def approximate_results(sketch, filters, chart_type, aggregate, template):
+    """Estimated summary and compliance of a view, with its charts drawn from the matching sample rows."""
+    estimate = sketch.estimate(filters)
+    preview = estimate['preview']
+    bucket = None
+    if aggregate and chart_type in AGGREGATED_CHART_TYPES:
+        bucket = choose_bucket(filters['start_date'], filters['end_date'])
+    # The sample keeps the same share of every stratum, so out-of-limit rates per period need no weights
+    compliance_fig = {}
+    if LIMITS is not None and not preview.empty:
+        rates_bucket = choose_bucket(filters['start_date'], filters['end_date']) or 'D'
+        compliance_fig = exceedance_figure(exceedance_rates(compliance_counts(preview), rates_bucket), rates_bucket,
+                                           template=template)
+    figure = results_figure(preview, chart_type, bucket, template)[0] if not preview.empty else {}
+    return {**estimate, 'figure': figure, 'compliance_fig': compliance_fig}
+
+
+def _refine_pool():
+    # Created on first use, under REFINE_LOCK: a pool started before the WSGI server forks
+    # would leave every worker with a pool whose threads did not survive the fork
+    if REFINE['pool'] is None:
+        REFINE['pool'] = ThreadPoolExecutor(max_workers=REFINE_WORKERS, thread_name_prefix='avs-refine')
+    return REFINE['pool']
+
+
+def _reset_refine():
+    # Refinements of the parent process are not the child's: start again from an empty state
+    global REFINE_LOCK
+    REFINE_LOCK = threading.Lock()
+    REFINE.update(futures=OrderedDict(), waiters={}, pool=None)
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_refine)
+
+
+def start_refine(view, filters, chart_type, aggregate, template, token=None):
+    """
+    Compute the exact results of a view in the background (into VIEW_CACHE), once for every
+    browser waiting for the same view. Returns the token refine_dashboard_content polls for
+    them; `token` is given when the refinement was started on another worker process.
+    """
+    if token is None:
+        token = hashlib.sha1(f"{VIEW_CACHE['generation']}|{view_key(view)}".encode()).hexdigest()[:12]
+    with REFINE_LOCK:
+        futures, waiters = REFINE['futures'], REFINE['waiters']
+        if token not in futures or futures[token].cancelled():
+            futures[token] = _refine_pool().submit(get_view_results, view, filters, chart_type, aggregate, template)
+            while len(futures) > REFINE_SIZE:
+                waiters.pop(futures.popitem(last=False)[0], None)
+        waiters[token] = waiters.get(token, 0) + 1
+    return token
+
+
+def release_refine(request):
+    """
+    The browser no longer waits for the refinement of `request` (a refine request, or None): it
+    is dropped while still queued when no other browser waits for it.
+    """
+    if not request:
+        return
+    with REFINE_LOCK:
+        waiters = REFINE['waiters']
+        if request['token'] not in waiters:
+            return
+        waiters[request['token']] -= 1
+        if waiters[request['token']] <= 0:
+            del waiters[request['token']]
+            REFINE['futures'][request['token']].cancel()
+
+
+def summary_cards(summary, compliance, approximate=False):
+    """Text of the four summary cards; estimates are marked with ≈."""
+    prefix = "≈ " if approximate else ""
+    avg_result = f"{summary['avg_result']:.2f}" if pd.notna(summary['avg_result']) else "-"
+    tests = f"{summary['tests']:,}" if approximate else str(summary['tests'])
+    out_of_limit = f"{compliance['out']} ({compliance['rate']:.1f}%)" if compliance['rate'] is not None else "0"
+    return (f"{prefix}{summary['samples']}", f"{prefix}{avg_result}", f"{prefix}{tests}",
+            f"{prefix}{out_of_limit}")
+
+
+def accuracy_indicator(estimate=None):
+    """Badge under the summary cards: an estimate and its precision, or the exact values that replaced it."""
+    if estimate is None:
+        return [dbc.Badge("Valori esatti", color='success', className='me-2'),
+                html.Span("Riepilogo e grafici calcolati su tutte le letture.")]
+    error = estimate['error']
+    precision = f"letture ±{error['tests']:.1%}"
+    if estimate['summary']['avg_result'] is not None:
+        precision += f", media ±{error['avg_result']:.2f}"
+    if estimate['compliance']['rate'] is not None:
+        precision += f", fuori limite ±{error['out']:,.0f}"
+    return [dbc.Badge("Stima", color='warning', className='me-2'),
+            html.Span(f"Precisione al 95%: {precision}. Da strati, quantili e un campione di "
+                      f"{len(estimate['preview']):,} letture. Calcolo dei valori esatti in corso…")]
+
+
+def chart_type_options(has_abs=True):
+    """Chart types of the dropdown; the correlation matrix needs the 'ABS' column as its second dimension."""
+    options = [
+        {'label': 'Grafico a Dispersione', 'value': 'scatter'},
+        {'label': 'Grafico a Linee', 'value': 'line'},
+        {'label': 'Box Plot', 'value': 'box'},
+        {'label': 'Istogramma', 'value': 'histogram'},
+        {'label': 'Istogramma di Densità', 'value': 'density_histogram'},
+        {'label': 'Matrice di Correlazione', 'value': 'scatter_matrix'},
+        {'label': 'Piccoli Multipli', 'value': 'small_multiples'}
+    ]
+    return [option for option in options if has_abs or option['value'] != 'scatter_matrix']
+
+
+def warm_view(state):
+    """Build one dashboard view into VIEW_CACHE, without touching the caches of the last filters."""
+    view = normalize_view(state, dashboard_defaults())
+    template = "bootstrap" if state['light_theme'] else "cyborg"
+    get_view_results(view, view_filters(state), state['chart_type'], state['aggregate'], template, prewarm=True)
+
+
+def prewarm_views(wait=False):
+    """
+    Build the default view and the most requested ones (core/prewarm.py) in the
+    background, so the first users after startup or an upload find them ready.
+    """
+    if not has_data():
+        return None
+    return start_prewarm('dash', warm_view, dashboard_defaults(), wait=wait)
+
+
 # -------------------- 2. Dash App Creation --------------------
 # Define the two themes for the switch
 url_theme1 = dbc.themes.BOOTSTRAP
 url_theme2 = dbc.themes.CYBORG
 
+# Callback responses are encoded with orjson (when installed) and, with
+# flask-compress installed, compressed with brotli or gzip
+use_fast_json()
+
 # Use the two themes in the external_stylesheets list
-app = Dash(__name__, external_stylesheets=[url_theme1])
+app = Dash(__name__, external_stylesheets=[url_theme1], compress=flask_compress is not None)
 app.title = "Dashboard Avanzata Qualità Acqua"
+# The underlying Flask app, for WSGI servers (see wsgi.py)
+server = app.server
+
+
+# Every callback first checks that the store hasn't been changed by another worker process
+@server.before_request
+def check_data_version():
+    if request.path.startswith('/_dash-update-component'):
+        sync_data_version()
+
+
+# -------------------- Opt-in profiling of slow callbacks --------------------
+# AVS_PROFILE=1 profiles every callback; opening the dashboard with ?profile=<AVS_PROFILE_TOKEN>
+# profiles only that browser (a cookie carries the token to the callback requests, and
+# ?profile=off removes it). The slowest requests are listed at /admin/profiles.
+PROFILE_COOKIE = 'avs_profile'
+CALLBACK_PATH = '/_dash-update-component'
+# Input props never copied into a profile: uploaded files travel base64-encoded in 'contents'
+PROFILE_SKIPPED_PROPS = ('contents',)
+
+
+def callback_details(payload):
+    """
+    What a profile keeps of a callback request: the callback, the names of the inputs that changed
+    and the values of its inputs (the filters that made it slow), without uploads and without States.
+    """
+    inputs = {}
+    for item in payload.get('inputs', []):
+        # Pattern-matching inputs (ALL) arrive as a list of items
+        for entry in item if isinstance(item, list) else [item]:
+            if entry.get('property') in PROFILE_SKIPPED_PROPS:
+                continue
+            component = entry.get('id')
+            component = json.dumps(component, sort_keys=True) if isinstance(component, dict) else str(component)
+            inputs[f"{component}.{entry.get('property')}"] = entry.get('value')
+    return json.dumps({'output': payload.get('output'), 'changed': payload.get('changedPropIds', []),
+                       'inputs': inputs}, default=str)
+
+
+def is_admin_request():
+    """
+    The request carries the profiling token. Without AVS_PROFILE_TOKEN the admin pages are off:
+    behind a reverse proxy every request comes from localhost, so the address proves nothing.
+    """
+    return is_admin_token(request.args.get(PROFILE_PARAM)) or is_admin_token(request.cookies.get(PROFILE_COOKIE))
+
+
+@server.before_request
+def start_request_profile():
+    if request.path != CALLBACK_PATH:
+        return
+    if profiling_enabled() or is_admin_token(request.cookies.get(PROFILE_COOKIE)):
+        # The callback payload names the outputs and carries the filter values that made it slow
+        payload = request.get_json(silent=True) or {}
+        g.request_profile = start_profile(str(payload.get('output', request.path)), details=callback_details(payload))
+
+
+@server.after_request
+def finish_request_profile(response):
+    profile = g.pop('request_profile', None)
+    if profile is not None:
+        finish_profile(profile)
+    value = request.args.get(PROFILE_PARAM)
+    if is_admin_token(value):
+        response.set_cookie(PROFILE_COOKIE, value, httponly=True, samesite='Strict')
+    elif value == 'off':
+        response.delete_cookie(PROFILE_COOKIE)
+    return response
+
+
+@server.teardown_request
+def discard_request_profile(exc):
+    # A callback that raised never reaches after_request: stop its profiler without saving it
+    profile = g.pop('request_profile', None)
+    if profile is not None:
+        discard_profile(profile)
+
+
+# Admin page: the N slowest profiled requests, with their profiles and callback inputs
+@server.route('/admin/profiles')
+def list_profiles():
+    if not is_admin_request():
+        abort(403)
+    rows = []
+    for entry in get_profile_store().entries():
+        links = ' '.join(f'<a href="/admin/profiles/{entry["id"]}.{kind}">{kind}</a>' for kind in entry['kinds'])
+        rows.append(
+            f"<tr><td>{entry['duration'] * 1000:,.0f} ms</td><td>{html_escape.escape(entry['started'])}</td>"
+            f"<td>{html_escape.escape(entry['name'])}</td><td>{links}</td>"
+            f"<td><details><summary>richiesta</summary><pre>{html_escape.escape(entry['details'])}</pre>"
+            f"</details></td></tr>"
+        )
+    body = ''.join(rows) or '<tr><td colspan="5">Nessuna richiesta profilata.</td></tr>'
+    return (f"<!doctype html><title>Richieste più lente</title><h2>Richieste più lente</h2>"
+            f"<table border='1' cellpadding='6'><tr><th>Durata</th><th>Inizio</th><th>Output</th>"
+            f"<th>Profilo</th><th>Dettagli</th></tr>{body}</table>")
+
+
+@server.route('/admin/profiles/<profile_id>.<kind>')
+def show_profile(profile_id, kind):
+    if not is_admin_request():
+        abort(403)
+    path = get_profile_store().path(profile_id, kind)
+    if path is None:
+        abort(404)
+    return send_file(path, as_attachment=(kind == 'pstats'))
+
+
+# Liveness: the process is up and serving requests
+@server.route('/healthz')
+def healthz():
+    return jsonify(status='ok')
+
+
+# Readiness: default datasets are loaded and the embedded store (if any) is reachable
+@server.route('/readyz')
+def readyz():
+    if not STATUS['ready']:
+        return jsonify(status='loading' if STATUS['error'] is None else 'error', error=STATUS['error']), 503
+    if STORE is not None:
+        try:
+            STORE.has_table(QUALITY_TABLE)
+        except Exception as e:
+            return jsonify(status='error', error=str(e)), 503
+    return jsonify(status='ready', rows=len(DATA['df']))
 
 # -------------------- 3. App Layout --------------------
 # The layout is designed using a Bootstrap Container for proper spacing
@@ -62,16 +861,26 @@ app.layout = dbc.Container([
         id='upload-data',
         children=html.Div([
             'Trascina e rilascia o ',
-            html.A('Seleziona un file')
+            html.A('Seleziona uno o più file')
         ]),
         style={
             'width': '100%', 'height': '60px', 'lineHeight': '60px',
             'borderWidth': '1px', 'borderStyle': 'dashed',
             'borderRadius': '5px', 'textAlign': 'center', 'marginBottom': '20px'
         },
-        multiple=False
+        # Several exports (e.g. one per month) are merged into a single timeline
+        multiple=True
     ),
 
+    # Read options (sheet and column subset), shown once a file is uploaded
+    dbc.Row([
+        dbc.Col(dcc.Dropdown(id='sheet-dropdown', placeholder="Seleziona Foglio", clearable=False), md=4),
+        dbc.Col(dcc.Dropdown(id='column-dropdown', multi=True, placeholder="Colonne da caricare"), md=8),
+    ], id='read-options', className="mb-4", style={'display': 'none'}),
+
+    # Data checks of the loaded dataset (dropped rows, coerced values, duplicates, impossible readings)
+    html.Div(id='validation-report'),
+
     # Main dashboard content, hidden until data is uploaded
     html.Div(id='dashboard-content', style={'display': 'none'}, children=[
         dbc.Row([
@@ -100,7 +909,16 @@ app.layout = dbc.Container([
                         ]),
                         color="info", inverse=True
                     ),
-                ], className="mb-4"),
+                    dbc.Card(
+                        dbc.CardBody([
+                            html.H5("Fuori Limite", className="card-title"),
+                            html.P(id="out-of-limit-card", className="card-text")
+                        ]),
+                        color="danger", inverse=True
+                    ),
+                ], className="mb-2"),
+                # Whether the cards show an estimate (and how precise) or the exact values
+                html.Div(id='summary-accuracy', className="small mb-4"),
 
                 # Filter section
                 html.Label("Seleziona Intervallo di Date:", className="mt-2"),
@@ -118,6 +936,10 @@ app.layout = dbc.Container([
                 html.Label("Seleziona Nomi Test:", className="mt-4"),
                 dcc.Dropdown(id='test-dropdown', multi=True),
 
+                html.Label("Mostra Solo Anomalie:", className="mt-4"),
+                dcc.Dropdown(id='anomaly-dropdown', multi=True, placeholder="Lascia vuoto per tutte le letture",
+                             options=[{'label': k, 'value': k} for k in ANOMALY_KINDS]),
+
                 html.Label("Filtra per Valore Risultato:", className="mt-4"),
                 dcc.RangeSlider(id='results-slider', min=0, max=100, step=0.1, value=[0, 100],
                                 marks=None, tooltip={"placement": "bottom", "always_visible": True}),
@@ -125,17 +947,22 @@ app.layout = dbc.Container([
                 html.Label("Seleziona Tipo di Grafico:", className="mt-4"),
                 dcc.Dropdown(
                     id='chart-type',
-                    options=[
-                        {'label': 'Grafico a Dispersione', 'value': 'scatter'},
-                        {'label': 'Grafico a Linee', 'value': 'line'},
-                        {'label': 'Box Plot', 'value': 'box'},
-                        {'label': 'Istogramma', 'value': 'histogram'},
-                        {'label': 'Istogramma di Densità', 'value': 'density_histogram'},
-                        {'label': 'Matrice di Correlazione', 'value': 'scatter_matrix'}
-                    ],
+                    options=chart_type_options(),
                     # Set the default value to 'line'
                     value='line'
                 ),
+
+                # On long date ranges line/scatter/histogram switch to per-period bands;
+                # clicking a period zooms the date range into it
+                dbc.Switch(id='aggregate-switch', label="Aggregazione temporale automatica",
+                           value=True, className="mt-3"),
+
+                # Live mode: new readings from AVS_LIVE_SOURCE are appended to the chart
+                # and the summary cards without redrawing the history
+                dbc.Switch(id='live-switch', label="Aggiornamento live", value=False,
+                           disabled=LIVE is None, className="mt-2"),
+                dcc.Interval(id='live-interval', interval=LIVE_INTERVAL_MS, disabled=True),
+                dcc.Store(id='live-state'),
             ], md=4, className="me-4"),
 
             # Right column for the graph and data table
@@ -145,6 +972,27 @@ app.layout = dbc.Container([
                     type="default",
                     children=dcc.Graph(id='results-graph', style={'height': '600px'})
                 ),
+                # Small multiples: one compact panel per test or sample. The grid only holds empty
+                # slots; assets/panels.js reports the slots scrolling into view and each panel is
+                # built and sent by its own callback then.
+                html.Div(id='panels-section', style={'display': 'none'}, children=[
+                    dbc.Row([
+                        dbc.Col(dbc.RadioItems(id='panel-by', inline=True, value='test',
+                                               options=[{'label': f"Un pannello per {label.lower()}", 'value': by}
+                                                        for by, label in PANEL_BY_LABELS.items()]), md=8),
+                        dbc.Col(dbc.Switch(id='panel-shared-y', label="Stessa scala Y", value=False), md=4),
+                    ], className="mb-2"),
+                    html.P(id='panels-count', className="text-muted"),
+                    dbc.Row(id='panels-grid'),
+                ]),
+                # Share of readings over the regulatory limits, per test and period
+                html.Div(dcc.Graph(id='compliance-graph', style={'height': '350px'}),
+                         style={'display': 'block' if LIMITS is not None else 'none'}),
+                # Correlation between the selected tests; clicking a cell shows that pair of tests
+                html.Div(id='correlation-section', style={'display': 'none'}, children=[
+                    dcc.Graph(id='correlation-graph', style={'height': '450px'}),
+                    dcc.Graph(id='correlation-scatter', style={'height': '450px'}),
+                ]),
                 html.Hr(className="my-4"),
                 dbc.Row([
                     dbc.Col(html.H4("Tabella Dati Filtrati", className="mb-3"), width=6),
@@ -154,16 +1002,39 @@ app.layout = dbc.Container([
                         width=6, className="d-flex justify-content-end align-items-center"
                     )
                 ]),
+                # Pages are sliced server-side: only the visible rows are sent to the browser
                 dash_table.DataTable(
                     id='results-table',
-                    page_action="native",
+                    page_action="custom",
+                    page_current=0,
                     page_size=15,
                     style_table={'overflowX': 'auto'},
                     style_header={'backgroundColor': 'rgb(230, 230, 230)', 'fontWeight': 'bold'},
                     style_cell={'textAlign': 'left', 'padding': '10px'}
                 ),
                 dcc.Download(id="download-dataframe-csv"),
-                dcc.Store(id='filtered-data-store')
+                dcc.Store(id='filtered-data-store'),
+                # View answered approximately, whose exact results are awaited by refine_dashboard_content,
+                # checked every REFINE_POLL_MS while they are being computed
+                dcc.Store(id='refine-request'),
+                dcc.Interval(id='refine-interval', interval=REFINE_POLL_MS, disabled=True),
+                # Added, changed and removed readings between two loaded versions of the data
+                html.Div(id='versions-section', style={'display': 'none'}, children=[
+                    html.Hr(className="my-4"),
+                    html.H4("Confronta Versioni", className="mb-3"),
+                    dbc.Row([
+                        dbc.Col(dcc.Dropdown(id='version-old', clearable=False, placeholder="Confronta con"), md=6),
+                        dbc.Col(dcc.Dropdown(id='version-new', clearable=False, placeholder="Versione"), md=6),
+                    ], className="mb-3"),
+                    html.P(id='version-counts'),
+                    dash_table.DataTable(
+                        id='version-table',
+                        page_size=15,
+                        style_table={'overflowX': 'auto'},
+                        style_header={'backgroundColor': 'rgb(230, 230, 230)', 'fontWeight': 'bold'},
+                        style_cell={'textAlign': 'left', 'padding': '10px'}
+                    ),
+                ]),
             ], md=7)
         ], className="mt-4")
     ]),
@@ -209,6 +1080,40 @@ def toggle_modal(n_clicks_logo, n_clicks_close, is_open):
         return not is_open
     return is_open
 
+# Callback to list sheets and columns of the uploaded file, without loading its data
+@app.callback(
+    Output('read-options', 'style'),
+    Output('sheet-dropdown', 'options'),
+    Output('sheet-dropdown', 'value'),
+    Output('sheet-dropdown', 'disabled'),
+    Output('column-dropdown', 'options'),
+    Output('column-dropdown', 'value'),
+    Input('upload-data', 'contents'),
+    Input('sheet-dropdown', 'value'),
+    State('upload-data', 'filename')
+)
+def update_read_options(contents, sheet_name, filename):
+    if not contents:
+        return {'display': 'none'}, [], None, True, [], None
+
+    try:
+        # Sheets and columns are taken from the first file of the upload
+        source = decode_uploads(contents[:1], filename[:1])[0]
+        sheets = [] if source.name.lower().endswith('.csv') else list_excel_sheets(source)
+        # A new upload starts from the first sheet, a sheet change keeps the user's choice
+        if ctx.triggered_id == 'upload-data' or sheet_name not in sheets:
+            sheet_name = sheets[0] if sheets else None
+        columns = list_columns(source, sheet_name)
+    except Exception:
+        # Let update_layout report the error while parsing the file
+        return {'display': 'none'}, [], None, True, [], []
+
+    return (
+        {'display': 'flex'},
+        [{'label': s, 'value': s} for s in sheets], sheet_name, not sheets,
+        [{'label': c, 'value': c} for c in columns], columns
+    )
+
 # Callback to handle file upload and initialize dashboard components
 @app.callback(
     Output('dashboard-content', 'style'),
@@ -226,60 +1131,104 @@ def toggle_modal(n_clicks_logo, n_clicks_close, is_open):
     Output('results-slider', 'max'),
     Output('results-slider', 'value'),
     Output('upload-data', 'children'),
-    Input('upload-data', 'contents'),
-    State('upload-data', 'filename')
+    Output('validation-report', 'children'),
+    Output('chart-type', 'options'),
+    Output('chart-type', 'value'),
+    Input('column-dropdown', 'value'),
+    State('sheet-dropdown', 'value'),
+    State('upload-data', 'contents'),
+    State('upload-data', 'filename'),
+    State('column-dropdown', 'options'),
+    State('chart-type', 'value')
 )
-def update_layout(contents, filename):
-    if not contents:
+def update_layout(columns, sheet_name, contents, filenames, column_options, chart_type):
+    if not contents and not has_data():
         return (
             {'display': 'none'}, None, None, None, None, [], None, [], [], [], [], None, None, None,
-            html.Div(['Trascina e rilascia o ', html.A('Seleziona un file')])
+            html.Div(['Trascina e rilascia o ', html.A('Seleziona uno o più file')]), None, no_update, no_update
         )
 
-    content_type, content_string = contents.split(',')
-    
     try:
-        decoded = base64.b64decode(content_string)
-        if 'xls' in filename or 'xlsx' in filename:
-            df = pd.read_excel(io.BytesIO(decoded))
-        elif 'csv' in filename:
-            df = pd.read_csv(io.BytesIO(decoded))
+        if contents:
+            sources = decode_uploads(contents, filenames)
+            # Data cleaning and preparation (invalid 'Time' rows are dropped while parsing)
+            # Only the chosen sheet and columns are read, skipping formatting.
+            # Files are parsed concurrently and merged into one de-duplicated, sorted timeline.
+            usecols = columns if columns and len(columns) < len(column_options or []) else None
+            # Dropped rows, coerced values, duplicates and impossible readings are counted in the same pass
+            report = ValidationReport()
+            # Uploads too large for the memory budget are streamed into the embedded store
+            # one chunk at a time, or sampled per series while parsing when there is none
+            mode, sample, estimated = plan_loading(sources, filenames)
+            filename = ', '.join(filenames)
+            if mode == MODE_STORE:
+                rows = stream_to_store(sources, usecols=usecols, report=report)
+                df, version, options = pd.DataFrame(), None, STORE.quality_options()
+                message = f'File caricati con successo: {filename} ({rows} righe, scritte a blocchi nell\'archivio locale)'
+            else:
+                df = load_quality_files(sources, sheet_name=sheet_name, usecols=usecols, report=report, sample=sample)
+                # The readings as loaded become a new version (a column subset or a sample is not a new version of the data)
+                version = record_version(VERSIONS, df, filename) if usecols is None and sample is None else None
+                # Limits, compliance status and anomaly scores are attached once, here, for every reading
+                df = score_anomalies(apply_limits(df, LIMITS))
+                options = quality_options(df)
+                message = f'File caricati con successo: {filename} ({len(df)} righe)'
+                if sample is not None:
+                    message = [message, html.Div(sampled_notice(sample, estimated), className='text-warning small')]
+
+                if STORE is not None:
+                    # Persist to the embedded store and release the in-memory copy
+                    STORE.write_quality(df)
+                    df = pd.DataFrame()
+
+            # Store the processed dataframe for other callbacks
+            DATA['df'] = df
+            DATA['filename'] = filename
+            DATA['options'] = options
+            DATA['validation'] = report
+            DATA['version'] = version
+            hold_dataset(df, filename)
+            clear_filter_caches()
+            # The sketch of the new data and the most requested views are built in the background
+            get_sketch()
+            prewarm_views()
+        elif STORE is not None:
+            # No upload yet: start from the data already persisted in the store
+            options = STORE.quality_options()
+            message = 'Dati caricati dall\'archivio locale'
         else:
-            raise Exception('Tipo di file non supportato. Carica un file .csv o .xlsx.')
-
-        # Data cleaning and preparation
-        df[COLUMN_NAMES['date_time']] = pd.to_datetime(df[COLUMN_NAMES['date_time']], errors='coerce')
-        df = df[df[COLUMN_NAMES['date_time']].notna()]
-        df[COLUMN_NAMES['date']] = df[COLUMN_NAMES['date_time']].dt.floor('D')
-        
-        # Store the processed dataframe for other callbacks
-        DATA['df'] = df
-        DATA['filename'] = filename
-
-        operator_options = [{'label': o, 'value': o} for o in df[COLUMN_NAMES['user_id']].unique()]
-        sample_options = [{'label': s, 'value': s} for s in df[COLUMN_NAMES['sample_id']].unique()]
-        test_options = [{'label': t, 'value': t} for t in df[COLUMN_NAMES['test_name']].unique()]
-        
-        min_result = df[COLUMN_NAMES['result']].min()
-        max_result = df[COLUMN_NAMES['result']].max()
-        
+            # No upload yet: start from the default dataset loaded at startup
+            options = current_options()
+            message = f"Dati predefiniti caricati: {DATA['filename']} ({len(DATA['df'])} righe)"
+
+        operator_options = [{'label': o, 'value': o} for o in options['operators']]
+        sample_options = [{'label': s, 'value': s} for s in options['samples']]
+        test_options = [{'label': t, 'value': t} for t in options['tests']]
+
+        min_result = options['min_result']
+        max_result = options['max_result']
+
         # Set all samples and tests as default selected
         default_samples = [s['value'] for s in sample_options]
         default_tests = [t['value'] for t in test_options]
 
         return (
             {'display': 'block'},
-            df[COLUMN_NAMES['date']].min(),
-            df[COLUMN_NAMES['date']].max(),
-            df[COLUMN_NAMES['date']].min(),
-            df[COLUMN_NAMES['date']].max(),
+            options['min_date'],
+            options['max_date'],
+            options['min_date'],
+            options['max_date'],
             operator_options, None,
             sample_options,
             default_samples, # Set all samples as default
             test_options,
             default_tests, # Set all tests as default
             min_result, max_result, [min_result, max_result],
-            html.Div([f'File caricato con successo: {filename}'])
+            html.Div(message if isinstance(message, list) else [message]),
+            validation_alert(DATA['validation']),
+            chart_type_options(options['has_abs']),
+            # Without 'ABS' the correlation matrix is not offered: fall back to the default chart
+            'line' if chart_type == 'scatter_matrix' and not options['has_abs'] else no_update
         )
 
     except Exception as e:
@@ -287,7 +1236,7 @@ def update_layout(contents, filename):
         return (
             {'display': 'none'},
             None, None, None, None, [], None, [], [], [], [], None, None, None,
-            html.Div([f'Errore: {e}'], style={'color': 'red'})
+            html.Div([f'Errore: {e}'], style={'color': 'red'}), None, no_update, no_update
         )
 
 # Callback to disable Sample and Test dropdowns if an Operator is selected
@@ -303,122 +1252,379 @@ def disable_dropdowns(operator_value):
     return False, False
 
 
-# Callback to update summary cards, graph, and data table
+# Callback to update summary cards and graph
 # The template input is from the ThemeSwitchAIO component
 @app.callback(
     Output('results-graph', 'figure'),
-    Output('results-table', 'data'),
     Output('total-samples-card', 'children'),
     Output('avg-result-card', 'children'),
     Output('total-tests-card', 'children'),
+    Output('out-of-limit-card', 'children'),
+    Output('compliance-graph', 'figure'),
     Output('filtered-data-store', 'data'),
+    Output('live-state', 'data'),
+    Output('summary-accuracy', 'children'),
+    Output('refine-request', 'data'),
     Input('date-picker', 'start_date'),
     Input('date-picker', 'end_date'),
     Input('sample-dropdown', 'value'),
     Input('test-dropdown', 'value'),
     Input('operator-dropdown', 'value'),
     Input('results-slider', 'value'),
+    Input('anomaly-dropdown', 'value'),
     Input('chart-type', 'value'),
-    Input(ThemeSwitchAIO.ids.switch("theme-switch"), "value")
+    Input('aggregate-switch', 'value'),
+    Input('live-switch', 'value'),
+    Input(ThemeSwitchAIO.ids.switch("theme-switch"), "value"),
+    State('refine-request', 'data')
 )
-def update_dashboard_content(start_date, end_date, samples, tests, operators, results_range, chart_type, is_light_theme):
-    # Use the globally stored dataframe
-    df = DATA['df']
-    if df.empty:
-        return {}, [], "0", "0", "0", no_update
+def update_dashboard_content(start_date, end_date, samples, tests, operators, results_range, anomalies,
+                             chart_type, aggregate, live, is_light_theme, pending):
+    # This browser's previous refinement is superseded by the new view (unless others wait for it)
+    release_refine(pending)
+    live = bool(live) and LIVE is not None
+    if live:
+        # Take in the readings received so far; later batches are streamed by stream_live_points
+        poll_live()
+        live_seq = LIVE.seq
+
+    # Use the globally stored dataframe (or the embedded store)
+    if not has_data():
+        return {}, "0", "0", "0", "0", {}, no_update, None, None, None
 
     # Determine the Plotly template based on the theme switch state
     template = "bootstrap" if is_light_theme else "cyborg"
 
-    # Filter data based on user selections
-    df_filtered = df[
-        (df[COLUMN_NAMES['date']] >= pd.to_datetime(start_date)) &
-        (df[COLUMN_NAMES['date']] <= pd.to_datetime(end_date)) &
-        (df[COLUMN_NAMES['result']] >= results_range[0]) &
-        (df[COLUMN_NAMES['result']] <= results_range[1])
-    ].copy()
-
-    # Apply specific filters based on selections
-    if operators:
-        df_filtered = df_filtered[df_filtered[COLUMN_NAMES['user_id']].isin(operators)]
-    elif samples and tests:
-        df_filtered = df_filtered[
-            df_filtered[COLUMN_NAMES['sample_id']].isin(samples) &
-            df_filtered[COLUMN_NAMES['test_name']].isin(tests)
-        ]
-    
+    # Filter data based on user selections (the date range is a binary search on the sorted timeline,
+    # or a SQL query when the embedded store is enabled). The filters themselves are kept in
+    # filtered-data-store so the table pages and the export can reuse them.
+    filters = {
+        'start_date': start_date, 'end_date': end_date, 'results_range': results_range,
+        'operators': operators, 'samples': samples, 'tests': tests, 'anomalies': anomalies
+    }
+    # The view is counted, so the most requested ones can be pre-built after a restart or an upload
+    state = {**filters, 'start_date': pd.to_datetime(start_date), 'end_date': pd.to_datetime(end_date),
+             'chart_type': chart_type, 'aggregate': bool(aggregate), 'light_theme': bool(is_light_theme)}
+    view = record_view('dash', state, dashboard_defaults())
+
+    if live:
+        # Live charts are extended point by point, so they are always built for this client
+        df_filtered = get_filtered_data(filters)
+        results = None if df_filtered.empty else dashboard_results(filters, df_filtered, chart_type, aggregate,
+                                                                   template, live=True)
+    else:
+        # Recent and pre-warmed views come straight from VIEW_CACHE, without filtering again.
+        # Other views of a large dataset are answered at once from its sketch, then refined.
+        sketch = None if is_cached_view(view) else get_sketch()
+        if sketch is not None:
+            approximate = approximate_results(sketch, filters, chart_type, aggregate, template)
+            token = start_refine(view, filters, chart_type, aggregate, template)
+            return (approximate['figure'],
+                    *summary_cards(approximate['summary'], approximate['compliance'], approximate=True),
+                    approximate['compliance_fig'], filters, None, accuracy_indicator(approximate),
+                    {'token': token, 'view': view, 'filters': filters, 'chart_type': chart_type,
+                     'aggregate': aggregate, 'template': template})
+        results = get_view_results(view, filters, chart_type, aggregate, template)
+
     # Handle case where the filtered dataframe is empty
-    if df_filtered.empty:
-        return {}, [], "0", "0", "0", df_filtered.to_json(date_format='iso', orient='split')
+    if results is None:
+        return {}, "0", "0", "0", "0", {}, filters, None, None, None
 
     # --- Create summary metrics ---
-    total_samples = len(df_filtered[COLUMN_NAMES['sample_id']].unique()) if not df_filtered.empty else 0
-    avg_result = f"{df_filtered[COLUMN_NAMES['result']].mean():.2f}" if not df_filtered.empty else "0"
-    total_tests = len(df_filtered) if not df_filtered.empty else 0
+    summary = results['summary']
+    compliance = results['compliance']
+    compliance_fig = results.get('compliance_fig', {})
+    fig, traces = results['figure']
 
-    # --- Create the Plotly figure ---
-    # Now we include all columns in the graph's tooltip
-    hover_cols = df_filtered.columns.tolist()
-    
-    fig = {}
-    if chart_type == 'scatter':
-        fig = px.scatter(df_filtered, x=COLUMN_NAMES['date'], y=COLUMN_NAMES['result'], color=COLUMN_NAMES['sample_id'],
-                         hover_data=hover_cols, title="Grafico a Dispersione dei Risultati dei Test", template=template)
-    elif chart_type == 'line':
-        fig = px.line(df_filtered, x=COLUMN_NAMES['date'], y=COLUMN_NAMES['result'], color=COLUMN_NAMES['sample_id'],
-                      hover_data=hover_cols, title="Grafico a Linee dei Risultati dei Test", template=template)
-        fig.update_traces(mode='lines+markers')
-    elif chart_type == 'box':
-        fig = px.box(df_filtered, x=COLUMN_NAMES['sample_id'], y=COLUMN_NAMES['result'], color=COLUMN_NAMES['test_name'],
-                     hover_data=hover_cols, title="Box Plot dei Risultati per ID Campione", template=template)
-    elif chart_type == 'histogram':
-        fig = px.histogram(df_filtered, x=COLUMN_NAMES['date'], y=COLUMN_NAMES['result'], color=COLUMN_NAMES['sample_id'],
-                           title="Istogramma dei Risultati dei Test",
-                           barmode="group", template=template)
-        fig.update_traces(hovertemplate='<b>Data:</b> %{x|%Y-%m-%d}<br><b>Risultato:</b> %{y}<br><b>ID Campione:</b> %{color}<extra></extra>')
-    elif chart_type == 'density_histogram':
-        fig = px.histogram(df_filtered, x=COLUMN_NAMES['result'], color=COLUMN_NAMES['test_name'],
-                           nbins=20, histnorm='probability density', marginal='rug',
-                           title='Istogramma di Densità dei Risultati', template=template)
-    elif chart_type == 'scatter_matrix':
-        fig = px.scatter_matrix(df_filtered, dimensions=[COLUMN_NAMES['result'], COLUMN_NAMES['abs']],
-                                color=COLUMN_NAMES['test_name'],
-                                title="Matrice di Correlazione tra Risultato e ABS", template=template)
-        fig.update_traces(diagonal_visible=False)
+    # Live mode: running aggregates for the cards and, for line/scatter charts, the trace
+    # of each sample so new points can be appended to it
+    live_state = None
+    if live:
+        live_state = {
+            'seq': live_seq,
+            'count': int(summary['tests']),
+            # Sum of the results themselves: the average is None (or NaN) when no reading has a result
+            'sum': float(df_filtered[COLUMN_NAMES['result']].sum()),
+            'samples': df_filtered[COLUMN_NAMES['sample_id']].unique().tolist(),
+            'checked': compliance['checked'],
+            'out': compliance['out'],
+            'traces': traces,
+        }
 
+    # Return all updated components; an empty refine request supersedes one still pending
+    return (fig, *summary_cards(summary, compliance), compliance_fig, filters, live_state, None, None)
 
-    # Update graph layout for a clean, professional look
-    if chart_type in ['scatter', 'line', 'box', 'histogram']:
-        fig.update_layout(
-            xaxis_title="Data",
-            yaxis_title="Risultato",
-            legend_title="ID Campione",
-            hovermode='closest',
-            template=template
-        )
-    elif chart_type == 'density_histogram':
-        fig.update_layout(
-            xaxis_title="Risultato",
-            yaxis_title="Densità",
-            template=template
-        )
-    
-    # --- Prepare data for the Dash table ---
-    # Select and rename columns for a cleaner table view
-    df_table_data = df_filtered.rename(columns={
-        COLUMN_NAMES['date_time']: 'Ora',
-        COLUMN_NAMES['sample_id']: 'ID Campione',
-        COLUMN_NAMES['test_name']: 'Nome Test',
-        COLUMN_NAMES['result']: 'Risultato',
-        COLUMN_NAMES['user_id']: 'ID Operatore',
-        COLUMN_NAMES['abs']: 'ABS'
-    })
-    
-    # Convert dataframe to a list of dictionaries for the table
-    table_data = df_table_data.to_dict('records')
 
-    # Return all updated components
-    return fig, table_data, str(total_samples), str(avg_result), str(total_tests), df_filtered.to_json(date_format='iso', orient='split')
+# Callback to swap the exact results in for an approximate answer: it checks the refinement
+# started by update_dashboard_content on every tick of refine-interval, without holding a request
+# thread while it runs, and starts it when the token is unknown here (e.g. on another worker
+# process). A newer request supersedes it, so a stale answer never replaces a newer one, and a
+# refinement dropped for a newer view is not computed at all.
+@app.callback(
+    Output('results-graph', 'figure', allow_duplicate=True),
+    Output('total-samples-card', 'children', allow_duplicate=True),
+    Output('avg-result-card', 'children', allow_duplicate=True),
+    Output('total-tests-card', 'children', allow_duplicate=True),
+    Output('out-of-limit-card', 'children', allow_duplicate=True),
+    Output('compliance-graph', 'figure', allow_duplicate=True),
+    Output('summary-accuracy', 'children', allow_duplicate=True),
+    Output('refine-interval', 'disabled'),
+    Input('refine-request', 'data'),
+    Input('refine-interval', 'n_intervals'),
+    prevent_initial_call=True
+)
+def refine_dashboard_content(request, _):
+    if not request:
+        return (no_update,) * 7 + (True,)
+    with REFINE_LOCK:
+        future = REFINE['futures'].get(request['token'])
+    if future is None:
+        start_refine(request['view'], request['filters'], request['chart_type'], request['aggregate'],
+                     request['template'], token=request['token'])
+        return (no_update,) * 7 + (False,)
+    if not future.done():
+        return (no_update,) * 7 + (False,)
+    try:
+        results = future.result()
+    except CancelledError:
+        # Dropped for a newer view, whose own refine request is on its way
+        return (no_update,) * 7 + (True,)
+    except Exception:
+        # The approximate answer stays on screen, marked as an estimate
+        logger.exception("Risultati esatti della vista non calcolati")
+        return (no_update,) * 7 + (True,)
+
+    if results is None:
+        return {}, "0", "0", "0", "0", {}, accuracy_indicator(), True
+    return (results['figure'][0], *summary_cards(results['summary'], results['compliance']),
+            results.get('compliance_fig', {}), accuracy_indicator(), True)
+
+# Callback to lay out the small-multiples grid: empty, titled slots only. Panels are built by
+# render_panel once their slot scrolls into view, so 50+ tests never become one giant figure.
+@app.callback(
+    Output('panels-section', 'style'),
+    Output('results-graph', 'style'),
+    Output('panels-count', 'children'),
+    Output('panels-grid', 'children'),
+    Input('filtered-data-store', 'data'),
+    Input('chart-type', 'value'),
+    Input('panel-by', 'value'),
+    Input('panel-shared-y', 'value'),
+    Input(ThemeSwitchAIO.ids.switch("theme-switch"), "value")
+)
+def update_panel_slots(filters, chart_type, by, shared_y, is_light_theme):
+    if chart_type != 'small_multiples':
+        return {'display': 'none'}, {'height': '600px'}, "", []
+    if not filters or not has_data():
+        return {'display': 'block'}, {'display': 'none'}, "Nessun dato trovato con i filtri selezionati.", []
+    token, panel_set = get_panel_set(filters, by, shared_y)
+    # The theme is part of the slot ids, so switching it builds the visible panels again
+    token = f"{token}{'l' if is_light_theme else 'd'}"
+    slots = []
+    for i, name in enumerate(panel_set.names):
+        index = f"{token}-{i}"
+        placeholder = {'layout': {'title': {'text': panel_set.title(name), 'font': {'size': 13}},
+                                  'height': PANEL_HEIGHT, 'xaxis': {'visible': False}, 'yaxis': {'visible': False}}}
+        slots.append(dbc.Col(id={'type': 'panel-slot', 'index': index}, className="avs-panel mb-3",
+                             md=12 // PANEL_COLUMNS, children=[
+            dcc.Store(id={'type': 'panel-visible', 'index': index}),
+            dcc.Graph(id={'type': 'panel-graph', 'index': index}, figure=placeholder,
+                      style={'height': f'{PANEL_HEIGHT}px'}, config={'displayModeBar': False}),
+        ]))
+    count = (f"{len(panel_set)} pannelli: stesse date in tutti, colori uguali per la stessa serie. "
+             "I pannelli vengono disegnati quando entrano nella pagina.")
+    return {'display': 'block'}, {'display': 'none'}, count, slots
+
+
+# Callback to build one panel, when assets/panels.js reports its slot in view
+@app.callback(
+    Output({'type': 'panel-graph', 'index': MATCH}, 'figure'),
+    Input({'type': 'panel-visible', 'index': MATCH}, 'data'),
+    State('filtered-data-store', 'data'),
+    State('panel-by', 'value'),
+    State('panel-shared-y', 'value'),
+    State(ThemeSwitchAIO.ids.switch("theme-switch"), "value"),
+    prevent_initial_call=True
+)
+def render_panel(visible, filters, by, shared_y, is_light_theme):
+    if not visible or not filters or not has_data():
+        return no_update
+    token, panel_set = get_panel_set(filters, by, shared_y)
+    slot_token, position = ctx.triggered_id['index'].rsplit('-', 1)
+    # A slot of an earlier selection (the filters changed while it was loading)
+    if slot_token[:-1] != token or int(position) >= len(panel_set):
+        return no_update
+    template = "bootstrap" if is_light_theme else "cyborg"
+    return compact_figure(panel_set.figure(panel_set.names[int(position)], template=template))
+
+
+# Callback to draw the cross-test correlation matrix and the scatter of its strongest pair
+@app.callback(
+    Output('correlation-section', 'style'),
+    Output('correlation-graph', 'figure'),
+    Output('correlation-scatter', 'figure'),
+    Input('filtered-data-store', 'data'),
+    Input(ThemeSwitchAIO.ids.switch("theme-switch"), "value")
+)
+def update_correlation(filters, is_light_theme):
+    if not filters or not has_data():
+        return {'display': 'none'}, {}, {}
+    bucket, wide, corr, counts = get_correlation(filters)
+    # Correlations need at least two tests in the selection
+    if wide.shape[1] < 2:
+        return {'display': 'none'}, {}, {}
+    template = "bootstrap" if is_light_theme else "cyborg"
+    test_x, test_y = strongest_pair(corr)
+    return ({'display': 'block'}, correlation_figure(corr, counts, bucket, template=template),
+            compact_figure(pair_figure(wide, test_x, test_y, template=template)))
+
+
+# Callback to drill into a cell of the correlation matrix: only that pair of tests is
+# extracted from the cached pivot, downsampled to at most CORRELATION_MAX_POINTS points
+@app.callback(
+    Output('correlation-scatter', 'figure', allow_duplicate=True),
+    Input('correlation-graph', 'clickData'),
+    State('filtered-data-store', 'data'),
+    State(ThemeSwitchAIO.ids.switch("theme-switch"), "value"),
+    prevent_initial_call=True
+)
+def drill_into_correlation(click_data, filters, is_light_theme):
+    if not click_data or not filters or not has_data():
+        return no_update
+    _, wide, _, _ = get_correlation(filters)
+    point = click_data['points'][0]
+    if point['x'] not in wide.columns or point['y'] not in wide.columns:
+        return no_update
+    template = "bootstrap" if is_light_theme else "cyborg"
+    return compact_figure(pair_figure(wide, point['x'], point['y'], template=template))
+
+
+# Live mode polls the source only while the switch is on
+@app.callback(
+    Output('live-interval', 'disabled'),
+    Input('live-switch', 'value')
+)
+def toggle_live(live):
+    return not live
+
+
+# Callback to stream new live readings: only the new points are sent and appended to the
+# existing traces with extendData, and the cards are updated from running aggregates
+@app.callback(
+    Output('results-graph', 'extendData'),
+    Output('total-samples-card', 'children', allow_duplicate=True),
+    Output('avg-result-card', 'children', allow_duplicate=True),
+    Output('total-tests-card', 'children', allow_duplicate=True),
+    Output('out-of-limit-card', 'children', allow_duplicate=True),
+    Output('live-state', 'data', allow_duplicate=True),
+    Input('live-interval', 'n_intervals'),
+    State('live-state', 'data'),
+    State('filtered-data-store', 'data'),
+    prevent_initial_call=True
+)
+def stream_live_points(n_intervals, live_state, filters):
+    if LIVE is None or not live_state or not filters:
+        return no_update, no_update, no_update, no_update, no_update, no_update
+
+    poll_live()
+    new_rows, seq = LIVE.since(live_state['seq'])
+    if seq == live_state['seq']:
+        return no_update, no_update, no_update, no_update, no_update, no_update
+    live_state['seq'] = seq
+
+    # New readings after the end of the selected range are still shown
+    new_rows = filter_quality(new_rows, **{**filters, 'end_date': None}) if not new_rows.empty else new_rows
+    if new_rows.empty:
+        return no_update, no_update, no_update, no_update, no_update, live_state
+
+    # Limits and anomaly scores were attached by poll_live when the batch was read
+    compliance = compliance_summary(new_rows)
+    live_state['count'] += len(new_rows)
+    live_state['sum'] += float(new_rows[COLUMN_NAMES['result']].sum())
+    live_state['checked'] += compliance['checked']
+    live_state['out'] += compliance['out']
+    known = set(live_state['samples'])
+    live_state['samples'] += [s for s in new_rows[COLUMN_NAMES['sample_id']].unique().tolist() if s not in known]
+
+    extend_data = no_update
+    if live_state['traces']:
+        update, indices = {'x': [], 'y': [], 'customdata': []}, []
+        # Samples without a trace yet appear with the next full redraw
+        for sample, rows in new_rows.groupby(COLUMN_NAMES['sample_id'], sort=False):
+            trace = live_state['traces'].get(str(sample))
+            if trace is None:
+                continue
+            update['x'].append(epoch_ms(rows[COLUMN_NAMES['date']].to_numpy()).tolist())
+            update['y'].append(rows[COLUMN_NAMES['result']].tolist())
+            update['customdata'].append(hover_rows(rows, trace['columns']) or [])
+            indices.append(trace['index'])
+        if indices:
+            extend_data = [update, indices]
+
+    return (
+        extend_data,
+        str(len(live_state['samples'])),
+        f"{live_state['sum'] / live_state['count']:.2f}",
+        str(live_state['count']),
+        (f"{live_state['out']} ({live_state['out'] / live_state['checked'] * 100:.1f}%)"
+         if live_state['checked'] else "0"),
+        live_state,
+    )
+
+
+# Callback to drill into a period of the aggregated chart: the date range is narrowed
+# to the clicked period, which re-queries the data at a finer resolution
+@app.callback(
+    Output('date-picker', 'start_date', allow_duplicate=True),
+    Output('date-picker', 'end_date', allow_duplicate=True),
+    Input('results-graph', 'clickData'),
+    State('aggregate-switch', 'value'),
+    State('chart-type', 'value'),
+    State('date-picker', 'start_date'),
+    State('date-picker', 'end_date'),
+    prevent_initial_call=True
+)
+def drill_into_bucket(click_data, aggregate, chart_type, start_date, end_date):
+    if not aggregate or not click_data:
+        return no_update, no_update
+    # Only the band chart can be drilled into: other charts carry their hover columns as customdata
+    if chart_type not in AGGREGATED_CHART_TYPES or choose_bucket(start_date, end_date) is None:
+        return no_update, no_update
+    # Only the mean traces of the band chart carry the period bounds
+    customdata = click_data['points'][0].get('customdata')
+    if not customdata or len(customdata) < 2:
+        return no_update, no_update
+    return customdata[0], customdata[1]
+
+# Callback to fill the data table one page at a time
+@app.callback(
+    Output('results-table', 'data'),
+    Output('results-table', 'page_count'),
+    Output('results-table', 'page_current'),
+    Input('filtered-data-store', 'data'),
+    Input('results-table', 'page_current'),
+    Input('results-table', 'page_size')
+)
+def update_table_page(filters, page_current, page_size):
+    if not filters or not has_data():
+        return [], 0, 0
+
+    # New filters start again from the first page
+    if ctx.triggered_id == 'filtered-data-store':
+        page_current = 0
+    page_current = page_current or 0
+
+    if STORE is not None:
+        # Only the requested page is read from the store (LIMIT/OFFSET)
+        total_rows = STORE.quality_summary(filters)['tests']
+        df_page = STORE.quality_rows(filters, limit=page_size, offset=page_current * page_size)
+    else:
+        df_filtered = get_filtered_data(filters)
+        total_rows = len(df_filtered)
+        df_page = df_filtered.iloc[page_current * page_size:(page_current + 1) * page_size]
+
+    page_count = max(math.ceil(total_rows / page_size), 1)
+    return to_table_records(df_page), page_count, page_current
 
 # Callback to download the filtered dataframe
 @app.callback(
@@ -427,14 +1633,62 @@ def update_dashboard_content(start_date, end_date, samples, tests, operators, re
     State("filtered-data-store", "data"),
     prevent_initial_call=True
 )
-def download_filtered_data(n_clicks, json_data):
-    if not json_data:
+def download_filtered_data(n_clicks, filters):
+    if not filters or not has_data():
         return no_update
-    
-    df_filtered = pd.read_json(json_data, orient='split')
+
+    # The export is recomputed from the filters instead of round-tripping the rows through the browser
+    df_filtered = get_filtered_data(filters)
     return dcc.send_data_frame(df_filtered.to_csv, "dati_filtrati.csv")
 
 
+
+# Version pickers, refreshed after every load (the upload message changes each time)
+@app.callback(
+    Output('versions-section', 'style'),
+    Output('version-old', 'options'),
+    Output('version-old', 'value'),
+    Output('version-new', 'options'),
+    Output('version-new', 'value'),
+    Input('upload-data', 'children')
+)
+def update_version_options(_):
+    versions = VERSIONS.versions()
+    current = DATA['version']
+    if current is None or len(versions) < 2:
+        return {'display': 'none'}, [], None, [], None
+    options = [{'label': version_label(meta), 'value': meta['id']} for meta in reversed(versions)]
+    new_id = current['id'] if any(meta['id'] == current['id'] for meta in versions) else options[0]['value']
+    return {'display': 'block'}, options, previous_version(versions, new_id), options, new_id
+
+
+# Added, changed and removed readings between the two chosen versions, from the stored deltas
+@app.callback(
+    Output('version-counts', 'children'),
+    Output('version-table', 'data'),
+    Output('version-table', 'columns'),
+    Input('version-old', 'value'),
+    Input('version-new', 'value')
+)
+def compare_versions(old_id, new_id):
+    if not old_id or not new_id:
+        return None, [], []
+    try:
+        counts, changes = VERSIONS.compare(old_id, new_id)
+    except (LookupError, OSError):
+        return "Versione non più disponibile.", [], []
+    text = (f"Letture aggiunte: {counts[ADDED]:,} · modificate: {counts[CHANGED]:,} · "
+            f"rimosse: {counts[REMOVED]:,}")
+    if len(changes) > VERSION_ROWS_SHOWN:
+        text += f" (prime {VERSION_ROWS_SHOWN:,} differenze)"
+    shown = changes.head(VERSION_ROWS_SHOWN)
+    shown = shown.astype(object).where(shown.notna(), None)
+    return text, shown.to_dict('records'), [{'name': col, 'id': col} for col in shown.columns]
+
+
 # --- 5. Run the app ---
 if __name__ == '__main__':
+    # Development server only; in production serve `server` through wsgi.py
+    preload_default_data()
+    prewarm_views()
     app.run(debug=True)
@@ -0,0 +1,34 @@
+// Small multiples (app_export.py): a panel is built only when its slot scrolls into view.
+// Each slot (.avs-panel) holds a dcc.Store; setting its data triggers the render_panel
+// callback for that slot alone. Slots are watched as they are added to the page, and each
+// slot element is reported once per id. Ids repeat when a view comes back (same filters,
+// chart type or panel options), but the slots are then new elements, or an element whose
+// id changed, so their panels load again.
+(function () {
+    const reported = new WeakMap();
+
+    const observer = new IntersectionObserver(function (entries) {
+        entries.forEach(function (entry) {
+            if (!entry.isIntersecting || !window.dash_clientside || !window.dash_clientside.set_props) {
+                return;
+            }
+            observer.unobserve(entry.target);
+            const slot = JSON.parse(entry.target.id);
+            window.dash_clientside.set_props({type: 'panel-visible', index: slot.index}, {data: true});
+        });
+    }, {rootMargin: '300px 0px'});
+
+    function watchSlots() {
+        document.querySelectorAll('.avs-panel[id]').forEach(function (element) {
+            if (reported.get(element) === element.id) {
+                return;
+            }
+            reported.set(element, element.id);
+            observer.observe(element);
+        });
+    }
+
+    new MutationObserver(watchSlots).observe(document.documentElement, {
+        childList: true, subtree: true, attributes: true, attributeFilter: ['id'],
+    });
+})();
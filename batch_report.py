@@ -0,0 +1,330 @@
+"""
+Headless batch reports for Controllo Qualità and Osmosi, without opening the dashboards.
+
+    python batch_report.py                                   # last calendar month, default datasets
+    python batch_report.py --quality export_*.csv --start 2025-01-01 --end 2025-03-31
+    python batch_report.py --osmosi documents/osmosi_report.xlsx --quality --out reports/osmosi
+
+Writes one self-contained HTML report for every Sample ID / Test Name pair with
+readings in the period and for every Osmosi year it touches. Each report has
+summary cards, the chart and an XLSX appendix with its rows, embedded as a
+download link. An index.html links them all.
+
+The data goes through the same steps as the dashboards: it is parsed once,
+checked against the legal limits and scored for anomalies (core.*). It is then
+sorted by (Sample ID, Test Name, Time), so each report is a contiguous slice.
+Reports are rendered by a process pool. On Linux the workers are forked after
+loading and share that one indexed copy copy-on-write. Elsewhere each worker
+gets its own copy when it starts.
+"""
+import argparse
+import base64
+import gc
+import html
+import io
+import multiprocessing
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+import plotly.express as px
+
+from core.aggregation import aggregate_results, band_figure, choose_bucket
+from core.anomaly import ANOMALY_KINDS, add_anomaly_points, anomaly_summary, score_anomalies
+from core.compliance import (OUT_OF_LIMIT, add_out_of_limit_points, apply_limits, compliance_summary,
+                             limit_text, load_limits)
+from core.filters import filter_quality
+from core.ingestion import load_osmosi_file, load_quality_files
+from core.schema import ANOMALY_COLUMNS, COMPLIANCE_COLUMN, LIMIT_COLUMNS, MESI_ORDINE, OSMOSI_COLUMNS, QUALITY_COLUMNS
+from core.validation import ValidationReport
+
+DEFAULT_QUALITY = 'documents/controllo_qualita.xlsx'
+DEFAULT_OSMOSI = 'documents/osmosi_report.xlsx'
+DEFAULT_OUT_DIR = 'reports'
+
+# Above this many readings a report draws per-period bands instead of every point
+MAX_CHART_POINTS = 5000
+# Flagged readings (out of limit or anomalous) listed in each report
+MAX_LISTED_READINGS = 100
+XLSX_MIME = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+# The indexed data shared with the pool workers (inherited when they are forked)
+SHARED = {}
+
+PAGE_STYLE = """
+body { font-family: system-ui, sans-serif; margin: 2rem auto; max-width: 1200px; color: #222; }
+h1 { margin-bottom: 0; } .subtitle { color: #666; margin-top: .3rem; }
+.cards { display: flex; flex-wrap: wrap; gap: 1rem; margin: 1.5rem 0; }
+.card { border: 1px solid #ddd; border-radius: 8px; padding: .8rem 1.2rem; min-width: 140px; }
+.card .label { color: #666; font-size: .85rem; } .card .value { font-size: 1.5rem; font-weight: 600; }
+table { border-collapse: collapse; width: 100%; font-size: .9rem; margin: 1rem 0; }
+th, td { border-bottom: 1px solid #eee; padding: .35rem .6rem; text-align: left; }
+th { background: #f6f6f6; } .download { display: inline-block; margin: 1rem 0; }
+"""
+
+
+# -------------------- Loading and indexing (parent process) --------------------
+def previous_month(today=None):
+    """First and last day of the previous calendar month."""
+    first_this_month = (today or date.today()).replace(day=1)
+    end = first_this_month - timedelta(days=1)
+    return end.replace(day=1), end
+
+
+def load_quality(sources, sheet_name, start, end, report=None):
+    """
+    Readings of the period, with limits and anomaly scores, sorted by
+    (Sample ID, Test Name, Time). Returns the frame and the slice of each pair.
+    """
+    df = load_quality_files(sources, sheet_name=sheet_name, report=report)
+    if df.empty:
+        return df, []
+    # Anomalies are scored on the whole history, so the first readings of the period have context
+    df = score_anomalies(apply_limits(df, load_limits()))
+    df = filter_quality(df, start_date=start, end_date=end)
+    keys = [QUALITY_COLUMNS['sample_id'], QUALITY_COLUMNS['test_name'], QUALITY_COLUMNS['date_time']]
+    df = df.sort_values(keys, kind='stable').reset_index(drop=True)
+
+    codes = df.groupby(keys[:2], sort=False, dropna=False).ngroup().to_numpy()
+    bounds = np.flatnonzero(np.diff(codes)) + 1
+    starts, stops = np.r_[0, bounds], np.r_[bounds, len(df)]
+    groups = [(df.at[lo, keys[0]], df.at[lo, keys[1]], int(lo), int(hi)) for lo, hi in zip(starts, stops)] if len(df) else []
+    return df, groups
+
+
+def load_osmosi(source, sheet_name, start, end, report=None):
+    """Osmosi rows of the years touched by the period, in month order."""
+    df = load_osmosi_file(source, sheet_name=sheet_name, report=report)
+    year, month = OSMOSI_COLUMNS['anno'], OSMOSI_COLUMNS['mese']
+    df = df[df[year].between(start.year, end.year)].copy()
+    df[month] = pd.Categorical(df[month], categories=MESI_ORDINE, ordered=True)
+    return df.sort_values([year, month]).reset_index(drop=True)
+
+
+def print_validation(label, report):
+    """Data checks of an input on stderr: the run goes on, but dropped or suspicious rows are not silent."""
+    if not report.issues:
+        return
+    print(f"{label}: {report.summary()}", file=sys.stderr)
+    for issue in report.issues:
+        column = f" [{issue['column']}]" if issue['column'] else ''
+        print(f"  {issue['severity']}: {issue['message']}{column}: {issue['rows']:,}", file=sys.stderr)
+
+
+# -------------------- Rendering (pool workers) --------------------
+def share(shared):
+    """Pool initializer for platforms without fork: each worker receives its copy once."""
+    SHARED.update(shared)
+
+
+def slug(text):
+    return re.sub(r'[^A-Za-z0-9._-]+', '_', str(text)).strip('_') or 'report'
+
+
+def to_xlsx(df, sheet_name):
+    output = io.BytesIO()
+    with pd.ExcelWriter(output, engine='openpyxl') as writer:
+        df.to_excel(writer, index=False, sheet_name=sheet_name)
+    return output.getvalue()
+
+
+def render_page(title, subtitle, cards, sections, appendix, plotlyjs):
+    """Self-contained HTML page: summary cards, charts and tables, XLSX appendix as a data URI."""
+    body = [f'<h1>{html.escape(title)}</h1>', f'<p class="subtitle">{html.escape(subtitle)}</p>', '<div class="cards">']
+    body += [f'<div class="card"><div class="label">{html.escape(label)}</div>'
+             f'<div class="value">{html.escape(str(value))}</div></div>' for label, value in cards]
+    body.append('</div>')
+    first_figure = True
+    for section in sections:
+        if isinstance(section, str):
+            body.append(section)
+        else:
+            # Plotly's JavaScript is embedded once per page
+            body.append(section.to_html(full_html=False, include_plotlyjs=plotlyjs if first_figure else False))
+            first_figure = False
+    filename, content = appendix
+    body.append(f'<a class="download" download="{html.escape(filename)}" '
+                f'href="data:{XLSX_MIME};base64,{base64.b64encode(content).decode()}">'
+                f'Appendice: dati del report (XLSX, {len(content) / 1024:,.0f} KB)</a>')
+    return ('<!DOCTYPE html><html lang="it"><head><meta charset="utf-8">'
+            f'<title>{html.escape(title)}</title><style>{PAGE_STYLE}</style></head>'
+            f'<body>{"".join(body)}</body></html>')
+
+
+def quality_report(sample, test, lo, hi):
+    """Report of one Sample ID / Test Name pair; returns its row of the index."""
+    df = SHARED['quality'].iloc[lo:hi]
+    start, end, out_dir, plotlyjs = SHARED['start'], SHARED['end'], SHARED['out_dir'], SHARED['plotlyjs']
+    time_col, result_col = QUALITY_COLUMNS['date_time'], QUALITY_COLUMNS['result']
+    result = df[result_col]
+    compliance = compliance_summary(df)
+    anomalies = anomaly_summary(df)
+
+    title = f'{sample} - {test}'
+    bucket = choose_bucket(start, end) if len(df) > MAX_CHART_POINTS else None
+    if bucket is not None:
+        fig = band_figure(aggregate_results(df, bucket), bucket, title="Andamento dei Risultati")
+    else:
+        fig = px.line(df, x=time_col, y=result_col, markers=True, title="Andamento dei Risultati",
+                      hover_data=[QUALITY_COLUMNS['user_id']])
+        fig.update_layout(xaxis_title="Data", yaxis_title="Risultato")
+        add_out_of_limit_points(fig, df, x=time_col)
+        add_anomaly_points(fig, df, x=time_col)
+
+    flagged = df[df[COMPLIANCE_COLUMN].isin(OUT_OF_LIMIT) | df[ANOMALY_COLUMNS['kind']].isin(ANOMALY_KINDS)]
+    sections = [fig, f'<h2>Letture segnalate ({len(flagged)})</h2>']
+    if flagged.empty:
+        sections.append('<p>Nessuna lettura fuori limite o anomala nel periodo.</p>')
+    else:
+        listed = flagged[[time_col, result_col, LIMIT_COLUMNS['min'], LIMIT_COLUMNS['max'],
+                          COMPLIANCE_COLUMN, ANOMALY_COLUMNS['kind']]].head(MAX_LISTED_READINGS).copy()
+        listed.insert(2, 'Limite', limit_text(listed.pop(LIMIT_COLUMNS['min']).to_numpy(),
+                                              listed.pop(LIMIT_COLUMNS['max']).to_numpy()))
+        sections.append(listed.to_html(index=False, na_rep='', float_format='{:g}'.format, border=0))
+
+    current_limit = limit_text(df[LIMIT_COLUMNS['min']].to_numpy()[-1:], df[LIMIT_COLUMNS['max']].to_numpy()[-1:])[0]
+    cards = [
+        ("Letture", f"{len(df):,}"),
+        ("Risultato Medio", f"{result.mean():.2f}"),
+        ("Minimo / Massimo", f"{result.min():g} / {result.max():g}"),
+        ("Limite in vigore", current_limit or "-"),
+        ("Fuori Limite", f"{compliance['out']} ({compliance['rate']:.1f}%)" if compliance['rate'] is not None else "0"),
+        ("Anomalie", sum(anomalies.values())),
+    ]
+    appendix_name = f'{slug(sample)}__{slug(test)}.xlsx'
+    page = render_page(title, f"Controllo Qualità, dal {start:%d/%m/%Y} al {end:%d/%m/%Y}", cards, sections,
+                       (appendix_name, to_xlsx(df, 'Letture')), plotlyjs)
+    path = os.path.join('qualita', f'{slug(sample)}__{slug(test)}.html')
+    with open(os.path.join(out_dir, path), 'w', encoding='utf-8') as handle:
+        handle.write(page)
+    return {'kind': 'quality', 'sample': sample, 'test': test, 'path': path, 'readings': len(df),
+            'mean': float(result.mean()), 'out': compliance['out'], 'anomalies': sum(anomalies.values())}
+
+
+def osmosi_report(year):
+    """Report of one Osmosi year; returns its row of the index."""
+    osmosi = SHARED['osmosi']
+    df = osmosi[osmosi[OSMOSI_COLUMNS['anno']] == year]
+    out_dir, plotlyjs = SHARED['out_dir'], SHARED['plotlyjs']
+    total, month, washes = OSMOSI_COLUMNS['totale_mc'], OSMOSI_COLUMNS['mese'], OSMOSI_COLUMNS['lavaggio']
+
+    fig = px.bar(df, x=month, y=total, color=washes, title=f"Consumo Totale MC per Mese ({year})",
+                 labels={total: 'Totale MC', month: 'Mese', washes: 'Lavaggi'})
+    table = df.to_html(index=False, na_rep='', float_format='{:,.2f}'.format, border=0)
+    cards = [
+        ("Totale MC Consumati", f"{df[total].sum():,.0f}"),
+        ("Media MC al Mese", f"{df[total].mean():,.2f}"),
+        ("Numero Totale di Lavaggi", int(df[washes].sum())),
+        ("Mesi", len(df)),
+    ]
+    page = render_page(f"Osmosi {year}", "Consumi dell'impianto di osmosi", cards,
+                       [fig, '<h2>Dati mensili</h2>', table], (f'osmosi_{year}.xlsx', to_xlsx(df, 'Osmosi')),
+                       plotlyjs)
+    path = os.path.join('osmosi', f'{year}.html')
+    with open(os.path.join(out_dir, path), 'w', encoding='utf-8') as handle:
+        handle.write(page)
+    return {'kind': 'osmosi', 'year': int(year), 'path': path, 'total_mc': float(df[total].sum()),
+            'washes': int(df[washes].sum())}
+
+
+# -------------------- Index and entry point --------------------
+def write_index(out_dir, start, end, rows):
+    """index.html with a link and the headline numbers of every report."""
+    quality = sorted((r for r in rows if r['kind'] == 'quality'), key=lambda r: (str(r['sample']), str(r['test'])))
+    osmosi = sorted((r for r in rows if r['kind'] == 'osmosi'), key=lambda r: r['year'])
+
+    def link(row, text):
+        return f'<a href="{html.escape(row["path"].replace(os.sep, "/"))}">{html.escape(str(text))}</a>'
+
+    body = [f'<h1>Report dal {start:%d/%m/%Y} al {end:%d/%m/%Y}</h1>',
+            f'<p class="subtitle">Generato il {time.strftime("%d/%m/%Y %H:%M")}</p>']
+    if quality:
+        body.append('<h2>Controllo Qualità</h2><table><tr><th>ID Campione</th><th>Test</th><th>Letture</th>'
+                    '<th>Risultato Medio</th><th>Fuori Limite</th><th>Anomalie</th></tr>')
+        body += [f'<tr><td>{link(r, r["sample"])}</td><td>{link(r, r["test"])}</td><td>{r["readings"]:,}</td>'
+                 f'<td>{r["mean"]:.2f}</td><td>{r["out"]}</td><td>{r["anomalies"]}</td></tr>' for r in quality]
+        body.append('</table>')
+    if osmosi:
+        body.append('<h2>Osmosi</h2><table><tr><th>Anno</th><th>Totale MC</th><th>Lavaggi</th></tr>')
+        body += [f'<tr><td>{link(r, r["year"])}</td><td>{r["total_mc"]:,.0f}</td><td>{r["washes"]}</td></tr>'
+                 for r in osmosi]
+        body.append('</table>')
+    with open(os.path.join(out_dir, 'index.html'), 'w', encoding='utf-8') as handle:
+        handle.write('<!DOCTYPE html><html lang="it"><head><meta charset="utf-8"><title>Report</title>'
+                     f'<style>{PAGE_STYLE}</style></head><body>{"".join(body)}</body></html>')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Batch HTML/XLSX reports for Controllo Qualità and Osmosi.")
+    parser.add_argument('--quality', nargs='*', help=f"quality exports (.csv/.xlsx); default {DEFAULT_QUALITY}, "
+                                                     "pass the flag with no files to skip them")
+    parser.add_argument('--quality-sheet', help="Excel sheet of the quality exports (default: the first)")
+    parser.add_argument('--osmosi', nargs='?', const='', help=f"Osmosi report (.xlsx); default {DEFAULT_OSMOSI}, "
+                                                              "pass the flag with no file to skip it")
+    parser.add_argument('--osmosi-sheet', help="Excel sheet of the Osmosi report (default: the first)")
+    parser.add_argument('--start', type=date.fromisoformat, help="first day (YYYY-MM-DD); default: last month")
+    parser.add_argument('--end', type=date.fromisoformat, help="last day (YYYY-MM-DD); default: last month")
+    parser.add_argument('--out', help=f"output folder (default {DEFAULT_OUT_DIR}/<start>_<end>)")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="report processes")
+    parser.add_argument('--plotlyjs', choices=('inline', 'cdn'), default='inline',
+                        help="embed Plotly's JavaScript in every report (offline) or load it from the CDN")
+    args = parser.parse_args(argv)
+
+    default_start, default_end = previous_month()
+    start, end = args.start or default_start, args.end or default_end
+    if start > end:
+        parser.error("--start is after --end")
+    quality_sources = args.quality if args.quality is not None else (
+        [DEFAULT_QUALITY] if os.path.exists(DEFAULT_QUALITY) else [])
+    osmosi_source = args.osmosi if args.osmosi is not None else (
+        DEFAULT_OSMOSI if os.path.exists(DEFAULT_OSMOSI) else '')
+    out_dir = args.out or os.path.join(DEFAULT_OUT_DIR, f'{start:%Y-%m-%d}_{end:%Y-%m-%d}')
+    for folder in ('qualita', 'osmosi'):
+        os.makedirs(os.path.join(out_dir, folder), exist_ok=True)
+
+    started = time.perf_counter()
+    quality_checks, osmosi_checks = ValidationReport(), ValidationReport()
+    quality, groups = load_quality(quality_sources, args.quality_sheet, start, end, quality_checks) \
+        if quality_sources else (pd.DataFrame(), [])
+    osmosi = load_osmosi(osmosi_source, args.osmosi_sheet, start, end, osmosi_checks) \
+        if osmosi_source else pd.DataFrame()
+    print_validation('Quality data', quality_checks)
+    print_validation('Osmosi data', osmosi_checks)
+    years = sorted(osmosi[OSMOSI_COLUMNS['anno']].unique().tolist()) if not osmosi.empty else []
+    print(f"Loaded {len(quality):,} readings ({len(groups)} sample/test pairs) and {len(years)} Osmosi years "
+          f"in {time.perf_counter() - started:.1f} s", flush=True)
+
+    SHARED.update(quality=quality, osmosi=osmosi, start=start, end=end, out_dir=out_dir,
+                  plotlyjs=True if args.plotlyjs == 'inline' else 'cdn')
+    fork = 'fork' in multiprocessing.get_all_start_methods()
+    if fork:
+        # Keep the collector in the workers away from the inherited pages, as wsgi.py does
+        gc.freeze()
+    pool = ProcessPoolExecutor(max_workers=max(args.workers, 1),
+                               mp_context=multiprocessing.get_context('fork') if fork else None,
+                               initializer=None if fork else share, initargs=() if fork else (dict(SHARED),))
+
+    rows, failures = [], 0
+    with pool:
+        jobs = {pool.submit(quality_report, *group): f'{group[0]} - {group[1]}' for group in groups}
+        jobs.update({pool.submit(osmosi_report, year): f'Osmosi {year}' for year in years})
+        for job in as_completed(jobs):
+            try:
+                rows.append(job.result())
+            except Exception as exc:
+                failures += 1
+                print(f"  {jobs[job]}: {type(exc).__name__}: {exc}", file=sys.stderr)
+
+    write_index(out_dir, start, end, rows)
+    print(f"Wrote {len(rows)} reports to {os.path.join(out_dir, 'index.html')} "
+          f"in {time.perf_counter() - started:.1f} s" + (f" ({failures} failed)" if failures else ""))
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1 @@
+"""Logica condivisa tra la dashboard Dash e le pagine Streamlit."""
@@ -0,0 +1,125 @@
+"""
+Aggregazione temporale dei risultati per intervalli di date lunghi.
+
+Su un intervallo di mesi o anni i singoli punti non sono leggibili: i risultati
+vengono raggruppati per (Sample ID, Test Name) in periodi di giorno, settimana,
+mese o trimestre scelti in base all'ampiezza dell'intervallo, e disegnati come
+media con una banda di percentili.
+"""
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objects as go
+from pandas.tseries.frequencies import to_offset
+
+from core.schema import QUALITY_COLUMNS
+
+# (frequenza pandas, etichetta, durata approssimativa in giorni), dal più fine al più ampio
+BUCKETS = [
+    ('D', 'Giorno', 1),
+    ('W-MON', 'Settimana', 7),
+    ('MS', 'Mese', 30.44),
+    ('QS', 'Trimestre', 91.31),
+]
+BUCKET_LABELS = {freq: label for freq, label, _ in BUCKETS}
+
+# Sotto questa ampiezza (in giorni) si mostrano i punti originali
+MIN_AGGREGATE_DAYS = 31
+# Numero massimo di periodi per serie prima di passare al periodo successivo
+MAX_BUCKETS = 150
+
+# Grafici che passano alla vista aggregata sugli intervalli lunghi
+AGGREGATED_CHART_TYPES = ('line', 'scatter', 'histogram')
+
+QUANTILES = (0.1, 0.9)
+
+PERIOD_START = 'Periodo'
+PERIOD_END = 'Fine Periodo'
+
+
+def choose_bucket(start_date, end_date):
+    """Sceglie il periodo di aggregazione per l'intervallo, oppure None per i punti originali."""
+    if start_date is None or end_date is None:
+        return None
+    span_days = (pd.to_datetime(end_date) - pd.to_datetime(start_date)).days + 1
+    if span_days <= MIN_AGGREGATE_DAYS:
+        return None
+    for freq, _, days in BUCKETS:
+        if span_days / days <= MAX_BUCKETS:
+            return freq
+    return BUCKETS[-1][0]
+
+
+def aggregate_results(df, freq, quantiles=QUANTILES):
+    """
+    Media, minimo, massimo, conteggio e percentili di 'Result' per campione, test e periodo.
+
+    Restituisce una riga per periodo non vuoto, con inizio ('Periodo') e ultimo
+    giorno ('Fine Periodo') del periodo.
+    """
+    time_col = QUALITY_COLUMNS['date_time']
+    keys = [
+        QUALITY_COLUMNS['sample_id'],
+        QUALITY_COLUMNS['test_name'],
+        pd.Grouper(key=time_col, freq=freq, label='left', closed='left'),
+    ]
+    grouped = df.groupby(keys, sort=True)[QUALITY_COLUMNS['result']]
+
+    agg = grouped.agg(['mean', 'min', 'max', 'count'])
+    bands = grouped.quantile(list(quantiles)).unstack()
+    bands.columns = [f'p{round(q * 100)}' for q in quantiles]
+    agg = agg.join(bands).reset_index().rename(columns={time_col: PERIOD_START})
+
+    agg = agg[agg['count'] > 0]
+    agg[PERIOD_END] = agg[PERIOD_START] + to_offset(freq) - pd.Timedelta(days=1)
+    return agg
+
+
+def _rgba(color, alpha):
+    color = color.lstrip('#')
+    r, g, b = (int(color[i:i + 2], 16) for i in (0, 2, 4))
+    return f'rgba({r}, {g}, {b}, {alpha})'
+
+
+def band_figure(agg, freq, title, template=None, quantiles=QUANTILES):
+    """
+    Grafico a bande: media per periodo con la banda tra i percentili indicati.
+
+    Ogni punto della media porta in `customdata` inizio e fine del periodo,
+    usati per il drill-down verso una risoluzione più fine.
+    """
+    low, high = (f'p{round(q * 100)}' for q in quantiles)
+    palette = px.colors.qualitative.Plotly
+    fig = go.Figure()
+
+    series = agg.groupby([QUALITY_COLUMNS['sample_id'], QUALITY_COLUMNS['test_name']], sort=False)
+    for i, ((sample, test), group) in enumerate(series):
+        color = palette[i % len(palette)]
+        name = f'{sample} - {test}'
+        x = group[PERIOD_START]
+
+        fig.add_trace(go.Scatter(x=x, y=group[high], mode='lines', line={'width': 0},
+                                 legendgroup=name, showlegend=False, hoverinfo='skip'))
+        fig.add_trace(go.Scatter(x=x, y=group[low], mode='lines', line={'width': 0},
+                                 fill='tonexty', fillcolor=_rgba(color, 0.2),
+                                 legendgroup=name, showlegend=False, hoverinfo='skip'))
+        fig.add_trace(go.Scatter(
+            x=x, y=group['mean'], mode='lines+markers', name=name, legendgroup=name,
+            line={'color': color},
+            customdata=list(zip(group[PERIOD_START].dt.strftime('%Y-%m-%d'),
+                                group[PERIOD_END].dt.strftime('%Y-%m-%d'),
+                                group['count'], group['min'], group['max'])),
+            hovertemplate=('<b>%{customdata[0]} - %{customdata[1]}</b><br>'
+                           'Media: %{y:.2f}<br>Min: %{customdata[3]}<br>Max: %{customdata[4]}<br>'
+                           'Letture: %{customdata[2]}<extra>' + name + '</extra>'),
+        ))
+
+    fig.update_layout(
+        title=f"{title} (per {BUCKET_LABELS.get(freq, freq).lower()}, banda {low}-{high})",
+        xaxis_title="Data",
+        yaxis_title="Risultato",
+        legend_title="Campione - Test",
+        hovermode='closest',
+        template=template,
+        meta={'bucket': freq},
+    )
+    return fig
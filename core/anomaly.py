@@ -0,0 +1,202 @@
+"""
+Rilevamento delle letture sospette nelle serie di 'Result' (Sample ID × Test Name).
+
+Per ogni serie, in ordine di 'Time', si calcolano in un solo passaggio:
+
+- un punteggio z robusto rispetto alle letture precedenti (mediana e MAD
+  mobili), che individua i picchi;
+- la lunghezza della sequenza di valori identici, che individua gli strumenti
+  bloccati;
+- un punteggio di cambio di livello (differenza tra la media delle ultime
+  letture e quella delle letture prima, divisa per la loro variabilità), che
+  individua le derive e i cambi di taratura.
+
+Tutti i calcoli usano solo letture precedenti: le righe aggiunte in seguito
+(modalità live) si valutano con update_anomalies a partire dalla coda di ogni
+serie, senza ricalcolare lo storico.
+"""
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+
+from core.schema import ANOMALY_COLUMNS, QUALITY_COLUMNS
+
+# Letture precedenti usate per mediana e MAD
+ANOMALY_WINDOW = 20
+# Letture precedenti minime per calcolare il punteggio z
+ANOMALY_MIN_PERIODS = 5
+# Soglia del punteggio z robusto (Iglewicz e Hoaglin)
+SPIKE_Z = 3.5
+# Letture identiche consecutive oltre le quali lo strumento si considera bloccato
+FLATLINE_RUN = 5
+# Letture per lato nel confronto tra medie del cambio di livello
+CHANGE_WINDOW = 5
+# Soglia del punteggio di cambio di livello
+CHANGE_SCORE = 4.0
+# MAD minima, in proporzione alla mediana: evita punteggi infiniti sulle serie quasi costanti
+MAD_FLOOR_RATIO = 0.01
+# Letture precedenti di ogni serie sufficienti a valutare le righe nuove come nel calcolo completo
+ANOMALY_CONTEXT = 2 * ANOMALY_WINDOW
+
+ANOMALY_NONE = 'Nessuna'
+ANOMALY_SPIKE = 'Picco'
+ANOMALY_FLATLINE = 'Valore bloccato'
+ANOMALY_CHANGE = 'Cambio di livello'
+ANOMALY_KINDS = (ANOMALY_SPIKE, ANOMALY_FLATLINE, ANOMALY_CHANGE)
+
+ANOMALY_COLOR = '#ff7f0e'
+
+
+def _shift(values, first, periods=1):
+    """Valore di `periods` righe prima nella stessa serie (NaN all'inizio della serie)."""
+    shifted = np.full(len(values), np.nan)
+    if periods < len(values):
+        shifted[periods:] = values[:-periods]
+    shifted[first] = np.nan
+    return shifted
+
+
+def _series_positions(codes):
+    """Inizio di ogni serie e posizione di ogni riga nella propria serie (codici già ordinati)."""
+    index = np.arange(len(codes))
+    first = np.ones(len(codes), dtype=bool)
+    first[1:] = codes[1:] != codes[:-1]
+    start = np.maximum.accumulate(np.where(first, index, 0))
+    return first, index - start
+
+
+def _rolling(values, window, position, how):
+    """
+    Media o varianza su `window` righe, NaN dove la finestra uscirebbe dalla serie.
+
+    Le serie sono contigue: basta un rolling sull'intero array e scartare le
+    finestre che attraversano il confine tra due serie.
+    """
+    rolled = getattr(pd.Series(values).rolling(window, min_periods=window), how)().to_numpy(copy=True)
+    rolled[position < window - 1] = np.nan
+    return rolled
+
+
+def _rolling_median(values, codes, position, window, min_periods):
+    """
+    Mediana mobile per serie con un solo rolling sull'intero array.
+
+    Solo le prime `window - 1` righe di ogni serie, dove la finestra uscirebbe
+    dalla serie, vengono ricalcolate raggruppando per serie.
+    """
+    rolled = pd.Series(values).rolling(window, min_periods=min_periods).median().to_numpy(copy=True)
+    head = position < window - 1
+    if head.any():
+        by_series = pd.Series(values[head]).groupby(codes[head], sort=False)
+        rolled[head] = by_series.rolling(window, min_periods=min_periods).median().droplevel(0).sort_index().to_numpy()
+    return rolled
+
+
+def score_anomalies(df):
+    """
+    Aggiunge ad ogni lettura 'Punteggio Z', 'Punteggio Cambio' e 'Anomalia'
+    (Picco, Valore bloccato, Cambio di livello o Nessuna). Restituisce un nuovo DataFrame.
+    """
+    z_col, change_col, kind_col = ANOMALY_COLUMNS['robust_z'], ANOMALY_COLUMNS['change'], ANOMALY_COLUMNS['kind']
+    n = len(df)
+    if n == 0:
+        return df.assign(**{z_col: np.array([], dtype='float64'), change_col: np.array([], dtype='float64'),
+                            kind_col: np.array([], dtype=object)})
+
+    # Righe ordinate per serie e, dentro la serie, per 'Time'
+    codes = df.groupby([QUALITY_COLUMNS['sample_id'], QUALITY_COLUMNS['test_name']],
+                       sort=False, dropna=False).ngroup().to_numpy()
+    order = np.lexsort((df[QUALITY_COLUMNS['date_time']].to_numpy(), codes))
+    codes = codes[order]
+    x = pd.to_numeric(df[QUALITY_COLUMNS['result']], errors='coerce').to_numpy(dtype='float64')[order]
+    first, position = _series_positions(codes)
+
+    # Picchi: mediana e MAD mobili per serie, riferite alle letture precedenti
+    median = _rolling_median(x, codes, position, ANOMALY_WINDOW, ANOMALY_MIN_PERIODS)
+    mad = _rolling_median(np.abs(x - median), codes, position, ANOMALY_WINDOW, ANOMALY_MIN_PERIODS)
+    # Mediana delle ultime CHANGE_WINDOW letture: un picco è lontano anche da queste,
+    # le letture di un nuovo livello no
+    local = _rolling_median(x, codes, position, CHANGE_WINDOW, 1)
+    median, mad, local = _shift(median, first), _shift(mad, first), _shift(local, first)
+    scale = np.maximum(mad, MAD_FLOOR_RATIO * np.abs(median))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        robust_z = np.where(scale > 0, 0.6745 * (x - median) / scale, np.nan)
+        local_z = np.where(scale > 0, 0.6745 * (x - local) / scale, np.nan)
+
+    # Strumento bloccato: lunghezza della sequenza di valori identici fino alla lettura
+    same = x == _shift(x, first)
+    index = np.arange(n)
+    run_start = np.maximum.accumulate(np.where(same, 0, index))
+    flatline = index - run_start + 1 >= FLATLINE_RUN
+
+    # Cambio di livello: ultime CHANGE_WINDOW letture contro le CHANGE_WINDOW precedenti
+    recent_mean = _rolling(x, CHANGE_WINDOW, position, 'mean')
+    recent_var = _rolling(x, CHANGE_WINDOW, position, 'var')
+    before_mean = _shift(recent_mean, position < CHANGE_WINDOW, CHANGE_WINDOW)
+    before_var = _shift(recent_var, position < CHANGE_WINDOW, CHANGE_WINDOW)
+    spread = np.sqrt((recent_var + before_var) / CHANGE_WINDOW)
+    spread = np.maximum(spread, MAD_FLOOR_RATIO * np.abs(before_mean))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        change = np.where(spread > 0, np.abs(recent_mean - before_mean) / spread, np.nan)
+    # Si segnala solo la prima lettura oltre soglia, non tutte quelle del nuovo livello
+    above = change >= CHANGE_SCORE
+    change_point = above & ~(_shift(change, first) >= CHANGE_SCORE)
+
+    # Dopo un cambio di livello le letture lontane dalla mediana vecchia non sono picchi
+    spike = (np.abs(robust_z) >= SPIKE_Z) & (np.abs(local_z) >= SPIKE_Z) & ~above
+    kind = np.select([spike, flatline, change_point],
+                     [ANOMALY_SPIKE, ANOMALY_FLATLINE, ANOMALY_CHANGE], default=ANOMALY_NONE).astype(object)
+
+    # Ritorno all'ordine originale delle righe
+    columns = {}
+    for name, values in ((z_col, robust_z), (change_col, change), (kind_col, kind)):
+        restored = np.empty(n, dtype=values.dtype)
+        restored[order] = values
+        columns[name] = restored
+    return df.assign(**columns)
+
+
+def update_anomalies(history, new_rows, context=ANOMALY_CONTEXT):
+    """
+    Valuta solo le righe nuove, usando come riferimento le ultime `context`
+    letture delle stesse serie già presenti in `history`.
+    """
+    if new_rows.empty or history.empty:
+        return score_anomalies(new_rows)
+    keys = [QUALITY_COLUMNS['sample_id'], QUALITY_COLUMNS['test_name']]
+    touched = pd.MultiIndex.from_frame(history[keys]).isin(pd.MultiIndex.from_frame(new_rows[keys]))
+    tail = history[touched].sort_values(QUALITY_COLUMNS['date_time'], kind='stable').groupby(keys).tail(context)
+    scored = score_anomalies(pd.concat([tail, new_rows], ignore_index=True))
+    return scored.iloc[len(tail):].reset_index(drop=True)
+
+
+def anomaly_summary(df):
+    """Numero di letture anomale per tipo."""
+    kind_col = ANOMALY_COLUMNS['kind']
+    if kind_col not in df.columns:
+        return {kind: 0 for kind in ANOMALY_KINDS}
+    counts = df[kind_col].value_counts()
+    return {kind: int(counts.get(kind, 0)) for kind in ANOMALY_KINDS}
+
+
+def add_anomaly_points(fig, df, x):
+    """Evidenzia sul grafico le letture anomale con una traccia dedicata."""
+    kind_col = ANOMALY_COLUMNS['kind']
+    if kind_col not in df.columns:
+        return fig
+    anomalies = df[df[kind_col].isin(ANOMALY_KINDS)]
+    if anomalies.empty:
+        return fig
+    fig.add_trace(go.Scatter(
+        x=anomalies[x], y=anomalies[QUALITY_COLUMNS['result']], mode='markers', name='Anomalie',
+        marker={'color': ANOMALY_COLOR, 'size': 13, 'symbol': 'circle-open', 'line': {'width': 2}},
+        customdata=np.column_stack([anomalies[QUALITY_COLUMNS['sample_id']].astype(object),
+                                    anomalies[QUALITY_COLUMNS['test_name']].astype(object),
+                                    anomalies[kind_col].astype(object),
+                                    anomalies[ANOMALY_COLUMNS['robust_z']].round(2).astype(object),
+                                    anomalies[ANOMALY_COLUMNS['change']].round(2).astype(object)]),
+        hovertemplate=('<b>%{customdata[2]}</b><br>%{customdata[0]} - %{customdata[1]}<br>'
+                       'Risultato: %{y}<br>Punteggio z: %{customdata[3]}<br>'
+                       'Punteggio cambio: %{customdata[4]}<extra></extra>'),
+    ))
+    return fig
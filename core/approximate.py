@@ -0,0 +1,286 @@
+"""
+Risposte approssimate e immediate per i dataset molto grandi.
+
+Su milioni di letture, trascinare il filtro dei risultati o cambiare le date
+rifà filtri, riepiloghi e grafico su tutte le righe. Qui, una volta per
+dataset, si prepara un QualitySketch che risponde subito con una stima; il
+risultato esatto viene calcolato intanto in background e sostituisce la stima
+quando è pronto.
+
+Il QualitySketch divide le letture in strati (ID campione × test × mese) e
+per ogni strato tiene:
+
+- i conteggi esatti: letture, risultati, somma, letture verificate e fuori limite;
+- uno sketch dei quantili dei risultati (SKETCH_QUANTILES + 1 quantili), da
+  cui si stimano quante letture dello strato cadono in un intervallo di
+  risultati e la loro media;
+- un campione stratificato: la stessa frazione delle letture di ogni strato,
+  distribuita sul mese, con il peso (letture / letture campionate) di ognuna.
+
+Uno strato tutto dentro l'intervallo di date usa i conteggi esatti, o lo
+sketch se l'intervallo di risultati ne taglia una parte; gli strati ai bordi
+dell'intervallo di date, e tutti con i filtri per operatore o anomalia, usano
+il campione pesato. Il campione filtrato è anche l'anteprima del grafico.
+"""
+import numpy as np
+import pandas as pd
+
+from core.compliance import OUT_OF_LIMIT, STATUS_NO_LIMIT
+from core.filters import filter_quality
+from core.memory import sample_rows
+from core.schema import COMPLIANCE_COLUMN, QUALITY_COLUMNS
+
+# Sotto queste letture i risultati esatti sono già abbastanza veloci
+APPROX_MIN_ROWS = 200_000
+# Letture del campione stratificato (anche l'anteprima dei grafici)
+APPROX_SAMPLE_ROWS = 50_000
+# Intervalli di quantili di ogni sketch (SKETCH_QUANTILES + 1 quantili per strato)
+SKETCH_QUANTILES = 64
+# Livello dell'intervallo di confidenza dell'indicatore di precisione (z al 95%)
+APPROX_Z = 1.96
+
+
+def _segment_mass(quantiles, low, high):
+    """
+    Frazione delle letture di ogni strato con risultato in [low, high] e loro
+    media, dagli sketch (una riga di quantili per strato). Tra due quantili
+    consecutivi c'è 1 / SKETCH_QUANTILES delle letture, distribuito in modo
+    uniforme; due quantili uguali sono un valore ripetuto.
+    """
+    left, right = quantiles[:, :-1], quantiles[:, 1:]
+    width = right - left
+    start, end = np.maximum(left, low), np.minimum(right, high)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        share = np.where(width > 0, np.clip(end - start, 0, None) / width,
+                         ((left >= low) & (left <= high)).astype(float))
+    share = np.nan_to_num(share) / width.shape[1]
+    fraction = share.sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = (share * np.where(width > 0, (start + end) / 2, left)).sum(axis=1) / fraction
+    return fraction, np.where(fraction > 0, mean, np.nan)
+
+
+def _stratum_variance(row_strata, values, sampled, population):
+    """
+    Varianza della stima per strato N·media(values) da un campione di `sampled`
+    letture su `population` (N² s² / n); `values` vale per le letture campionate
+    che passano i filtri, le altre contano zero.
+    """
+    count = len(sampled)
+    n = np.maximum(sampled, 1)
+    total = np.bincount(row_strata, weights=values, minlength=count)
+    squares = np.bincount(row_strata, weights=values ** 2, minlength=count)
+    spread = np.clip(squares - total ** 2 / n, 0, None) / np.maximum(n - 1, 1)
+    return population ** 2 * spread / n
+
+
+class QualitySketch:
+    """
+    Strati, sketch dei quantili e campione stratificato di un dataset di
+    Controllo Qualità (vedi il docstring del modulo). Si costruisce una volta
+    per dataset; estimate() risponde per qualsiasi combinazione di filtri.
+    """
+
+    def __init__(self, df, sample_rows_target=APPROX_SAMPLE_ROWS, quantiles=SKETCH_QUANTILES):
+        sample_col, test_col = QUALITY_COLUMNS['sample_id'], QUALITY_COLUMNS['test_name']
+        result_col = QUALITY_COLUMNS['result']
+        self.rows_total = len(df)
+
+        # Strato di ogni lettura: ID campione × test × mese
+        months = df[QUALITY_COLUMNS['date']].to_numpy(dtype='datetime64[ns]').astype('datetime64[M]')
+        groups = pd.DataFrame({'sample': df[sample_col].to_numpy(), 'test': df[test_col].to_numpy(),
+                               'month': months}).groupby(['sample', 'test', 'month'], sort=False, dropna=False)
+        codes = groups.ngroup().to_numpy()
+        keys = groups.size().index
+        results = df[result_col].to_numpy(dtype='float64')
+        has_result = ~np.isnan(results)
+        status = df[COMPLIANCE_COLUMN].to_numpy() if COMPLIANCE_COLUMN in df.columns else None
+        count = len(keys)
+
+        month_start = pd.DatetimeIndex(keys.get_level_values('month').to_numpy(dtype='datetime64[ns]'))
+        strata = pd.DataFrame({
+            'sample': keys.get_level_values('sample'),
+            'test': keys.get_level_values('test'),
+            'month_start': month_start,
+            'month_end': month_start + pd.offsets.MonthEnd(0),
+            'rows': np.bincount(codes, minlength=count),
+            'results': np.bincount(codes, weights=has_result, minlength=count).astype('int64'),
+            'sum': np.bincount(codes[has_result], weights=results[has_result], minlength=count),
+        })
+        if status is not None:
+            valid = has_result
+            strata['checked'] = np.bincount(codes[valid], weights=(status[valid] != STATUS_NO_LIMIT),
+                                            minlength=count).astype('int64')
+            strata['out'] = np.bincount(codes[valid], weights=pd.Series(status[valid]).isin(OUT_OF_LIMIT).to_numpy(),
+                                        minlength=count).astype('int64')
+        else:
+            strata['checked'] = strata['out'] = 0
+
+        # Sketch dei quantili: risultati ordinati per strato, quantili letti per posizione
+        order = np.lexsort((results[has_result], codes[has_result]))
+        sorted_results = results[has_result][order]
+        sizes = strata['results'].to_numpy()
+        offsets = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+        positions = offsets[:, None] + np.linspace(0, 1, quantiles + 1)[None, :] * np.maximum(sizes - 1, 0)[:, None]
+        lower = np.floor(positions).astype('int64')
+        upper = np.minimum(lower + 1, offsets[:, None] + np.maximum(sizes - 1, 0)[:, None])
+        if len(sorted_results):
+            lower, upper = (np.clip(index, 0, len(sorted_results) - 1) for index in (lower, upper))
+            self.quantiles = (sorted_results[lower] + (sorted_results[upper] - sorted_results[lower])
+                              * (positions - np.floor(positions)))
+        else:
+            self.quantiles = np.empty((count, quantiles + 1))
+        self.quantiles[sizes == 0] = np.nan
+        strata['min'], strata['max'] = self.quantiles[:, 0], self.quantiles[:, -1]
+
+        # Campione stratificato, con le posizioni nel dataset in ordine di tempo
+        fraction = min(sample_rows_target / max(len(df), 1), 1.0)
+        kept = sample_rows(pd.DataFrame({'stratum': codes}), fraction, keys=('stratum',)).index.to_numpy()
+        self.rows = df.iloc[kept].reset_index(drop=True)
+        self.row_strata = codes[kept]
+        strata['sampled'] = np.bincount(self.row_strata, minlength=count)
+        self.weights = strata['rows'].to_numpy() / np.maximum(strata['sampled'].to_numpy(), 1)
+        self.fraction = fraction
+        self.strata = strata
+
+    def _covered(self, filters):
+        """Strati compatibili con campioni e test, e quelli interamente dentro l'intervallo di date."""
+        strata = self.strata
+        selected = np.ones(len(strata), dtype=bool)
+        samples, tests, operators = filters.get('samples'), filters.get('tests'), filters.get('operators')
+        if not operators and samples and tests:
+            selected &= strata['sample'].isin(samples).to_numpy() & strata['test'].isin(tests).to_numpy()
+        start, end = filters.get('start_date'), filters.get('end_date')
+        inside = np.ones(len(strata), dtype=bool)
+        if start is not None:
+            start = pd.Timestamp(start)
+            selected &= (strata['month_end'] >= start).to_numpy()
+            inside &= (strata['month_start'] >= start).to_numpy()
+        if end is not None:
+            end = pd.Timestamp(end)
+            selected &= (strata['month_start'] <= end).to_numpy()
+            inside &= (strata['month_end'] <= end).to_numpy()
+        return selected, inside
+
+    def estimate(self, filters):
+        """
+        Stima di quality_summary e compliance_summary per i `filters` della
+        dashboard (stessi nomi di filter_quality), con le letture del campione
+        che li soddisfano come anteprima:
+
+            {'summary': {...}, 'compliance': {...}, 'error': {...}, 'preview': DataFrame}
+
+        `error` ha la semiampiezza dell'intervallo al 95% di ogni valore stimato:
+        'tests' relativa al numero di letture (es. 0.03 = ±3%), 'avg_result'
+        nell'unità dei risultati e 'out' in letture fuori limite.
+        """
+        strata = self.strata
+        results_range = filters.get('results_range')
+        preview = filter_quality(self.rows, **filters)
+        selected, inside = self._covered(filters)
+
+        # Strati risolti con conteggi esatti o sketch: senza operatori né anomalie, tutti dentro le date
+        sketched = selected & inside & (not filters.get('operators')) & (not filters.get('anomalies'))
+        rows = np.zeros(len(strata))
+        total = np.zeros(len(strata))
+        checked = np.zeros(len(strata))
+        out = np.zeros(len(strata))
+        variance = np.zeros(len(strata))
+        total_variance = np.zeros(len(strata))
+        out_variance = np.zeros(len(strata))
+
+        if results_range is None:
+            fraction, mean = np.ones(len(strata)), strata['sum'].to_numpy() / np.maximum(strata['results'], 1)
+            whole = np.ones(len(strata), dtype=bool)
+            base = strata['rows'].to_numpy()
+            cut_low = cut_high = np.zeros(len(strata))
+        else:
+            low, high = results_range
+            fraction, mean = _segment_mass(self.quantiles, low, high)
+            whole = ((strata['min'] >= low) & (strata['max'] <= high)).to_numpy()
+            base = strata['results'].to_numpy()
+            # Estremi dell'intervallo che cadono dentro lo strato
+            cut_low = (strata['min'] < low).to_numpy(dtype=float)
+            cut_high = (strata['max'] > high).to_numpy(dtype=float)
+        exact = sketched & whole
+        partial = sketched & ~whole
+        rows[exact] = base[exact]
+        total[exact] = strata['sum'].to_numpy()[exact]
+        checked[exact] = strata['checked'].to_numpy()[exact]
+        out[exact] = strata['out'].to_numpy()[exact]
+        # Intervallo di risultati che taglia lo strato: conteggio e media dallo sketch,
+        # con l'errore di un quantile (uniforme) per ogni estremo che cade nello strato.
+        # L'errore dell'interpolazione è lo stesso negli strati con risultati simili: si
+        # somma tra gli strati invece di sommarne le varianze
+        rows[partial] = base[partial] * fraction[partial]
+        total[partial] = rows[partial] * np.nan_to_num(mean[partial])
+        edge_error = np.where(partial, base / SKETCH_QUANTILES / np.sqrt(12), 0.0)
+        sketch_rows_error = (edge_error * (cut_low + cut_high)).sum()
+
+        # Tutti gli altri strati (e la conformità di quelli tagliati): campione pesato
+        from_sample = ~sketched
+        row_strata = self.row_strata[preview.index.to_numpy()]
+        weights = self.weights[row_strata]
+        results = preview[QUALITY_COLUMNS['result']].to_numpy(dtype='float64')
+        count = len(strata)
+        passing = np.bincount(row_strata, minlength=count)
+        sampled_rows = np.bincount(row_strata, weights=weights, minlength=count)
+        sampled_total = np.bincount(row_strata, weights=np.nan_to_num(results) * weights, minlength=count)
+        rows[from_sample] = sampled_rows[from_sample]
+        total[from_sample] = sampled_total[from_sample]
+        # Errori degli strati dal campione: letture, media e fuori limite
+        sampled, population = strata['sampled'].to_numpy(), strata['rows'].to_numpy()
+        estimated_rows = from_sample & selected
+        variance[estimated_rows] += _stratum_variance(row_strata, np.ones(len(row_strata)), sampled,
+                                                      population)[estimated_rows]
+        tests = rows.sum()
+        average = total.sum() / tests if tests > 0 else 0.0
+        # Media: varianza linearizzata del rapporto somma / letture
+        deviations = np.nan_to_num(results, nan=average) - average
+        total_variance[estimated_rows] = _stratum_variance(row_strata, deviations, sampled,
+                                                           population)[estimated_rows]
+        # Strati tagliati: le letture incerte sono quelle vicine agli estremi dell'intervallo
+        sketch_total_error = 0.0
+        if partial.any():
+            sketch_total_error = (edge_error * (cut_low * abs(low - average) + cut_high * abs(high - average))).sum()
+        if COMPLIANCE_COLUMN in preview.columns:
+            status = preview[COMPLIANCE_COLUMN]
+            sampled_checked = np.bincount(row_strata, weights=weights * (status != STATUS_NO_LIMIT).to_numpy(),
+                                          minlength=count)
+            sampled_out = np.bincount(row_strata, weights=weights * status.isin(OUT_OF_LIMIT).to_numpy(),
+                                      minlength=count)
+            estimated = from_sample | partial
+            # Strati tagliati: quota di letture fuori limite del campione, sul conteggio dello sketch
+            scale = np.where(partial, rows / np.maximum(sampled_rows, 1e-9), 1.0)
+            scale[partial & (sampled_rows == 0)] = 0
+            checked[estimated] = (sampled_checked * scale)[estimated]
+            out[estimated] = (sampled_out * scale)[estimated]
+            is_out = status.isin(OUT_OF_LIMIT).to_numpy(dtype='float64')
+            out_variance[estimated_rows] = _stratum_variance(row_strata, is_out, sampled,
+                                                             population)[estimated_rows]
+            # Strati tagliati: quota fuori limite delle letture campionate che passano i filtri
+            out_share = np.bincount(row_strata, weights=is_out, minlength=count) / np.maximum(passing, 1)
+            out_variance[partial] = (rows ** 2 * out_share * (1 - out_share) / np.maximum(passing, 1))[partial]
+
+        samples = set(strata['sample'][(exact | partial) & (rows > 0)])
+        samples.update(preview[QUALITY_COLUMNS['sample_id']].unique())
+        checked_total, out_total = checked.sum(), out.sum()
+        return {
+            'summary': {
+                'samples': len(samples),
+                'avg_result': total.sum() / tests if tests > 0 else None,
+                'tests': int(round(tests)),
+            },
+            'compliance': {
+                'checked': int(round(checked_total)),
+                'out': int(round(out_total)),
+                'rate': out_total / checked_total * 100 if checked_total > 0 else None,
+            },
+            'error': {
+                'tests': APPROX_Z * np.hypot(np.sqrt(variance.sum()), sketch_rows_error) / tests if tests > 0 else 0.0,
+                'avg_result': (APPROX_Z * np.hypot(np.sqrt(total_variance.sum()), sketch_total_error) / tests
+                               if tests > 0 else 0.0),
+                'out': APPROX_Z * np.sqrt(out_variance.sum()),
+            },
+            'preview': preview,
+        }
@@ -0,0 +1,185 @@
+"""
+Confronto delle letture con i limiti di legge (conducibilità, pH, durezza, ...).
+
+I limiti stanno in una tabella (CSV o Excel) versionata per data: ogni riga vale
+per un test, e facoltativamente per un solo campione, dalla data 'Valido Dal'
+fino alla versione successiva. Ogni lettura prende la versione in vigore al suo
+'Time' con un join as-of vettorizzato (pd.merge_asof); i limiti specifici del
+campione hanno la precedenza su quelli generali del test.
+
+Lo stato di conformità viene calcolato una volta al caricamento; i tassi di
+superamento per periodo si ricavano da conteggi giornalieri, molto più piccoli
+delle letture, così cambiare periodo non rilegge tutto lo storico.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objects as go
+
+from core.aggregation import BUCKET_LABELS, PERIOD_START
+from core.dates import parse_dates
+from core.ingestion import read_excel_fast
+from core.schema import COMPLIANCE_COLUMN, LIMIT_COLUMNS, QUALITY_COLUMNS
+
+LIMITS_PATH_ENV = 'AVS_LIMITS_PATH'
+DEFAULT_LIMITS_PATH = 'documents/limiti.csv'
+
+STATUS_OK = 'Conforme'
+STATUS_LOW = 'Sotto limite'
+STATUS_HIGH = 'Sopra limite'
+STATUS_NO_LIMIT = 'Senza limite'
+OUT_OF_LIMIT = (STATUS_LOW, STATUS_HIGH)
+
+CHECKED = 'Verificate'
+OUT = 'Fuori Limite'
+RATE = 'Tasso Superamento (%)'
+
+OUT_OF_LIMIT_COLOR = '#d62728'
+
+
+def limits_path():
+    """Percorso della tabella dei limiti (AVS_LIMITS_PATH o documents/limiti.csv)."""
+    return os.environ.get(LIMITS_PATH_ENV) or DEFAULT_LIMITS_PATH
+
+
+def load_limits(source=None):
+    """
+    Legge la tabella dei limiti, oppure restituisce None se il file non esiste.
+
+    Solleva ValueError se mancano le colonne 'Test Name' o 'Valido Dal'.
+    """
+    source = source or limits_path()
+    if isinstance(source, (str, os.PathLike)) and not os.path.exists(source):
+        return None
+    name = str(getattr(source, 'name', source)).lower()
+    limits = read_excel_fast(source) if name.endswith(('.xls', '.xlsx')) else pd.read_csv(source)
+
+    missing = [LIMIT_COLUMNS[c] for c in ('test_name', 'valid_from') if LIMIT_COLUMNS[c] not in limits.columns]
+    if missing:
+        raise ValueError(f"Colonne mancanti nella tabella dei limiti: {', '.join(missing)}")
+
+    limits = limits.copy()
+    for key in ('sample_id', 'min', 'max'):
+        if LIMIT_COLUMNS[key] not in limits.columns:
+            limits[LIMIT_COLUMNS[key]] = np.nan
+    limits[LIMIT_COLUMNS['test_name']] = limits[LIMIT_COLUMNS['test_name']].astype(str).str.strip()
+    # 'Sample ID' vuoto: limite generale del test
+    limits[LIMIT_COLUMNS['sample_id']] = [(str(s).strip() or None) if pd.notna(s) else None
+                                          for s in limits[LIMIT_COLUMNS['sample_id']]]
+    limits[LIMIT_COLUMNS['valid_from']] = parse_dates(limits[LIMIT_COLUMNS['valid_from']])
+    for key in ('min', 'max'):
+        limits[LIMIT_COLUMNS[key]] = pd.to_numeric(limits[LIMIT_COLUMNS[key]], errors='coerce')
+    limits = limits.dropna(subset=[LIMIT_COLUMNS['valid_from']])
+    return limits.sort_values(LIMIT_COLUMNS['valid_from'], kind='stable').reset_index(drop=True)
+
+
+def apply_limits(df, limits):
+    """
+    Aggiunge ad ogni lettura i limiti in vigore ('Limite Min', 'Limite Max') e lo
+    stato di conformità ('Conformità'). Restituisce un nuovo DataFrame.
+    """
+    time_col = QUALITY_COLUMNS['date_time']
+    test_col, sample_col = QUALITY_COLUMNS['test_name'], QUALITY_COLUMNS['sample_id']
+    min_col, max_col = LIMIT_COLUMNS['min'], LIMIT_COLUMNS['max']
+
+    bounds = np.full((len(df), 2), np.nan)
+    if limits is not None and not limits.empty and not df.empty:
+        readings = pd.DataFrame({
+            '_row': np.arange(len(df)),
+            time_col: df[time_col].to_numpy(),
+            test_col: df[test_col].astype(object).to_numpy(),
+            sample_col: df[sample_col].astype(object).to_numpy(),
+        }).dropna(subset=[time_col]).sort_values(time_col, kind='stable')
+
+        is_specific = limits[LIMIT_COLUMNS['sample_id']].notna()
+        # Prima i limiti generali del test, poi quelli del singolo campione che li sostituiscono
+        for table, by in ((limits[~is_specific], [test_col]), (limits[is_specific], [test_col, sample_col])):
+            if table.empty:
+                continue
+            versions = pd.DataFrame({
+                time_col: table[LIMIT_COLUMNS['valid_from']].astype(readings[time_col].dtype).to_numpy(),
+                **{col: table[LIMIT_COLUMNS[key]].astype(object).to_numpy()
+                   for col, key in ((test_col, 'test_name'), (sample_col, 'sample_id')) if col in by},
+                min_col: table[min_col].to_numpy(),
+                max_col: table[max_col].to_numpy(),
+            })
+            joined = pd.merge_asof(readings, versions, on=time_col, by=by, direction='backward')
+            matched = joined[[min_col, max_col]].notna().any(axis=1).to_numpy()
+            bounds[joined['_row'].to_numpy()[matched]] = joined.loc[matched, [min_col, max_col]].to_numpy()
+
+    low, high = bounds[:, 0], bounds[:, 1]
+    result = pd.to_numeric(df[QUALITY_COLUMNS['result']], errors='coerce').to_numpy(dtype='float64')
+    no_limit = (np.isnan(low) & np.isnan(high)) | np.isnan(result)
+    status = np.select([no_limit, result < low, result > high],
+                       [STATUS_NO_LIMIT, STATUS_LOW, STATUS_HIGH], default=STATUS_OK)
+    return df.assign(**{min_col: low, max_col: high, COMPLIANCE_COLUMN: status})
+
+
+def compliance_summary(df):
+    """Letture con un limite, letture fuori limite e tasso di superamento (%)."""
+    if COMPLIANCE_COLUMN not in df.columns:
+        return {'checked': 0, 'out': 0, 'rate': None}
+    status = df[COMPLIANCE_COLUMN]
+    checked = int((status != STATUS_NO_LIMIT).sum())
+    out = int(status.isin(OUT_OF_LIMIT).sum())
+    return {'checked': checked, 'out': out, 'rate': out / checked * 100 if checked else None}
+
+
+def compliance_counts(df):
+    """Conteggi giornalieri per campione e test: letture verificate e fuori limite."""
+    keys = [QUALITY_COLUMNS['date'], QUALITY_COLUMNS['sample_id'], QUALITY_COLUMNS['test_name']]
+    if df.empty or COMPLIANCE_COLUMN not in df.columns:
+        return pd.DataFrame(columns=[*keys, CHECKED, OUT])
+    status = df[COMPLIANCE_COLUMN]
+    counts = df[keys].assign(**{CHECKED: (status != STATUS_NO_LIMIT).to_numpy(),
+                                OUT: status.isin(OUT_OF_LIMIT).to_numpy()})
+    return counts.groupby(keys, sort=True).sum().reset_index()
+
+
+def exceedance_rates(counts, freq):
+    """Tasso di superamento per test e periodo, dai conteggi giornalieri."""
+    grouped = counts.groupby([QUALITY_COLUMNS['test_name'],
+                              pd.Grouper(key=QUALITY_COLUMNS['date'], freq=freq, label='left', closed='left')])
+    rates = grouped[[CHECKED, OUT]].sum().reset_index().rename(columns={QUALITY_COLUMNS['date']: PERIOD_START})
+    rates = rates[rates[CHECKED] > 0]
+    return rates.assign(**{RATE: rates[OUT] / rates[CHECKED] * 100})
+
+
+def exceedance_figure(rates, freq, template=None):
+    """Grafico del tasso di superamento dei limiti per periodo e test."""
+    fig = px.bar(rates, x=PERIOD_START, y=RATE, color=QUALITY_COLUMNS['test_name'], barmode='group',
+                 hover_data=[CHECKED, OUT], template=template,
+                 title=f"Tasso di Superamento dei Limiti (per {BUCKET_LABELS.get(freq, freq).lower()})")
+    fig.update_layout(xaxis_title="Periodo", yaxis_title="Fuori limite (%)", legend_title="Test")
+    return fig
+
+
+def limit_text(low, high):
+    """Limiti in forma leggibile: '6.5 - 9.5', '≤ 2000' o '≥ 6.5'."""
+    low, high = pd.Series(low, dtype='float64'), pd.Series(high, dtype='float64')
+    low_text, high_text = low.map('{:g}'.format), high.map('{:g}'.format)
+    text = np.where(low.notna() & high.notna(), low_text + ' - ' + high_text,
+                    np.where(high.notna(), '≤ ' + high_text, np.where(low.notna(), '≥ ' + low_text, '')))
+    return text.astype(object)
+
+
+def add_out_of_limit_points(fig, df, x):
+    """Evidenzia sul grafico le letture fuori limite con una traccia dedicata."""
+    if COMPLIANCE_COLUMN not in df.columns:
+        return fig
+    out = df[df[COMPLIANCE_COLUMN].isin(OUT_OF_LIMIT)]
+    if out.empty:
+        return fig
+    fig.add_trace(go.Scatter(
+        x=out[x], y=out[QUALITY_COLUMNS['result']], mode='markers', name='Fuori limite',
+        marker={'color': OUT_OF_LIMIT_COLOR, 'size': 11, 'symbol': 'x'},
+        customdata=np.column_stack([out[QUALITY_COLUMNS['sample_id']].astype(object),
+                                    out[QUALITY_COLUMNS['test_name']].astype(object),
+                                    limit_text(out[LIMIT_COLUMNS['min']].to_numpy(), out[LIMIT_COLUMNS['max']].to_numpy()),
+                                    out[COMPLIANCE_COLUMN].astype(object)]),
+        hovertemplate=('<b>%{customdata[3]}</b><br>%{customdata[0]} - %{customdata[1]}<br>'
+                       'Risultato: %{y}<br>Limite: %{customdata[2]}<extra></extra>'),
+    ))
+    return fig
@@ -0,0 +1,115 @@
+"""
+Correlazione tra test diversi sulle stesse acque.
+
+Le letture vengono portate in una tabella larga: una riga per (Sample ID,
+periodo) e una colonna per 'Test Name', con la media di 'Result' nel periodo.
+La tabella è sparsa (non tutti i test vengono eseguiti su ogni campione ogni
+giorno): la correlazione di Pearson di ogni coppia di test usa solo le righe in
+cui entrambi sono presenti, calcolata per tutte le coppie insieme con prodotti
+di matrici invece di un ciclo sulle coppie.
+"""
+import numpy as np
+import pandas as pd
+import plotly.express as px
+
+from core.aggregation import BUCKET_LABELS, PERIOD_START
+from core.schema import QUALITY_COLUMNS
+
+# Righe in comune minime perché la correlazione di una coppia venga mostrata
+CORRELATION_MIN_PERIODS = 5
+# Punti massimi del grafico di dettaglio di una coppia di test
+CORRELATION_MAX_POINTS = 5000
+
+
+def pivot_tests(df, freq):
+    """Media di 'Result' per (Sample ID, periodo) × 'Test Name'."""
+    time_col = QUALITY_COLUMNS['date_time']
+    keys = [
+        QUALITY_COLUMNS['sample_id'],
+        pd.Grouper(key=time_col, freq=freq, label='left', closed='left'),
+        QUALITY_COLUMNS['test_name'],
+    ]
+    if df.empty:
+        return pd.DataFrame()
+    means = df.groupby(keys, sort=True, observed=True)[QUALITY_COLUMNS['result']].mean()
+    wide = means.unstack(QUALITY_COLUMNS['test_name'])
+    wide.index = wide.index.set_names(PERIOD_START, level=1)
+    return wide
+
+
+def correlation_matrix(wide, min_periods=CORRELATION_MIN_PERIODS):
+    """
+    Correlazione di Pearson tra le colonne di `wide` sulle righe in comune.
+
+    Restituisce (correlazioni, righe in comune), entrambe test × test; le
+    coppie con meno di `min_periods` righe in comune hanno correlazione NaN.
+    Dà lo stesso risultato di DataFrame.corr(min_periods=...).
+    """
+    values = wide.to_numpy(dtype='float64')
+    present = ~np.isnan(values)
+    mask = present.astype('float64')
+    x = np.where(present, values, 0.0)
+
+    # Per ogni coppia (i, j), somme sulle sole righe in cui i e j sono entrambi presenti
+    n = mask.T @ mask
+    sum_x = x.T @ mask
+    sum_xx = (x * x).T @ mask
+    sum_xy = x.T @ x
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        covariance = n * sum_xy - sum_x * sum_x.T
+        variance = (n * sum_xx - sum_x ** 2) * (n * sum_xx - sum_x ** 2).T
+        corr = covariance / np.sqrt(variance)
+    corr = np.clip(corr, -1.0, 1.0)
+    corr[(n < min_periods) | ~np.isfinite(corr)] = np.nan
+
+    columns = wide.columns
+    return (pd.DataFrame(corr, index=columns, columns=columns),
+            pd.DataFrame(n.astype('int64'), index=columns, columns=columns))
+
+
+def strongest_pair(corr):
+    """Coppia di test diversi con la correlazione più forte (in valore assoluto)."""
+    strength = np.nan_to_num(corr.abs().to_numpy(copy=True), nan=-1.0)
+    np.fill_diagonal(strength, -1.0)
+    i, j = divmod(int(strength.argmax()), len(corr.columns))
+    if strength[i, j] < 0:
+        # Nessuna coppia con abbastanza periodi in comune: le prime due colonne
+        i, j = 0, min(1, len(corr.columns) - 1)
+    return corr.columns[i], corr.columns[j]
+
+
+def correlation_figure(corr, counts, freq, template=None):
+    """Mappa di calore delle correlazioni; ogni cella porta nel tooltip le righe in comune."""
+    fig = px.imshow(corr.round(2), zmin=-1, zmax=1, color_continuous_scale='RdBu_r', text_auto=True,
+                    aspect='auto', template=template,
+                    title=f"Correlazione tra Test (medie per campione e {BUCKET_LABELS.get(freq, freq).lower()})")
+    fig.update_traces(customdata=counts.to_numpy(),
+                      hovertemplate='%{y} / %{x}<br>Correlazione: %{z}<br>Periodi in comune: %{customdata}<extra></extra>')
+    fig.update_layout(xaxis_title=None, yaxis_title=None, coloraxis_colorbar_title="r")
+    return fig
+
+
+def pair_frame(wide, test_x, test_y, max_points=CORRELATION_MAX_POINTS):
+    """
+    Righe in cui entrambi i test sono presenti, ridotte a `max_points` con un
+    campione casuale riproducibile.
+    """
+    # Sulla diagonale le due colonne coincidono
+    pair = wide[list(dict.fromkeys([test_x, test_y]))].dropna().reset_index()
+    if len(pair) > max_points:
+        pair = pair.sample(max_points, random_state=0).sort_values(PERIOD_START, kind='stable')
+    return pair
+
+
+def pair_figure(wide, test_x, test_y, template=None, max_points=CORRELATION_MAX_POINTS):
+    """Grafico a dispersione di una cella della matrice: un punto per campione e periodo."""
+    pair = pair_frame(wide, test_x, test_y, max_points)
+    total = int(wide[list(dict.fromkeys([test_x, test_y]))].notna().all(axis=1).sum())
+    title = f"{test_y} rispetto a {test_x}"
+    if total > len(pair):
+        title += f" ({len(pair):,} punti su {total:,})"
+    fig = px.scatter(pair, x=test_x, y=test_y, color=QUALITY_COLUMNS['sample_id'],
+                     hover_data=[PERIOD_START], template=template, title=title)
+    fig.update_layout(legend_title="ID Campione")
+    return fig
@@ -0,0 +1,164 @@
+"""
+Conversione delle colonne di date in datetime64 nativi.
+
+pd.to_datetime senza formato prova a interpretare ogni valore per conto suo,
+ed è molto più lento del percorso vettorizzato con un formato esplicito. Qui il
+formato di una colonna viene riconosciuto una volta sola su un campione di
+valori, memorizzato per file e colonna, e usato per convertire l'intera
+colonna. Le date con fuso orario (es. '2025-03-01T10:00:00+01:00') vengono
+riportate all'ora locale di DATA_TIMEZONE, così export con e senza fuso si
+possono unire e confrontare con le date scelte nei filtri.
+"""
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+# Fuso orario degli strumenti: le date con fuso vengono convertite in quest'ora locale
+DATA_TIMEZONE = 'Europe/Rome'
+
+# Formati provati, nell'ordine: ISO prima, poi giorno/mese (export italiani) e infine mese/giorno
+DATE_FORMATS = (
+    'ISO8601',
+    '%d/%m/%Y %H:%M:%S',
+    '%d/%m/%Y %H:%M',
+    '%d/%m/%Y',
+    '%d.%m.%Y %H:%M:%S',
+    '%d.%m.%Y %H:%M',
+    '%d.%m.%Y',
+    '%d-%m-%Y %H:%M:%S',
+    '%d-%m-%Y %H:%M',
+    '%d-%m-%Y',
+    '%m/%d/%Y %H:%M:%S',
+    '%m/%d/%Y %H:%M',
+    '%m/%d/%Y',
+)
+# Ripiego per le colonne con formati misti: interpretazione valore per valore
+MIXED_FORMAT = 'mixed'
+
+# I formati giorno/mese e mese/giorno a due cifre si riscrivono come ISO (AAAA-MM-GG):
+# il parser ISO di pandas è molto più veloce di strptime sui formati arbitrari
+_PADDED_DATE = r'^\d{2}[/.-]\d{2}[/.-]\d{4}'
+_ISO_REWRITE = {'%d': r'\3-\2-\1', '%m': r'\3-\1-\2'}
+_DATE_PARTS = r'^(\d{2})[/.-](\d{2})[/.-](\d{4})'
+
+# Valori non vuoti usati per riconoscere il formato
+DETECT_SAMPLE_ROWS = 200
+# Quota minima del campione che un formato deve interpretare; le celle sporche
+# (es. 'n/d') non fanno scartare il formato e diventano NaT
+DETECT_MIN_PARSED = 0.95
+# Date in forma ISO (AAAA-...): mai interpretate con il giorno prima del mese
+_ISO_SHAPED = r'^\s*\d{4}-'
+# Formati memorizzati (file e colonna); oltre si dimenticano i meno usati
+FORMAT_CACHE_SIZE = 256
+
+_format_cache = OrderedDict()
+_format_lock = threading.Lock()
+
+
+def detect_format(values, formats=DATE_FORMATS, sample_rows=DETECT_SAMPLE_ROWS,
+                  min_parsed=DETECT_MIN_PARSED):
+    """
+    Formato di `formats` che interpreta più valori del campione (a parità, il
+    primo), se ne interpreta almeno `min_parsed`; altrimenti 'mixed'.
+    """
+    sample = pd.Series(values).dropna().head(sample_rows)
+    sample = sample[sample.astype(str).str.strip() != '']
+    if sample.empty:
+        return formats[0]
+    best, best_rate = MIXED_FORMAT, 0.0
+    for fmt in formats:
+        try:
+            # utc=True: anche i campioni con offset diversi (ora legale) si confrontano
+            parsed = pd.to_datetime(sample, format=fmt, errors='coerce', utc=True)
+        except (ValueError, TypeError):
+            continue
+        rate = parsed.notna().mean()
+        if rate == 1.0:
+            return fmt
+        if rate > best_rate:
+            best, best_rate = fmt, rate
+    return best if best_rate >= min_parsed else MIXED_FORMAT
+
+
+def cached_format(cache_key, values):
+    """Formato della colonna, riconosciuto la prima volta e poi riletto dalla cache."""
+    if cache_key is None:
+        return detect_format(values)
+    with _format_lock:
+        fmt = _format_cache.get(cache_key)
+        if fmt is not None:
+            _format_cache.move_to_end(cache_key)
+            return fmt
+    fmt = detect_format(values)
+    with _format_lock:
+        _format_cache[cache_key] = fmt
+        while len(_format_cache) > FORMAT_CACHE_SIZE:
+            _format_cache.popitem(last=False)
+    return fmt
+
+
+def to_local_naive(values, timezone=DATA_TIMEZONE):
+    """Date con fuso -> ora locale di `timezone` senza fuso; le altre restano come sono."""
+    if isinstance(values.dtype, pd.DatetimeTZDtype):
+        return values.dt.tz_convert(timezone).dt.tz_localize(None)
+    return values
+
+
+def _as_iso(values, fmt):
+    """Testo giorno/mese (o mese/giorno) a due cifre riscritto come ISO, oppure None."""
+    replacement = _ISO_REWRITE.get(fmt[:2])
+    if replacement is None or not pd.api.types.is_string_dtype(values):
+        return None
+    sample = values.dropna().head(DETECT_SAMPLE_ROWS)
+    if sample.empty or not sample.str.match(_PADDED_DATE).all():
+        return None
+    return values.str.replace(_DATE_PARTS, replacement, regex=True)
+
+
+def parse_dates(values, fmt=None, cache_key=None):
+    """
+    Converte una colonna in datetime64 (valori non validi -> NaT).
+
+    Le colonne già datetime64 non vengono toccate. Senza `fmt` il formato si
+    riconosce su un campione e, se indicata, si memorizza sotto `cache_key`
+    (es. (file, colonna)), così i blocchi successivi e le riletture dello
+    stesso file non lo riconoscono di nuovo.
+    """
+    values = pd.Series(values) if not isinstance(values, pd.Series) else values
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return to_local_naive(values)
+    # Le celle Excel già di tipo data passano così come sono, qualunque sia il formato
+    fmt = fmt or cached_format(cache_key, values)
+    iso = _as_iso(values, fmt)
+    if iso is not None:
+        parsed = _to_datetime(iso, 'ISO8601')
+        # Il campione non copre tutta la colonna: le righe rimaste senza data
+        # (es. '1/2/2025' più avanti nel file, non riscritta) si rileggono con il formato
+        retry = parsed.isna().to_numpy() & values.notna().to_numpy()
+        if retry.any():
+            parsed[retry] = _to_datetime(values[retry], fmt)
+        return parsed
+    if fmt != MIXED_FORMAT:
+        return _to_datetime(values, fmt)
+    # Formati misti: nel dubbio il giorno viene prima del mese, come negli export
+    # italiani, ma le date ISO (AAAA-MM-GG) restano anno-mese-giorno
+    iso_shaped = values.astype(str).str.match(_ISO_SHAPED).to_numpy()
+    if not iso_shaped.any():
+        return _to_datetime(values, fmt, dayfirst=True)
+    if iso_shaped.all():
+        return _to_datetime(values, fmt)
+    parsed = pd.Series(pd.NaT, index=values.index, dtype='datetime64[ns]')
+    parsed[iso_shaped] = _to_datetime(values[iso_shaped], fmt)
+    parsed[~iso_shaped] = _to_datetime(values[~iso_shaped], fmt, dayfirst=True)
+    return parsed
+
+
+def _to_datetime(values, fmt, **options):
+    """pd.to_datetime con `fmt` (non validi -> NaT), riportato all'ora locale senza fuso."""
+    try:
+        parsed = pd.to_datetime(values, format=fmt, errors='coerce', **options)
+    except ValueError:
+        # Offset diversi nella stessa colonna (es. ora legale): si passa da UTC
+        parsed = pd.to_datetime(values, format=fmt, errors='coerce', utc=True, **options)
+    return to_local_naive(parsed)
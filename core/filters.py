@@ -0,0 +1,75 @@
+"""Filtri della dashboard di Controllo Qualità, condivisi tra Dash e Streamlit."""
+import pandas as pd
+
+from core.schema import ANOMALY_COLUMNS, QUALITY_COLUMNS
+
+
+def filter_quality(df, start_date=None, end_date=None, results_range=None,
+                   operators=None, samples=None, tests=None, anomalies=None):
+    """
+    Applica i filtri della dashboard.
+
+    Se il DataFrame è ordinato per data (come quello prodotto da
+    load_quality_files) l'intervallo di date si risolve con una ricerca
+    binaria invece di una maschera su tutte le righe. Gli operatori, se
+    indicati, hanno la precedenza sulla coppia campioni/test. Con `anomalies`
+    restano solo le letture con uno dei tipi di anomalia indicati.
+    """
+    date_col = QUALITY_COLUMNS['date']
+    result_col = QUALITY_COLUMNS['result']
+
+    if start_date is not None or end_date is not None:
+        dates = df[date_col]
+        start = pd.to_datetime(start_date) if start_date is not None else None
+        end = pd.to_datetime(end_date) if end_date is not None else None
+        if dates.is_monotonic_increasing:
+            lo = dates.searchsorted(start, side='left') if start is not None else 0
+            hi = dates.searchsorted(end, side='right') if end is not None else len(df)
+            df = df.iloc[lo:hi]
+        else:
+            mask = pd.Series(True, index=df.index)
+            if start is not None:
+                mask &= dates >= start
+            if end is not None:
+                mask &= dates <= end
+            df = df[mask]
+
+    if results_range is not None:
+        df = df[(df[result_col] >= results_range[0]) & (df[result_col] <= results_range[1])]
+
+    if operators:
+        df = df[df[QUALITY_COLUMNS['user_id']].isin(operators)]
+    elif samples and tests:
+        df = df[
+            df[QUALITY_COLUMNS['sample_id']].isin(samples) &
+            df[QUALITY_COLUMNS['test_name']].isin(tests)
+        ]
+
+    if anomalies:
+        df = df[df[ANOMALY_COLUMNS['kind']].isin(anomalies)]
+    return df
+
+
+def quality_options(df):
+    """Valori per inizializzare i filtri (stessa forma di DataStore.quality_options)."""
+    date_col = QUALITY_COLUMNS['date']
+    result_col = QUALITY_COLUMNS['result']
+    return {
+        'min_date': df[date_col].min(),
+        'max_date': df[date_col].max(),
+        'min_result': df[result_col].min(),
+        'max_result': df[result_col].max(),
+        'operators': df[QUALITY_COLUMNS['user_id']].unique().tolist(),
+        'samples': df[QUALITY_COLUMNS['sample_id']].unique().tolist(),
+        'tests': df[QUALITY_COLUMNS['test_name']].unique().tolist(),
+        'has_abs': QUALITY_COLUMNS['abs'] in df.columns,
+    }
+
+
+def quality_summary(df):
+    """Campioni distinti, risultato medio e numero di test (stessa forma di DataStore.quality_summary)."""
+    return {
+        'samples': df[QUALITY_COLUMNS['sample_id']].nunique(),
+        'avg_result': df[QUALITY_COLUMNS['result']].mean() if len(df) else None,
+        'tests': len(df),
+    }
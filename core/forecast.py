@@ -0,0 +1,291 @@
+"""
+Previsioni dei consumi e dei lavaggi dell'impianto di osmosi.
+
+Ogni serie mensile (es. 'Totale MC' e 'Lavaggio') segue un modello stagionale
+leggero: livello, tendenza lineare e un effetto per mese dell'anno. Gli
+effetti mensili sono "ristretti" verso zero (regressione ridge), così con
+uno o due anni di dati un mese anomalo non diventa la stagionalità.
+
+Le serie condividono il calendario dei mesi e quindi la stessa matrice del
+modello: tutte le serie vengono stimate insieme, con un solo sistema lineare
+(una colonna per serie). Il modello conserva solo le somme X'X, X'Y e Y'Y:
+quando arrivano mesi nuovi basta aggiungere i loro contributi, senza rileggere
+lo storico. I modelli stimati restano in memoria per versione dei dati
+(hash del contenuto delle serie); una versione che estende una già stimata
+riparte da quel modello.
+
+Gli intervalli di previsione combinano la varianza dei residui e
+l'incertezza dei coefficienti. Il prossimo lavaggio delle membrane viene
+stimato dagli intervalli tra i lavaggi passati.
+"""
+import copy
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from statistics import NormalDist
+
+import numpy as np
+import pandas as pd
+
+from core.schema import MESI_ORDINE, OSMOSI_COLUMNS
+
+logger = logging.getLogger(__name__)
+
+# Mesi previsti dopo l'ultimo mese con dati
+FORECAST_HORIZON = 6
+# Copertura degli intervalli di previsione
+FORECAST_LEVEL = 0.9
+# Mesi con dati necessari per una previsione
+FORECAST_MIN_MONTHS = 6
+# Restringimento degli effetti mensili verso zero: come se ogni mese avesse
+# tante osservazioni in più con effetto nullo
+FORECAST_SEASONAL_PENALTY = 1.0
+# Modelli stimati conservati in memoria (uno per versione dei dati)
+FORECAST_CACHE_ENTRIES = 16
+
+# Serie previste per il report Osmosi
+FORECAST_SERIES = (OSMOSI_COLUMNS['totale_mc'], OSMOSI_COLUMNS['lavaggio'])
+
+FORECAST_COLUMNS = {
+    'series': 'Serie',
+    'year': OSMOSI_COLUMNS['anno'],
+    'month': OSMOSI_COLUMNS['mese'],
+    'forecast': 'Previsione',
+    'lower': 'Previsione Min',
+    'upper': 'Previsione Max',
+    'std': 'Deviazione Standard',
+}
+
+# Colonne del modello: costante, tendenza, un effetto per mese dell'anno
+_TREND_COLUMNS = 2
+_PARAMETERS = _TREND_COLUMNS + 12
+
+
+def month_index(year, month):
+    """Mese come numero progressivo (anno * 12 + mese - 1), vettorizzato."""
+    return np.asarray(year, dtype='int64') * 12 + np.asarray(month, dtype='int64') - 1
+
+
+def month_label(index):
+    """Nome del mese e anno di un numero progressivo, es. 'Ottobre 2025'."""
+    return f"{MESI_ORDINE[index % 12]} {index // 12}"
+
+
+def monthly_series(df, columns=FORECAST_SERIES):
+    """
+    Serie mensili del report Osmosi: una riga per mese (indice da month_index,
+    in ordine), una colonna per serie, sommando eventuali periodi dello stesso
+    mese. Le righe senza anno o mese riconosciuto vengono ignorate.
+    """
+    columns = [col for col in columns if col in df.columns]
+    months = df[OSMOSI_COLUMNS['mese']].map({name: number for number, name in enumerate(MESI_ORDINE, 1)})
+    years = pd.to_numeric(df[OSMOSI_COLUMNS['anno']], errors='coerce')
+    valid = (months.notna() & years.notna()).to_numpy()
+    values = df.loc[valid, columns].apply(pd.to_numeric, errors='coerce').astype('float64')
+    values.index = month_index(years[valid], months[valid])
+    # I mesi con un valore mancante in una serie escono da tutte: le serie condividono il calendario
+    return values.groupby(level=0).sum(min_count=1).dropna().sort_index()
+
+
+def series_version(series):
+    """Hash del contenuto delle serie mensili: chiave del modello stimato."""
+    digest = hashlib.sha256('\x1f'.join(map(str, series.columns)).encode())
+    digest.update(pd.util.hash_pandas_object(series.reset_index(), index=False).to_numpy().tobytes())
+    return digest.hexdigest()[:16]
+
+
+def _design(index, start):
+    """Matrice del modello per i mesi `index`: costante, mesi da `start`, mese dell'anno."""
+    index = np.asarray(index, dtype='int64')
+    design = np.zeros((len(index), _PARAMETERS))
+    design[:, 0] = 1.0
+    design[:, 1] = index - start
+    design[np.arange(len(index)), _TREND_COLUMNS + index % 12] = 1.0
+    return design
+
+
+class SeasonalModel:
+    """
+    Modello stagionale di più serie mensili, stimato dalle somme X'X, X'Y e
+    Y'Y. Le serie si aggiungono un mese alla volta o a blocchi (update) e il
+    modello si risolve solo quando serve una previsione.
+    """
+
+    def __init__(self, columns, start, penalty=FORECAST_SEASONAL_PENALTY):
+        self.columns = list(columns)
+        self.start = int(start)
+        self.penalty = penalty
+        self.xtx = np.zeros((_PARAMETERS, _PARAMETERS))
+        self.xty = np.zeros((_PARAMETERS, len(self.columns)))
+        self.yty = np.zeros(len(self.columns))
+        self.months = np.empty(0, dtype='int64')
+        self.row_hashes = np.empty(0, dtype='uint64')
+
+    @classmethod
+    def fit(cls, series, penalty=FORECAST_SEASONAL_PENALTY):
+        model = cls(series.columns, series.index[0], penalty)
+        model.update(series)
+        return model
+
+    @property
+    def n(self):
+        return len(self.months)
+
+    def extends(self, series):
+        """True se `series` contiene tutti i mesi già stimati, con gli stessi valori, più altri mesi dopo."""
+        if list(series.columns) != self.columns or len(series) < self.n:
+            return False
+        hashes = pd.util.hash_pandas_object(series.iloc[:self.n].reset_index(), index=False).to_numpy()
+        return np.array_equal(hashes, self.row_hashes)
+
+    def update(self, series):
+        """
+        Aggiunge al modello i mesi di `series` successivi all'ultimo stimato.
+        `series` deve estendere i mesi già stimati (vedi extends).
+        """
+        new = series.iloc[self.n:]
+        if new.empty:
+            return self
+        design = _design(new.index, self.start)
+        values = new.to_numpy(dtype='float64')
+        self.xtx += design.T @ design
+        self.xty += design.T @ values
+        self.yty += np.einsum('ij,ij->j', values, values)
+        self.months = np.concatenate((self.months, np.asarray(new.index, dtype='int64')))
+        self.row_hashes = np.concatenate(
+            (self.row_hashes, pd.util.hash_pandas_object(new.reset_index(), index=False).to_numpy()))
+        return self
+
+    def _solve(self):
+        penalty = np.zeros(_PARAMETERS)
+        penalty[_TREND_COLUMNS:] = self.penalty
+        inverse = np.linalg.pinv(self.xtx + np.diag(penalty))
+        coef = inverse @ self.xty
+        # Somma dei quadrati dei residui di ogni serie, dalle sole somme
+        residuals = self.yty - 2 * np.einsum('pk,pk->k', coef, self.xty) + np.einsum('pk,pq,qk->k', coef, self.xtx, coef)
+        # Gradi di libertà effettivi: la restrizione "consuma" meno di un parametro per mese
+        dof = max(self.n - np.trace(inverse @ self.xtx), 1.0)
+        return inverse, coef, np.maximum(residuals, 0) / dof
+
+    def forecast(self, horizon=FORECAST_HORIZON, level=FORECAST_LEVEL):
+        """
+        Previsione dei `horizon` mesi dopo l'ultimo con dati, con intervallo al
+        livello `level`: una riga per serie e mese (colonne FORECAST_COLUMNS).
+        Le previsioni non scendono sotto zero (consumi e lavaggi).
+        """
+        inverse, coef, variance = self._solve()
+        future = self.months[-1] + np.arange(1, horizon + 1)
+        design = _design(future, self.start)
+        mean = design @ coef
+        # Varianza dei coefficienti ridge: inverse @ X'X @ inverse, per la varianza dei residui
+        leverage = np.einsum('hp,pq,hq->h', design, inverse @ self.xtx @ inverse, design)
+        std = np.sqrt(variance[None, :] * (1 + leverage[:, None]))
+        z = NormalDist().inv_cdf((1 + level) / 2)
+
+        columns = FORECAST_COLUMNS
+        return pd.DataFrame({
+            columns['series']: np.repeat(self.columns, horizon),
+            columns['year']: np.tile(future // 12, len(self.columns)),
+            columns['month']: np.tile([MESI_ORDINE[month] for month in future % 12], len(self.columns)),
+            columns['forecast']: np.maximum(mean, 0).T.ravel(),
+            columns['lower']: np.maximum(mean - z * std, 0).T.ravel(),
+            columns['upper']: np.maximum(mean + z * std, 0).T.ravel(),
+            columns['std']: std.T.ravel(),
+        })
+
+
+class ForecastCache:
+    """
+    Modelli stimati per versione delle serie (series_version), i più recenti
+    per primi. Una versione nuova che estende una già stimata (stessi mesi
+    più mesi nuovi) aggiorna una copia di quel modello con i soli mesi nuovi.
+    """
+
+    def __init__(self, max_entries=FORECAST_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self._models = OrderedDict()
+        self._lock = threading.Lock()
+
+    def model(self, series):
+        """Modello delle serie mensili `series` (vedi monthly_series), stimato al più una volta per versione."""
+        version = series_version(series)
+        with self._lock:
+            if version in self._models:
+                self._models.move_to_end(version)
+                return self._models[version]
+            base = next((model for model in reversed(self._models.values()) if model.extends(series)), None)
+        if base is not None:
+            logger.debug("Previsione: aggiornamento con %d mesi nuovi", len(series) - base.n)
+            model = copy.deepcopy(base).update(series)
+        else:
+            model = SeasonalModel.fit(series)
+        with self._lock:
+            self._models[version] = model
+            while len(self._models) > self.max_entries:
+                self._models.popitem(last=False)
+        return model
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_forecast_cache():
+    """ForecastCache condivisa dal processo, creata al primo uso."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ForecastCache()
+        return _cache
+
+
+def next_wash(series, level=FORECAST_LEVEL):
+    """
+    Stima del prossimo lavaggio delle membrane dalla serie mensile dei lavaggi:
+    ultimo lavaggio più l'intervallo mediano tra i lavaggi passati, con
+    l'intervallo tra i quantili degli intervalli osservati al livello `level`.
+    Restituisce un dizionario con i mesi come numeri progressivi (vedi
+    month_label), oppure None con meno di due lavaggi.
+    """
+    washes = series.index[series.to_numpy() > 0].to_numpy(dtype='int64')
+    if len(washes) < 2:
+        return None
+    gaps = np.diff(washes)
+    low, median, high = np.quantile(gaps, [(1 - level) / 2, 0.5, (1 + level) / 2], method='nearest')
+    last = int(washes[-1])
+    expected = last + int(median)
+    return {
+        'last': last,
+        'expected': expected,
+        'earliest': last + int(low),
+        'latest': last + int(high),
+        # Nessun lavaggio registrato entro il mese previsto
+        'overdue': expected <= int(series.index[-1]),
+    }
+
+
+def forecast_osmosi(df, horizon=FORECAST_HORIZON, level=FORECAST_LEVEL):
+    """
+    Previsioni per il report Osmosi `df`: (previsioni mensili di
+    FORECAST_SERIES, stima del prossimo lavaggio). Con meno di
+    FORECAST_MIN_MONTHS mesi di dati restituisce (None, None).
+    """
+    series = monthly_series(df)
+    if len(series) < FORECAST_MIN_MONTHS:
+        return None, None
+    forecast = get_forecast_cache().model(series).forecast(horizon, level)
+    wash = next_wash(series[OSMOSI_COLUMNS['lavaggio']], level) if OSMOSI_COLUMNS['lavaggio'] in series else None
+    return forecast, wash
+
+
+def total_interval(forecast, level=FORECAST_LEVEL):
+    """
+    Somma delle previsioni `forecast` (righe di una serie) con il suo
+    intervallo al livello `level`, considerando indipendenti gli errori dei
+    singoli mesi: (totale, minimo, massimo).
+    """
+    columns = FORECAST_COLUMNS
+    total = float(forecast[columns['forecast']].sum())
+    spread = NormalDist().inv_cdf((1 + level) / 2) * float(np.sqrt((forecast[columns['std']] ** 2).sum()))
+    return total, max(total - spread, 0.0), total + spread
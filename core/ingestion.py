@@ -0,0 +1,544 @@
+"""
+Lettura e pulizia dei file di Controllo Qualità e Osmosi (CSV e Excel).
+
+I CSV vengono letti a blocchi con una mappa di tipi esplicita: le righe con
+'Time' non valido vengono scartate blocco per blocco, prima di concatenare,
+così il DataFrame finale non passa mai da una copia "sporca" completa.
+Se pyarrow è installato la lettura usa il suo parser multi-thread.
+
+Gli .xlsx vengono letti con python-calamine se installato, altrimenti con
+openpyxl in modalità read-only (solo valori, niente stili), un foglio e un
+sottoinsieme di colonne alla volta.
+
+Un CSV troppo grande per la memoria si può anche leggere un blocco alla volta
+(iter_quality_csv), per scriverlo blocco per blocco nell'archivio su disco.
+
+Più export (es. uno al mese) vengono letti in parallelo e uniti in un'unica
+serie temporale ordinata, senza le letture duplicate tra export sovrapposti.
+
+Con un ValidationReport (core/validation.py) la lettura conta anche quello che
+scarta o corregge: date non valide, valori non numerici (un CSV che ne
+contiene viene riletto con le colonne numeriche come testo), letture ripetute.
+"""
+import io
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from operator import itemgetter
+
+import openpyxl
+import pandas as pd
+
+from core.dates import parse_dates
+from core.memory import sample_rows
+from core.schema import (OSMOSI_COLUMNS, OSMOSI_NUMERIC_COLUMNS, OSMOSI_REQUIRED_COLUMNS, QUALITY_COLUMNS,
+                         QUALITY_DEDUP_KEYS, QUALITY_DTYPES, QUALITY_NUMERIC_COLUMNS, QUALITY_REQUIRED_COLUMNS,
+                         QUALITY_TIME_FORMAT)
+from core.validation import (SEVERITY_INFO, ValidationReport, check_columns, coerce_numeric, count_invalid_dates, validate_osmosi,
+                             validate_quality)
+
+try:
+    import pyarrow as pa
+    from pyarrow import csv as pa_csv
+except ImportError:  # pyarrow è opzionale: si usa il parser di pandas a blocchi
+    pa = None
+    pa_csv = None
+
+try:
+    import python_calamine
+except ImportError:  # python-calamine è opzionale: si usa openpyxl in read-only
+    python_calamine = None
+
+logger = logging.getLogger(__name__)
+
+# Righe per blocco (parser pandas) e byte per blocco (parser pyarrow)
+CSV_CHUNK_ROWS = 100_000
+CSV_BLOCK_BYTES = 8 * 1024 * 1024
+
+
+class UnsupportedFileError(ValueError):
+    """Il file caricato non ha un'estensione supportata."""
+
+
+_ARROW_TYPES = {
+    'str': 'string',
+    'float64': 'float64',
+    'int64': 'int64',
+}
+
+
+def _source_size(source):
+    """Restituisce la dimensione in byte della sorgente, se determinabile."""
+    if isinstance(source, (str, os.PathLike)):
+        return os.path.getsize(source)
+    try:
+        position = source.tell()
+        size = source.seek(0, io.SEEK_END)
+        source.seek(position)
+        return size
+    except (AttributeError, OSError):
+        return None
+
+
+def _source_name(source, filename=None):
+    """Nome del file (percorso o attributo .name degli upload) usato per riconoscerne il tipo."""
+    return str(filename or getattr(source, 'name', source))
+
+
+def _rewind(source):
+    """Riporta all'inizio una sorgente file-like già letta (no-op per i percorsi)."""
+    if hasattr(source, 'seek'):
+        source.seek(0)
+
+
+def _iter_arrow_chunks(handle, dtypes, block_size, usecols=None):
+    """
+    Legge il CSV a blocchi con pyarrow (multi-thread) e restituisce DataFrame.
+
+    `dtypes` ha un tipo per ogni colonna del file, nell'ordine dell'intestazione:
+    i nomi vengono da lì (come li legge pandas) e nessun tipo è dedotto dal
+    primo blocco, così un blocco successivo con valori diversi non si rifiuta.
+    """
+    column_types = {col: pa.type_for_alias(_ARROW_TYPES[t]) for col, t in dtypes.items()}
+    convert_options = pa_csv.ConvertOptions(column_types=column_types, strings_can_be_null=True)
+    if usecols:
+        convert_options.include_columns = usecols
+    reader = pa_csv.open_csv(
+        handle,
+        read_options=pa_csv.ReadOptions(block_size=block_size, use_threads=True,
+                                        column_names=list(dtypes), skip_rows=1),
+        convert_options=convert_options,
+    )
+    for batch in reader:
+        yield batch.to_pandas()
+
+
+def _iter_pandas_chunks(handle, dtypes, chunksize, usecols=None):
+    """Legge il CSV a blocchi con il parser C di pandas."""
+    yield from pd.read_csv(handle, dtype=dtypes, chunksize=chunksize, usecols=usecols)
+
+
+def _format_key(source, *parts):
+    """Chiave della cache dei formati di data per un file (None se il file non ha un nome)."""
+    if not isinstance(source, (str, os.PathLike)) and getattr(source, 'name', None) is None:
+        return None
+    return (source_fingerprint([source])[0], *parts)
+
+
+def _clean_quality_chunk(chunk, time_format, format_key=None, report=None):
+    """
+    Converte 'Time' con il formato del file e le colonne numeriche lette come
+    testo, scarta le righe con 'Time' non valido e aggiunge 'Date'.
+    """
+    time_col = QUALITY_COLUMNS['date_time']
+    if report is not None:
+        report.rows_read += len(chunk)
+    coerce_numeric(chunk, QUALITY_NUMERIC_COLUMNS, report)
+    times = parse_dates(chunk[time_col], fmt=time_format, cache_key=format_key)
+    valid = count_invalid_dates(chunk[time_col], times, time_col, report)
+    chunk = chunk[valid].assign(**{time_col: times[valid]})
+    chunk[QUALITY_COLUMNS['date']] = chunk[time_col].dt.floor('D')
+    return chunk
+
+
+def _read_quality_chunks(handle, dtypes, time_format, format_key, chunksize, usecols, total_bytes, progress, report,
+                         sample=None):
+    """
+    Legge e pulisce tutti i blocchi del CSV (pyarrow se installato, altrimenti
+    pandas) e restituisce la lista dei blocchi non vuoti; vedi read_quality_csv
+    per `progress`, `report` e `sample`.
+    """
+    if pa_csv is not None:
+        chunks = _iter_arrow_chunks(handle, dtypes, CSV_BLOCK_BYTES, usecols)
+    else:
+        chunks = _iter_pandas_chunks(handle, dtypes, chunksize, usecols)
+
+    frames = []
+    rows = 0
+    seen = {}
+    skipped = 0
+    for number, chunk in enumerate(chunks, start=1):
+        chunk = _clean_quality_chunk(chunk, time_format, format_key, report)
+        if sample is not None:
+            # Campione blocco per blocco: in memoria resta solo la parte tenuta
+            valid = len(chunk)
+            chunk = sample_rows(chunk, sample, seen=seen)
+            skipped += valid - len(chunk)
+        if not chunk.empty:
+            frames.append(chunk)
+            rows += len(chunk)
+
+        fraction = None
+        if total_bytes:
+            try:
+                fraction = min(handle.tell() / total_bytes, 1.0)
+            except (AttributeError, OSError):
+                pass
+        logger.debug("CSV blocco %d: %d righe valide", number, rows)
+        if progress is not None:
+            progress(number, rows, fraction)
+    if sample is not None:
+        _report_sample(report, sample, skipped)
+    return frames
+
+
+def _select_columns(handle, dtypes, usecols):
+    """
+    Controlla l'intestazione del CSV; restituisce le colonne richieste
+    (nell'ordine del file) e un tipo per ogni colonna del file. Le colonne
+    fuori dallo schema si leggono come testo, così tutti i blocchi hanno gli
+    stessi tipi qualunque valore contengano.
+    """
+    header = list(pd.read_csv(handle, nrows=0).columns)
+    handle.seek(0)
+    check_columns(header, QUALITY_REQUIRED_COLUMNS)
+    dtypes = {col: dtypes.get(col, 'str') for col in header}
+    if usecols:
+        # Colonne richieste nell'ordine del file, ignorando quelle assenti
+        usecols = [col for col in header if col in usecols]
+    return usecols, dtypes
+
+
+def _report_sample(report, sample, skipped):
+    if report is not None:
+        report.add('Campione', f"Dataset troppo grande per la memoria: caricato un campione del {sample:.0%} "
+                   "delle letture di ogni serie", skipped)
+
+
+def read_quality_csv(source, time_format=QUALITY_TIME_FORMAT, dtypes=None, chunksize=CSV_CHUNK_ROWS,
+                     progress=None, usecols=None, report=None, sample=None):
+    """
+    Legge un CSV di Controllo Qualità a blocchi.
+
+    `source` può essere un percorso o un oggetto file binario. `progress`, se
+    indicato, viene chiamato dopo ogni blocco con (numero blocco, righe valide
+    lette finora, frazione del file letta oppure None). `usecols` limita la
+    lettura alle colonne indicate. Senza `time_format` il formato di 'Time'
+    viene riconosciuto sul primo blocco e riusato per gli altri.
+
+    Solleva SchemaError se mancano colonne obbligatorie. Le righe scartate e i
+    valori corretti vengono contati in `report`, se indicato. Con `sample`
+    (frazione tra 0 e 1) di ogni serie si tiene solo quella frazione delle
+    letture, scelta blocco per blocco (vedi core/memory.py).
+    """
+    dtypes = QUALITY_DTYPES if dtypes is None else dtypes
+    _rewind(source)
+    total_bytes = _source_size(source)
+    format_key = _format_key(source, QUALITY_COLUMNS['date_time'])
+    handle = open(source, 'rb') if isinstance(source, (str, os.PathLike)) else source
+    try:
+        usecols, dtypes = _select_columns(handle, dtypes, usecols)
+        attempt = ValidationReport(report.source if report is not None else None)
+        try:
+            # Tipi numerici letti direttamente dal parser: il caso normale, una sola passata
+            frames = _read_quality_chunks(handle, dtypes, time_format, format_key, chunksize, usecols,
+                                          total_bytes, progress, attempt, sample)
+        except ValueError as e:
+            numeric = [col for col in QUALITY_NUMERIC_COLUMNS if dtypes.get(col) == 'float64']
+            if not numeric:
+                raise
+            # Valori non numerici: si rilegge con quelle colonne come testo, convertite blocco per blocco
+            logger.info("Valori non numerici nel CSV (%s): rilettura delle colonne %s come testo", e, numeric)
+            handle.seek(0)
+            attempt = ValidationReport(attempt.source)
+            frames = _read_quality_chunks(handle, {**dtypes, **{col: 'str' for col in numeric}}, time_format,
+                                          format_key, chunksize, usecols, total_bytes, progress, attempt, sample)
+    finally:
+        if handle is not source:
+            handle.close()
+    if report is not None:
+        report.merge(attempt)
+
+    if not frames:
+        return pd.DataFrame(columns=list(usecols or dtypes) + [QUALITY_COLUMNS['date']])
+    return pd.concat(frames, ignore_index=True)
+
+
+def iter_quality_csv(source, usecols=None, report=None, chunksize=CSV_CHUNK_ROWS):
+    """
+    Legge un CSV di Controllo Qualità un blocco alla volta, già pulito come in
+    read_quality_csv, senza tenere in memoria più di un blocco.
+
+    Le colonne numeriche vengono lette come testo e convertite blocco per
+    blocco: un blocco già restituito non si può rileggere. Solleva SchemaError
+    se mancano colonne obbligatorie.
+    """
+    dtypes = {**QUALITY_DTYPES, **{col: 'str' for col in QUALITY_NUMERIC_COLUMNS if col in QUALITY_DTYPES}}
+    if usecols:
+        usecols = set(usecols) | set(QUALITY_REQUIRED_COLUMNS)
+    _rewind(source)
+    format_key = _format_key(source, QUALITY_COLUMNS['date_time'])
+    handle = open(source, 'rb') if isinstance(source, (str, os.PathLike)) else source
+    try:
+        usecols, dtypes = _select_columns(handle, dtypes, usecols)
+        if pa_csv is not None:
+            chunks = _iter_arrow_chunks(handle, dtypes, CSV_BLOCK_BYTES, usecols)
+        else:
+            chunks = _iter_pandas_chunks(handle, dtypes, chunksize, usecols)
+        for chunk in chunks:
+            yield _clean_quality_chunk(chunk, QUALITY_TIME_FORMAT, format_key, report)
+    finally:
+        if handle is not source:
+            handle.close()
+
+
+def list_excel_sheets(source):
+    """Elenca i fogli di una cartella di lavoro senza caricarne il contenuto."""
+    _rewind(source)
+    if _source_name(source).lower().endswith('.xls'):
+        sheets = pd.ExcelFile(source).sheet_names
+    else:
+        workbook = openpyxl.load_workbook(source, read_only=True)
+        sheets = workbook.sheetnames
+        workbook.close()
+    _rewind(source)
+    return sheets
+
+
+def list_columns(source, sheet_name=None):
+    """Legge solo l'intestazione di un CSV o di un foglio Excel."""
+    _rewind(source)
+    if _source_name(source).lower().endswith('.csv'):
+        columns = pd.read_csv(source, nrows=0).columns.tolist()
+    else:
+        columns = read_excel_fast(source, sheet_name=sheet_name, nrows=0).columns.tolist()
+    _rewind(source)
+    return columns
+
+
+def _read_excel_streaming(source, sheet_name=None, usecols=None, nrows=None):
+    """Legge un foglio .xlsx riga per riga con openpyxl in modalità read-only."""
+    workbook = openpyxl.load_workbook(source, read_only=True, data_only=True)
+    try:
+        sheet = workbook[sheet_name] if sheet_name else workbook.worksheets[0]
+        rows = sheet.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return pd.DataFrame()
+
+        # Stessa convenzione di pandas per le intestazioni vuote
+        header = [col if col is not None else f'Unnamed: {i}' for i, col in enumerate(header)]
+        positions = [i for i, col in enumerate(header) if not usecols or col in usecols]
+        columns = [header[i] for i in positions]
+        if not positions:
+            return pd.DataFrame()
+        pick = itemgetter(*positions) if len(positions) > 1 else (lambda row: (row[positions[0]],))
+
+        data = []
+        for row in rows:
+            if nrows is not None and len(data) >= nrows:
+                break
+            if len(row) < len(header):
+                row = row + (None,) * (len(header) - len(row))
+            values = pick(row)
+            if any(v is not None for v in values):
+                data.append(values)
+        return pd.DataFrame.from_records(data, columns=columns)
+    finally:
+        workbook.close()
+
+
+def read_excel_fast(source, sheet_name=None, usecols=None, nrows=None):
+    """
+    Legge un foglio Excel saltando stili e formattazione.
+
+    Usa python-calamine se installato, altrimenti openpyxl in read-only; i vecchi
+    .xls passano da pandas. `sheet_name=None` legge il primo foglio e `usecols`
+    limita la lettura alle colonne indicate (quelle assenti vengono ignorate).
+    """
+    _rewind(source)
+    wanted = set(usecols) if usecols else None
+    name = _source_name(source).lower()
+    if python_calamine is not None or name.endswith('.xls'):
+        return pd.read_excel(source, sheet_name=sheet_name or 0, nrows=nrows,
+                             usecols=(lambda col: col in wanted) if wanted else None,
+                             engine='calamine' if python_calamine is not None else None)
+    return _read_excel_streaming(source, sheet_name=sheet_name, usecols=wanted, nrows=nrows)
+
+
+def prepare_quality_frame(df, time_format=None, format_key=None, report=None):
+    """Pulizia di un DataFrame già letto (es. da Excel): colonne numeriche, 'Time' valido e colonna 'Date'."""
+    time_col = QUALITY_COLUMNS['date_time']
+    if report is not None:
+        report.rows_read += len(df)
+    coerce_numeric(df, QUALITY_NUMERIC_COLUMNS, report)
+    times = parse_dates(df[time_col], fmt=time_format, cache_key=format_key)
+    valid = count_invalid_dates(df[time_col], times, time_col, report)
+    df = df[valid].assign(**{time_col: times[valid]})
+    df[QUALITY_COLUMNS['date']] = df[time_col].dt.floor('D')
+    return df
+
+
+def load_quality_file(source, filename=None, progress=None, sheet_name=None, usecols=None, report=None,
+                      sample=None):
+    """
+    Carica un file di Controllo Qualità scegliendo il lettore in base all'estensione.
+
+    `sheet_name` e `usecols` selezionano foglio e colonne da leggere; le colonne
+    indispensabili alla dashboard vengono sempre incluse. `sample` legge solo
+    una frazione delle letture di ogni serie (vedi read_quality_csv).
+    Solleva UnsupportedFileError se il tipo di file non è supportato e
+    SchemaError se mancano colonne obbligatorie.
+    """
+    name = _source_name(source, filename).lower()
+    if usecols:
+        usecols = set(usecols) | set(QUALITY_REQUIRED_COLUMNS)
+    if name.endswith('.csv'):
+        return read_quality_csv(source, progress=progress, usecols=usecols, report=report, sample=sample)
+    if name.endswith(('.xls', '.xlsx')):
+        df = read_excel_fast(source, sheet_name=sheet_name, usecols=usecols)
+        check_columns(df.columns, QUALITY_REQUIRED_COLUMNS)
+        df = prepare_quality_frame(df, format_key=_format_key(source, sheet_name, QUALITY_COLUMNS['date_time']),
+                                   report=report)
+        if sample is not None:
+            valid = len(df)
+            df = sample_rows(df, sample)
+            _report_sample(report, sample, valid - len(df))
+        return df
+    raise UnsupportedFileError('Tipo di file non supportato. Carica un file .csv o .xlsx.')
+
+
+def repeated_keys(df, keys=QUALITY_DEDUP_KEYS):
+    """Righe la cui chiave torna più avanti nel DataFrame (da togliere perché vinca l'ultima)."""
+    return pd.util.hash_pandas_object(df[list(keys)], index=False).duplicated(keep='last').to_numpy()
+
+
+def add_merged_duplicates(report, rows, keys=QUALITY_DEDUP_KEYS):
+    """Conta in `report` le letture ripetute tolte unendo più file."""
+    report.add('Duplicato', "Letture ripetute nei file, tenute una volta (vince l'ultimo file)",
+               rows, column=', '.join(keys), severity=SEVERITY_INFO)
+
+
+def merge_quality_frames(frames, keys=QUALITY_DEDUP_KEYS, report=None):
+    """
+    Unisce più DataFrame di Controllo Qualità in un'unica serie ordinata per 'Time'.
+
+    Le righe con la stessa chiave (Time, Sample ID, Test Name) vengono tenute una
+    sola volta, confrontando un hash a 64 bit della chiave invece delle colonne.
+    A parità di chiave vince l'ultimo file della lista; le righe rimosse
+    vengono contate in `report`, se indicato.
+    """
+    frames = [f for f in frames if not f.empty]
+    if not frames:
+        return pd.DataFrame()
+    df = frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+
+    keys = [k for k in keys if k in df.columns]
+    if len(frames) > 1 and keys:
+        repeated = repeated_keys(df, keys)
+        df = df[~repeated]
+        if report is not None:
+            add_merged_duplicates(report, repeated.sum(), keys)
+
+    time_col = QUALITY_COLUMNS['date_time']
+    return df.sort_values(time_col, kind='stable').reset_index(drop=True)
+
+
+def append_quality_rows(df, new_rows, keys=QUALITY_DEDUP_KEYS):
+    """
+    Aggiunge nuove letture a un DataFrame già ordinato per 'Time' (es. il polling live).
+
+    Solo la coda con 'Time' >= del primo istante delle nuove righe può avere le
+    stesse chiavi: viene trovata con una ricerca binaria e unita alle nuove righe
+    con merge_quality_frames (vincono le nuove), il resto resta com'è. Così ogni
+    aggiornamento costa quanto la coda, non quanto tutta la storia.
+    """
+    if new_rows.empty:
+        return df
+    if df.empty:
+        return merge_quality_frames([new_rows], keys=keys)
+    time_col = QUALITY_COLUMNS['date_time']
+    start = df[time_col].searchsorted(new_rows[time_col].min(), side='left')
+    tail = merge_quality_frames([df.iloc[start:], new_rows], keys=keys)
+    return pd.concat([df.iloc[:start], tail], ignore_index=True)
+
+
+def load_quality_files(sources, filenames=None, progress=None, sheet_name=None, usecols=None, max_workers=None,
+                       report=None, sample=None):
+    """
+    Carica più file di Controllo Qualità in parallelo e li unisce con merge_quality_frames.
+
+    `sheet_name` viene usato per i file Excel che lo contengono, gli altri usano
+    il primo foglio. `progress` viene passato solo quando c'è un unico file.
+    Con `report` (ValidationReport) vengono contati i problemi di ogni file e
+    poi controllate una volta le letture unite (core/validation.py). Con
+    `sample` ogni file viene letto a campione (vedi load_quality_file).
+    """
+    sources = list(sources)
+    filenames = list(filenames) if filenames else [None] * len(sources)
+    # Un report per file, così i file letti in parallelo non scrivono sullo stesso
+    reports = [ValidationReport(os.path.basename(_source_name(source, filename)) if len(sources) > 1 else None)
+               for source, filename in zip(sources, filenames)]
+
+    def load_one(source, filename, file_report):
+        sheet = sheet_name
+        name = _source_name(source, filename).lower()
+        if sheet is not None and not name.endswith('.csv') and sheet not in list_excel_sheets(source):
+            sheet = None
+        return load_quality_file(source, filename, sheet_name=sheet, usecols=usecols,
+                                 progress=progress if len(sources) == 1 else None,
+                                 report=file_report if report is not None else None, sample=sample)
+
+    if len(sources) == 1:
+        frames = [load_one(sources[0], filenames[0], reports[0])]
+    else:
+        # Il parsing di pyarrow/openpyxl/calamine rilascia il GIL in buona parte
+        with ThreadPoolExecutor(max_workers=max_workers or min(len(sources), os.cpu_count() or 1)) as pool:
+            frames = list(pool.map(load_one, sources, filenames, reports))
+    if report is None:
+        return merge_quality_frames(frames)
+
+    for file_report in reports:
+        report.merge(file_report)
+    df = merge_quality_frames(frames, report=report)
+    validate_quality(df, report)
+    return df
+
+
+def load_osmosi_file(source, sheet_name=None, usecols=None, report=None):
+    """
+    Carica un report Osmosi (.xlsx): foglio e colonne a scelta, più quelle
+    indispensabili alla dashboard.
+
+    Le date diventano datetime64 a mezzanotte (non oggetti date), così confronti
+    e raggruppamenti restano vettorizzati; il formato di ogni colonna viene
+    riconosciuto una volta per file. Solleva UnsupportedFileError per gli altri
+    formati e SchemaError se mancano colonne obbligatorie. Con `report`
+    (ValidationReport) vengono controllati anche contatori e periodi.
+    """
+    if not _source_name(source).lower().endswith('.xlsx'):
+        raise UnsupportedFileError('Tipo di file non supportato. Carica un file .xlsx.')
+    if usecols:
+        usecols = set(usecols) | set(OSMOSI_REQUIRED_COLUMNS)
+    # Lettura in sola lettura: niente stili, solo il foglio e le colonne richieste
+    df = read_excel_fast(source, sheet_name=sheet_name, usecols=usecols)
+    check_columns(df.columns, OSMOSI_REQUIRED_COLUMNS)
+    if report is not None:
+        report.rows_read += len(df)
+    coerce_numeric(df, OSMOSI_NUMERIC_COLUMNS, report)
+    for column in (OSMOSI_COLUMNS['data_inizio'], OSMOSI_COLUMNS['data_fine']):
+        dates = parse_dates(df[column], cache_key=_format_key(source, sheet_name, column)).dt.normalize()
+        count_invalid_dates(df[column], dates, column, report, dropped=False)
+        df[column] = dates
+    if OSMOSI_COLUMNS['mese'] in df.columns:
+        df[OSMOSI_COLUMNS['mese']] = df[OSMOSI_COLUMNS['mese']].str.strip().str.capitalize()
+    if report is not None:
+        validate_osmosi(df, report)
+    return df
+
+
+def source_fingerprint(sources):
+    """
+    Identificativo economico di un insieme di sorgenti, senza leggerne il contenuto.
+
+    Per i percorsi usa dimensione e data di modifica, per i file caricati
+    l'identificativo assegnato all'upload (o nome e dimensione).
+    """
+    fingerprint = []
+    for source in sources:
+        if isinstance(source, (str, os.PathLike)):
+            stat = os.stat(source)
+            fingerprint.append((str(source), stat.st_size, stat.st_mtime_ns))
+        else:
+            fingerprint.append((_source_name(source), getattr(source, 'file_id', None) or _source_size(source)))
+    return tuple(fingerprint)
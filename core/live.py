@@ -0,0 +1,130 @@
+"""
+Modalità live: lettura incrementale delle nuove letture degli strumenti.
+
+La sorgente è un CSV a cui gli strumenti aggiungono righe, oppure una cartella
+di spool in cui compaiono nuovi file (.csv o .xlsx, da scrivere altrove e poi
+spostare nella cartella, così non vengono letti a metà). Ad ogni lettura si
+parte da dove ci si era fermati: dal byte successivo per il CSV, dai file non
+ancora visti per la cartella. Le righe nuove vengono numerate per lotto, così
+ogni client chiede solo i lotti successivi all'ultimo ricevuto.
+"""
+import io
+import os
+import threading
+from collections import deque
+
+import pandas as pd
+
+from core.ingestion import load_quality_file
+from core.schema import QUALITY_COLUMNS
+
+LIVE_SOURCE_ENV = 'AVS_LIVE_SOURCE'
+
+# Intervallo tra due aggiornamenti del browser (millisecondi)
+LIVE_INTERVAL_MS = 5000
+# Lotti tenuti in memoria per i client rimasti indietro
+LIVE_MAX_BATCHES = 500
+
+
+class CsvTail:
+    """Righe aggiunte in fondo a un CSV dopo l'apertura."""
+
+    def __init__(self, path, from_start=False):
+        self.path = str(path)
+        self._header = b''
+        self._offset = 0
+        if not from_start and os.path.exists(self.path):
+            self._read_header()
+            self._offset = os.path.getsize(self.path)
+
+    def _read_header(self):
+        with open(self.path, 'rb') as handle:
+            self._header = handle.readline()
+        return len(self._header)
+
+    def read_new(self):
+        if not os.path.exists(self.path):
+            return pd.DataFrame()
+        size = os.path.getsize(self.path)
+        if size < self._offset:
+            # File troncato o ruotato: si riparte dall'inizio
+            self._offset = 0
+        if size == self._offset:
+            return pd.DataFrame()
+        if self._offset == 0:
+            self._offset = self._read_header()
+
+        with open(self.path, 'rb') as handle:
+            handle.seek(self._offset)
+            data = handle.read(size - self._offset)
+        # Solo righe complete: l'ultima può essere ancora in scrittura
+        end = data.rfind(b'\n') + 1
+        if end == 0:
+            return pd.DataFrame()
+        self._offset += end
+        return load_quality_file(io.BytesIO(self._header + data[:end]), filename='live.csv')
+
+
+class SpoolDirectory:
+    """File comparsi in una cartella dopo l'apertura, in ordine di nome."""
+
+    def __init__(self, path, from_start=False):
+        self.path = str(path)
+        self._seen = set() if from_start else set(self._files())
+
+    def _files(self):
+        return sorted(name for name in os.listdir(self.path)
+                      if name.lower().endswith(('.csv', '.xlsx')) and not name.startswith('.'))
+
+    def read_new(self):
+        frames = []
+        for name in self._files():
+            if name in self._seen:
+                continue
+            self._seen.add(name)
+            frames.append(load_quality_file(os.path.join(self.path, name)))
+        frames = [f for f in frames if not f.empty]
+        return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+
+class LiveFeed:
+    """Lotti di righe nuove numerati in sequenza, condivisi tra tutte le sessioni."""
+
+    def __init__(self, path, from_start=False, max_batches=LIVE_MAX_BATCHES):
+        self.path = str(path)
+        self.reader = SpoolDirectory(path, from_start) if os.path.isdir(path) else CsvTail(path, from_start)
+        self.seq = 0
+        self._batches = deque(maxlen=max_batches)
+        self._lock = threading.Lock()
+
+    def poll(self, prepare=None):
+        """
+        Legge la sorgente; restituisce le righe nuove (eventualmente vuote).
+
+        `prepare`, se indicata, riceve le righe nuove e ne restituisce la versione
+        da conservare nel lotto (es. con limiti e punteggi di anomalia).
+        """
+        with self._lock:
+            df = self.reader.read_new()
+            if not df.empty:
+                df = df.sort_values(QUALITY_COLUMNS['date_time'], kind='stable').reset_index(drop=True)
+                if prepare is not None:
+                    df = prepare(df)
+                self.seq += 1
+                self._batches.append((self.seq, df))
+            return df
+
+    def since(self, seq):
+        """Righe dei lotti successivi a `seq` e numero dell'ultimo lotto."""
+        with self._lock:
+            frames = [df for batch_seq, df in self._batches if batch_seq > seq]
+            current = self.seq
+        return (pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()), current
+
+
+def open_live_feed(path=None):
+    """LiveFeed sulla sorgente indicata in AVS_LIVE_SOURCE, oppure None se non impostata."""
+    path = path or os.environ.get(LIVE_SOURCE_ENV)
+    if not path:
+        return None
+    return LiveFeed(path)
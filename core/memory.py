@@ -0,0 +1,334 @@
+"""
+Conteggio della memoria per sessione e dataset, con limiti configurabili.
+
+Ogni pagina dichiara al MemoryGovernor quello che tiene in memoria per una
+sessione: il dataset caricato, le righe filtrate, i file di esportazione. Un
+elemento condiviso da più sessioni (es. lo stesso file nella cache di
+Streamlit) conta una volta sola e viene rilasciato, con la funzione indicata
+dalla pagina, quando nessuna sessione attiva lo usa più.
+
+- le sessioni inattive da SESSION_IDLE_SECONDS vengono chiuse e i loro dati
+  e le loro cache rilasciati;
+- oltre il limite del processo (AVS_MEMORY_BUDGET_MB) si chiudono le sessioni
+  usate meno di recente, mai quella che sta lavorando;
+- prima di leggere un file la sua dimensione in memoria viene stimata da
+  quella su disco: se supera quanto resta alla sessione (AVS_SESSION_BUDGET_MB)
+  il dataset va nell'archivio su disco (se attivo) oppure viene letto a
+  campione, con una frazione delle letture di ogni serie, invece di far
+  esaurire la memoria al processo.
+
+Le pagine Streamlit contano i loro dati con hold_memory(), per la sessione
+corrente.
+"""
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+from core.schema import QUALITY_COLUMNS
+
+MEMORY_BUDGET_ENV = 'AVS_MEMORY_BUDGET_MB'
+SESSION_BUDGET_ENV = 'AVS_SESSION_BUDGET_MB'
+
+# Memoria per dati e cache di tutto il processo, e di una sola sessione (MB)
+MEMORY_BUDGET_MB = 2048
+SESSION_BUDGET_MB = 512
+# Una sessione senza interazioni da mezz'ora viene chiusa e i suoi dati rilasciati
+SESSION_IDLE_SECONDS = 30 * 60
+# Byte in memoria per byte su disco, dopo la lettura e le colonne aggiunte (limiti, anomalie)
+MEMORY_EXPANSION = {'.csv': 3.0, '.xlsx': 6.0, '.xls': 6.0}
+# Frazione minima di letture tenuta nel modo a campione
+MIN_SAMPLE_FRACTION = 0.01
+
+# Modi di caricamento di un dataset
+MODE_FULL = 'full'
+MODE_STORE = 'store'
+MODE_SAMPLED = 'sampled'
+
+# Serie del campionamento: ogni serie tiene la stessa frazione di letture
+SAMPLE_KEYS = (QUALITY_COLUMNS['sample_id'], QUALITY_COLUMNS['test_name'])
+
+_MB = 1024 * 1024
+
+logger = logging.getLogger(__name__)
+
+
+def frame_bytes(df):
+    """Byte occupati da un DataFrame, testo compreso."""
+    return int(df.memory_usage(deep=True, index=True).sum()) if df is not None else 0
+
+
+def value_bytes(value):
+    """Byte di un DataFrame o di un insieme di file già generati (es. le esportazioni)."""
+    if value is None or hasattr(value, 'memory_usage'):
+        return frame_bytes(value)
+    return sum(len(part) for part in value)
+
+
+def _source_bytes(source):
+    if isinstance(source, (str, os.PathLike)):
+        return os.path.getsize(source)
+    if hasattr(source, 'getbuffer'):
+        return source.getbuffer().nbytes
+    return getattr(source, 'size', 0) or 0
+
+
+def estimate_bytes(sources, filenames=None):
+    """Stima dei byte in memoria dei file `sources` una volta letti, dalla loro dimensione su disco."""
+    filenames = list(filenames) if filenames else [None] * len(sources)
+    total = 0
+    for source, filename in zip(sources, filenames):
+        name = str(filename or getattr(source, 'name', None) or source)
+        factor = MEMORY_EXPANSION.get(os.path.splitext(name.lower())[1], max(MEMORY_EXPANSION.values()))
+        total += int(_source_bytes(source) * factor)
+    return total
+
+
+def sample_rows(df, fraction, keys=SAMPLE_KEYS, seen=None):
+    """
+    Campione sistematico di `df`: in ogni serie (`keys`) si tiene una lettura
+    ogni 1 / `fraction`, sempre compresa la prima, così ogni serie resta
+    rappresentata su tutto il suo intervallo di tempo. Vettorizzato, senza
+    numeri casuali: lo stesso file dà sempre lo stesso campione.
+
+    Per un file letto a blocchi si passa lo stesso dizionario `seen` a ogni
+    blocco: tiene le letture già viste di ogni serie, così il campione è quello
+    che si otterrebbe sul file intero.
+    """
+    if fraction >= 1 or df.empty:
+        return df
+    keys = [key for key in keys if key in df.columns]
+    if not keys:
+        start = seen.get((), 0) if seen is not None else 0
+        position = np.arange(start, start + len(df))
+        if seen is not None:
+            seen[()] = start + len(df)
+    else:
+        groups = df.groupby(keys, sort=False, observed=True, dropna=False)
+        position = groups.cumcount().to_numpy()
+        if seen is not None:
+            # Letture già viste di ogni serie, nell'ordine dei gruppi di ngroup()
+            sizes = groups.size()
+            names = [key if isinstance(key, tuple) else (key,) for key in sizes.index]
+            offsets = np.array([seen.get(key, 0) for key in names], dtype='int64')
+            position = position + offsets[groups.ngroup().to_numpy()]
+            for key, size in zip(names, sizes.to_numpy()):
+                seen[key] = seen.get(key, 0) + int(size)
+    keep = np.floor(position * fraction) != np.floor((position - 1) * fraction)
+    return df[keep]
+
+
+def memory_budget():
+    """Limite di memoria del processo, in byte (AVS_MEMORY_BUDGET_MB)."""
+    return int(float(os.environ.get(MEMORY_BUDGET_ENV) or MEMORY_BUDGET_MB) * _MB)
+
+
+def session_budget():
+    """Limite di memoria di una sessione, in byte (AVS_SESSION_BUDGET_MB)."""
+    return int(float(os.environ.get(SESSION_BUDGET_ENV) or SESSION_BUDGET_MB) * _MB)
+
+
+def format_bytes(nbytes):
+    """Byte in forma leggibile, es. '1.2 GB'."""
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if nbytes < 1024 or unit == 'GB':
+            return f"{nbytes:,.0f} {unit}" if unit == 'B' else f"{nbytes:,.1f} {unit}"
+        nbytes /= 1024
+
+
+class MemoryGovernor:
+    """
+    Elementi in memoria `{chiave: {bytes, release, sessions}}` e ultima attività
+    di ogni sessione. Le chiavi sono quelle delle cache delle pagine (es. la
+    chiave del dataset), così sessioni diverse sullo stesso dataset lo contano
+    una volta.
+    """
+
+    def __init__(self, budget=None, session_budget_bytes=None, idle_seconds=SESSION_IDLE_SECONDS):
+        self.budget = budget if budget is not None else memory_budget()
+        self.session_budget = session_budget_bytes if session_budget_bytes is not None else session_budget()
+        self.idle_seconds = idle_seconds
+        self._items = {}
+        self._sessions = {}
+        self._slots = {}
+        self._lock = threading.Lock()
+
+    def hold(self, session, key, nbytes, release=None, slot=None):
+        """
+        La sessione usa l'elemento `key` di `nbytes` byte; `release()` lo toglie
+        dalla memoria (es. svuotando la voce della cache) quando nessuna sessione
+        attiva lo usa più. Con `slot` (es. 'dataset', 'filtered') l'elemento
+        prende il posto di quello tenuto prima dalla sessione nello stesso slot:
+        un nuovo file o nuovi filtri non si sommano ai precedenti.
+        Restituisce le sessioni chiuse per rientrare nel limite.
+        """
+        released = []
+        with self._lock:
+            self._sessions[session] = time.monotonic()
+            item = self._items.setdefault(key, {'bytes': 0, 'release': release, 'sessions': set()})
+            item['bytes'] = int(nbytes)
+            item['release'] = release or item['release']
+            item['sessions'].add(session)
+            if slot is not None:
+                previous = self._slots.get((session, slot))
+                self._slots[(session, slot)] = key
+                if previous is not None and previous != key:
+                    released = self._leave(session, previous)
+        self._release(released)
+        return self.enforce(current=session)
+
+    def drop(self, session, slot):
+        """La sessione non tiene più niente nello slot `slot` (es. cache svuotata)."""
+        with self._lock:
+            key = self._slots.pop((session, slot), None)
+            released = self._leave(session, key) if key is not None else []
+        self._release(released)
+
+    def known_bytes(self, key):
+        """Byte già contati per l'elemento `key`, oppure None se nessuna sessione lo tiene."""
+        with self._lock:
+            item = self._items.get(key)
+            return item['bytes'] if item is not None else None
+
+    def session_bytes(self, session):
+        """Byte degli elementi usati dalla sessione."""
+        with self._lock:
+            return sum(item['bytes'] for item in self._items.values() if session in item['sessions'])
+
+    def slot_bytes(self, session, slot):
+        """Byte dell'elemento che la sessione tiene nello slot `slot` (0 se nessuno)."""
+        with self._lock:
+            item = self._items.get(self._slots.get((session, slot)))
+            return item['bytes'] if item is not None else 0
+
+    def total_bytes(self):
+        with self._lock:
+            return sum(item['bytes'] for item in self._items.values())
+
+    def _leave(self, session, key):
+        """Toglie la sessione dall'elemento `key`; lo restituisce se non lo usa più nessuno."""
+        item = self._items.get(key)
+        if item is None:
+            return []
+        item['sessions'].discard(session)
+        return [] if item['sessions'] else [(key, self._items.pop(key))]
+
+    def _close(self, session):
+        """Chiude la sessione; restituisce gli elementi rimasti senza sessioni (da rilasciare fuori dal lock)."""
+        self._sessions.pop(session, None)
+        for slot in [slot for slot in self._slots if slot[0] == session]:
+            del self._slots[slot]
+        released = []
+        for key in list(self._items):
+            released += self._leave(session, key)
+        return released
+
+    def _release(self, released):
+        for key, item in released:
+            if item['release'] is not None:
+                try:
+                    item['release']()
+                except Exception:
+                    logger.warning("Rilascio di %s non riuscito", key, exc_info=True)
+            logger.debug("Memoria: rilasciato %s (%s)", key, format_bytes(item['bytes']))
+
+    def close(self, session):
+        """Chiude una sessione e rilascia i dati che usava solo lei."""
+        with self._lock:
+            released = self._close(session)
+        self._release(released)
+
+    def enforce(self, current=None):
+        """
+        Chiude le sessioni inattive e, oltre il limite del processo, quelle usate
+        meno di recente (mai `current`). Restituisce le sessioni chiuse.
+        """
+        released, closed = [], []
+        with self._lock:
+            idle_since = time.monotonic() - self.idle_seconds
+            for session, last_seen in sorted(self._sessions.items(), key=lambda entry: entry[1]):
+                over = sum(item['bytes'] for item in self._items.values()) > self.budget
+                if session != current and (last_seen < idle_since or over):
+                    released += self._close(session)
+                    closed.append(session)
+        self._release(released)
+        if closed:
+            logger.info("Memoria: chiuse %d sessioni (%s in uso)", len(closed), format_bytes(self.total_bytes()))
+        return closed
+
+    def available(self, session):
+        """Byte che la sessione può ancora occupare, nel suo limite e in quello del processo."""
+        self.enforce(current=session)
+        with self._lock:
+            total = sum(item['bytes'] for item in self._items.values())
+            own = sum(item['bytes'] for item in self._items.values() if session in item['sessions'])
+        return max(min(self.session_budget - own, self.budget - total), 0)
+
+    def plan(self, session, estimated, store_available=False, replaces=0):
+        """
+        Modo di caricamento di un dataset stimato in `estimated` byte (vedi
+        estimate_bytes), che prende il posto di `replaces` byte già contati per
+        la sessione: (MODE_FULL, 1.0), (MODE_STORE, 1.0) se l'archivio su disco
+        è attivo, altrimenti (MODE_SAMPLED, frazione delle letture da tenere).
+        """
+        room = self.available(session) + replaces
+        if estimated <= room:
+            return MODE_FULL, 1.0
+        if store_available:
+            return MODE_STORE, 1.0
+        return MODE_SAMPLED, max(room / max(estimated, 1), MIN_SAMPLE_FRACTION)
+
+    def status(self, session=None):
+        """Riepilogo in una riga, per le pagine e il log."""
+        with self._lock:
+            sessions = len(self._sessions)
+        text = f"{format_bytes(self.total_bytes())} di {format_bytes(self.budget)} in uso, {sessions} sessioni"
+        if session is not None:
+            text += f"; questa sessione {format_bytes(self.session_bytes(session))} di {format_bytes(self.session_budget)}"
+        return text
+
+
+def sampled_notice(fraction, estimated):
+    """Avviso mostrato quando un dataset viene caricato a campione."""
+    return (f"Il file è troppo grande per la memoria disponibile (circa {format_bytes(estimated)} una volta letto): "
+            f"è stato caricato un campione del {fraction:.0%} delle letture di ogni serie. "
+            "Riepiloghi e grafici sono approssimati; per analizzare tutti i dati attiva l'archivio locale "
+            "(AVS_STORE_PATH) o carica un periodo più breve.")
+
+
+_governor = None
+_governor_lock = threading.Lock()
+
+
+def get_memory_governor():
+    """MemoryGovernor condiviso dal processo, creato al primo uso."""
+    global _governor
+    with _governor_lock:
+        if _governor is None:
+            _governor = MemoryGovernor()
+        return _governor
+
+
+def session_id():
+    """ID della sessione Streamlit corrente (None fuori da una pagina Streamlit)."""
+    # Streamlit serve solo alle pagine: la dashboard Dash usa questo modulo senza
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+    ctx = get_script_run_ctx()
+    return ctx.session_id if ctx is not None else None
+
+
+def hold_memory(slot, cache_key, value, release):
+    """
+    Conta `value` (DataFrame o file di esportazione) tra i dati della sessione
+    Streamlit corrente, nello slot `slot`; `release` svuota la voce della cache
+    quando non serve più. I byte si misurano una volta per chiave.
+    """
+    session = session_id()
+    if session is None:
+        return
+    governor = get_memory_governor()
+    key = (slot, cache_key)
+    nbytes = governor.known_bytes(key)
+    governor.hold(session, key, value_bytes(value) if nbytes is None else nbytes, release, slot)
@@ -0,0 +1,132 @@
+"""
+Piccoli multipli: un pannello compatto per test (o per campione).
+
+Decine di test sullo stesso grafico a linee non si leggono, e una figura
+Plotly con decine di faccette è pesante da costruire e da disegnare. Qui ogni
+pannello è una figura a sé, piccola, che le pagine costruiscono solo quando
+serve (quando entra nella pagina, o a gruppi su richiesta).
+
+Tutto quello che i pannelli devono avere in comune si calcola una volta sul
+server per l'intera selezione (PanelSet): elenco e ordine dei pannelli, righe
+di ciascuno, intervallo delle date, scala dei risultati e colore di ogni
+serie. Così un pannello costruito per ultimo ha gli stessi assi e gli stessi
+colori di quelli costruiti prima.
+
+Ogni serie di un pannello viene ridotta a PANEL_POINTS punti tenendo minimo
+e massimo di ogni intervallo di tempo: picchi e fuori scala restano visibili.
+"""
+import numpy as np
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objects as go
+
+from core.schema import QUALITY_COLUMNS
+
+# Un pannello per test o per campione; le serie di ogni pannello sono l'altra dimensione
+PANEL_BY = {
+    'test': QUALITY_COLUMNS['test_name'],
+    'sample': QUALITY_COLUMNS['sample_id'],
+}
+PANEL_BY_LABELS = {'test': 'Test', 'sample': 'Campione'}
+
+# Punti massimi per serie in un pannello (metà minimi e metà massimi per intervallo di tempo)
+PANEL_POINTS = 200
+# Altezza di un pannello, in pixel
+PANEL_HEIGHT = 220
+# Pannelli per riga della griglia
+PANEL_COLUMNS = 3
+# Margine aggiunto sopra e sotto la scala dei risultati, in proporzione all'intervallo
+PANEL_Y_PADDING = 0.05
+
+
+def downsample_minmax(df, series, x, y, points=PANEL_POINTS, x_range=None):
+    """
+    Riduce ogni serie (`series`) a circa `points` righe: l'intervallo `x_range`
+    (predefinito: quello dei dati) viene diviso in `points` / 2 intervalli e
+    per ognuno si tengono la riga con il valore minimo e quella con il massimo
+    di `y`. Un solo groupby per tutte le serie; le righe restano in ordine di `x`.
+    """
+    if df.empty or len(df) <= points:
+        return df.sort_values(x, kind='stable')
+    bins = max(points // 2, 1)
+    times = df[x].to_numpy(dtype='datetime64[ns]').astype('int64')
+    start, end = (times.min(), times.max()) if x_range is None else (
+        pd.Timestamp(x_range[0]).value, pd.Timestamp(x_range[1]).value)
+    width = max(end - start, 1)
+    bucket = np.clip((times - start) * bins // width, 0, bins - 1)
+    values = df[y].reset_index(drop=True)
+    groups = values.groupby([df[series].to_numpy(), bucket], sort=False)
+    keep = np.unique(np.concatenate((groups.idxmin().dropna().to_numpy(dtype='int64'),
+                                     groups.idxmax().dropna().to_numpy(dtype='int64'))))
+    return df.iloc[keep].sort_values(x, kind='stable')
+
+
+class PanelSet:
+    """
+    Pannelli di una selezione di letture: un pannello per valore di `by` (vedi
+    PANEL_BY), con assi e colori calcolati una volta per tutti. I singoli
+    pannelli si costruiscono poi con figure(), in qualsiasi ordine.
+    """
+
+    def __init__(self, df, by='test', shared_y=False):
+        self.by = by
+        self.column = PANEL_BY[by]
+        self.series = PANEL_BY['sample' if by == 'test' else 'test']
+        self.df = df
+        time_col, result_col = QUALITY_COLUMNS['date_time'], QUALITY_COLUMNS['result']
+
+        # Posizioni delle righe di ogni pannello, in ordine di nome
+        positions = df.groupby(self.column, sort=True, observed=True).indices
+        self.names = list(positions)
+        self.positions = positions
+        self.counts = {name: len(rows) for name, rows in positions.items()}
+
+        # Stesse date per tutti i pannelli
+        times = df[time_col]
+        self.x_range = [times.min(), times.max()] if not df.empty else None
+
+        # Scala dei risultati: per pannello (unità diverse), o una sola per tutti
+        bounds = df.groupby(self.column, sort=True, observed=True)[result_col].agg(['min', 'max'])
+        if shared_y and not bounds.empty:
+            bounds['min'], bounds['max'] = bounds['min'].min(), bounds['max'].max()
+        span = (bounds['max'] - bounds['min']).where(lambda s: s > 0, bounds['max'].abs().clip(lower=1))
+        self.y_ranges = {name: [low, high] for name, low, high in zip(
+            bounds.index, bounds['min'] - span * PANEL_Y_PADDING, bounds['max'] + span * PANEL_Y_PADDING)}
+
+        # Un colore per serie, lo stesso in tutti i pannelli
+        palette = px.colors.qualitative.Plotly
+        self.colors = {name: palette[i % len(palette)]
+                       for i, name in enumerate(sorted(df[self.series].dropna().unique(), key=str))}
+
+    def __len__(self):
+        return len(self.names)
+
+    def title(self, name):
+        return f"{name} ({self.counts[name]:,} letture)"
+
+    def figure(self, name, template=None, points=PANEL_POINTS):
+        """Figura compatta del pannello `name`, con le serie ridotte a `points` punti."""
+        time_col, result_col = QUALITY_COLUMNS['date_time'], QUALITY_COLUMNS['result']
+        rows = self.df.iloc[self.positions[name]]
+        rows = downsample_minmax(rows[[time_col, result_col, self.series]].dropna(subset=[result_col]),
+                                 self.series, time_col, result_col, points, self.x_range)
+        fig = go.Figure()
+        for series, group in rows.groupby(self.series, sort=True, observed=True):
+            fig.add_trace(go.Scatter(
+                x=group[time_col].to_numpy(), y=group[result_col].to_numpy(), name=str(series),
+                mode='lines+markers' if len(group) <= 50 else 'lines',
+                line={'color': self.colors.get(series), 'width': 1.5}, marker={'size': 4},
+                hovertemplate=f'<b>{series}</b><br>%{{x|%Y-%m-%d %H:%M}}<br>Risultato: %{{y}}<extra></extra>',
+            ))
+        fig.update_layout(
+            title={'text': self.title(name), 'font': {'size': 13}},
+            height=PANEL_HEIGHT,
+            margin={'l': 40, 'r': 10, 't': 35, 'b': 25},
+            showlegend=False,
+            hovermode='closest',
+            template=template,
+        )
+        if self.x_range is not None:
+            fig.update_xaxes(range=self.x_range)
+        fig.update_yaxes(range=self.y_ranges.get(name))
+        return fig
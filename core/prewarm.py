@@ -0,0 +1,252 @@
+"""
+Pre-calcolo in background delle viste più richieste.
+
+Ogni volta che una dashboard mostra una vista (filtri, tipo di grafico, ...) ne
+viene registrata la forma normalizzata: solo i valori diversi da quelli
+predefiniti della pagina, con le date come testo. Così "tutti i campioni" o
+"l'anno corrente" restano la stessa vista anche quando i dati cambiano. I
+conteggi vengono salvati in un file JSON (AVS_VIEW_STATS_PATH) condiviso tra
+i processi e sopravvivono ai riavvii.
+
+All'avvio e dopo ogni aggiornamento dei dati, le AVS_PREWARM_VIEWS viste più
+richieste (sempre a partire da quella predefinita) vengono ricostruite da un
+thread in background e finiscono nelle cache di risultati e figure delle
+pagine: chi apre la dashboard per primo la trova già pronta.
+"""
+import atexit
+import importlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from datetime import date, datetime
+
+import numpy as np
+import pandas as pd
+
+# Librerie opzionali che plotly (tramite narwhals) cerca in sys.modules per riconoscere i
+# dati: vengono importate qui, prima di ogni thread di pre-calcolo. Se la prima importazione
+# avvenisse in un'altra pagina mentre un pre-calcolo costruisce una figura, il thread
+# troverebbe il modulo importato a metà (AttributeError su duckdb.DuckDBPyRelation).
+for _module in ('duckdb', 'pyarrow'):
+    try:
+        importlib.import_module(_module)
+    except ImportError:
+        pass
+
+VIEW_STATS_PATH_ENV = 'AVS_VIEW_STATS_PATH'
+PREWARM_VIEWS_ENV = 'AVS_PREWARM_VIEWS'
+
+# Viste pre-calcolate per pagina (0 disattiva il pre-calcolo)
+PREWARM_VIEWS = 5
+# Viste ricordate per pagina; oltre si dimenticano le meno richieste
+VIEW_STATS_MAX = 200
+# Viste non più richieste da questi giorni vengono dimenticate
+VIEW_MAX_AGE_DAYS = 30
+# I conteggi vengono scritti su file al più ogni tanti secondi
+VIEW_FLUSH_SECONDS = 30
+
+logger = logging.getLogger(__name__)
+
+# Thread del pre-calcolo, riconosciuti dal nome
+PREWARM_THREAD_PREFIX = 'avs-prewarm'
+
+
+class _PrewarmContextFilter(logging.Filter):
+    """
+    Scarta l'avviso di Streamlit sul ScriptRunContext mancante nei thread del
+    pre-calcolo: le cache di Streamlit funzionano anche senza sessione, manca
+    solo lo spinner, che qui non ha nessuno a cui essere mostrato.
+    """
+
+    def filter(self, record):
+        return not threading.current_thread().name.startswith(PREWARM_THREAD_PREFIX)
+
+
+logging.getLogger('streamlit.runtime.scriptrunner_utils.script_run_context').addFilter(_PrewarmContextFilter())
+
+
+def _plain(value):
+    """Valore confrontabile e serializzabile in JSON: date come testo ISO, sequenze come liste."""
+    if isinstance(value, (pd.Timestamp, datetime, date, np.datetime64)):
+        return pd.Timestamp(value).date().isoformat()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (list, tuple, np.ndarray, pd.Index)):
+        # Nessuna selezione equivale a nessun filtro
+        return [_plain(item) for item in value] or None
+    return value
+
+
+def _same(value, default):
+    if isinstance(value, list) and isinstance(default, list):
+        # Le selezioni multiple valgono come insiemi: l'ordine dei clic non cambia la vista
+        return sorted(map(str, value)) == sorted(map(str, default))
+    return value == default
+
+
+def normalize_view(state, defaults):
+    """Vista normalizzata: solo i valori di `state` diversi da quelli in `defaults`."""
+    view = {}
+    for name, value in state.items():
+        value = _plain(value)
+        if not _same(value, _plain(defaults.get(name))):
+            view[name] = value
+    return view
+
+
+def restore_view(view, defaults):
+    """Stato completo di una vista: i valori predefiniti attuali più quelli della vista."""
+    return {**{name: _plain(value) for name, value in defaults.items()}, **view}
+
+
+def view_dates(state, names=('start_date', 'end_date')):
+    """Date di uno stato ripristinato (testo ISO, vedi restore_view) come datetime.date."""
+    return tuple(date.fromisoformat(state[name]) if state.get(name) else None for name in names)
+
+
+def view_key(view):
+    """Chiave di una vista, identica per selezioni uguali in ordine diverso."""
+    canonical = {name: sorted(map(str, value)) if isinstance(value, list) else value
+                 for name, value in view.items()}
+    return json.dumps(canonical, sort_keys=True, default=str)
+
+
+class ViewStats:
+    """Conteggi delle viste per pagina, salvati come `{pagina: {chiave: {view, hits, last_seen}}}`."""
+
+    def __init__(self, path=None):
+        self.path = str(path or os.environ.get(VIEW_STATS_PATH_ENV)
+                        or os.path.join(tempfile.gettempdir(), 'avs_views.json'))
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+
+    def _read(self):
+        try:
+            with open(self.path, encoding='utf-8') as handle:
+                return json.load(handle)
+        except (OSError, ValueError):
+            return {}  # nessun conteggio ancora, o file scritto a metà da un altro processo
+
+    def record(self, page, view):
+        """Conta una richiesta della vista (già normalizzata) sulla pagina."""
+        key = view_key(view)
+        with self._lock:
+            entry = self._pending.setdefault(page, {}).setdefault(key, {'view': view, 'hits': 0})
+            entry['view'] = view
+            entry['hits'] += 1
+            entry['last_seen'] = time.time()
+            due = time.monotonic() - self._last_flush >= VIEW_FLUSH_SECONDS
+        if due:
+            self.flush()
+
+    def _merged(self, pending):
+        stats = self._read()
+        for page, entries in pending.items():
+            page_stats = stats.setdefault(page, {})
+            for key, entry in entries.items():
+                saved = page_stats.setdefault(key, {'view': entry['view'], 'hits': 0, 'last_seen': 0})
+                saved['view'] = entry['view']
+                saved['hits'] += entry['hits']
+                saved['last_seen'] = max(saved['last_seen'], entry['last_seen'])
+        return stats
+
+    def flush(self):
+        """Aggiunge al file i conteggi in sospeso e dimentica le viste vecchie o poco richieste."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._last_flush = time.monotonic()
+        if not pending:
+            return
+        stats = self._merged(pending)
+        oldest = time.time() - VIEW_MAX_AGE_DAYS * 24 * 60 * 60
+        for page, entries in stats.items():
+            kept = sorted((item for item in entries.items() if item[1]['last_seen'] >= oldest),
+                          key=lambda item: item[1]['hits'], reverse=True)[:VIEW_STATS_MAX]
+            stats[page] = dict(kept)
+        try:
+            directory = os.path.dirname(self.path) or '.'
+            os.makedirs(directory, exist_ok=True)
+            # Scrittura su un file temporaneo e rinomina: chi legge non vede mai un file a metà.
+            # Due processi che scrivono insieme possono perdere qualche conteggio, non il file.
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.avs_views')
+            with os.fdopen(fd, 'w', encoding='utf-8') as handle:
+                json.dump(stats, handle)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning("Impossibile salvare i conteggi delle viste in %s: %s", self.path, e)
+
+    def top(self, page, n):
+        """Le `n` viste più richieste della pagina, dalla più richiesta."""
+        with self._lock:
+            pending = {page: dict(self._pending.get(page, {}))}
+        entries = self._merged(pending).get(page, {}).values()
+        ranked = sorted(entries, key=lambda entry: (entry['hits'], entry['last_seen']), reverse=True)
+        return [entry['view'] for entry in ranked[:n]]
+
+
+_stats = None
+_stats_lock = threading.Lock()
+_started = set()
+
+
+def get_view_stats():
+    """ViewStats condiviso dal processo, creato al primo uso."""
+    global _stats
+    with _stats_lock:
+        if _stats is None:
+            _stats = ViewStats()
+            # I conteggi ancora in sospeso vengono salvati anche all'uscita del processo
+            atexit.register(_stats.flush)
+        return _stats
+
+
+def prewarm_count():
+    """Numero di viste da pre-calcolare per pagina (AVS_PREWARM_VIEWS)."""
+    return int(os.environ.get(PREWARM_VIEWS_ENV) or PREWARM_VIEWS)
+
+
+def record_view(page, state, defaults):
+    """Registra la vista mostrata da una pagina; restituisce la vista normalizzata."""
+    view = normalize_view(state, defaults)
+    get_view_stats().record(page, view)
+    return view
+
+
+def start_prewarm(page, warm, defaults, version=None, n=None, wait=False, args=()):
+    """
+    Ricostruisce in background la vista predefinita e le viste più richieste
+    della pagina, chiamando `warm(stato, *args)` per ognuna (stato completo, vedi
+    restore_view). `warm` riceve i dati della pagina solo tramite `args`: non una
+    closure sulle variabili dello script, che il thread terrebbe in vita. Con `version` (es. la chiave del dataset) il pre-calcolo
+    parte una sola volta per versione dei dati nel processo. Restituisce il
+    thread avviato, oppure None se non c'è niente da fare.
+
+    Gli errori di una vista vengono registrati nel log e non fermano le altre.
+    """
+    n = prewarm_count() if n is None else n
+    if n <= 0:
+        return None
+    if version is not None:
+        with _stats_lock:
+            if (page, version) in _started:
+                return None
+            _started.add((page, version))
+
+    def run():
+        views = [{}] + [view for view in get_view_stats().top(page, n) if view]
+        for view in views[:n]:
+            try:
+                warm(restore_view(view, defaults), *args)
+            except Exception:
+                logger.warning("Pre-calcolo della vista %s di %s non riuscito", view, page, exc_info=True)
+
+    # Un thread a parte e non il pool dei compiti: le viste usano a loro volta dei TaskGraph
+    thread = threading.Thread(target=run, name=f'{PREWARM_THREAD_PREFIX}-{page}', daemon=True)
+    thread.start()
+    if wait:
+        thread.join()
+    return thread
@@ -0,0 +1,272 @@
+"""
+Profilazione su richiesta delle interazioni lente (callback Dash e pagine Streamlit).
+
+È spenta di default. Si attiva per tutte le richieste con AVS_PROFILE=1, oppure
+per un solo browser aprendo la dashboard con `?profile=<AVS_PROFILE_TOKEN>`.
+Ogni richiesta profilata viene campionata con pyinstrument (profiler statistico,
+se installato) o, in mancanza, con cProfile della libreria standard; vengono
+conservate solo le AVS_PROFILE_KEEP richieste più lente, come file HTML/testo
+e .pstats nella cartella AVS_PROFILE_DIR, condivisa tra i processi.
+
+I compiti che una richiesta profilata affida al pool di core/tasks.py vengono
+profilati nel loro thread e aggiunti al profilo della richiesta.
+"""
+import contextvars
+import cProfile
+import io
+import json
+import marshal
+import os
+import pstats
+import tempfile
+import threading
+import time
+import uuid
+
+try:
+    from pyinstrument import Profiler as SamplingProfiler
+    from pyinstrument.renderers import ConsoleRenderer, HTMLRenderer
+    from pyinstrument.session import Session
+except ImportError:  # pyinstrument è opzionale: si usa cProfile (deterministico, più costoso)
+    SamplingProfiler = None
+
+PROFILE_ENV = 'AVS_PROFILE'
+PROFILE_TOKEN_ENV = 'AVS_PROFILE_TOKEN'
+PROFILE_DIR_ENV = 'AVS_PROFILE_DIR'
+PROFILE_KEEP_ENV = 'AVS_PROFILE_KEEP'
+
+# Parametro dell'URL che attiva la profilazione (e dà accesso all'elenco dei profili)
+PROFILE_PARAM = 'profile'
+# Richieste più lente conservate
+PROFILE_KEEP = 20
+# Intervallo di campionamento di pyinstrument (secondi)
+SAMPLE_INTERVAL = 0.001
+# Righe del riepilogo testuale di cProfile
+PSTATS_LINES = 60
+# Lunghezza massima dei dettagli della richiesta salvati (es. i filtri)
+DETAILS_MAX_CHARS = 4000
+
+
+def profiling_enabled():
+    """True se AVS_PROFILE chiede di profilare tutte le richieste."""
+    return os.environ.get(PROFILE_ENV, '').lower() in ('1', 'true', 'yes', 'on')
+
+
+def profile_token():
+    """Token di amministrazione (AVS_PROFILE_TOKEN), oppure None se non impostato."""
+    return os.environ.get(PROFILE_TOKEN_ENV) or None
+
+
+def is_admin_token(value):
+    """True se `value` è il token di amministrazione configurato."""
+    token = profile_token()
+    return token is not None and value == token
+
+
+class ProfileStore:
+    """Profili delle richieste più lente, salvati come `<id>.json` più i file del profilo."""
+
+    def __init__(self, root=None, keep=None):
+        self.root = str(root or os.environ.get(PROFILE_DIR_ENV) or os.path.join(tempfile.gettempdir(), 'avs_profiles'))
+        self.keep = int(keep or os.environ.get(PROFILE_KEEP_ENV) or PROFILE_KEEP)
+        self._lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+
+    def entries(self):
+        """Profili conservati, dal più lento."""
+        entries = []
+        for name in os.listdir(self.root):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.root, name), encoding='utf-8') as handle:
+                    entries.append(json.load(handle))
+            except (OSError, ValueError):
+                continue  # rimosso o scritto a metà da un altro processo
+        return sorted(entries, key=lambda entry: entry['duration'], reverse=True)
+
+    def is_slow_enough(self, duration):
+        """True se una richiesta di questa durata entra tra le `keep` più lente."""
+        entries = self.entries()
+        return len(entries) < self.keep or duration > entries[self.keep - 1]['duration']
+
+    def path(self, profile_id, kind):
+        """Percorso di un file del profilo ('html', 'txt' o 'pstats'), oppure None se non esiste."""
+        if not all(c in '0123456789abcdef' for c in profile_id) or kind not in ('html', 'txt', 'pstats'):
+            return None
+        path = os.path.join(self.root, f'{profile_id}.{kind}')
+        return path if os.path.exists(path) else None
+
+    def record(self, name, duration, outputs, details=None):
+        """
+        Salva un profilo (`outputs`: estensione -> contenuto) e rimuove quelli
+        usciti dalle `keep` richieste più lente. Restituisce l'ID del profilo.
+        """
+        profile_id = uuid.uuid4().hex
+        entry = {
+            'id': profile_id,
+            'name': name,
+            'duration': duration,
+            'started': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time() - duration)),
+            'pid': os.getpid(),
+            'kinds': sorted(outputs),
+            'details': (details or '')[:DETAILS_MAX_CHARS],
+        }
+        with self._lock:
+            for kind, content in outputs.items():
+                mode = 'wb' if isinstance(content, bytes) else 'w'
+                with open(os.path.join(self.root, f'{profile_id}.{kind}'), mode) as handle:
+                    handle.write(content)
+            # Metadati per ultimi: un profilo elencato ha sempre i suoi file
+            with open(os.path.join(self.root, f'{profile_id}.json'), 'w', encoding='utf-8') as handle:
+                json.dump(entry, handle)
+            for old in self.entries()[self.keep:]:
+                for kind in ('json', *old.get('kinds', ())):
+                    try:
+                        os.remove(os.path.join(self.root, f"{old['id']}.{kind}"))
+                    except OSError:
+                        pass
+        return profile_id
+
+
+class RequestProfile:
+    """Profilo di una singola richiesta: start(), poi finish() per salvarlo se è tra i più lenti."""
+
+    def __init__(self, name, store, details=None):
+        self.name = name
+        self.store = store
+        self.details = details
+        self._profiler = None
+        self._started = None
+        # Profili dei compiti eseguiti per questa richiesta su altri thread
+        self._parts = []
+        self._parts_lock = threading.Lock()
+        self.thread_id = threading.get_ident()
+
+    def start(self):
+        self._started = time.perf_counter()
+        self._profiler = _start_profiler()
+        return self
+
+    def stop(self):
+        """Ferma il profiler senza salvare (es. richiesta interrotta)."""
+        if self._profiler is None:
+            return None
+        _stop_profiler(self._profiler)
+        return time.perf_counter() - self._started
+
+    def run_part(self, fn, *args, **kwargs):
+        """Esegue `fn` sul thread corrente, aggiungendone il profilo a quello della richiesta."""
+        try:
+            profiler = _start_profiler()
+        except ValueError:  # un altro profiler è già attivo su questo thread
+            return fn(*args, **kwargs)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _stop_profiler(profiler)
+            with self._parts_lock:
+                if self._profiler is not None:
+                    self._parts.append(profiler)
+
+    def finish(self):
+        """Ferma il profiler e salva il profilo se la richiesta è tra le più lente; restituisce la durata."""
+        duration = self.stop()
+        if duration is None:
+            return None
+        if self.store.is_slow_enough(duration):
+            self.store.record(self.name, duration, self._outputs(), self.details)
+        self._profiler = None
+        return duration
+
+    def _outputs(self):
+        with self._parts_lock:
+            parts = list(self._parts)
+        if SamplingProfiler is not None:
+            # Albero delle chiamate interattivo (HTML) e la sua versione testuale, con i compiti degli altri thread
+            session = self._profiler.last_session
+            for part in parts:
+                if part.last_session is not None:
+                    session = Session.combine(session, part.last_session)
+            return {'html': HTMLRenderer().render(session), 'txt': ConsoleRenderer(unicode=True).render(session)}
+        text = io.StringIO()
+        stats = pstats.Stats(self._profiler, stream=text)
+        for part in parts:
+            stats.add(part)
+        stats.sort_stats('cumulative').print_stats(PSTATS_LINES)
+        # Stesso contenuto di Stats.dump_stats: si apre con pstats.Stats o snakeviz
+        return {'txt': text.getvalue(), 'pstats': marshal.dumps(stats.stats)}
+
+
+def _start_profiler():
+    if SamplingProfiler is not None:
+        profiler = SamplingProfiler(interval=SAMPLE_INTERVAL, async_mode='disabled')
+        profiler.start()
+    else:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    return profiler
+
+
+def _stop_profiler(profiler):
+    if SamplingProfiler is not None:
+        profiler.stop()
+    else:
+        profiler.disable()
+
+
+_store = None
+_store_lock = threading.Lock()
+# Profilo della richiesta in corso: una variabile di contesto, così segue i compiti
+# che la richiesta affida al pool (TaskGraph esegue ogni compito nel contesto di chi l'ha aggiunto)
+_active = contextvars.ContextVar('avs_profile', default=None)
+
+
+def get_profile_store():
+    """ProfileStore condiviso dal processo, creato al primo uso."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ProfileStore()
+        return _store
+
+
+def start_profile(name, details=None):
+    """
+    Avvia il profilo di una richiesta sul thread corrente.
+
+    Un profilo rimasto aperto sullo stesso thread (es. una pagina Streamlit
+    interrotta da st.rerun) viene fermato e scartato.
+    """
+    previous = _active.get()
+    if previous is not None:
+        previous.stop()
+    profile = RequestProfile(name, get_profile_store(), details).start()
+    _active.set(profile)
+    return profile
+
+
+def finish_profile(profile):
+    """Chiude un profilo avviato con start_profile; restituisce la durata della richiesta."""
+    if _active.get() is profile:
+        _active.set(None)
+    return profile.finish()
+
+
+def discard_profile(profile):
+    """Ferma senza salvarlo un profilo avviato con start_profile (es. richiesta fallita)."""
+    if _active.get() is profile:
+        _active.set(None)
+    profile.stop()
+
+
+def run_profiled(fn, *args, **kwargs):
+    """
+    Esegue `fn`; se la richiesta da cui proviene il contesto corrente è
+    profilata e `fn` gira su un altro thread, il suo profilo si aggiunge a quello
+    della richiesta.
+    """
+    profile = _active.get()
+    if profile is None or profile.thread_id == threading.get_ident():
+        return fn(*args, **kwargs)
+    return profile.run_part(fn, *args, **kwargs)
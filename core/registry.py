@@ -0,0 +1,162 @@
+"""
+Registro dei file caricati, indicizzati per contenuto (SHA-256).
+
+Un upload viene letto e hashato una sola volta, all'arrivo, e salvato su disco
+in una cartella che porta il suo hash. Da lì in poi le pagine lo identificano
+con quell'ID (una stringa corta, economica da confrontare ad ogni rerun) e lo
+leggono dal percorso sul disco, invece di far hashare a Streamlit tutti i byte
+del file ad ogni interazione. Gli upload non usati da troppo tempo, o oltre il
+limite di spazio, vengono rimossi.
+
+Le pagine Streamlit passano i file caricati a resolve_uploads, che usa il
+registro condiviso dal processo (get_upload_registry).
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+UPLOAD_DIR_ENV = 'AVS_UPLOAD_DIR'
+
+# Un upload non letto da più di un'ora viene rimosso
+UPLOAD_IDLE_SECONDS = 60 * 60
+# Spazio massimo occupato dagli upload; oltre si rimuovono i meno usati
+UPLOAD_MAX_BYTES = 1024 * 1024 * 1024
+
+_HASH_BLOCK_BYTES = 1024 * 1024
+
+
+def _digest(data):
+    """SHA-256 del contenuto, letto a blocchi senza copiarlo."""
+    view = memoryview(data)
+    sha = hashlib.sha256()
+    for start in range(0, len(view), _HASH_BLOCK_BYTES):
+        sha.update(view[start:start + _HASH_BLOCK_BYTES])
+    return sha.hexdigest()
+
+
+class UploadRegistry:
+    """Upload salvati su disco come `<cartella>/<hash>/<nome file>`."""
+
+    def __init__(self, root=None, idle_seconds=UPLOAD_IDLE_SECONDS, max_bytes=UPLOAD_MAX_BYTES):
+        self.root = str(root or os.environ.get(UPLOAD_DIR_ENV) or os.path.join(tempfile.gettempdir(), 'avs_uploads'))
+        self.idle_seconds = idle_seconds
+        self.max_bytes = max_bytes
+        self._entries = {}
+        self._lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+        self._scan()
+
+    def _scan(self):
+        # Gli upload rimasti da un avvio precedente restano disponibili
+        for upload_id in os.listdir(self.root):
+            directory = os.path.join(self.root, upload_id)
+            names = os.listdir(directory) if os.path.isdir(directory) else []
+            if len(names) != 1 or names[0].startswith('.'):
+                continue
+            path = os.path.join(directory, names[0])
+            self._entries[upload_id] = {'path': path, 'size': os.path.getsize(path),
+                                        'last_used': os.path.getmtime(path)}
+
+    def register(self, data, filename):
+        """
+        Salva il contenuto (bytes o buffer) e ne restituisce l'ID.
+
+        Lo stesso contenuto caricato più volte, anche da sessioni diverse,
+        viene salvato una volta sola.
+        """
+        upload_id = _digest(data)
+        with self._lock:
+            entry = self._entries.get(upload_id)
+            if entry is not None and os.path.exists(entry['path']):
+                entry['last_used'] = time.time()
+                return upload_id
+
+            directory = os.path.join(self.root, upload_id)
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, os.path.basename(filename) or 'upload')
+            # Scrittura su un file temporaneo e rinomina: chi legge non vede mai un file a metà
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.')
+            with os.fdopen(fd, 'wb') as handle:
+                handle.write(data)
+            os.replace(tmp_path, path)
+            self._entries[upload_id] = {'path': path, 'size': len(memoryview(data)), 'last_used': time.time()}
+        self.evict(keep=[upload_id])
+        return upload_id
+
+    def path(self, upload_id):
+        """Percorso dell'upload, oppure None se non è (più) nel registro."""
+        with self._lock:
+            entry = self._entries.get(upload_id)
+            if entry is None or not os.path.exists(entry['path']):
+                self._entries.pop(upload_id, None)
+                return None
+            entry['last_used'] = time.time()
+            return entry['path']
+
+    def evict(self, keep=(), now=None):
+        """
+        Rimuove gli upload inattivi e, oltre `max_bytes`, i meno usati di recente.
+        Gli ID in `keep` (es. quelli della sessione corrente) non vengono mai rimossi.
+        """
+        now = now or time.time()
+        keep = set(keep)
+        with self._lock:
+            by_age = sorted(self._entries.items(), key=lambda item: item[1]['last_used'])
+            total = sum(entry['size'] for _, entry in by_age)
+            removed = []
+            for upload_id, entry in by_age:
+                if now - entry['last_used'] <= self.idle_seconds and total <= self.max_bytes:
+                    break
+                if upload_id in keep:
+                    continue
+                removed.append(upload_id)
+                total -= entry['size']
+            for upload_id in removed:
+                del self._entries[upload_id]
+                shutil.rmtree(os.path.join(self.root, upload_id), ignore_errors=True)
+        return removed
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_upload_registry():
+    """Registro condiviso tra le sessioni (un file identico viene salvato una volta sola)."""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = UploadRegistry()
+        return _registry
+
+
+def resolve_uploads(uploaded_files, state_key='upload_ids'):
+    """
+    Restituisce i percorsi su disco dei file caricati in una pagina Streamlit,
+    registrandoli al primo arrivo. Nella sessione resta solo l'associazione
+    file_id -> ID del contenuto (in `st.session_state[state_key]`, una chiave per
+    pagina), così ai rerun le cache lavorano su un percorso invece di hashare
+    tutti i byte del file.
+    """
+    # Streamlit serve solo alle pagine: il registro in sé non ne dipende
+    import streamlit as st
+
+    registry = get_upload_registry()
+    known_ids = st.session_state.get(state_key, {})
+    upload_ids, paths = {}, []
+    for uploaded_file in uploaded_files:
+        path = registry.path(known_ids.get(uploaded_file.file_id))
+        if path is None:
+            # Nuovo upload (o rimosso dal registro per inattività): hash e salvataggio
+            upload_id = registry.register(uploaded_file.getbuffer(), uploaded_file.name)
+            path = registry.path(upload_id)
+        else:
+            upload_id = known_ids[uploaded_file.file_id]
+        upload_ids[uploaded_file.file_id] = upload_id
+        paths.append(path)
+    st.session_state[state_key] = upload_ids
+    registry.evict(keep=upload_ids.values())
+    return paths
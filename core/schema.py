@@ -0,0 +1,98 @@
+"""Nomi delle colonne e tipi attesi per i file di Controllo Qualità e Osmosi."""
+
+# --- Controllo Qualità ---
+QUALITY_COLUMNS = {
+    'date_time': 'Time',
+    'sample_id': 'Sample ID',
+    'test_name': 'Test Name',
+    'result': 'Result',
+    'date': 'Date',
+    'user_id': 'User ID',
+    'abs': 'ABS'
+}
+
+# Colonne sempre lette, anche quando l'utente sceglie un sottoinsieme di colonne
+QUALITY_REQUIRED_COLUMNS = ('Time', 'User ID', 'Sample ID', 'Test Name', 'Result')
+
+# Chiave di una lettura: la stessa riga presente in più export viene tenuta una sola volta
+QUALITY_DEDUP_KEYS = ('Time', 'Sample ID', 'Test Name')
+
+# Tipi espliciti per le colonne dell'export LIMS: evita l'inferenza colonna per colonna.
+# 'Time' viene letta come testo e convertita con un formato noto durante la lettura.
+QUALITY_DTYPES = {
+    'Time': 'str',
+    'User ID': 'str',
+    'Sample ID': 'str',
+    'Test Number': 'str',
+    'Test Name': 'str',
+    'ABS': 'float64',
+    'Result': 'float64',
+    'Unit': 'str',
+    'Chemical Form': 'str',
+    'Dilution': 'str',
+    'Reagent Blank': 'str',
+    'Standard Adjust': 'str',
+    'Message1': 'str',
+}
+
+# Formato della colonna 'Time' negli export CSV; None: riconosciuto una volta per file (core/dates.py)
+QUALITY_TIME_FORMAT = None
+
+# Colonne numeriche: i valori non numerici diventano vuoti e vengono segnalati (core/validation.py)
+QUALITY_NUMERIC_COLUMNS = ('ABS', 'Result')
+
+# Intervallo fisicamente possibile dei risultati per test; gli altri test non possono essere negativi
+QUALITY_PLAUSIBLE_RANGES = {
+    'pH': (0, 14),
+}
+
+# --- Osmosi ---
+OSMOSI_COLUMNS = {
+    'data_inizio': 'Data Inizio',
+    'mc_inizio': 'MC Inizio',
+    'data_fine': 'Data Fine',
+    'mc_fine': 'MC Fine',
+    'totale_mc': 'Totale MC',
+    'mese': 'Mese',
+    'lavaggio': 'Lavaggio',
+    'anno': 'Anno'
+}
+
+OSMOSI_REQUIRED_COLUMNS = ('Data Inizio', 'Data Fine', 'Totale MC', 'Mese', 'Lavaggio', 'Anno')
+
+OSMOSI_NUMERIC_COLUMNS = ('MC Inizio', 'MC Fine', 'Totale MC', 'Lavaggio', 'Anno')
+
+# Un periodo per mese: due righe con lo stesso anno e mese sono un doppione
+OSMOSI_DEDUP_KEYS = ('Anno', 'Mese')
+
+# Differenza tollerata (m³) tra 'Totale MC' e la differenza delle letture del contatore
+OSMOSI_METER_TOLERANCE = 1
+
+MESI_ORDINE = ["Gennaio", "Febbraio", "Marzo", "Aprile", "Maggio", "Giugno",
+               "Luglio", "Agosto", "Settembre", "Ottobre", "Novembre", "Dicembre"]
+
+# --- Limiti di legge ---
+# Tabella dei limiti: una riga per test (e, se indicato, per campione) valida dalla data 'Valido Dal'
+# fino alla versione successiva. 'Sample ID' vuoto vale per tutti i campioni.
+LIMIT_COLUMNS = {
+    'test_name': 'Test Name',
+    'sample_id': 'Sample ID',
+    'valid_from': 'Valido Dal',
+    'min': 'Limite Min',
+    'max': 'Limite Max',
+}
+
+# Colonna aggiunta ad ogni lettura con l'esito del confronto con i limiti
+COMPLIANCE_COLUMN = 'Conformità'
+
+# --- Anomalie ---
+# Colonne aggiunte ad ogni lettura dal rilevamento delle anomalie (core/anomaly.py)
+ANOMALY_COLUMNS = {
+    'robust_z': 'Punteggio Z',
+    'change': 'Punteggio Cambio',
+    'kind': 'Anomalia',
+}
+
+# Colonne calcolate al caricamento (limiti, conformità, anomalie): non fanno parte delle
+# letture registrate come versione
+QUALITY_DERIVED_COLUMNS = (LIMIT_COLUMNS['min'], LIMIT_COLUMNS['max'], COMPLIANCE_COLUMN, *ANOMALY_COLUMNS.values())
@@ -0,0 +1,352 @@
+"""
+Archivio analitico locale (DuckDB o SQLite) per i dati di Controllo Qualità e Osmosi.
+
+È opzionale: si attiva indicando il percorso del file nella variabile d'ambiente
+AVS_STORE_PATH. I dati caricati vengono scritti su disco e filtri, aggregazioni,
+pagine della tabella ed esportazioni diventano query SQL, così lo storico non
+deve stare tutto in memoria e lo stesso file è condiviso tra più processi.
+Ogni scrittura cambia la versione dei dati (un piccolo file accanto
+all'archivio), così gli altri processi sanno quando le loro cache sono vecchie.
+Si usa DuckDB se installato, altrimenti sqlite3 della libreria standard.
+
+Un file DuckDB può essere aperto in scrittura da un solo processo alla volta:
+le query lo aprono in sola lettura (condivisa tra i processi) e, mentre un
+altro processo o thread scrive, riprovano per qualche secondo.
+"""
+import os
+import sqlite3
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import date, datetime
+
+import pandas as pd
+
+from core.schema import ANOMALY_COLUMNS, OSMOSI_COLUMNS, QUALITY_COLUMNS, QUALITY_DEDUP_KEYS
+
+try:
+    import duckdb
+except ImportError:  # DuckDB è opzionale: si ripiega su SQLite
+    duckdb = None
+
+STORE_PATH_ENV = 'AVS_STORE_PATH'
+
+# File con la versione dei dati, accanto all'archivio
+VERSION_SUFFIX = '.version'
+
+# Secondi di attesa di un file occupato da un'altra scrittura, prima di rinunciare
+STORE_LOCK_TIMEOUT = 30
+
+QUALITY_TABLE = 'quality'
+OSMOSI_TABLE = 'osmosi'
+
+_DATETIME_COLUMNS = [QUALITY_COLUMNS['date_time'], QUALITY_COLUMNS['date'],
+                     OSMOSI_COLUMNS['data_inizio'], OSMOSI_COLUMNS['data_fine']]
+
+
+def _quote(name):
+    """Racchiude un nome di colonna o tabella tra doppi apici (i nomi hanno spazi)."""
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def _placeholders(values):
+    return ', '.join('?' * len(values))
+
+
+def _is_lock_conflict(error):
+    """Errore DuckDB di un file occupato: scrittura di un altro processo, o connessioni diverse in questo."""
+    message = str(error)
+    return 'lock' in message or 'different configuration' in message
+
+
+class DataStore:
+    """Archivio su file con le tabelle `quality` e `osmosi`."""
+
+    def __init__(self, path, backend=None):
+        self.path = str(path)
+        self.backend = backend or ('duckdb' if duckdb is not None else 'sqlite')
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    # --- Connessione e conversione dei parametri ---
+
+    def _open_duckdb(self, read_only):
+        # Un file non ancora creato non si può aprire in sola lettura
+        read_only = read_only and os.path.exists(self.path)
+        deadline = time.monotonic() + STORE_LOCK_TIMEOUT
+        delay = 0.01
+        while True:
+            try:
+                return duckdb.connect(self.path, read_only=read_only)
+            except (duckdb.IOException, duckdb.ConnectionException) as e:
+                if not _is_lock_conflict(e) or time.monotonic() + delay > deadline:
+                    raise
+                time.sleep(delay)
+                delay = min(delay * 2, 0.5)
+
+    @contextmanager
+    def _connect(self, write=False):
+        # Una connessione per operazione: il file resta libero per gli altri processi
+        if self.backend == 'duckdb':
+            con = self._open_duckdb(read_only=not write)
+        else:
+            con = sqlite3.connect(self.path, timeout=STORE_LOCK_TIMEOUT)
+        try:
+            yield con
+            if self.backend == 'sqlite':
+                con.commit()
+        finally:
+            con.close()
+
+    def _param(self, value):
+        if isinstance(value, (datetime, date)):
+            value = pd.Timestamp(value)
+            return value.to_pydatetime() if self.backend == 'duckdb' else str(value)
+        if hasattr(value, 'item'):  # scalari NumPy
+            return value.item()
+        return value
+
+    def _fetch(self, con, sql, params=()):
+        params = [self._param(p) for p in params]
+        if self.backend == 'duckdb':
+            return con.execute(sql, params).df()
+        return pd.read_sql_query(sql, con, params=params, parse_dates=_DATETIME_COLUMNS)
+
+    def _query(self, sql, params=()):
+        with self._connect() as con:
+            return self._fetch(con, sql, params)
+
+    # --- Versione dei dati ---
+
+    @property
+    def version_path(self):
+        return self.path + VERSION_SUFFIX
+
+    def data_version(self):
+        """Versione dei dati nell'archivio, cambiata da ogni scrittura di qualsiasi processo ('' se mai scritto)."""
+        try:
+            with open(self.version_path, encoding='utf-8') as handle:
+                return handle.read().strip()
+        except OSError:
+            return ''
+
+    def _bump_version(self):
+        # Scrittura atomica: gli altri processi leggono la versione vecchia o quella nuova
+        temporary = f"{self.version_path}.{os.getpid()}.tmp"
+        with open(temporary, 'w', encoding='utf-8') as handle:
+            handle.write(uuid.uuid4().hex)
+        os.replace(temporary, self.version_path)
+
+    # --- Scrittura ---
+
+    def _has_table(self, con, table):
+        if self.backend == 'duckdb':
+            sql = "SELECT COUNT(*) AS n FROM information_schema.tables WHERE table_name = ?"
+        else:
+            sql = "SELECT COUNT(*) AS n FROM sqlite_master WHERE type = 'table' AND name = ?"
+        return bool(self._fetch(con, sql, [table])['n'].iloc[0])
+
+    def has_table(self, table):
+        if not os.path.exists(self.path):
+            return False
+        with self._connect() as con:
+            return self._has_table(con, table)
+
+    def write_table(self, table, df, mode='replace', keys=None):
+        """
+        Scrive un DataFrame nella tabella indicata.
+
+        Con mode='append' le righe già presenti con la stessa chiave (`keys`)
+        vengono sostituite da quelle nuove.
+        """
+        with self._connect(write=True) as con:
+            exists = self._has_table(con, table) if mode == 'append' else False
+            if self.backend == 'duckdb':
+                con.register('incoming', df)
+                if not exists:
+                    con.execute(f"CREATE OR REPLACE TABLE {_quote(table)} AS SELECT * FROM incoming")
+                else:
+                    if keys:
+                        key_sql = ', '.join(_quote(k) for k in keys)
+                        con.execute(f"DELETE FROM {_quote(table)} WHERE ({key_sql}) IN "
+                                    f"(SELECT {key_sql} FROM incoming)")
+                    con.execute(f"INSERT INTO {_quote(table)} BY NAME SELECT * FROM incoming")
+                con.unregister('incoming')
+            else:
+                if exists and keys:
+                    key_sql = ', '.join(_quote(k) for k in keys)
+                    rows = df[list(keys)].astype(str).itertuples(index=False, name=None)
+                    con.executemany(f"DELETE FROM {_quote(table)} WHERE ({key_sql}) = ({_placeholders(keys)})", rows)
+                df.to_sql(table, con, if_exists='append' if exists else 'replace', index=False, chunksize=50_000)
+                self._create_indexes(con, table)
+        self._bump_version()
+
+    def _create_indexes(self, con, table):
+        # DuckDB usa le zone map sui dati ordinati, SQLite ha bisogno di indici espliciti
+        if table == QUALITY_TABLE:
+            # 'key': le righe ripetute si sostituiscono per chiave, anche scrivendo a blocchi
+            indexes = {'date': [QUALITY_COLUMNS['date']],
+                       'sample_test': [QUALITY_COLUMNS['sample_id'], QUALITY_COLUMNS['test_name']],
+                       'key': list(QUALITY_DEDUP_KEYS)}
+        elif table == OSMOSI_TABLE:
+            indexes = {'anno_mese': [OSMOSI_COLUMNS['anno'], OSMOSI_COLUMNS['mese']]}
+        else:
+            return
+        for name, columns in indexes.items():
+            con.execute(f"CREATE INDEX IF NOT EXISTS {_quote(f'ix_{table}_{name}')} ON {_quote(table)} "
+                        f"({', '.join(_quote(c) for c in columns)})")
+
+    def write_quality(self, df, mode='replace'):
+        self.write_table(QUALITY_TABLE, df, mode=mode, keys=QUALITY_DEDUP_KEYS)
+
+    def write_osmosi(self, df, mode='replace'):
+        self.write_table(OSMOSI_TABLE, df, mode=mode,
+                         keys=(OSMOSI_COLUMNS['anno'], OSMOSI_COLUMNS['mese']))
+
+    # --- Controllo Qualità ---
+
+    def _quality_where(self, filters):
+        """Traduce i filtri della dashboard (vedi filter_quality) in una clausola WHERE."""
+        clauses, params = [], []
+        if filters.get('start_date') is not None:
+            clauses.append(f"{_quote(QUALITY_COLUMNS['date'])} >= ?")
+            params.append(pd.to_datetime(filters['start_date']))
+        if filters.get('end_date') is not None:
+            clauses.append(f"{_quote(QUALITY_COLUMNS['date'])} <= ?")
+            params.append(pd.to_datetime(filters['end_date']))
+        if filters.get('results_range') is not None:
+            clauses.append(f"{_quote(QUALITY_COLUMNS['result'])} BETWEEN ? AND ?")
+            params.extend(filters['results_range'])
+        if filters.get('operators'):
+            clauses.append(f"{_quote(QUALITY_COLUMNS['user_id'])} IN ({_placeholders(filters['operators'])})")
+            params.extend(filters['operators'])
+        elif filters.get('samples') and filters.get('tests'):
+            clauses.append(f"{_quote(QUALITY_COLUMNS['sample_id'])} IN ({_placeholders(filters['samples'])})")
+            clauses.append(f"{_quote(QUALITY_COLUMNS['test_name'])} IN ({_placeholders(filters['tests'])})")
+            params.extend(filters['samples'])
+            params.extend(filters['tests'])
+        if filters.get('anomalies'):
+            clauses.append(f"{_quote(ANOMALY_COLUMNS['kind'])} IN ({_placeholders(filters['anomalies'])})")
+            params.extend(filters['anomalies'])
+        return (' WHERE ' + ' AND '.join(clauses)) if clauses else '', params
+
+    def _distinct(self, table, column):
+        # Valori distinti nell'ordine di prima apparizione, come Series.unique()
+        sql = (f"SELECT {_quote(column)} AS v FROM {_quote(table)} WHERE {_quote(column)} IS NOT NULL "
+               f"GROUP BY {_quote(column)} ORDER BY MIN(rowid)")
+        return self._query(sql)['v'].tolist()
+
+    def quality_options(self):
+        """Valori per inizializzare i filtri: intervallo date e risultati, operatori, campioni, test, colonna ABS."""
+        date, result = _quote(QUALITY_COLUMNS['date']), _quote(QUALITY_COLUMNS['result'])
+        bounds = self._query(f"SELECT MIN({date}) AS min_date, MAX({date}) AS max_date, "
+                             f"MIN({result}) AS min_result, MAX({result}) AS max_result FROM {_quote(QUALITY_TABLE)}")
+        options = bounds.iloc[0].to_dict()
+        for key in ('min_date', 'max_date'):
+            options[key] = pd.to_datetime(options[key])
+        options['operators'] = self._distinct(QUALITY_TABLE, QUALITY_COLUMNS['user_id'])
+        options['samples'] = self._distinct(QUALITY_TABLE, QUALITY_COLUMNS['sample_id'])
+        options['tests'] = self._distinct(QUALITY_TABLE, QUALITY_COLUMNS['test_name'])
+        columns = self._query(f"SELECT * FROM {_quote(QUALITY_TABLE)} LIMIT 0").columns
+        options['has_abs'] = QUALITY_COLUMNS['abs'] in columns
+        return options
+
+    def quality_rows(self, filters, limit=None, offset=0):
+        """Righe filtrate, ordinate per 'Time'; `limit`/`offset` per leggere una pagina."""
+        where, params = self._quality_where(filters)
+        sql = f"SELECT * FROM {_quote(QUALITY_TABLE)}{where} ORDER BY {_quote(QUALITY_COLUMNS['date_time'])}"
+        if limit is not None:
+            sql += " LIMIT ? OFFSET ?"
+            params += [int(limit), int(offset)]
+        return self._query(sql, params)
+
+    def quality_tail(self, samples, tests, n):
+        """Ultime `n` letture di ogni serie (Sample ID, Test Name) dei campioni e test indicati."""
+        sample, test, time = (_quote(QUALITY_COLUMNS[k]) for k in ('sample_id', 'test_name', 'date_time'))
+        sql = (f"SELECT * FROM (SELECT *, ROW_NUMBER() OVER (PARTITION BY {sample}, {test} ORDER BY {time} DESC) "
+               f"AS _rank FROM {_quote(QUALITY_TABLE)} WHERE {sample} IN ({_placeholders(samples)}) "
+               f"AND {test} IN ({_placeholders(tests)})) AS tail WHERE _rank <= ? ORDER BY {time}")
+        return self._query(sql, [*samples, *tests, int(n)]).drop(columns='_rank')
+
+    def quality_duplicates(self, n_examples):
+        """
+        Letture ripetute (stessa chiave) nell'archivio, contate come in
+        validate_quality: coppie (righe, chiavi di esempio) per le ripetizioni con
+        lo stesso 'Result' e con un 'Result' diverso.
+        """
+        keys = ', '.join(_quote(k) for k in QUALITY_DEDUP_KEYS)
+        groups = (f"SELECT {keys}, COUNT(*) AS n, COUNT(DISTINCT {_quote(QUALITY_COLUMNS['result'])}) AS v "
+                  f"FROM {_quote(QUALITY_TABLE)} GROUP BY {keys} HAVING COUNT(*) > 1")
+        # Per chiave: la prima lettura di ogni valore distinto oltre al primo è in conflitto, le altre ripetono
+        conflicting = "CASE WHEN v > 1 THEN v - 1 ELSE 0 END"
+        totals = self._query(f"SELECT SUM(n - 1 - {conflicting}) AS same, SUM({conflicting}) AS conflicting "
+                             f"FROM ({groups}) AS g").iloc[0]
+        result = []
+        for name, where in (('same', f"n - 1 > {conflicting}"), ('conflicting', 'v > 1')):
+            examples = self._query(f"SELECT {keys} FROM ({groups}) AS g WHERE {where} ORDER BY {keys} LIMIT ?",
+                                   [int(n_examples)])
+            rows = 0 if pd.isna(totals[name]) else int(totals[name])
+            result.append((rows, list(examples.itertuples(index=False, name=None))))
+        return tuple(result)
+
+    def quality_summary(self, filters):
+        """Campioni distinti, risultato medio e numero di test per i filtri indicati."""
+        where, params = self._quality_where(filters)
+        sql = (f"SELECT COUNT(DISTINCT {_quote(QUALITY_COLUMNS['sample_id'])}) AS samples, "
+               f"AVG({_quote(QUALITY_COLUMNS['result'])}) AS avg_result, COUNT(*) AS tests "
+               f"FROM {_quote(QUALITY_TABLE)}{where}")
+        row = self._query(sql, params).iloc[0]
+        return {
+            'samples': int(row['samples']),
+            'avg_result': None if pd.isna(row['avg_result']) else float(row['avg_result']),
+            'tests': int(row['tests']),
+        }
+
+    # --- Osmosi ---
+
+    def _osmosi_where(self, filters):
+        clauses, params = [], []
+        for key, column in (('years', 'anno'), ('months', 'mese'), ('lavaggio', 'lavaggio')):
+            if filters.get(key):
+                clauses.append(f"{_quote(OSMOSI_COLUMNS[column])} IN ({_placeholders(filters[key])})")
+                params.extend(filters[key])
+        if filters.get('mc_range') is not None:
+            clauses.append(f"{_quote(OSMOSI_COLUMNS['totale_mc'])} BETWEEN ? AND ?")
+            params.extend(filters['mc_range'])
+        return (' WHERE ' + ' AND '.join(clauses)) if clauses else '', params
+
+    def osmosi_options(self):
+        """Anni, mesi, valori di lavaggio e intervallo di Totale MC presenti nell'archivio."""
+        total = _quote(OSMOSI_COLUMNS['totale_mc'])
+        options = self._query(f"SELECT MIN({total}) AS min_mc, MAX({total}) AS max_mc FROM {_quote(OSMOSI_TABLE)}").iloc[0].to_dict()
+        options['years'] = sorted(self._distinct(OSMOSI_TABLE, OSMOSI_COLUMNS['anno']))
+        options['months'] = self._distinct(OSMOSI_TABLE, OSMOSI_COLUMNS['mese'])
+        options['lavaggio'] = self._distinct(OSMOSI_TABLE, OSMOSI_COLUMNS['lavaggio'])
+        return options
+
+    def osmosi_rows(self, filters):
+        where, params = self._osmosi_where(filters)
+        return self._query(f"SELECT * FROM {_quote(OSMOSI_TABLE)}{where}", params)
+
+    def osmosi_totals(self, filters, metric, by):
+        """Somma di `metric` raggruppata per le colonne `by` (es. Anno e Mese)."""
+        where, params = self._osmosi_where(filters)
+        group = ', '.join(_quote(c) for c in by)
+        sql = (f"SELECT {group}, SUM({_quote(metric)}) AS {_quote(metric)} "
+               f"FROM {_quote(OSMOSI_TABLE)}{where} GROUP BY {group}")
+        return self._query(sql, params)
+
+    def osmosi_summary(self, filters):
+        """Totale e media di Totale MC e numero di lavaggi per i filtri indicati."""
+        where, params = self._osmosi_where(filters)
+        total, wash = _quote(OSMOSI_COLUMNS['totale_mc']), _quote(OSMOSI_COLUMNS['lavaggio'])
+        sql = (f"SELECT SUM({total}) AS total_mc, AVG({total}) AS mean_mc, SUM({wash}) AS washes, "
+               f"COUNT(*) AS n_rows FROM {_quote(OSMOSI_TABLE)}{where}")
+        return self._query(sql, params).iloc[0].to_dict()
+
+
+def open_store(path=None):
+    """Restituisce l'archivio configurato in AVS_STORE_PATH, oppure None se non è attivo."""
+    path = path or os.environ.get(STORE_PATH_ENV)
+    return DataStore(path) if path else None
@@ -0,0 +1,135 @@
+"""
+Costruzione in parallelo delle parti indipendenti di una pagina.
+
+Metriche, figure, esportazioni e tabelle di una pagina dipendono tutte dai dati
+filtrati ma non l'una dall'altra. Qui ognuna diventa un compito di un
+TaskGraph, con le sue dipendenze esplicite: ogni compito parte non appena sono
+pronti quelli da cui dipende, su un pool di thread condiviso dal processo.
+Groupby, operazioni NumPy, scrittura XLSX e serializzazione JSON rilasciano il
+GIL in buona parte, quindi la pagina è pronta quando termina il compito più
+lento, invece che dopo la somma di tutti.
+
+Si usano thread e non processi: i compiti condividono i DataFrame già
+filtrati e restituiscono figure Plotly, che con un pool di processi andrebbero
+copiate avanti e indietro.
+"""
+import contextvars
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from core.profiling import run_profiled
+
+TASK_WORKERS_ENV = 'AVS_TASK_WORKERS'
+# Thread del pool condiviso (AVS_TASK_WORKERS): i compiti di più richieste si dividono gli stessi thread
+TASK_WORKERS = min(8, os.cpu_count() or 1)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_task_pool():
+    """Pool di thread condiviso dal processo, creato al primo uso."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            workers = int(os.environ.get(TASK_WORKERS_ENV) or TASK_WORKERS)
+            _pool = ThreadPoolExecutor(max_workers=max(workers, 1), thread_name_prefix='avs-task')
+        return _pool
+
+
+def _reset_pool():
+    # I thread del pool non sopravvivono a un fork (es. il master di gunicorn che
+    # pre-calcola le viste prima di avviare i worker): il figlio ne crea uno nuovo
+    global _pool, _pool_lock
+    _pool = None
+    _pool_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_pool)
+
+
+class TaskGraph:
+    """
+    Compiti con dipendenze, eseguiti in parallelo.
+
+    Ogni compito riceve prima i risultati dei compiti da cui dipende, nell'ordine
+    di `deps`, poi gli altri argomenti passati ad add():
+
+        graph = TaskGraph()
+        graph.add('totals', yearly_totals, df)
+        graph.add('figure', yearly_figure, metric, deps=['totals'])  # yearly_figure(totals, metric)
+
+    Se un compito fallisce, result() solleva la sua eccezione sia per lui che
+    per i compiti che ne dipendono. I compiti non devono attendere altri
+    TaskGraph: con il pool pieno l'attesa non finirebbe.
+    """
+
+    def __init__(self, executor=None):
+        self._executor = executor
+        self._tasks = {}
+        self._futures = {}
+        self._lock = threading.Lock()
+        self._started = False
+        self._submitted = set()
+
+    def add(self, name, fn, *args, deps=(), **kwargs):
+        """Aggiunge un compito; le dipendenze devono essere già state aggiunte."""
+        if self._started:
+            raise RuntimeError("Impossibile aggiungere compiti a un TaskGraph già avviato")
+        if name in self._tasks:
+            raise ValueError(f"Compito già presente: {name}")
+        missing = [dep for dep in deps if dep not in self._tasks]
+        if missing:
+            raise ValueError(f"Dipendenze sconosciute per '{name}': {', '.join(missing)}")
+        # Il contesto (es. quello della richiesta Dash) segue il compito nel thread del pool
+        self._tasks[name] = (fn, args, kwargs, tuple(deps), contextvars.copy_context())
+        self._futures[name] = Future()
+        return name
+
+    def start(self):
+        """Avvia i compiti senza dipendenze; gli altri partono appena sono pronti i loro."""
+        with self._lock:
+            if self._started:
+                return self
+            self._started = True
+        executor = self._executor or get_task_pool()
+        self._executor = executor
+        for name, (_, _, _, deps, _) in self._tasks.items():
+            if not deps:
+                self._submit(name)
+        return self
+
+    def result(self, name, timeout=None):
+        """Risultato di un compito, atteso se necessario (avvia il grafo se non è già partito)."""
+        self.start()
+        return self._futures[name].result(timeout)
+
+    def results(self, timeout=None):
+        """Risultati di tutti i compiti, per nome."""
+        self.start()
+        return {name: future.result(timeout) for name, future in self._futures.items()}
+
+    def _submit(self, name):
+        with self._lock:
+            # Ogni compito viene avviato una volta sola, anche se più dipendenze terminano insieme
+            if name in self._submitted:
+                return
+            self._submitted.add(name)
+        self._futures[name].set_running_or_notify_cancel()
+        self._executor.submit(self._run, name)
+
+    def _run(self, name):
+        fn, args, kwargs, deps, context = self._tasks[name]
+        future = self._futures[name]
+        try:
+            values = [self._futures[dep].result() for dep in deps]
+            # Se la richiesta che ha aggiunto il compito è profilata, il compito entra nel suo profilo
+            future.set_result(context.run(run_profiled, fn, *values, *args, **kwargs))
+        except BaseException as exc:
+            future.set_exception(exc)
+        # Avvia i compiti che aspettavano solo questo
+        for other, (_, _, _, other_deps, _) in self._tasks.items():
+            if name in other_deps and all(self._futures[dep].done() for dep in other_deps):
+                self._submit(other)
@@ -0,0 +1,129 @@
+"""
+Serializzazione compatta delle figure Plotly inviate al browser.
+
+Plotly codifica già gli array NumPy numerici come array tipizzati in base64,
+ma date e `customdata` misti (testo, numeri, date) viaggiano come liste JSON,
+un valore alla volta. Qui le date diventano millisecondi in float64 (l'asse
+resta di tipo data) e le colonne di `customdata` costanti in una traccia
+vengono scritte direttamente nell'hovertemplate: quello che resta è spesso
+solo numerico e viaggia anch'esso in base64.
+"""
+import re
+
+import numpy as np
+import pandas as pd
+import plotly.io as pio
+
+try:
+    import orjson
+except ImportError:  # orjson è opzionale: si usa il modulo json della libreria standard
+    orjson = None
+
+_CUSTOMDATA_REF = re.compile(r'%\{customdata\[(\d+)\]([^}]*)\}')
+# Etichette dei tooltip di plotly.express: 'Colonna=%{customdata[i]}'
+_CUSTOMDATA_LABEL = re.compile(r'(?:^|<br>)([^<>=]+)=%\{customdata\[(\d+)\]')
+
+
+def use_fast_json():
+    """Serializza le figure con orjson (usato anche da Dash e Streamlit), se installato."""
+    if orjson is not None:
+        pio.json.config.default_engine = 'orjson'
+
+
+def epoch_ms(values):
+    """Date naive -> millisecondi dall'epoca in float64 (NaT -> NaN)."""
+    ms = values.astype('datetime64[ms]')
+    out = ms.astype('int64').astype('float64')
+    out[np.isnat(ms)] = np.nan
+    return out
+
+
+def _date_strings(values):
+    """Date come testo già pronto: solo il giorno se sono tutte a mezzanotte."""
+    dates = pd.to_datetime(pd.Series(values))
+    fmt = '%Y-%m-%d' if (dates == dates.dt.normalize()).all() else '%Y-%m-%d %H:%M:%S'
+    return dates.dt.strftime(fmt).astype(object).to_numpy()
+
+
+def _axis_name(anchor, prefix):
+    # 'x' -> 'xaxis', 'x2' -> 'xaxis2'
+    return prefix + 'axis' + (anchor or prefix)[1:]
+
+
+def _compact_customdata(trace, extendable=False):
+    """Sposta nell'hovertemplate le colonne testuali costanti e converte il resto in float64 se possibile."""
+    customdata = getattr(trace, 'customdata', None)
+    template = getattr(trace, 'hovertemplate', None)
+    if not isinstance(customdata, np.ndarray) or customdata.ndim != 2 or not len(customdata) or not template:
+        return
+
+    literals, kept, columns = {}, [], []
+    for j in range(customdata.shape[1]):
+        column = pd.Series(customdata[:, j])
+        first = column.iloc[0]
+        if not extendable and isinstance(first, str) and (column == first).all():
+            literals[j] = first
+            continue
+        kept.append(j)
+        # Date come testo già pronto: più corte e senza conversione valore per valore
+        columns.append(_date_strings(column) if isinstance(first, pd.Timestamp) else column.to_numpy())
+    new_index = {j: i for i, j in enumerate(kept)}
+
+    def rewrite(match):
+        j = int(match.group(1))
+        if j in literals:
+            return literals[j]
+        return f'%{{customdata[{new_index[j]}]{match.group(2)}}}'
+
+    remaining = np.column_stack(columns) if columns else None
+    if remaining is not None and not extendable:
+        try:
+            remaining = remaining.astype('float64')
+        except (TypeError, ValueError):
+            pass  # colonne miste: restano una lista JSON
+    trace.hovertemplate = _CUSTOMDATA_REF.sub(rewrite, template)
+    trace.customdata = remaining
+
+
+def compact_figure(fig, extendable=False):
+    """
+    Riduce la dimensione JSON di una figura senza cambiarne il contenuto.
+
+    Modifica la figura e la restituisce: va usata su figure appena costruite,
+    prima di metterle in cache, mai su figure condivise. Le tracce con `customdata` non
+    NumPy (es. il drill-down dei grafici aggregati) non vengono toccate.
+    Con `extendable=True` tutte le colonne del tooltip restano in `customdata`
+    come lista, così la traccia può essere estesa con punti nuovi (extendData).
+    """
+    date_axes = set()
+    for trace in fig.data:
+        for attr in ('x', 'y'):
+            values = getattr(trace, attr, None) if attr in trace else None
+            if isinstance(values, np.ndarray) and np.issubdtype(values.dtype, np.datetime64):
+                trace[attr] = epoch_ms(values)
+                date_axes.add(_axis_name(getattr(trace, attr + 'axis', None), attr))
+        if 'customdata' in trace:
+            _compact_customdata(trace, extendable)
+
+    for axis in date_axes:
+        fig.layout[axis].type = 'date'
+    return fig
+
+
+def hover_columns(trace):
+    """Colonne del tooltip di una traccia plotly.express, nell'ordine di `customdata`."""
+    template = trace['hovertemplate'] if 'hovertemplate' in trace else None
+    labels = {int(j): label for label, j in _CUSTOMDATA_LABEL.findall(template or '')}
+    return [labels[j] for j in sorted(labels)]
+
+
+def hover_rows(df, columns):
+    """Righe di `customdata` per punti nuovi, nello stesso formato di compact_figure."""
+    values = []
+    for column in columns:
+        series = df[column]
+        if pd.api.types.is_datetime64_any_dtype(series):
+            values.append(_date_strings(series))
+        else:
+            values.append(series.to_numpy(dtype=object))
+    return np.column_stack(values).tolist() if values else None
@@ -0,0 +1,289 @@
+"""
+Controllo di qualità dei dati al caricamento.
+
+Le righe con problemi non vengono più scartate in silenzio né fanno fallire i
+grafici al momento della richiesta: la lettura (core/ingestion.py) le conta
+mentre già converte ogni blocco, poi i controlli sulle righe girano una volta
+sola, vettorizzati, sul DataFrame unito. L'esito è un ValidationReport che
+viaggia insieme al dataset e finisce nelle stesse cache, così un file grande
+viene controllato una volta per versione e le pagine si limitano a mostrarlo.
+
+Controlli:
+- colonne obbligatorie assenti (SchemaError: senza di loro la dashboard non parte)
+  e colonne facoltative assenti (es. 'ABS' per la matrice di correlazione);
+- date non valide, righe scartate;
+- valori non numerici nelle colonne numeriche, convertiti in valori vuoti;
+- letture duplicate (stessa chiave, anche con risultati diversi);
+- risultati negativi o fuori dall'intervallo possibile del test;
+- Osmosi: contatore che torna indietro, totali incoerenti con le letture,
+  periodi che finiscono prima di iniziare o ripetuti.
+"""
+import numpy as np
+import pandas as pd
+
+from core.schema import (OSMOSI_COLUMNS, OSMOSI_DEDUP_KEYS, OSMOSI_METER_TOLERANCE, QUALITY_COLUMNS,
+                         QUALITY_DEDUP_KEYS, QUALITY_PLAUSIBLE_RANGES)
+
+SEVERITY_WARNING = 'Avviso'
+SEVERITY_INFO = 'Info'
+
+# Esempi conservati per ogni problema
+MAX_EXAMPLES = 5
+
+ISSUE_COLUMNS = ('Gravità', 'Controllo', 'Colonna', 'Righe', 'Dettaglio', 'Esempi')
+
+
+class SchemaError(ValueError):
+    """Mancano colonne indispensabili alla dashboard."""
+
+
+class ValidationReport:
+    """
+    Esito dei controlli su un dataset: righe lette, righe tenute e problemi
+    trovati. Contiene solo dati semplici, così si può mettere in cache
+    (st.cache_data) o passare tra processi.
+    """
+
+    def __init__(self, source=None):
+        self.source = source
+        self.rows_read = 0
+        self.rows_kept = 0
+        self.issues = []
+
+    def add(self, check, message, rows, column=None, examples=(), severity=SEVERITY_WARNING):
+        """
+        Registra un problema che riguarda `rows` righe (ignorato se non ne
+        riguarda nessuna). Lo stesso problema trovato di nuovo (es. in un altro
+        blocco dello stesso file) somma le righe a quello già registrato.
+        """
+        self._record(check, message, rows, column, examples, severity, self.source)
+
+    def _record(self, check, message, rows, column, examples, severity, source):
+        rows = int(rows)
+        if rows <= 0:
+            return
+        key = (check, message, column, severity, source)
+        for issue in self.issues:
+            if (issue['check'], issue['message'], issue['column'], issue['severity'], issue['source']) == key:
+                issue['rows'] += rows
+                room = MAX_EXAMPLES - len(issue['examples'])
+                issue['examples'] += [str(value) for value in list(examples)[:max(room, 0)]]
+                return
+        self.issues.append({
+            'severity': severity,
+            'check': check,
+            'column': column,
+            'rows': rows,
+            'message': message,
+            'source': source,
+            'examples': [str(value) for value in list(examples)[:MAX_EXAMPLES]],
+        })
+
+    def merge(self, other):
+        """
+        Aggiunge i conteggi e i problemi di un altro report (es. un file di più,
+        o un blocco dello stesso file): lo stesso problema somma le righe.
+        """
+        self.rows_read += other.rows_read
+        self.rows_kept += other.rows_kept
+        for issue in other.issues:
+            self._record(issue['check'], issue['message'], issue['rows'], issue['column'], issue['examples'],
+                         issue['severity'], issue['source'])
+        return self
+
+    @property
+    def warnings(self):
+        return [issue for issue in self.issues if issue['severity'] == SEVERITY_WARNING]
+
+    def summary(self):
+        """Riepilogo in una riga, es. per il titolo della sezione o il log."""
+        dropped = self.rows_read - self.rows_kept
+        text = f"{self.rows_read:,} righe lette, {self.rows_kept:,} caricate"
+        if dropped > 0:
+            text += f" ({dropped:,} scartate)"
+        warnings = len(self.warnings)
+        if warnings:
+            text += f", {warnings} {'avviso' if warnings == 1 else 'avvisi'}"
+        elif not self.issues:
+            text += ", nessun problema"
+        return text
+
+    def to_frame(self):
+        """Problemi come tabella, per la visualizzazione nelle pagine."""
+        records = [(issue['severity'], issue['check'], issue['column'] or '', issue['rows'],
+                    issue['message'] + (f" ({issue['source']})" if issue['source'] else ''),
+                    ', '.join(issue['examples']))
+                   for issue in self.issues]
+        return pd.DataFrame.from_records(records, columns=list(ISSUE_COLUMNS))
+
+
+def validation_section(report):
+    """Esito dei controlli in una pagina Streamlit: riepilogo in una riga che si apre sulla tabella dei problemi."""
+    if report is None or not report.issues:
+        return
+    # Streamlit serve solo alle pagine: la dashboard Dash mostra il report con i suoi componenti
+    import streamlit as st
+    icon = "⚠️" if report.warnings else "ℹ️"
+    with st.expander(f"{icon} Controllo dei Dati: {report.summary()}", expanded=False):
+        st.dataframe(report.to_frame(), hide_index=True)
+
+
+def check_columns(columns, required):
+    """Solleva SchemaError se nell'intestazione `columns` manca una colonna di `required`."""
+    missing = [col for col in required if col not in set(columns)]
+    if missing:
+        raise SchemaError(f"Colonne obbligatorie mancanti: {', '.join(missing)}")
+
+
+def coerce_numeric(df, columns, report=None):
+    """
+    Converte in numeri le colonne di `columns` lette come testo o miste (es. da
+    Excel), accettando la virgola decimale. I valori non convertibili
+    diventano vuoti e vengono contati nel report; le colonne già numeriche
+    non vengono toccate. Le colonne di soli interi restano intere.
+    """
+    for col in columns:
+        if col not in df.columns or pd.api.types.is_numeric_dtype(df[col]):
+            continue
+        text = df[col].astype('string').str.strip()
+        values = pd.to_numeric(text.str.replace(r'^(-?\d+),(\d+)$', r'\1.\2', regex=True), errors='coerce')
+        bad = values.isna() & text.notna() & (text != '')
+        if report is not None and bad.any():
+            report.add('Valore non numerico', 'Valori non numerici sostituiti da valori vuoti', bad.sum(),
+                       column=col, examples=text[bad].unique())
+        values = values.astype('float64')
+        if values.notna().all() and np.array_equal(values, np.floor(values)):
+            values = values.astype('int64')
+        df[col] = values
+    return df
+
+
+def count_invalid_dates(original, parsed, column, report=None, dropped=True):
+    """Conta nel report le date vuote o non riconosciute; restituisce la maschera delle date valide."""
+    valid = parsed.notna()
+    if report is not None and not valid.all():
+        invalid = original[~valid.to_numpy()]
+        outcome = 'scartate' if dropped else 'tenute senza data'
+        report.add('Data non valida', f'Righe con data vuota o non riconosciuta, {outcome}', len(invalid),
+                   column=column, examples=invalid.dropna().astype(str).unique())
+    return valid
+
+
+def _duplicates(df, keys, value, report, label):
+    """Righe che ripetono una chiave già vista, e quante di queste con un valore diverso."""
+    keys = [key for key in keys if key in df.columns]
+    if not keys or df.empty:
+        return
+    key_hash = pd.util.hash_pandas_object(df[keys], index=False)
+    repeated = key_hash.duplicated(keep='first').to_numpy()
+    if not repeated.any():
+        return
+    if value in df.columns:
+        full_hash = pd.util.hash_pandas_object(df[keys + [value]], index=False)
+        conflicting = repeated & ~full_hash.duplicated(keep='first').to_numpy()
+    else:
+        conflicting = np.zeros(len(df), dtype=bool)
+
+    def counted(mask):
+        return mask.sum(), df.loc[mask, keys].drop_duplicates().head(MAX_EXAMPLES).itertuples(index=False)
+
+    add_duplicates(report, keys, counted(repeated & ~conflicting), counted(conflicting), value, label)
+
+
+def add_duplicates(report, keys, same, conflicting, value=QUALITY_COLUMNS['result'], label='Letture ripetute'):
+    """
+    Registra righe ripetute contate altrove (es. nell'archivio, con
+    DataStore.quality_duplicates). `same` e `conflicting` sono coppie (righe,
+    chiavi di esempio) per le ripetizioni con lo stesso `value` e con uno diverso.
+    """
+    for (rows, examples), message in ((same, f"{label} con lo stesso valore"),
+                                      (conflicting, f"{label} con {value} diverso")):
+        report.add('Duplicato', message, rows, column=', '.join(keys),
+                   examples=[' / '.join(map(str, row)) for row in examples])
+
+
+def validate_quality(df, report, duplicates=True):
+    """
+    Controlli sulle letture di Controllo Qualità già convertite, in un'unica
+    passata vettorizzata: duplicati e risultati impossibili (negativi, o fuori
+    dall'intervallo di QUALITY_PLAUSIBLE_RANGES per il test). Con
+    duplicates=False le letture ripetute non vengono cercate, es. per un blocco
+    di un file più grande i cui duplicati si contano alla fine.
+    """
+    report.rows_kept = len(df)
+    if QUALITY_COLUMNS['abs'] not in df.columns:
+        report.add('Colonna assente', 'Matrice di correlazione non disponibile', len(df),
+                   column=QUALITY_COLUMNS['abs'], severity=SEVERITY_INFO)
+    if duplicates:
+        _duplicates(df, list(QUALITY_DEDUP_KEYS), QUALITY_COLUMNS['result'], report, 'Letture ripetute')
+
+    result_col, test_col = QUALITY_COLUMNS['result'], QUALITY_COLUMNS['test_name']
+    if result_col not in df.columns or not pd.api.types.is_numeric_dtype(df[result_col]):
+        return report
+    result = df[result_col].to_numpy(dtype='float64', na_value=np.nan)
+    if test_col in df.columns:
+        tests = df[test_col]
+        lower = tests.map({test: low for test, (low, _) in QUALITY_PLAUSIBLE_RANGES.items()}).to_numpy(dtype='float64', na_value=np.nan)
+        upper = tests.map({test: high for test, (_, high) in QUALITY_PLAUSIBLE_RANGES.items()}).to_numpy(dtype='float64', na_value=np.nan)
+    else:
+        tests = pd.Series('', index=df.index)
+        lower = upper = np.full(len(df), np.nan)
+    ranged = ~np.isnan(lower) | ~np.isnan(upper)
+
+    with np.errstate(invalid='ignore'):
+        negative = ~ranged & (result < 0)
+        outside = ranged & ((result < np.nan_to_num(lower, nan=-np.inf)) | (result > np.nan_to_num(upper, nan=np.inf)))
+    for mask, message in ((negative, 'Risultati negativi'),
+                          (outside, "Risultati fuori dall'intervallo possibile del test")):
+        if mask.any():
+            examples = [f"{test}: {value:g}" for test, value in zip(tests[mask].head(MAX_EXAMPLES), result[mask])]
+            report.add('Valore impossibile', message, mask.sum(), column=result_col, examples=examples)
+
+    missing = np.isnan(result)
+    report.add('Valore mancante', 'Letture senza risultato', missing.sum(), column=result_col,
+               severity=SEVERITY_INFO)
+    return report
+
+
+def validate_osmosi(df, report):
+    """
+    Controlli sul report Osmosi: periodi ripetuti o che finiscono prima di
+    iniziare, totali negativi o diversi da 'MC Fine' - 'MC Inizio', e letture
+    del contatore che tornano indietro rispetto al periodo precedente.
+    """
+    report.rows_kept = len(df)
+    columns = OSMOSI_COLUMNS
+    _duplicates(df, list(OSMOSI_DEDUP_KEYS), columns['totale_mc'], report, 'Periodi ripetuti')
+    if df.empty:
+        return report
+
+    start, end = df[columns['data_inizio']], df[columns['data_fine']]
+    backwards = (end < start).to_numpy()
+    if backwards.any():
+        report.add('Periodo non valido', "'Data Fine' precedente a 'Data Inizio'", backwards.sum(),
+                   column=columns['data_fine'], examples=start[backwards].dt.date.unique())
+
+    total = pd.to_numeric(df[columns['totale_mc']], errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+    with np.errstate(invalid='ignore'):
+        negative = total < 0
+    report.add('Valore impossibile', 'Totale MC negativo', negative.sum(), column=columns['totale_mc'],
+               examples=start[negative].dt.date.unique())
+
+    if columns['mc_inizio'] not in df.columns or columns['mc_fine'] not in df.columns:
+        return report
+    ordered = df.sort_values(columns['data_inizio'], kind='stable')
+    first = pd.to_numeric(ordered[columns['mc_inizio']], errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+    last = pd.to_numeric(ordered[columns['mc_fine']], errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+    dates = ordered[columns['data_inizio']].dt.date.to_numpy()
+    ordered_total = pd.to_numeric(ordered[columns['totale_mc']], errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+    previous_last = np.concatenate(([np.nan], last[:-1]))
+    with np.errstate(invalid='ignore'):
+        checks = (
+            (last < first, "'MC Fine' minore di 'MC Inizio': il contatore è tornato indietro", columns['mc_fine']),
+            (first < previous_last, "'MC Inizio' minore di 'MC Fine' del periodo precedente", columns['mc_inizio']),
+            (np.abs(ordered_total - (last - first)) > OSMOSI_METER_TOLERANCE,
+             "'Totale MC' diverso da 'MC Fine' - 'MC Inizio'", columns['totale_mc']),
+        )
+    for mask, message, column in checks:
+        report.add('Contatore', message, mask.sum(), column=column, examples=pd.unique(dates[mask]))
+    return report
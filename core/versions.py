@@ -0,0 +1,413 @@
+"""
+Versioni dei dataset caricati, salvate come differenze tra una versione e l'altra.
+
+Ogni caricamento completo di un dataset diventa una versione, identificata da
+un hash del contenuto: le righe vengono hashate una per una (64 bit) e l'ID è
+lo SHA-256 degli hash ordinati, quindi lo stesso contenuto dà sempre la stessa
+versione, anche se le righe arrivano in un altro ordine o da un altro file.
+
+Una versione salva solo le righe aggiunte, rimosse e modificate rispetto alla
+precedente (con i valori di prima e di dopo), in formato colonnare: Parquet se
+pyarrow è installato. Le righe si riconoscono dalla chiave della lettura (es.
+Time, Sample ID, Test Name) e si confrontano con il loro hash, senza
+confrontare colonna per colonna. Ogni VERSION_SNAPSHOT_EVERY versioni, o
+quando le differenze sono quasi tutto il dataset, viene salvata anche una
+copia completa, da cui si ricostruiscono le versioni successive.
+
+Il confronto tra due versioni della stessa storia unisce le differenze
+intermedie, senza ricostruire i due dataset completi.
+"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow  # noqa: F401
+except ImportError:  # pyarrow è opzionale: le versioni si salvano con pickle, non in colonne
+    pyarrow = None
+
+VERSIONS_PATH_ENV = 'AVS_VERSIONS_PATH'
+
+logger = logging.getLogger(__name__)
+
+# Versioni conservate per dataset; oltre si rimuovono le più vecchie
+VERSIONS_KEEP = 30
+# Una copia completa ogni tante versioni, così una versione si ricostruisce da poche differenze
+VERSION_SNAPSHOT_EVERY = 10
+# Oltre questa frazione di righe cambiate si salva anche la copia completa
+VERSION_SNAPSHOT_RATIO = 0.5
+
+# Tipi di riga nelle differenze: 'previous' è il valore di prima di una riga 'changed'
+ADDED, REMOVED, CHANGED, PREVIOUS = 'added', 'removed', 'changed', 'previous'
+_BEFORE = (REMOVED, PREVIOUS)
+_AFTER = (ADDED, CHANGED)
+
+# Colonne interne: chiave e contenuto della riga, tipo di modifica
+KEY, ROW, OP = '_key', '_row', '_op'
+
+CHANGE_COLUMN = 'Modifica'
+CHANGE_LABELS = {ADDED: 'Aggiunta', REMOVED: 'Rimossa', CHANGED: 'Modificata'}
+BEFORE_SUFFIX = ' (prima)'
+
+
+def _data_columns(df):
+    return [col for col in df.columns if col not in (KEY, ROW, OP)]
+
+
+def hash_rows(df, keys):
+    """
+    Aggiunge a una copia di `df` la chiave (KEY) e l'hash del contenuto (ROW)
+    di ogni riga. Più righe con la stessa chiave restano distinte: la n-esima
+    occorrenza ha una chiave sua.
+    """
+    rows = pd.util.hash_pandas_object(df[_data_columns(df)], index=False).to_numpy()
+    keys = [key for key in keys if key in df.columns]
+    key_hash = pd.util.hash_pandas_object(df[keys], index=False).to_numpy() if keys else rows.copy()
+    occurrence = pd.Series(key_hash).groupby(key_hash).cumcount().to_numpy()
+    if occurrence.any():
+        repeated = pd.util.hash_pandas_object(pd.DataFrame({'key': key_hash, 'n': occurrence}), index=False).to_numpy()
+        key_hash = np.where(occurrence > 0, repeated, key_hash)
+    return df.assign(**{KEY: key_hash, ROW: rows})
+
+
+def content_id(hashed):
+    """ID della versione: SHA-256 delle colonne e degli hash delle righe, in ordine."""
+    digest = hashlib.sha256(json.dumps(_data_columns(hashed)).encode('utf-8'))
+    digest.update(np.sort(hashed[ROW].to_numpy()).tobytes())
+    return digest.hexdigest()[:16]
+
+
+def diff_rows(old, new):
+    """Differenze riga per riga tra due dataset con KEY e ROW (vedi hash_rows), come righe con OP."""
+    old_keys, new_keys = old[KEY].to_numpy(), new[KEY].to_numpy()
+    in_old = np.isin(new_keys, old_keys)
+    in_new = np.isin(old_keys, new_keys)
+    common = new[in_old]
+    old_rows = pd.Series(old[ROW].to_numpy(), index=old_keys)
+    changed = common[old_rows.reindex(common[KEY].to_numpy()).to_numpy() != common[ROW].to_numpy()]
+    previous = old[np.isin(old_keys, changed[KEY].to_numpy())]
+    return _delta_frame(added=new[~in_old], removed=old[~in_new], changed=changed, previous=previous)
+
+
+def _delta_frame(added, removed, changed, previous):
+    parts = [frame.assign(**{OP: op}) for op, frame in
+             ((ADDED, added), (REMOVED, removed), (PREVIOUS, previous), (CHANGED, changed))]
+    return pd.concat(parts, ignore_index=True)
+
+
+def compose_deltas(deltas):
+    """
+    Differenze nette di una sequenza di differenze consecutive: per ogni chiave
+    conta solo il valore prima della prima e quello dopo l'ultima.
+    """
+    if len(deltas) == 1:
+        return deltas[0]
+    steps = pd.concat([delta.assign(_step=step) for step, delta in enumerate(deltas)], ignore_index=True)
+    # Nello stesso passo il valore di prima viene prima di quello di dopo
+    steps['_after'] = steps[OP].isin(_AFTER)
+    steps = steps.sort_values(['_step', '_after'], kind='stable')
+    first = steps.drop_duplicates(KEY, keep='first')
+    last = steps.drop_duplicates(KEY, keep='last')
+    before = first[~first['_after']].drop(columns=['_step', '_after', OP])
+    after = last[last['_after']].drop(columns=['_step', '_after', OP])
+    # Una riga aggiunta e poi rimossa non ha né un valore di prima né uno di dopo: non cambia
+    in_after = np.isin(before[KEY].to_numpy(), after[KEY].to_numpy())
+    in_before = np.isin(after[KEY].to_numpy(), before[KEY].to_numpy())
+    both = diff_rows(before[in_after], after[in_before])
+    return _delta_frame(added=after[~in_before], removed=before[~in_after],
+                        changed=both[both[OP] == CHANGED].drop(columns=OP),
+                        previous=both[both[OP] == PREVIOUS].drop(columns=OP))
+
+
+def reverse_delta(delta):
+    """Le stesse differenze lette dalla versione nuova a quella vecchia."""
+    swap = {ADDED: REMOVED, REMOVED: ADDED, CHANGED: PREVIOUS, PREVIOUS: CHANGED}
+    return delta.assign(**{OP: delta[OP].map(swap)})
+
+
+def apply_delta(df, delta):
+    """Applica le differenze a un dataset con KEY e ROW."""
+    gone = delta.loc[delta[OP].isin(_BEFORE), KEY].to_numpy()
+    kept = df[~np.isin(df[KEY].to_numpy(), gone)]
+    arrived = delta[delta[OP].isin(_AFTER)].drop(columns=OP)
+    return pd.concat([kept, arrived], ignore_index=True) if len(arrived) else kept.reset_index(drop=True)
+
+
+def change_counts(delta):
+    """Righe aggiunte, rimosse e modificate."""
+    counts = delta[OP].value_counts()
+    return {op: int(counts.get(op, 0)) for op in (ADDED, REMOVED, CHANGED)}
+
+
+def changes_frame(delta, keys=()):
+    """
+    Tabella delle differenze per le pagine: una riga per lettura aggiunta,
+    rimossa o modificata; per le modificate anche i valori di prima delle
+    colonne che cambiano ('<colonna> (prima)').
+    """
+    columns = _data_columns(delta)
+    shown = delta[delta[OP] != PREVIOUS]
+    table = shown[columns].copy()
+    table.insert(0, CHANGE_COLUMN, shown[OP].map(CHANGE_LABELS).to_numpy())
+
+    changed = shown[shown[OP] == CHANGED]
+    if len(changed):
+        previous = delta[delta[OP] == PREVIOUS].set_index(KEY).reindex(changed[KEY].to_numpy())
+        for col in columns:
+            before, after = previous[col].to_numpy(), changed[col].to_numpy()
+            differs = ~((before == after) | (pd.isna(before) & pd.isna(after)))
+            if differs.any():
+                values = pd.Series(pd.NA, index=table.index, dtype=object)
+                values[(shown[OP] == CHANGED).to_numpy()] = before
+                table.insert(table.columns.get_loc(col), col + BEFORE_SUFFIX, values)
+
+    order = [CHANGE_COLUMN] + [key for key in keys if key in table.columns]
+    return table.sort_values(order, kind='stable').reset_index(drop=True)
+
+
+class VersionStore:
+    """
+    Versioni di un dataset, salvate come `<cartella>/<nome>/<id>.json` (metadati),
+    `<id>.delta.<formato>` (differenze dalla versione precedente) e, per alcune,
+    `<id>.snapshot.<formato>` (copia completa).
+    """
+
+    def __init__(self, name, keys, root=None, keep=VERSIONS_KEEP):
+        root = str(root or os.environ.get(VERSIONS_PATH_ENV) or os.path.join(tempfile.gettempdir(), 'avs_versions'))
+        self.name = name
+        self.keys = tuple(keys)
+        self.root = os.path.join(root, name)
+        self.keep = keep
+        self.format = 'parquet' if pyarrow is not None else 'pickle'
+        self._lock = threading.Lock()
+        # Ultima versione letta o scritta, con KEY e ROW: la base della prossima differenza
+        self._cached = None
+        os.makedirs(self.root, exist_ok=True)
+
+    # --- File ---
+
+    def _path(self, version_id, kind, fmt=None):
+        return os.path.join(self.root, f'{version_id}.{kind}.{fmt or self.format}')
+
+    def _write_frame(self, df, version_id, kind):
+        path = self._path(version_id, kind)
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, prefix='.avs_version')
+        os.close(fd)
+        if self.format == 'parquet':
+            # Colonne miste (es. numeri e testo da Excel) salvate come testo: Parquet vuole un tipo per colonna
+            mixed = [col for col in df.columns if df[col].dtype == object]
+            df.astype({col: 'string' for col in mixed}).to_parquet(tmp_path, index=False)
+        else:
+            df.to_pickle(tmp_path)
+        os.replace(tmp_path, path)
+
+    def _read_frame(self, meta, kind):
+        path = self._path(meta['id'], kind, meta['format'])
+        if meta['format'] == 'parquet':
+            return pd.read_parquet(path)
+        return pd.read_pickle(path)
+
+    def _write_meta(self, meta):
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, prefix='.avs_version')
+        with os.fdopen(fd, 'w', encoding='utf-8') as handle:
+            json.dump(meta, handle)
+        os.replace(tmp_path, os.path.join(self.root, f"{meta['id']}.json"))
+
+    # --- Elenco ---
+
+    def versions(self):
+        """Metadati delle versioni, dalla più vecchia."""
+        entries = []
+        for name in os.listdir(self.root):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.root, name), encoding='utf-8') as handle:
+                    entries.append(json.load(handle))
+            except (OSError, ValueError):
+                continue  # rimossa o scritta a metà da un altro processo
+        return sorted(entries, key=lambda meta: meta['created'])
+
+    def get(self, version_id):
+        """Metadati di una versione, oppure None se non esiste."""
+        return next((meta for meta in self.versions() if meta['id'] == version_id), None)
+
+    def _chain(self, version_id, by_id):
+        """La versione e le sue precedenti, dalla più recente, fino a una copia completa."""
+        chain = []
+        meta = by_id.get(version_id)
+        while meta is not None:
+            chain.append(meta)
+            if meta['snapshot']:
+                return chain
+            meta = by_id.get(meta['parent'])
+        raise LookupError(f"Versione {version_id} di {self.name} non ricostruibile")
+
+    # --- Lettura e scrittura ---
+
+    def _load_hashed(self, version_id, by_id=None):
+        cached = self._cached
+        if cached is not None and cached[0] == version_id:
+            return cached[1]
+        by_id = by_id or {meta['id']: meta for meta in self.versions()}
+        chain = self._chain(version_id, by_id)
+        df = self._read_frame(chain[-1], 'snapshot')
+        for meta in reversed(chain[:-1]):
+            df = apply_delta(df, self._read_frame(meta, 'delta'))
+        self._cached = (version_id, df)
+        return df
+
+    def load(self, version_id):
+        """Ricostruisce una versione, ordinata per chiave."""
+        df = self._load_hashed(version_id)
+        keys = [key for key in self.keys if key in df.columns]
+        df = df.sort_values(keys, kind='stable') if keys else df
+        return df[_data_columns(df)].reset_index(drop=True)
+
+    def record(self, df, label=None):
+        """
+        Registra `df` come nuova versione, successiva all'ultima, e ne
+        restituisce i metadati. Un contenuto già registrato non crea una
+        nuova versione: vengono restituiti i metadati di quella esistente.
+        """
+        hashed = hash_rows(df, self.keys)
+        version_id = content_id(hashed)
+        with self._lock:
+            versions = self.versions()
+            by_id = {meta['id']: meta for meta in versions}
+            if version_id in by_id:
+                return by_id[version_id]
+
+            parent = versions[-1] if versions else None
+            meta = {'id': version_id, 'parent': parent['id'] if parent else None, 'created': time.time(),
+                    'label': label, 'rows': len(df), 'format': self.format, 'snapshot': parent is None,
+                    ADDED: len(df), REMOVED: 0, CHANGED: 0}
+            if parent is not None:
+                try:
+                    delta = diff_rows(self._load_hashed(parent['id'], by_id), hashed)
+                except (LookupError, OSError):
+                    # La versione precedente non è più leggibile: si riparte da una copia completa
+                    meta.update(parent=None, snapshot=True)
+                else:
+                    meta.update(change_counts(delta))
+                    self._write_frame(delta, version_id, 'delta')
+                    depth = len(self._chain(parent['id'], by_id))
+                    meta['snapshot'] = (depth >= VERSION_SNAPSHOT_EVERY
+                                        or len(delta) > VERSION_SNAPSHOT_RATIO * max(len(df), 1))
+            if meta['snapshot']:
+                self._write_frame(hashed, version_id, 'snapshot')
+            # Metadati per ultimi: una versione elencata ha sempre i suoi file
+            self._write_meta(meta)
+            self._cached = (version_id, hashed)
+            self._prune(versions + [meta])
+        return meta
+
+    def _prune(self, versions):
+        """Rimuove le versioni più vecchie oltre `keep`; la prima rimasta diventa una copia completa."""
+        if len(versions) <= self.keep:
+            return
+        by_id = {meta['id']: meta for meta in versions}
+        removed = versions[:len(versions) - self.keep]
+        removed_ids = {meta['id'] for meta in removed}
+        for meta in versions[len(removed):]:
+            if meta['parent'] in removed_ids:
+                if not meta['snapshot']:
+                    self._write_frame(self._load_hashed(meta['id'], by_id), meta['id'], 'snapshot')
+                meta.update(parent=None, snapshot=True)
+                self._write_meta(meta)
+                # Le differenze da una versione rimossa non servono più
+                try:
+                    os.remove(self._path(meta['id'], 'delta', meta['format']))
+                except OSError:
+                    pass
+        for meta in removed:
+            for kind in ('json', f"delta.{meta['format']}", f"snapshot.{meta['format']}"):
+                try:
+                    os.remove(os.path.join(self.root, f"{meta['id']}.{kind}"))
+                except OSError:
+                    pass
+
+    # --- Confronto ---
+
+    def diff(self, old_id, new_id):
+        """
+        Differenze tra due versioni (righe con OP, vedi changes_frame). Tra
+        versioni della stessa storia si uniscono le differenze intermedie;
+        altrimenti si confrontano gli hash delle due versioni ricostruite.
+        """
+        by_id = {meta['id']: meta for meta in self.versions()}
+        if old_id == new_id:
+            return self._load_hashed(new_id, by_id).iloc[:0].assign(**{OP: pd.Series(dtype='str')})
+        path = self._path_between(old_id, new_id, by_id)
+        if path is not None:
+            return compose_deltas([self._read_frame(meta, 'delta') for meta in path])
+        path = self._path_between(new_id, old_id, by_id)
+        if path is not None:
+            return reverse_delta(compose_deltas([self._read_frame(meta, 'delta') for meta in path]))
+        return diff_rows(self._load_hashed(old_id, by_id), self._load_hashed(new_id, by_id))
+
+    def compare(self, old_id, new_id):
+        """Conteggi (aggiunte, rimosse, modificate) e tabella delle differenze tra due versioni."""
+        delta = self.diff(old_id, new_id)
+        return change_counts(delta), changes_frame(delta, self.keys)
+
+    def _path_between(self, old_id, new_id, by_id):
+        """Versioni da dopo `old_id` fino a `new_id`, in ordine, se `old_id` la precede."""
+        path = []
+        meta = by_id.get(new_id)
+        while meta is not None and meta['id'] != old_id:
+            path.append(meta)
+            meta = by_id.get(meta['parent'])
+        return list(reversed(path)) if meta is not None and path else None
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_version_store(name, keys):
+    """VersionStore del dataset `name`, condiviso dal processo e creato al primo uso."""
+    with _stores_lock:
+        if name not in _stores:
+            _stores[name] = VersionStore(name, keys)
+        return _stores[name]
+
+
+def record_version(store, df, label=None):
+    """
+    Come VersionStore.record, ma un errore (es. disco pieno) non interrompe il
+    caricamento dei dati: viene registrato nel log e si restituisce None.
+    """
+    try:
+        return store.record(df, label)
+    except Exception:
+        logger.warning("Impossibile salvare la versione di %s", store.name, exc_info=True)
+        return None
+
+
+def previous_version(versions, version_id):
+    """
+    Versione con cui confrontare `version_id` di default: la precedente, oppure
+    (per la prima versione rimasta) la più recente delle altre.
+    """
+    by_id = {meta['id']: meta for meta in versions}
+    parent = by_id[version_id]['parent'] if version_id in by_id else None
+    if parent in by_id:
+        return parent
+    created = by_id[version_id]['created'] if version_id in by_id else float('inf')
+    older = [meta['id'] for meta in versions if meta['created'] < created]
+    others = [meta['id'] for meta in versions if meta['id'] != version_id]
+    return (older or others or [version_id])[-1]
+
+
+def version_label(meta):
+    """Descrizione breve di una versione per gli elenchi: data, file e righe."""
+    created = time.strftime('%d/%m/%Y %H:%M', time.localtime(meta['created']))
+    return f"{created} · {meta['label'] or meta['id']} ({meta['rows']:,} righe)"
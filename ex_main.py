@@ -6,6 +6,7 @@ import base64
 import io
 import os
 import shutil
+from core.ingestion import load_quality_file
 
 # -------------------- 1. Inizializzazione Dati e Cache --------------------
 # Questo dizionario contiene un segnaposto per il dataframe.
@@ -27,6 +28,8 @@ COLUMN_NAMES = {
 # Usiamo Bootstrap per un migliore stile e design responsivo
 app = Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP])
 app.title = "Dashboard Avanzata Qualità Acqua"
+# App Flask sottostante, per i server WSGI (gunicorn ex_main:server)
+server = app.server
 
 # -------------------- 3. Layout dell'App --------------------
 # Il layout è progettato utilizzando un Container Bootstrap per una corretta spaziatura
@@ -177,17 +180,8 @@ def update_layout(contents, filename):
     
     try:
         decoded = base64.b64decode(content_string)
-        if 'xls' in filename or 'xlsx' in filename:
-            df = pd.read_excel(io.BytesIO(decoded))
-        elif 'csv' in filename:
-            df = pd.read_csv(io.BytesIO(decoded))
-        else:
-            raise Exception('Tipo di file non supportato. Carica un file .csv o .xlsx.')
-
-        # Pulizia e preparazione dei dati
-        df[COLUMN_NAMES['date_time']] = pd.to_datetime(df[COLUMN_NAMES['date_time']], errors='coerce')
-        df = df[df[COLUMN_NAMES['date_time']].notna()]
-        df[COLUMN_NAMES['date']] = df[COLUMN_NAMES['date_time']].dt.floor('D')
+        # Pulizia e preparazione dei dati (le righe con 'Time' non valido vengono scartate durante la lettura)
+        df = load_quality_file(io.BytesIO(decoded), filename)
         
         # Archivia il dataframe elaborato per altre callback
         DATA['df'] = df
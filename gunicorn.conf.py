@@ -0,0 +1,17 @@
+# Gunicorn settings for wsgi.py (read automatically by `gunicorn wsgi:server`)
+import multiprocessing
+import os
+
+bind = os.environ.get('AVS_BIND', '0.0.0.0:8050')
+
+# Load app and default datasets in the master before forking the workers
+preload_app = True
+
+# Uploads are only shared between worker processes through the embedded store
+# (AVS_STORE_PATH); without it a single worker serves all requests with threads.
+workers = int(os.environ.get('AVS_WORKERS', multiprocessing.cpu_count() if os.environ.get('AVS_STORE_PATH') else 1))
+worker_class = 'gthread'
+threads = int(os.environ.get('AVS_THREADS', 8))
+
+# Large uploads and exports can take a while to parse
+timeout = 120
@@ -0,0 +1,645 @@
+"""
+Load test for the dashboards: simulated lab users against a local server.
+
+    python loadtest.py dash                         # app_export.py through wsgi.py
+    python loadtest.py streamlit --users 1,2,4,8    # app.py and its pages
+    python loadtest.py dash --url http://127.0.0.1:8050 --pid 4242   # server already running
+
+Without --url the server is started on a free local port with synthetic data
+(--rows readings over --days days). Gunicorn is used for the Dash app when
+installed (gunicorn.conf.py, so AVS_WORKERS/AVS_THREADS apply), otherwise
+Werkzeug's threaded server. For each concurrency level in --users, that many
+virtual users open the dashboard and then make --steps scripted changes each:
+sample/test selections, date range, chart type, aggregation, table page.
+
+A Dash interaction is the whole chain of /_dash-update-component requests the
+browser would make for that change. Callbacks in the same round are sent in
+parallel, as the browser does. A Streamlit interaction is one script rerun over
+the websocket, from the widget change to the end of the run. Widgets inside
+fragments trigger full reruns here, so those numbers are an upper bound.
+
+Reported per level: p50/p95/p99 interaction latency, interactions and
+requests per second, errors, and peak server memory (RSS of the server
+process and its children, sampled every 0.2 s).
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+import requests
+
+try:
+    import psutil
+except ImportError:  # psutil is optional: memory is read from /proc (Linux only)
+    psutil = None
+
+try:
+    from websockets.sync.client import connect as websocket_connect
+except ImportError:  # websockets is optional: only needed for the Streamlit load test
+    websocket_connect = None
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_USERS = '1,2,4,8'
+DEFAULT_STEPS = 10
+DEFAULT_ROWS = 50_000
+DEFAULT_DAYS = 730
+# Seconds allowed for the server to start and load the synthetic data
+SERVER_TIMEOUT = 300
+REQUEST_TIMEOUT = 120
+MEMORY_INTERVAL = 0.2
+
+# Synthetic readings: test name -> (typical result, spread, unit)
+SYNTHETIC_TESTS = {
+    'COD': (1500.0, 250.0, 'mg/L'),
+    'Surfattanti anionici': (2600.0, 450.0, 'mg/L'),
+    'pH': (7.4, 0.3, ''),
+    'Conducibilità': (950.0, 90.0, 'µS/cm'),
+    'Durezza': (28.0, 4.0, '°F'),
+    'Cloro libero': (0.2, 0.05, 'mg/L'),
+}
+SYNTHETIC_SAMPLES = ('CCA', 'CCB', 'OSMOSI', 'POZZO 1', 'POZZO 2', 'SCARICO')
+SYNTHETIC_OPERATORS = ('OPERATORE 1', 'OPERATORE 2', 'OPERATORE 3')
+MONTHS = ("Gennaio", "Febbraio", "Marzo", "Aprile", "Maggio", "Giugno",
+          "Luglio", "Agosto", "Settembre", "Ottobre", "Novembre", "Dicembre")
+
+# Streamlit widgets changed by the scripted sessions, per page (by label)
+STREAMLIT_PAGES = {
+    'controllo_qualita': ('ID Campione:', 'Nomi Test:', 'Mostra solo:', 'Seleziona un tipo di grafico:',
+                          'Aggregazione temporale automatica'),
+    'osmosi': ('Anno:', 'Mese:', 'Lavaggio:', 'Seleziona un tipo di grafico:',
+               'Seleziona la metrica da visualizzare:'),
+}
+
+
+# -------------------- Synthetic data --------------------
+def quality_frame(rows, days, seed=0):
+    """Quality-control readings with the export's columns, a few spikes included."""
+    rng = np.random.default_rng(seed)
+    tests = list(SYNTHETIC_TESTS)
+    test = rng.integers(0, len(tests), rows)
+    base = np.array([SYNTHETIC_TESTS[t][0] for t in tests])[test]
+    spread = np.array([SYNTHETIC_TESTS[t][1] for t in tests])[test]
+    result = base + rng.normal(size=rows) * spread
+    spikes = rng.random(rows) < 0.005
+    result[spikes] += 4 * spread[spikes]
+    start = pd.Timestamp.now().normalize() - pd.Timedelta(days=days)
+    minutes = np.sort(rng.integers(0, days * 24 * 60, rows))
+    return pd.DataFrame({
+        'Time': start + pd.to_timedelta(minutes, unit='min'),
+        'User ID': rng.choice(SYNTHETIC_OPERATORS, rows),
+        'Sample ID': rng.choice(SYNTHETIC_SAMPLES, rows),
+        'Test Number': np.char.add('LCK', (test + 100).astype(str)),
+        'Test Name': np.array(tests)[test],
+        'ABS': rng.random(rows).round(3),
+        'Result': result.round(2),
+        'Unit': np.array([SYNTHETIC_TESTS[t][2] for t in tests])[test],
+    })
+
+
+def osmosi_frame(years, seed=0):
+    """Monthly meter readings of the reverse-osmosis plant, one row per month."""
+    rng = np.random.default_rng(seed)
+    first = date.today().year - years + 1
+    starts = pd.date_range(f'{first}-01-01', periods=years * 12, freq='MS')
+    totals = rng.integers(15_000, 30_000, len(starts))
+    meter = 1_500_000 + np.concatenate([[0], np.cumsum(totals)[:-1]])
+    return pd.DataFrame({
+        'Data Inizio': starts,
+        'MC Inizio': meter,
+        'Data Fine': starts + pd.offsets.MonthEnd(0),
+        'MC Fine': meter + totals,
+        'Totale MC': totals,
+        'Mese': [MONTHS[d.month - 1] for d in starts],
+        'Lavaggio': (rng.random(len(starts)) < 0.2).astype(int),
+        'Membrane': None,
+        'Anno': starts.year,
+    })
+
+
+def streamlit_workspace(root, rows, days):
+    """
+    Copy of the Streamlit app whose documents/ holds synthetic data: the pages
+    read their default files from paths relative to the working directory.
+    """
+    for name in ('app.py', 'pages', 'core', 'assets', '.streamlit'):
+        if os.path.exists(os.path.join(REPO_DIR, name)):
+            os.symlink(os.path.join(REPO_DIR, name), os.path.join(root, name))
+    documents = os.path.join(root, 'documents')
+    os.makedirs(documents)
+    quality_frame(rows, days).to_excel(os.path.join(documents, 'controllo_qualita.xlsx'), index=False)
+    osmosi_frame(max(days // 365, 2)).to_excel(os.path.join(documents, 'osmosi_report.xlsx'), index=False)
+    limits = os.path.join(REPO_DIR, 'documents', 'limiti.csv')
+    if os.path.exists(limits):
+        os.symlink(limits, os.path.join(documents, 'limiti.csv'))
+    return root
+
+
+# -------------------- Server --------------------
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(kind, port, workdir, rows, days):
+    """Start the Dash or Streamlit server on `port`; returns the process and the readiness URL."""
+    env = dict(os.environ)
+    if kind == 'dash':
+        data_path = os.path.join(workdir, 'controllo_qualita.csv')
+        quality_frame(rows, days).to_csv(data_path, index=False)
+        env.update(AVS_DEFAULT_DATA=data_path, AVS_BIND=f'127.0.0.1:{port}')
+        if shutil.which('gunicorn') or _has_module('gunicorn'):
+            command = [sys.executable, '-m', 'gunicorn', 'wsgi:server']
+        else:
+            command = [sys.executable, '-c',
+                       'import logging; from werkzeug.serving import run_simple; import wsgi; '
+                       'logging.getLogger("werkzeug").setLevel(logging.WARNING); '
+                       f'run_simple("127.0.0.1", {port}, wsgi.server, threaded=True)']
+        process = subprocess.Popen(command, cwd=REPO_DIR, env=env)
+        return process, f'http://127.0.0.1:{port}/readyz'
+    workspace = streamlit_workspace(workdir, rows, days)
+    command = [sys.executable, '-m', 'streamlit', 'run', os.path.join(workspace, 'app.py'),
+               '--server.headless', 'true', '--server.port', str(port),
+               '--browser.gatherUsageStats', 'false', '--logger.level', 'error']
+    process = subprocess.Popen(command, cwd=workspace, env=env)
+    return process, f'http://127.0.0.1:{port}/_stcore/health'
+
+
+def _has_module(name):
+    import importlib.util
+    return importlib.util.find_spec(name) is not None
+
+
+def wait_ready(url, process=None, timeout=SERVER_TIMEOUT):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f'Server exited with code {process.returncode}')
+        try:
+            if requests.get(url, timeout=5).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f'Server not ready after {timeout} s: {url}')
+
+
+# -------------------- Server memory --------------------
+def process_rss(pid):
+    """Resident memory (bytes) of a process and all its children, e.g. gunicorn workers."""
+    if psutil is not None:
+        try:
+            parent = psutil.Process(pid)
+            processes = [parent, *parent.children(recursive=True)]
+        except psutil.NoSuchProcess:
+            return 0
+        total = 0
+        for process in processes:
+            try:
+                total += process.memory_info().rss
+            except psutil.NoSuchProcess:
+                pass
+        return total
+    total, pending = 0, [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            with open(f'/proc/{current}/status') as handle:
+                rss = next((line for line in handle if line.startswith('VmRSS:')), None)
+            total += int(rss.split()[1]) * 1024 if rss else 0
+            for task in os.listdir(f'/proc/{current}/task'):
+                with open(f'/proc/{current}/task/{task}/children') as handle:
+                    pending.extend(int(child) for child in handle.read().split())
+        except (OSError, ValueError):
+            continue
+    return total
+
+
+class MemorySampler:
+    """Peak RSS of the server while a concurrency level runs."""
+
+    def __init__(self, pid, interval=MEMORY_INTERVAL):
+        self.pid = pid
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        if self.pid is not None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, process_rss(self.pid))
+            self._stop.wait(self.interval)
+
+
+# -------------------- Dash sessions --------------------
+def _parse_id(component_id):
+    return json.loads(component_id) if component_id.startswith('{') else component_id
+
+
+def _split_outputs(output):
+    parts = output[2:-2].split('...') if output.startswith('..') else [output]
+    return [tuple(part.rsplit('.', 1)) for part in parts]
+
+
+def _layout_props(node, props):
+    """(id, property) -> value for every component with an id in the layout tree."""
+    if isinstance(node, list):
+        for child in node:
+            _layout_props(child, props)
+    elif isinstance(node, dict) and 'props' in node:
+        component_id = node['props'].get('id')
+        if component_id is not None:
+            key = (json.dumps(component_id, sort_keys=True, separators=(',', ':'))
+                   if isinstance(component_id, dict) else component_id)
+            for prop, value in node['props'].items():
+                props[(key, prop)] = value
+        for value in node['props'].values():
+            _layout_props(value, props)
+    return props
+
+
+def _dash_callbacks(dependencies):
+    """Server-side callbacks the browser would call; clientside and pattern-matching ones are skipped."""
+    callbacks = []
+    for dep in dependencies:
+        # allow_duplicate outputs ('@' suffix) are click/interval handlers not driven by the script
+        if dep.get('clientside_function') or '"MATCH"' in dep['output'] or '"ALL' in dep['output'] or '@' in dep['output']:
+            continue
+        callbacks.append({
+            'output': dep['output'],
+            'outputs': _split_outputs(dep['output']),
+            'inputs': [(i['id'], i['property']) for i in dep['inputs']],
+            'state': [(s['id'], s['property']) for s in dep.get('state', [])],
+            'prevent_initial_call': dep.get('prevent_initial_call', False),
+        })
+    return callbacks
+
+
+class DashUser:
+    """One browser tab on the Dash dashboard."""
+
+    def __init__(self, base_url, rng):
+        self.base_url = base_url.rstrip('/')
+        self.rng = rng
+        self.http = requests.Session()
+        self.props = {}
+        self.callbacks = []
+        self._pool = ThreadPoolExecutor(max_workers=4)
+
+    def close(self):
+        self._pool.shutdown()
+        self.http.close()
+
+    def open(self):
+        """Page load: HTML, layout, dependencies and the initial callbacks. Returns (requests, errors)."""
+        counts = [0, 0]
+        for path in ('/', '/_dash-layout', '/_dash-dependencies'):
+            response = self.http.get(self.base_url + path, timeout=REQUEST_TIMEOUT)
+            counts[0] += 1
+            counts[1] += response.status_code != 200
+            if path == '/_dash-layout':
+                self.props = _layout_props(response.json(), {})
+            elif path == '/_dash-dependencies':
+                self.callbacks = _dash_callbacks(response.json())
+        requests_made, errors = self._run_chain(set(), initial=True)
+        return counts[0] + requests_made, counts[1] + errors
+
+    def interact(self):
+        """One scripted change and the callbacks it triggers. Returns (action, requests, errors)."""
+        actions = [action for action in (self._chart, self._samples, self._tests, self._dates,
+                                         self._aggregate, self._table_page) if action(check=True)]
+        action = self.rng.choice(actions)
+        changed = action()
+        requests_made, errors = self._run_chain(changed)
+        return action.__name__.lstrip('_'), requests_made, errors
+
+    # --- Scripted changes: each sets some props and returns the changed (id, property) ---
+    def _options(self, component_id):
+        options = self.props.get((component_id, 'options')) or []
+        return [o['value'] if isinstance(o, dict) else o for o in options]
+
+    def _chart(self, check=False):
+        options = self._options('chart-type')
+        if check:
+            return len(options) > 1
+        return self._set(('chart-type', 'value'), self.rng.choice(options))
+
+    def _subset(self, component_id, check):
+        options = self._options(component_id)
+        if check:
+            return len(options) > 1 and not self.props.get((component_id, 'disabled'))
+        return self._set((component_id, 'value'), self.rng.sample(options, self.rng.randint(1, len(options))))
+
+    def _samples(self, check=False):
+        return self._subset('sample-dropdown', check)
+
+    def _tests(self, check=False):
+        return self._subset('test-dropdown', check)
+
+    def _dates(self, check=False):
+        low = self.props.get(('date-picker', 'min_date_allowed'))
+        high = self.props.get(('date-picker', 'max_date_allowed'))
+        if check:
+            return bool(low and high)
+        low, high = date.fromisoformat(str(low)[:10]), date.fromisoformat(str(high)[:10])
+        span = max((high - low).days, 1)
+        start = low + timedelta(days=self.rng.randint(0, span))
+        end = min(start + timedelta(days=self.rng.randint(7, max(span, 7))), high)
+        return self._set(('date-picker', 'start_date'), start.isoformat()) | \
+            self._set(('date-picker', 'end_date'), end.isoformat())
+
+    def _aggregate(self, check=False):
+        if check:
+            return ('aggregate-switch', 'value') in self.props
+        return self._set(('aggregate-switch', 'value'), not self.props[('aggregate-switch', 'value')])
+
+    def _table_page(self, check=False):
+        pages = self.props.get(('results-table', 'page_count')) or 0
+        if check:
+            return pages > 1
+        return self._set(('results-table', 'page_current'), self.rng.randrange(pages))
+
+    def _set(self, key, value):
+        self.props[key] = value
+        return {key}
+
+    # --- Callback chain, as the Dash renderer runs it ---
+    def _run_chain(self, changed, initial=False):
+        """
+        Fire, round by round, every callback whose inputs changed (on the initial load:
+        every callback without prevent_initial_call), after the callbacks that feed it.
+        """
+        pending = [cb for cb in self.callbacks if not (initial and cb['prevent_initial_call'])]
+        requests_made = errors = 0
+        while pending:
+            produced = {cb['output']: set(cb['outputs']) for cb in pending}
+            ready = [cb for cb in pending
+                     if not any(set(cb['inputs']) & outputs for other, outputs in produced.items()
+                                if other != cb['output'])] or pending
+            pending = [cb for cb in pending if cb not in ready]
+            to_fire = [cb for cb in ready if initial or set(cb['inputs']) & changed]
+            for updated, failed in self._pool.map(lambda cb: self._fire(cb, changed), to_fire):
+                requests_made += 1
+                errors += failed
+                changed |= updated
+        return requests_made, errors
+
+    def _fire(self, cb, changed):
+        def values(pairs):
+            return [{'id': _parse_id(i), 'property': p, 'value': self.props.get((i, p))} for i, p in pairs]
+
+        outputs = [{'id': _parse_id(i), 'property': p} for i, p in cb['outputs']]
+        payload = {
+            'output': cb['output'],
+            'outputs': outputs if cb['output'].startswith('..') else outputs[0],
+            'inputs': values(cb['inputs']),
+            'state': values(cb['state']),
+            'changedPropIds': [f'{i}.{p}' for i, p in cb['inputs'] if (i, p) in changed],
+        }
+        try:
+            response = self.http.post(self.base_url + '/_dash-update-component', json=payload,
+                                      timeout=REQUEST_TIMEOUT)
+        except requests.RequestException:
+            return set(), True
+        if response.status_code == 204:  # PreventUpdate
+            return set(), False
+        if response.status_code != 200:
+            return set(), True
+        updated = set()
+        for component_id, props in response.json().get('response', {}).items():
+            for prop, value in props.items():
+                self.props[(component_id, prop)] = value
+                updated.add((component_id, prop))
+        return updated, False
+
+
+# -------------------- Streamlit sessions --------------------
+class StreamlitUser:
+    """One browser tab on a Streamlit page, speaking the app's websocket protocol."""
+
+    def __init__(self, base_url, rng, page):
+        from streamlit.proto.BackMsg_pb2 import BackMsg
+        from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+        self._back_msg, self._forward_msg = BackMsg, ForwardMsg
+        self.url = base_url.replace('http', 'ws', 1).rstrip('/') + '/_stcore/stream'
+        self.rng = rng
+        self.page = page
+        self.widgets = {}
+        self.values = {}
+        self.socket = None
+        self._connection = ExitStack()
+
+    def close(self):
+        self._connection.close()
+
+    def open(self):
+        self.socket = self._connection.enter_context(
+            websocket_connect(self.url, subprotocols=['streamlit'], max_size=None, open_timeout=REQUEST_TIMEOUT))
+        return self._rerun()
+
+    def interact(self):
+        labels = [label for label in STREAMLIT_PAGES[self.page] if label in self.widgets]
+        label = self.rng.choice(labels)
+        kind, widget = self.widgets[label]
+        options = list(getattr(widget, 'options', []))
+        if kind == 'multiselect':
+            value = self.rng.sample(options, self.rng.randint(0 if label == 'Mostra solo:' else 1, len(options)))
+        elif kind == 'selectbox':
+            value = self.rng.choice(options)
+        else:
+            value = not self.values.get(widget.id, (kind, widget.default))[1]
+        self.values[widget.id] = (kind, value)
+        requests_made, errors = self._rerun()
+        return label, requests_made, errors
+
+    def _rerun(self):
+        """Request a rerun with the current widget values and wait for the script to finish."""
+        msg = self._back_msg()
+        msg.rerun_script.page_name = self.page
+        msg.rerun_script.query_string = ''
+        for widget_id, (kind, value) in self.values.items():
+            state = msg.rerun_script.widget_states.widgets.add()
+            state.id = widget_id
+            if kind == 'multiselect':
+                state.string_array_value.data.extend(value)
+            elif kind == 'selectbox':
+                state.string_value = value
+            else:
+                state.bool_value = value
+        self.socket.send(msg.SerializeToString())
+        errors = 0
+        while True:
+            forward = self._forward_msg()
+            forward.ParseFromString(self.socket.recv(timeout=REQUEST_TIMEOUT))
+            kind = forward.WhichOneof('type')
+            if kind == 'delta' and forward.delta.WhichOneof('type') == 'new_element':
+                element = forward.delta.new_element
+                element_kind = element.WhichOneof('type')
+                if element_kind == 'exception':
+                    errors += 1
+                elif element_kind in ('multiselect', 'selectbox', 'checkbox'):
+                    widget = getattr(element, element_kind)
+                    self.widgets[widget.label] = (element_kind, widget)
+            elif kind == 'script_finished':
+                return 1, errors
+
+
+# -------------------- Load levels --------------------
+def run_level(make_user, users, steps, think, pid, seed):
+    """Run `users` sessions of `steps` interactions each; returns the level's statistics."""
+    latencies, counters, lock = [], {'requests': 0, 'errors': 0, 'interactions': 0}, threading.Lock()
+    start_barrier = threading.Barrier(users)
+
+    def session(index):
+        rng = random.Random(seed * 1000 + index)
+        user = make_user(rng)
+        waited = False
+        try:
+            requests_made, errors = user.open()
+            with lock:
+                counters['requests'] += requests_made
+                counters['errors'] += errors
+            # All users start their interactions together, after loading the page
+            start_barrier.wait()
+            waited = True
+            for _ in range(steps):
+                started = time.perf_counter()
+                _, requests_made, errors = user.interact()
+                elapsed = time.perf_counter() - started
+                with lock:
+                    latencies.append(elapsed)
+                    counters['interactions'] += 1
+                    counters['requests'] += requests_made
+                    counters['errors'] += errors
+                if think:
+                    time.sleep(rng.uniform(0, 2 * think))
+        except Exception as exc:
+            with lock:
+                counters['errors'] += 1
+            print(f'  user {index}: {type(exc).__name__}: {exc}', file=sys.stderr)
+            # Release the users still waiting for this one; once past the barrier, aborting it
+            # could fail users that have not yet woken up from it
+            if not waited:
+                start_barrier.abort()
+        finally:
+            user.close()
+
+    with MemorySampler(pid) as memory:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=users) as pool:
+            list(pool.map(session, range(users)))
+        elapsed = time.perf_counter() - started
+
+    values = np.array(latencies) * 1000 if latencies else np.array([np.nan])
+    return {
+        'users': users,
+        'interactions': counters['interactions'],
+        'requests': counters['requests'],
+        'errors': counters['errors'],
+        'p50_ms': float(np.percentile(values, 50)),
+        'p95_ms': float(np.percentile(values, 95)),
+        'p99_ms': float(np.percentile(values, 99)),
+        'interactions_per_s': counters['interactions'] / elapsed,
+        'requests_per_s': counters['requests'] / elapsed,
+        'peak_rss_mb': memory.peak / 2 ** 20 if pid is not None else None,
+    }
+
+
+def print_level(stats, header=False):
+    columns = (('users', 5, '{}'), ('interactions', 12, '{}'), ('errors', 6, '{}'), ('p50_ms', 8, '{:.0f}'),
+               ('p95_ms', 8, '{:.0f}'), ('p99_ms', 8, '{:.0f}'), ('interactions_per_s', 8, '{:.2f}'),
+               ('requests_per_s', 8, '{:.1f}'), ('peak_rss_mb', 9, '{:.0f}'))
+    titles = {'interactions_per_s': 'int/s', 'requests_per_s': 'req/s', 'peak_rss_mb': 'RSS MB',
+              'p50_ms': 'p50 ms', 'p95_ms': 'p95 ms', 'p99_ms': 'p99 ms'}
+    if header:
+        print('  '.join(titles.get(name, name).rjust(width) for name, width, _ in columns))
+    print('  '.join((fmt.format(stats[name]) if stats[name] is not None else '-').rjust(width)
+                    for name, width, fmt in columns), flush=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test for the Dash and Streamlit dashboards.")
+    parser.add_argument('target', choices=('dash', 'streamlit'))
+    parser.add_argument('--users', default=DEFAULT_USERS, help="concurrency levels, e.g. 1,2,4,8")
+    parser.add_argument('--steps', type=int, default=DEFAULT_STEPS, help="interactions per user and level")
+    parser.add_argument('--think', type=float, default=0.0, help="mean pause between interactions (s)")
+    parser.add_argument('--rows', type=int, default=DEFAULT_ROWS, help="synthetic readings")
+    parser.add_argument('--days', type=int, default=DEFAULT_DAYS, help="days covered by the synthetic readings")
+    parser.add_argument('--page', choices=tuple(STREAMLIT_PAGES), default='controllo_qualita',
+                        help="Streamlit page to drive")
+    parser.add_argument('--url', help="use an already running server instead of starting one")
+    parser.add_argument('--pid', type=int, help="server PID for memory sampling, with --url")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help="also write the results to this file")
+    args = parser.parse_args(argv)
+
+    if args.target == 'streamlit' and websocket_connect is None:
+        parser.error("the Streamlit load test needs the websockets package (pip install websockets)")
+
+    process, workdir = None, None
+    base_url, pid = args.url, args.pid
+    try:
+        if base_url is None:
+            workdir = tempfile.mkdtemp(prefix='avs_loadtest_')
+            port = free_port()
+            print(f"Starting the {args.target} server with {args.rows:,} synthetic readings...", flush=True)
+            process, ready_url = start_server(args.target, port, workdir, args.rows, args.days)
+            wait_ready(ready_url, process)
+            base_url, pid = f'http://127.0.0.1:{port}', process.pid
+        if pid is not None:
+            print(f"Server memory at rest: {process_rss(pid) / 2 ** 20:.0f} MB")
+
+        if args.target == 'dash':
+            def make_user(rng):
+                return DashUser(base_url, rng)
+        else:
+            def make_user(rng):
+                return StreamlitUser(base_url, rng, args.page)
+
+        results = []
+        for index, users in enumerate(int(level) for level in args.users.split(',')):
+            stats = run_level(make_user, users, args.steps, args.think, pid, args.seed)
+            results.append(stats)
+            print_level(stats, header=index == 0)
+        if args.json:
+            with open(args.json, 'w', encoding='utf-8') as handle:
+                json.dump({'target': args.target, 'rows': args.rows, 'steps': args.steps, 'levels': results},
+                          handle, indent=2)
+    finally:
+        if process is not None:
+            process.terminate()
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        if workdir is not None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -3,7 +3,25 @@ import pandas as pd
 import plotly.express as px
 import base64
 import io
+import os
 import openpyxl
+from core.aggregation import AGGREGATED_CHART_TYPES, aggregate_results, band_figure, choose_bucket
+from core.anomaly import ANOMALY_KINDS, add_anomaly_points, score_anomalies
+from core.correlation import correlation_figure, correlation_matrix, pair_figure, pivot_tests, strongest_pair
+from core.compliance import (add_out_of_limit_points, apply_limits, compliance_counts, compliance_summary,
+                             exceedance_figure, exceedance_rates, limits_path, load_limits)
+from core.filters import filter_quality
+from core.ingestion import UnsupportedFileError, list_columns, list_excel_sheets, load_quality_files, source_fingerprint
+from core.memory import MODE_SAMPLED, estimate_bytes, get_memory_governor, hold_memory, sampled_notice, session_id
+from core.panels import PANEL_BY, PANEL_BY_LABELS, PANEL_COLUMNS, PanelSet
+from core.prewarm import record_view, start_prewarm, view_dates
+from core.profiling import PROFILE_PARAM, finish_profile, is_admin_token, profiling_enabled, start_profile
+from core.registry import UPLOAD_IDLE_SECONDS, resolve_uploads
+from core.schema import QUALITY_DEDUP_KEYS, QUALITY_DERIVED_COLUMNS
+from core.transport import compact_figure, use_fast_json
+from core.validation import SchemaError, ValidationReport, validation_section
+from core.versions import (ADDED, CHANGED, REMOVED, get_version_store, previous_version, record_version,
+                           version_label)
 
 # --- Impostazioni di base della pagina ---
 st.set_page_config(
@@ -16,6 +34,16 @@ st.set_page_config(
 if st.sidebar.button("🏠 Home"):
     st.switch_page("app.py")
 
+# Le figure vengono serializzate con orjson, se installato
+use_fast_json()
+
+# Profilazione della pagina: per tutti con AVS_PROFILE=1, o per questa sessione con ?profile=<token>
+if is_admin_token(st.query_params.get(PROFILE_PARAM)):
+    st.session_state.profiling = True
+elif st.query_params.get(PROFILE_PARAM) == 'off':
+    st.session_state.profiling = False
+page_profile = start_profile('controllo_qualita.py') if profiling_enabled() or st.session_state.get('profiling') else None
+
 # --- Definisci i nomi delle colonne per coerenza ---
 COLUMN_NAMES = {
     'date_time': 'Time',
@@ -27,38 +55,109 @@ COLUMN_NAMES = {
     'abs': 'ABS'
 }
 
-# --- Funzione per leggere e pulire i dati (con spinner) ---
+# --- Versioni dei dati caricati (differenze tra un caricamento e l'altro), in AVS_VERSIONS_PATH ---
+VERSIONS = get_version_store('quality', QUALITY_DEDUP_KEYS)
+# Differenze mostrate nella tabella del confronto tra versioni
+VERSION_ROWS_SHOWN = 1000
+
+# Piccoli multipli: pannelli costruiti e inviati alla volta, gli altri su richiesta
+PANEL_BATCH = 12
+
+# --- Memoria per sessione: dataset, righe filtrate ed esportazioni di ogni sessione (core/memory.py) ---
+def plan_loading(file_sources, selection):
+    """
+    Frazione delle letture da caricare (None: tutte), decisa una volta per
+    selezione di file e opzioni: se la stima del dataset in memoria supera
+    quanto resta alla sessione, i dati vengono letti a campione.
+    """
+    plan = st.session_state.get('memory_plan')
+    if plan is None or plan[0] != selection:
+        session = session_id()
+        governor = get_memory_governor()
+        estimated = estimate_bytes(file_sources)
+        # Il dataset che la sessione tiene ora verrà sostituito da quello nuovo
+        current = governor.slot_bytes(session, 'dataset') if session is not None else 0
+        mode, fraction = governor.plan(session, estimated, replaces=current)
+        plan = (selection, round(fraction, 3) if mode == MODE_SAMPLED else None, estimated)
+        st.session_state['memory_plan'] = plan
+    return plan[1], plan[2]
+
+# --- Tabella dei limiti di legge, riletta solo quando il file cambia ---
 @st.cache_data
-def load_data(file_source):
+def get_limits(limits_key):
+    """Limiti versionati per data (None se la tabella non esiste o non è valida)."""
+    try:
+        return load_limits(limits_path())
+    except ValueError as e:
+        st.warning(f"Tabella dei limiti ignorata: {e}")
+        return None
+
+# --- Funzione per leggere e pulire i dati (con spinner) ---
+# I dataset non usati per un'ora escono dalla cache, come i rispettivi upload
+@st.cache_data(ttl=UPLOAD_IDLE_SECONDS)
+def load_data(file_sources, sheet_name=None, usecols=None, limits_key=None, sample=None):
     """
-    Carica e preprocessa i dati dal file.
-    Supporta sia un file caricato che un percorso di file locale.
+    Carica e preprocessa i dati da uno o più file.
+    Supporta sia file caricati che un percorso di file locale; più file vengono
+    uniti in un'unica serie temporale senza letture duplicate.
+    Per i file Excel si può scegliere il foglio e il sottoinsieme di colonne.
+    Con `sample` (file troppo grandi per la memoria) si legge solo quella
+    frazione delle letture di ogni serie.
+    Ogni lettura riceve i limiti in vigore alla sua data, lo stato di conformità
+    e i punteggi di anomalia della sua serie, calcolati una volta sola qui.
+    Restituisce anche l'esito dei controlli sui dati, in cache con il dataset.
     """
     with st.spinner('Caricamento dati in corso...'):
+        progress_bar = st.progress(0.0)
+
+        def mostra_avanzamento(blocco, righe, frazione):
+            progress_bar.progress(frazione or 0.0, text=f"Blocco {blocco}: {righe:,} righe lette")
+
         try:
-            if isinstance(file_source, str):
-                df = pd.read_excel(file_source)
-            elif file_source.name.endswith('.csv'):
-                df = pd.read_csv(file_source)
-            elif file_source.name.endswith(('.xls', '.xlsx')):
-                df = pd.read_excel(file_source)
-            else:
-                st.error('Tipo di file non supportato. Carica un file .csv o .xlsx.')
-                return pd.DataFrame()
-            
-            # Pulizia e preparazione dei dati
-            df[COLUMN_NAMES['date_time']] = pd.to_datetime(df[COLUMN_NAMES['date_time']], errors='coerce')
-            df = df[df[COLUMN_NAMES['date_time']].notna()]
-            df[COLUMN_NAMES['date']] = df[COLUMN_NAMES['date_time']].dt.floor('D')
-            
-            return df
-        
-        except FileNotFoundError:
-            st.error(f'Errore: File non trovato al percorso: {file_source}')
-            return pd.DataFrame()
+            # Lettura e pulizia dei dati: i CSV sono letti a blocchi con tipi espliciti
+            # e le righe con 'Time' non valido sono scartate durante la lettura
+            report = ValidationReport()
+            df = load_quality_files(file_sources, progress=mostra_avanzamento,
+                                    sheet_name=sheet_name, usecols=usecols, report=report, sample=sample)
+            return score_anomalies(apply_limits(df, get_limits(limits_key))), report
+
+        except (UnsupportedFileError, SchemaError) as e:
+            st.error(str(e))
+            return pd.DataFrame(), None
+        except FileNotFoundError as e:
+            st.error(f'Errore: File non trovato al percorso: {e.filename}')
+            return pd.DataFrame(), None
         except Exception as e:
             st.error(f'Errore durante l\'elaborazione del file: {e}')
-            return pd.DataFrame()
+            return pd.DataFrame(), None
+        finally:
+            progress_bar.empty()
+
+def dataset_version(data_key, file_sources, df):
+    """
+    Registra le letture caricate come versione, una volta per dataset nella sessione,
+    e ne restituisce i metadati. Sta fuori da load_data: una funzione in st.cache_data
+    non deve avere effetti collaterali, che non si ripeterebbero quando il risultato
+    arriva dalla cache. La versione contiene le letture come sono state caricate,
+    senza le colonne di limiti e anomalie.
+    """
+    if st.session_state.get('data_version_key') != data_key:
+        label = ', '.join(os.path.basename(str(source)) for source in file_sources)
+        loaded = df.drop(columns=[col for col in QUALITY_DERIVED_COLUMNS if col in df.columns])
+        st.session_state['data_version'] = record_version(VERSIONS, loaded, label)
+        st.session_state['data_version_key'] = data_key
+    return st.session_state['data_version']
+
+# --- Funzioni per leggere fogli e intestazioni senza caricare i dati ---
+@st.cache_data
+def get_sheet_names(file_source):
+    """Restituisce i fogli disponibili in un file Excel."""
+    return list_excel_sheets(file_source)
+
+@st.cache_data
+def get_column_names(file_source, sheet_name=None):
+    """Restituisce le colonne del file (o del foglio scelto)."""
+    return list_columns(file_source, sheet_name)
 
 # --- Funzione per salvare il DataFrame come XLSX ---
 def to_excel(df):
@@ -69,6 +168,340 @@ def to_excel(df):
     processed_data = output.getvalue()
     return processed_data
 
+# -------------------- Sezioni con aggiornamento indipendente --------------------
+# Ogni sezione è un fragment: cambiare il tipo di grafico riesegue solo il grafico,
+# senza rifare filtri, metriche, esportazione e tabella.
+
+def view_filters(state):
+    """Tupla dei filtri di una vista, chiave delle cache delle sezioni."""
+    return (state['start_date'], state['end_date'], tuple(state['results_range']), tuple(state['operators'] or ()),
+            tuple(state['samples'] or ()), tuple(state['tests'] or ()), tuple(state['anomalies'] or ()))
+
+@st.cache_data(max_entries=32)
+def get_filtered_data(data_key, filters, _df):
+    """
+    Applica i filtri, memorizzando il risultato per dataset e combinazione di filtri.
+    Ogni sessione riceve una propria copia del DataFrame.
+    """
+    start_date, end_date, results_range, operators, samples, tests, anomalies = filters
+    return filter_quality(_df, start_date, end_date, results_range, list(operators), list(samples), list(tests),
+                          list(anomalies))
+
+@st.cache_data(max_entries=8)
+def get_export_files(data_key, filters, _df_filtered):
+    """Genera CSV e XLSX una sola volta per combinazione di filtri."""
+    return _df_filtered.to_csv(index=False).encode('utf-8'), to_excel(_df_filtered)
+
+@st.cache_data(max_entries=8)
+def get_compliance_counts(data_key, filters, _df_filtered):
+    """Conteggi giornalieri di letture verificate e fuori limite per combinazione di filtri."""
+    return compliance_counts(_df_filtered)
+
+def results_figure(df_filtered, chart_type, bucket, selected_samples, selected_tests):
+    """Grafico principale dei dati filtrati (bande per periodo se `bucket` è indicato)."""
+    dynamic_title = ""
+    color_column = COLUMN_NAMES['sample_id']
+
+    if len(selected_samples) == 1 and selected_tests:
+        dynamic_title = f" per il campione: {selected_samples[0]}"
+        color_column = COLUMN_NAMES['test_name']
+    elif len(selected_samples) > 1 and selected_tests:
+        dynamic_title = f" per: {', '.join(selected_tests)}"
+        color_column = COLUMN_NAMES['sample_id']
+    elif selected_tests:
+        dynamic_title = f" per: {', '.join(selected_tests)}"
+
+    hover_cols = df_filtered.columns.tolist()
+
+    fig = {}
+    if bucket is not None:
+        fig = band_figure(aggregate_results(df_filtered, bucket), bucket,
+                          title=f"Andamento dei Risultati dei Test{dynamic_title}")
+    elif chart_type == 'scatter':
+        fig = px.scatter(df_filtered, x=COLUMN_NAMES['date'], y=COLUMN_NAMES['result'], color=color_column,
+                        hover_data=hover_cols, title=f"Grafico a Dispersione dei Risultati dei Test{dynamic_title}")
+    elif chart_type == 'line':
+        fig = px.line(df_filtered, x=COLUMN_NAMES['date'], y=COLUMN_NAMES['result'], color=color_column,
+                      hover_data=hover_cols, title=f"Grafico a Linee dei Risultati dei Test{dynamic_title}")
+        fig.update_traces(mode='lines+markers')
+    elif chart_type == 'box':
+        fig = px.box(df_filtered, x=COLUMN_NAMES['sample_id'], y=COLUMN_NAMES['result'], color=COLUMN_NAMES['test_name'],
+                     hover_data=hover_cols, title=f"Box Plot dei Risultati per ID Campione{dynamic_title}")
+    elif chart_type == 'violin':
+        fig = px.violin(df_filtered, x=COLUMN_NAMES['test_name'], y=COLUMN_NAMES['result'], color=COLUMN_NAMES['test_name'],
+                        hover_data=hover_cols, title=f"Grafico a Violino della Distribuzione dei Risultati{dynamic_title}")
+    elif chart_type == 'histogram':
+        fig = px.histogram(df_filtered, x=COLUMN_NAMES['date'], y=COLUMN_NAMES['result'], color=color_column,
+                           hover_data=hover_cols, title=f"Istogramma dei Risultati dei Test{dynamic_title}", barmode="group")
+    elif chart_type == 'density_histogram':
+        fig = px.histogram(df_filtered, x=COLUMN_NAMES['result'], color=COLUMN_NAMES['test_name'],
+                           nbins=20, histnorm='probability density', marginal='rug',
+                           hover_data=hover_cols, title=f"Istogramma di Densità dei Risultati{dynamic_title}")
+    elif chart_type == 'scatter_matrix' and COLUMN_NAMES['abs'] in df_filtered.columns:
+        fig = px.scatter_matrix(df_filtered, dimensions=[COLUMN_NAMES['result'], COLUMN_NAMES['abs']],
+                                color=COLUMN_NAMES['test_name'],
+                                hover_data=hover_cols, title=f"Matrice di Correlazione tra Risultato e ABS{dynamic_title}")
+        fig.update_traces(diagonal_visible=False)
+
+    # Letture fuori limite e letture anomale evidenziate sui grafici punto per punto
+    if bucket is None and chart_type in ('line', 'scatter'):
+        add_out_of_limit_points(fig, df_filtered, x=COLUMN_NAMES['date'])
+        add_anomaly_points(fig, df_filtered, x=COLUMN_NAMES['date'])
+
+    # Date e colonne del tooltip viaggiano come array tipizzati invece che valore per valore
+    if not isinstance(fig, dict):
+        compact_figure(fig)
+    return fig
+
+@st.cache_data(max_entries=32)
+def get_results_figure(data_key, filters, chart_type, bucket, _df_filtered):
+    """
+    Grafico principale per dataset, filtri e tipo di grafico.
+    Ogni sessione riceve una propria copia della figura.
+    """
+    return results_figure(_df_filtered, chart_type, bucket, list(filters[4]), list(filters[5]))
+
+@st.cache_resource(max_entries=8)
+def get_panel_set(data_key, filters, by, shared_y, _df_filtered):
+    """
+    Pannelli dei piccoli multipli, con assi e colori comuni calcolati una volta per selezione.
+    L'oggetto è condiviso tra le sessioni ma non viene mai modificato: ogni figura è costruita nuova.
+    """
+    return PanelSet(_df_filtered, by, shared_y)
+
+@st.cache_data(max_entries=256)
+def get_panel_figure(data_key, filters, by, shared_y, name, _panel_set):
+    """
+    Figura di un solo pannello, costruita la prima volta che viene mostrato.
+    Ogni sessione riceve una propria copia della figura.
+    """
+    return compact_figure(_panel_set.figure(name))
+
+def show_more_panels(selection, count):
+    st.session_state['panels_shown'] = (selection, count)
+
+def panels_section(data_key, filters, df_filtered):
+    """
+    Piccoli multipli: un pannello compatto per test o per campione. Vengono
+    costruiti solo i primi PANEL_BATCH pannelli, gli altri a gruppi su richiesta.
+    """
+    col_by, col_scale = st.columns([3, 1])
+    with col_by:
+        by = st.radio("Un pannello per:", options=list(PANEL_BY), format_func=PANEL_BY_LABELS.get, horizontal=True)
+    with col_scale:
+        shared_y = st.toggle("Stessa scala Y", value=False,
+                             help="Stesso intervallo dei risultati in tutti i pannelli (utile per test con la stessa unità).")
+    panel_set = get_panel_set(data_key, filters, by, shared_y, df_filtered)
+
+    # Pannelli già mostrati per questa selezione; si riparte dal primo gruppo quando cambiano i filtri
+    selection = (data_key, filters, by)
+    shown = st.session_state.get('panels_shown')
+    if not shown or shown[0] != selection:
+        shown = (selection, PANEL_BATCH)
+        st.session_state['panels_shown'] = shown
+    names = panel_set.names[:shown[1]]
+
+    st.caption(f"{len(panel_set)} pannelli; stesse date in tutti, colori uguali per la stessa serie.")
+    for start in range(0, len(names), PANEL_COLUMNS):
+        for col, name in zip(st.columns(PANEL_COLUMNS), names[start:start + PANEL_COLUMNS]):
+            with col:
+                st.plotly_chart(get_panel_figure(data_key, filters, by, shared_y, name, panel_set),
+                                width='stretch', config={'displayModeBar': False})
+    remaining = len(panel_set) - len(names)
+    if remaining > 0:
+        # Il gruppo successivo viene aggiunto prima del rerun, che riguarda solo la sezione del grafico
+        st.button(f"Mostra altri pannelli ({remaining} rimanenti)", on_click=show_more_panels,
+                  args=(selection, shown[1] + PANEL_BATCH))
+
+def chart_bucket(chart_type, aggregate, start_date, end_date):
+    """Periodo dell'aggregazione temporale, oppure None per disegnare ogni lettura."""
+    if aggregate and chart_type in AGGREGATED_CHART_TYPES:
+        return choose_bucket(start_date, end_date)
+    return None
+
+@st.fragment
+def chart_section(df_filtered, start_date, end_date, min_date, max_date,
+                  data_key=None, filters=None, has_limits=False, view_state=None, view_defaults=None):
+    """Grafico Plotly con i suoi controlli (tipo di grafico e aggregazione)."""
+    chart_options = ['line', 'scatter', 'box', 'violin', 'histogram', 'density_histogram', 'scatter_matrix',
+                     'small_multiples']
+    if COLUMN_NAMES['abs'] not in df_filtered.columns:
+        # Senza 'ABS' la matrice di correlazione non ha una seconda dimensione
+        chart_options.remove('scatter_matrix')
+    col_type, col_aggregate = st.columns([3, 1])
+    with col_type:
+        chart_type = st.selectbox(
+            "Seleziona un tipo di grafico:",
+            options=chart_options,
+            format_func=lambda x: {'line': 'Grafico a Linee', 'scatter': 'Grafico a Dispersione', 'box': 'Box Plot',
+                                   'violin': 'Grafico a Violino', 'histogram': 'Istogramma',
+                                   'density_histogram': 'Istogramma di Densità', 'scatter_matrix': 'Matrice di Correlazione',
+                                   'small_multiples': 'Piccoli Multipli'}[x]
+        )
+    with col_aggregate:
+        aggregate = st.toggle("Aggregazione temporale automatica", value=True,
+                              help="Su intervalli lunghi linee, dispersione e istogramma mostrano media e banda "
+                                   "di percentili per periodo. Clicca un periodo per ingrandirlo.")
+
+    # La vista viene contata: le più richieste vengono pre-calcolate dopo un riavvio o un aggiornamento dei dati
+    if view_state is not None:
+        record_view('controllo_qualita', {**view_state, 'chart_type': chart_type, 'aggregate': aggregate},
+                    view_defaults)
+
+    # --- Crea il grafico Plotly in un container ---
+    with st.container():
+        # Su intervalli lunghi: media e banda di percentili per periodo invece di ogni riga
+        bucket = chart_bucket(chart_type, aggregate, start_date, end_date)
+        if chart_type == 'small_multiples':
+            # Un pannello per test o campione invece di una figura unica
+            panels_section(data_key, filters, df_filtered)
+        elif bucket is not None:
+            fig = get_results_figure(data_key, filters, chart_type, bucket, df_filtered)
+            # Clic su un periodo: l'intervallo di date si restringe al periodo (drill-down)
+            event = st.plotly_chart(fig, width='stretch', on_select='rerun', selection_mode='points',
+                                    key=f"band_chart_{start_date}_{end_date}")
+            points = event.selection.points if event else []
+            if points and len(points[0].get('customdata') or []) >= 2:
+                drill_start, drill_end = (pd.to_datetime(d).date() for d in points[0]['customdata'][:2])
+                st.session_state['drill_range'] = (max(drill_start, min_date), min(drill_end, max_date))
+                # Il nuovo intervallo cambia i filtri: serve un rerun dell'intera pagina
+                st.rerun(scope="app")
+        else:
+            st.plotly_chart(get_results_figure(data_key, filters, chart_type, bucket, df_filtered),
+                            width='stretch')
+
+        # Tasso di superamento dei limiti per periodo, dai conteggi giornalieri
+        if has_limits:
+            rate_bucket = choose_bucket(start_date, end_date) or 'D'
+            rates = exceedance_rates(get_compliance_counts(data_key, filters, df_filtered), rate_bucket)
+            if not rates.empty:
+                st.plotly_chart(compact_figure(exceedance_figure(rates, rate_bucket)), width='stretch')
+
+@st.cache_data(max_entries=8)
+def get_correlation(data_key, filters, bucket, _df_filtered):
+    """Tabella (campione, periodo) × test e matrice di correlazione per combinazione di filtri."""
+    wide = pivot_tests(_df_filtered, bucket)
+    return (wide, *correlation_matrix(wide))
+
+@st.fragment
+def correlation_section(data_key, filters, df_filtered, start_date, end_date):
+    """Correlazione tra i test selezionati, con il dettaglio di una coppia di test."""
+    with st.expander("Correlazione tra Test", expanded=False):
+        bucket = choose_bucket(start_date, end_date) or 'D'
+        wide, corr, counts = get_correlation(data_key, filters, bucket, df_filtered)
+        if wide.shape[1] < 2:
+            st.info("Seleziona almeno due test per calcolarne la correlazione.")
+            return
+        st.plotly_chart(correlation_figure(corr, counts, bucket), width='stretch')
+
+        # Coppia proposta: quella con la correlazione più forte
+        tests = corr.columns.tolist()
+        default_x, default_y = strongest_pair(corr)
+        col_x, col_y = st.columns(2)
+        with col_x:
+            test_x = st.selectbox("Test sull'asse X:", tests, index=tests.index(default_x))
+        with col_y:
+            test_y = st.selectbox("Test sull'asse Y:", tests, index=tests.index(default_y))
+        # Il dettaglio si calcola solo per la coppia scelta, con al massimo CORRELATION_MAX_POINTS punti
+        st.plotly_chart(compact_figure(pair_figure(wide, test_x, test_y)), width='stretch')
+
+@st.fragment
+def export_section(data_key, filters, df_filtered):
+    """Pulsanti per il download dei dati filtrati."""
+    download_expander = st.expander("Esporta Dati", expanded=False)
+    with download_expander:
+        csv_data, excel_data = get_export_files(data_key, filters, df_filtered)
+        hold_memory('export', (data_key, filters), (csv_data, excel_data),
+                    lambda: get_export_files.clear(data_key, filters, None))
+        col_csv, col_xlsx = st.columns(2)
+        with col_csv:
+            st.download_button(
+                label="Esporta Dati Filtrati (CSV)",
+                data=csv_data,
+                file_name="dati_filtrati.csv",
+                mime="text/csv",
+            )
+        
+        with col_xlsx:
+            st.download_button(
+                label="Esporta Dati Filtrati (XLSX)",
+                data=excel_data,
+                file_name="dati_filtrati.xlsx",
+                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+            )
+
+@st.fragment
+def table_section(df_filtered):
+    """Tabella dati in un container."""
+    with st.container():
+        st.markdown("---")
+        st.header("Tabella Dati Filtrati")
+        
+        df_table_data = df_filtered.rename(columns={
+            COLUMN_NAMES['date_time']: 'Ora',
+            COLUMN_NAMES['sample_id']: 'ID Campione',
+            COLUMN_NAMES['test_name']: 'Nome Test',
+            COLUMN_NAMES['result']: 'Risultato',
+            COLUMN_NAMES['user_id']: 'ID Operatore',
+            'abs': 'ABS'
+        })
+        
+        st.dataframe(df_table_data)
+
+@st.cache_data(max_entries=8)
+def get_version_changes(old_id, new_id):
+    """Differenze tra due versioni (gli ID sono hash del contenuto: la cache non invecchia)."""
+    return VERSIONS.compare(old_id, new_id)
+
+@st.fragment
+def versions_section(version):
+    """Confronto tra la versione caricata e una precedente: letture aggiunte, modificate e rimosse."""
+    versions = VERSIONS.versions()
+    if version is None or len(versions) < 2:
+        return
+    with st.expander("Confronta Versioni", expanded=False):
+        by_id = {meta['id']: meta for meta in versions}
+        ids = [meta['id'] for meta in reversed(versions)]
+        col_old, col_new = st.columns(2)
+        with col_new:
+            new_id = st.selectbox("Versione:", ids, index=ids.index(version['id']) if version['id'] in ids else 0,
+                                  format_func=lambda i: version_label(by_id[i]))
+        # Di default il confronto è con la versione precedente
+        default_old = previous_version(versions, new_id)
+        with col_old:
+            old_id = st.selectbox("Confronta con:", ids, index=ids.index(default_old),
+                                  format_func=lambda i: version_label(by_id[i]))
+
+        counts, changes = get_version_changes(old_id, new_id)
+        col_added, col_changed, col_removed = st.columns(3)
+        col_added.metric("Letture Aggiunte", f"{counts[ADDED]:,}")
+        col_changed.metric("Letture Modificate", f"{counts[CHANGED]:,}")
+        col_removed.metric("Letture Rimosse", f"{counts[REMOVED]:,}")
+        if len(changes) > VERSION_ROWS_SHOWN:
+            st.caption(f"Prime {VERSION_ROWS_SHOWN:,} differenze su {len(changes):,}.")
+        if len(changes):
+            st.dataframe(changes.head(VERSION_ROWS_SHOWN), hide_index=True)
+
+def warm_view(state, data_key, df, has_limits):
+    """Riempie le cache delle sezioni per una vista, come quando la pagina la mostra (pre-calcolo)."""
+    warm_start, warm_end = view_dates(state)
+    warm_filters = view_filters({**state, 'start_date': warm_start, 'end_date': warm_end})
+    warm_filtered = get_filtered_data(data_key, warm_filters, df)
+    if warm_filtered.empty:
+        return
+    if has_limits:
+        get_compliance_counts(data_key, warm_filters, warm_filtered)
+    get_correlation(data_key, warm_filters, choose_bucket(warm_start, warm_end) or 'D', warm_filtered)
+    get_export_files(data_key, warm_filters, warm_filtered)
+    if state['chart_type'] == 'small_multiples':
+        # Primo gruppo di pannelli, come si apre la sezione (un pannello per test)
+        panel_set = get_panel_set(data_key, warm_filters, 'test', False, warm_filtered)
+        for name in panel_set.names[:PANEL_BATCH]:
+            get_panel_figure(data_key, warm_filters, 'test', False, name, panel_set)
+        return
+    get_results_figure(data_key, warm_filters, state['chart_type'],
+                       chart_bucket(state['chart_type'], state['aggregate'], warm_start, warm_end), warm_filtered)
+
 # -------------------- Layout e Widget --------------------
 
 # Inizializza lo stato della sessione per controllare il popup
@@ -80,18 +513,47 @@ st.image("assets/logo.jpg", width=120)
 
 st.title("Dashboard di Test della Qualità dell'Acqua")
 
-# File uploader
-uploaded_file = st.file_uploader("Trascina e rilascia o Seleziona un file", type=['csv', 'xlsx'])
+# File uploader (più export vengono uniti in un unico dataset)
+uploaded_files = st.file_uploader("Trascina e rilascia o Seleziona uno o più file", type=['csv', 'xlsx'],
+                                  accept_multiple_files=True)
 
 # Definisci il percorso del file predefinito
 LOCAL_FILE_PATH = "documents/controllo_qualita.xlsx"
 
 # Logica di caricamento del file
-df = pd.DataFrame()
-if uploaded_file:
-    df = load_data(uploaded_file)
-else:
-    df = load_data(LOCAL_FILE_PATH)
+file_sources = resolve_uploads(uploaded_files) if uploaded_files else [LOCAL_FILE_PATH]
+# Foglio e colonne vengono proposti in base al primo file
+file_source = file_sources[0]
+is_csv = file_source.lower().endswith('.csv')
+
+# Opzioni di lettura: foglio e colonne da caricare
+with st.expander("Opzioni di Lettura", expanded=False):
+    sheet_name = None
+    if not is_csv:
+        sheet_name = st.selectbox("Foglio:", get_sheet_names(file_source))
+    column_options = get_column_names(file_source, sheet_name)
+    selected_columns = st.multiselect("Colonne da caricare:", options=column_options, default=column_options,
+                                      help="Le colonne necessarie alla dashboard vengono sempre caricate.")
+
+usecols = None if set(selected_columns) == set(column_options) else tuple(selected_columns)
+# La tabella dei limiti fa parte della chiave: modificarla ricalcola la conformità
+limits_key = source_fingerprint([limits_path()]) if os.path.exists(limits_path()) else None
+# Dataset troppo grande per la memoria rimasta alla sessione: si carica a campione
+selection = (source_fingerprint(file_sources), sheet_name, usecols, limits_key)
+sample, estimated_bytes = plan_loading(file_sources, selection)
+df, validation_report = load_data(file_sources, sheet_name, usecols, limits_key, sample)
+if sample is not None:
+    st.warning(sampled_notice(sample, estimated_bytes), icon="⚠️")
+validation_section(validation_report)
+has_limits = get_limits(limits_key) is not None
+# Chiave economica del dataset, usata dalle cache delle sezioni al posto del contenuto
+data_key = (*selection, sample)
+hold_memory('dataset', data_key, df,
+            lambda: load_data.clear(file_sources, sheet_name, usecols, limits_key, sample))
+# Solo i caricamenti completi (tutte le colonne, nessun campione) diventano una versione
+data_version = None
+if not df.empty and usecols is None and sample is None:
+    data_version = dataset_version(data_key, file_sources, df)
 
 if not df.empty:
     # --- Sidebar per i filtri con l'immagine in cima ---
@@ -102,10 +564,17 @@ if not df.empty:
     with st.sidebar.expander("Seleziona Intervallo di Date", expanded=True):
         min_date = pd.to_datetime(df[COLUMN_NAMES['date']].min()).date()
         max_date = pd.to_datetime(df[COLUMN_NAMES['date']].max()).date()
+        # La chiave dipende dai limiti del dataset, così un nuovo file riparte dall'intervallo completo
+        date_key = f"date_range_{min_date}_{max_date}"
+        # Un drill-down sul grafico aggregato imposta il nuovo intervallo prima di creare il widget
+        if 'drill_range' in st.session_state:
+            st.session_state[date_key] = st.session_state.pop('drill_range')
+        elif date_key not in st.session_state:
+            st.session_state[date_key] = (min_date, max_date)
         date_range = st.date_input("Intervallo di Date:", 
-                                     [min_date, max_date], 
                                      min_value=min_date, 
-                                     max_value=max_date)
+                                     max_value=max_date,
+                                     key=date_key)
 
     # Filtri a tendina
     with st.sidebar.expander("Filtri Categoria", expanded=True):
@@ -134,45 +603,33 @@ if not df.empty:
             step=(max_result_val - min_result_val) / 100
         )
     
-    # Filtro per il tipo di grafico
-    with st.sidebar.expander("Tipo di Grafico", expanded=True):
-        chart_type = st.selectbox(
-            "Seleziona un tipo di grafico:",
-            options=['line', 'scatter', 'box', 'violin', 'histogram', 'density_histogram', 'scatter_matrix'],
-            format_func=lambda x: {'line': 'Grafico a Linee', 'scatter': 'Grafico a Dispersione', 'box': 'Box Plot',
-                                   'violin': 'Grafico a Violino', 'histogram': 'Istogramma',
-                                   'density_histogram': 'Istogramma di Densità', 'scatter_matrix': 'Matrice di Correlazione'}[x]
-        )
-    
-    # --- Filtra i Dati ---
-    df_filtered = df.copy()
-
-    if len(date_range) == 2:
-        start_date, end_date = date_range
-        df_filtered = df_filtered[
-            (df_filtered[COLUMN_NAMES['date']] >= pd.to_datetime(start_date)) &
-            (df_filtered[COLUMN_NAMES['date']] <= pd.to_datetime(end_date))
-        ]
-
-    df_filtered = df_filtered[
-        (df_filtered[COLUMN_NAMES['result']] >= results_range[0]) &
-        (df_filtered[COLUMN_NAMES['result']] <= results_range[1])
-    ]
-
-    if selected_operators:
-        df_filtered = df_filtered[df_filtered[COLUMN_NAMES['user_id']].isin(selected_operators)]
-    elif selected_samples and selected_tests:
-        df_filtered = df_filtered[
-            df_filtered[COLUMN_NAMES['sample_id']].isin(selected_samples) &
-            df_filtered[COLUMN_NAMES['test_name']].isin(selected_tests)
-        ]
+    # Filtro per tipo di anomalia (picchi, strumenti bloccati, cambi di livello)
+    with st.sidebar.expander("Filtro Anomalie", expanded=False):
+        selected_anomalies = st.multiselect("Mostra solo:", options=list(ANOMALY_KINDS),
+                                            help="Lascia vuoto per mostrare tutte le letture.")
+
+    # --- Filtra i Dati (memorizzati per dataset e combinazione di filtri) ---
+    start_date, end_date = date_range if len(date_range) == 2 else (None, None)
+    view_state = {'start_date': start_date, 'end_date': end_date, 'results_range': results_range,
+                  'operators': selected_operators, 'samples': selected_samples, 'tests': selected_tests,
+                  'anomalies': selected_anomalies}
+    # La pagina come si apre: usata per normalizzare le viste registrate e ricostruire quelle più richieste
+    view_defaults = {'start_date': min_date, 'end_date': max_date, 'results_range': [min_result_val, max_result_val],
+                     'operators': [], 'samples': sample_options, 'tests': default_test, 'anomalies': [],
+                     'chart_type': 'line', 'aggregate': True}
+    filters = view_filters(view_state)
+    df_filtered = get_filtered_data(data_key, filters, df)
+    hold_memory('filtered', (data_key, filters), df_filtered,
+                lambda: get_filtered_data.clear(data_key, filters, None))
+    if page_profile is not None:
+        page_profile.details = str(filters)
 
     # -------------------- Visualizzazione Principale --------------------
     if df_filtered.empty:
         st.warning("Nessun dato trovato con i filtri selezionati. Prova a modificare la tua selezione.")
     else:
         # Crea le colonne per le summary cards
-        col_samples, col_avg, col_tests = st.columns(3)
+        col_samples, col_avg, col_tests, col_out = st.columns(4)
 
         with col_samples:
             total_samples = len(df_filtered[COLUMN_NAMES['sample_id']].unique())
@@ -186,91 +643,25 @@ if not df.empty:
             total_tests = len(df_filtered)
             st.metric("Test Totali", total_tests)
 
+        with col_out:
+            compliance = compliance_summary(df_filtered)
+            out_text = f"{compliance['out']} ({compliance['rate']:.1f}%)" if compliance['rate'] is not None else "0"
+            st.metric("Fuori Limite", out_text,
+                      help="Letture oltre i limiti di legge in vigore alla loro data, sul totale delle letture con un limite.")
+
         st.markdown("---")
-        
-        # --- Crea il grafico Plotly in un container ---
-        with st.container():
-            dynamic_title = ""
-            color_column = COLUMN_NAMES['sample_id']
-            
-            if len(selected_samples) == 1 and selected_tests:
-                dynamic_title = f" per il campione: {selected_samples[0]}"
-                color_column = COLUMN_NAMES['test_name']
-            elif len(selected_samples) > 1 and selected_tests:
-                dynamic_title = f" per: {', '.join(selected_tests)}"
-                color_column = COLUMN_NAMES['sample_id']
-            elif selected_tests:
-                dynamic_title = f" per: {', '.join(selected_tests)}"
-            
-            hover_cols = df_filtered.columns.tolist()
-            
-            fig = {}
-            if chart_type == 'scatter':
-                fig = px.scatter(df_filtered, x=COLUMN_NAMES['date'], y=COLUMN_NAMES['result'], color=color_column,
-                                hover_data=hover_cols, title=f"Grafico a Dispersione dei Risultati dei Test{dynamic_title}")
-            elif chart_type == 'line':
-                fig = px.line(df_filtered, x=COLUMN_NAMES['date'], y=COLUMN_NAMES['result'], color=color_column,
-                              hover_data=hover_cols, title=f"Grafico a Linee dei Risultati dei Test{dynamic_title}")
-                fig.update_traces(mode='lines+markers')
-            elif chart_type == 'box':
-                fig = px.box(df_filtered, x=COLUMN_NAMES['sample_id'], y=COLUMN_NAMES['result'], color=COLUMN_NAMES['test_name'],
-                             hover_data=hover_cols, title=f"Box Plot dei Risultati per ID Campione{dynamic_title}")
-            elif chart_type == 'violin':
-                fig = px.violin(df_filtered, x=COLUMN_NAMES['test_name'], y=COLUMN_NAMES['result'], color=COLUMN_NAMES['test_name'],
-                                hover_data=hover_cols, title=f"Grafico a Violino della Distribuzione dei Risultati{dynamic_title}")
-            elif chart_type == 'histogram':
-                fig = px.histogram(df_filtered, x=COLUMN_NAMES['date'], y=COLUMN_NAMES['result'], color=color_column,
-                                   hover_data=hover_cols, title=f"Istogramma dei Risultati dei Test{dynamic_title}", barmode="group")
-            elif chart_type == 'density_histogram':
-                fig = px.histogram(df_filtered, x=COLUMN_NAMES['result'], color=COLUMN_NAMES['test_name'],
-                                   nbins=20, histnorm='probability density', marginal='rug',
-                                   hover_data=hover_cols, title=f"Istogramma di Densità dei Risultati{dynamic_title}")
-            elif chart_type == 'scatter_matrix':
-                fig = px.scatter_matrix(df_filtered, dimensions=[COLUMN_NAMES['result'], COLUMN_NAMES['abs']],
-                                        color=COLUMN_NAMES['test_name'],
-                                        hover_data=hover_cols, title=f"Matrice di Correlazione tra Risultato e ABS{dynamic_title}")
-                fig.update_traces(diagonal_visible=False)
-            
-            st.plotly_chart(fig, use_container_width=True)
-
-            # Pulsanti per il download dei dati
-            download_expander = st.expander("Esporta Dati", expanded=False)
-            with download_expander:
-                col_csv, col_xlsx = st.columns(2)
-                with col_csv:
-                    csv_data = df_filtered.to_csv(index=False).encode('utf-8')
-                    st.download_button(
-                        label="Esporta Dati Filtrati (CSV)",
-                        data=csv_data,
-                        file_name="dati_filtrati.csv",
-                        mime="text/csv",
-                    )
-                
-                with col_xlsx:
-                    excel_data = to_excel(df_filtered)
-                    st.download_button(
-                        label="Esporta Dati Filtrati (XLSX)",
-                        data=excel_data,
-                        file_name="dati_filtrati.xlsx",
-                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-                    )
-
-
-        # Tabella dati in un container
-        with st.container():
-            st.markdown("---")
-            st.header("Tabella Dati Filtrati")
-            
-            df_table_data = df_filtered.rename(columns={
-                COLUMN_NAMES['date_time']: 'Ora',
-                COLUMN_NAMES['sample_id']: 'ID Campione',
-                COLUMN_NAMES['test_name']: 'Nome Test',
-                COLUMN_NAMES['result']: 'Risultato',
-                COLUMN_NAMES['user_id']: 'ID Operatore',
-                'abs': 'ABS'
-            })
-            
-            st.dataframe(df_table_data)
+
+        # Grafico, esportazione e tabella si aggiornano in modo indipendente
+        chart_section(df_filtered, start_date, end_date, min_date, max_date,
+                      data_key, filters, has_limits, view_state, view_defaults)
+        correlation_section(data_key, filters, df_filtered, start_date, end_date)
+        export_section(data_key, filters, df_filtered)
+        table_section(df_filtered)
+        versions_section(data_version)
+
+    # Dati predefiniti appena (ri)caricati: le viste più richieste vengono preparate in background
+    if file_sources == [LOCAL_FILE_PATH]:
+        start_prewarm('controllo_qualita', warm_view, view_defaults, version=data_key, args=(data_key, df, has_limits))
 
 # -------------------- Footer --------------------
 st.markdown("---")
@@ -295,4 +686,8 @@ if st.session_state.show_info_popup:
         **Web:** https://orizon-aix.com
     """)
     if st.button("Chiudi"):
-        st.session_state.show_info_popup = False
\ No newline at end of file
+        st.session_state.show_info_popup = False
+
+# Salva il profilo della pagina, se è tra le esecuzioni più lente
+if page_profile is not None:
+    finish_profile(page_profile)
@@ -1,9 +1,19 @@
 import streamlit as st
 import pandas as pd
 import plotly.express as px
+import plotly.graph_objects as go
 import io
 import openpyxl
 from datetime import datetime
+from core.forecast import FORECAST_COLUMNS, FORECAST_HORIZON, FORECAST_LEVEL, forecast_osmosi, month_label, total_interval
+from core.ingestion import UnsupportedFileError, list_columns, list_excel_sheets, load_osmosi_file, source_fingerprint
+from core.memory import hold_memory
+from core.prewarm import record_view, start_prewarm
+from core.profiling import PROFILE_PARAM, finish_profile, is_admin_token, profiling_enabled, start_profile
+from core.registry import UPLOAD_IDLE_SECONDS, resolve_uploads
+from core.store import open_store
+from core.tasks import TaskGraph, get_task_pool
+from core.validation import SchemaError, ValidationReport, validation_section
 
 # --- Impostazioni di base della pagina ---
 st.set_page_config(
@@ -16,6 +26,13 @@ st.set_page_config(
 if st.sidebar.button("🏠 Home"):
     st.switch_page("app.py")
 
+# Profilazione della pagina: per tutti con AVS_PROFILE=1, o per questa sessione con ?profile=<token>
+if is_admin_token(st.query_params.get(PROFILE_PARAM)):
+    st.session_state.profiling = True
+elif st.query_params.get(PROFILE_PARAM) == 'off':
+    st.session_state.profiling = False
+page_profile = start_profile('osmosi.py') if profiling_enabled() or st.session_state.get('profiling') else None
+
 # --- Colonne ---
 COLUMN_NAMES = {
     'data_inizio': 'Data Inizio',
@@ -32,30 +49,153 @@ COLUMN_NAMES = {
 mesi_ordine = ["Gennaio", "Febbraio", "Marzo", "Aprile", "Maggio", "Giugno",
                "Luglio", "Agosto", "Settembre", "Ottobre", "Novembre", "Dicembre"]
 
+# --- Metriche dei grafici ---
+METRIC_OPTIONS = {
+    'Totale MC': COLUMN_NAMES['totale_mc'],
+    'Lavaggi': COLUMN_NAMES['lavaggio']
+}
+
+# --- Archivio locale opzionale (DuckDB/SQLite), attivo con AVS_STORE_PATH ---
+# Quando è attivo, filtri e aggregazioni vengono eseguiti come query SQL sul file.
+STORE = open_store()
+
 # --- Funzione caricamento dati ---
-@st.cache_data
-def load_data(file_source):
-    """Carica i dati da un file Excel e li preprocessa."""
+# I dataset non usati per un'ora escono dalla cache, come i rispettivi upload
+@st.cache_data(ttl=UPLOAD_IDLE_SECONDS)
+def load_data(file_source, sheet_name=None, usecols=None):
+    """
+    Carica i dati da un file Excel (foglio e colonne a scelta) e li preprocessa.
+    Restituisce anche l'esito dei controlli sui dati, in cache con il dataset.
+    """
     with st.spinner('Caricamento dati in corso...'):
         try:
-            if isinstance(file_source, str):
-                df = pd.read_excel(file_source, engine='openpyxl')
-            elif file_source.name.endswith('.xlsx'):
-                df = pd.read_excel(file_source, engine='openpyxl')
-            else:
-                st.error('Tipo di file non supportato. Carica un file .xlsx.')
-                return pd.DataFrame()
-        
-            df[COLUMN_NAMES['data_inizio']] = pd.to_datetime(df[COLUMN_NAMES['data_inizio']], errors='coerce').dt.date
-            df[COLUMN_NAMES['data_fine']] = pd.to_datetime(df[COLUMN_NAMES['data_fine']], errors='coerce').dt.date
-            
-            if COLUMN_NAMES['mese'] in df.columns:
-                df[COLUMN_NAMES['mese']] = df[COLUMN_NAMES['mese']].str.strip().str.capitalize()
-            
-            return df
+            report = ValidationReport()
+            df = load_osmosi_file(file_source, sheet_name=sheet_name, usecols=usecols, report=report)
+
+            if STORE is not None:
+                STORE.write_osmosi(df)
+
+            return df, report
+        except (UnsupportedFileError, SchemaError) as e:
+            st.error(str(e))
+            return pd.DataFrame(), None
         except Exception as e:
             st.error(f'Errore durante l\'elaborazione del file: {e}')
-            return pd.DataFrame()
+            return pd.DataFrame(), None
+
+# --- Previsioni di consumi e lavaggi ---
+@st.cache_data(max_entries=8)
+def get_forecast(data_key, _df):
+    """
+    Previsioni mensili e prossimo lavaggio per dataset. I modelli restano in
+    memoria anche per versione dei dati (core/forecast.py): un file con qualche
+    mese in più aggiorna il modello già stimato invece di ristimarlo.
+    """
+    return forecast_osmosi(_df)
+
+def forecast_section(forecast, wash):
+    """Consumo previsto nei prossimi mesi e prossimo lavaggio delle membrane."""
+    if forecast is None:
+        return
+    consumption = forecast[forecast[FORECAST_COLUMNS['series']] == COLUMN_NAMES['totale_mc']]
+    total, lower, upper = total_interval(consumption)
+    col_forecast, col_wash = st.columns(2)
+    col_forecast.metric(f"Consumo Previsto (prossimi {FORECAST_HORIZON} mesi)", f"{total:,.0f}",
+                        help=f"Intervallo al {FORECAST_LEVEL:.0%}: {lower:,.0f} - {upper:,.0f} MC")
+    if wash is not None:
+        col_wash.metric("Prossimo Lavaggio Previsto", month_label(wash['expected']),
+                        delta="In ritardo" if wash['overdue'] else None, delta_color="inverse",
+                        help=f"Ultimo lavaggio: {month_label(wash['last'])}. Di solito tra "
+                             f"{month_label(wash['earliest'])} e {month_label(wash['latest'])}.")
+    st.caption("Le previsioni usano tutti i dati caricati, indipendentemente dai filtri.")
+
+def forecast_color(fig, name):
+    """Colore della traccia `name` (None: la prima) della figura, per disegnarne la previsione nello stesso colore."""
+    for trace in fig.data:
+        if (name is None or trace.name == name) and trace.line.color:
+            return trace.line.color
+    return '#7f7f7f'
+
+def add_forecast_trace(fig, x, y, lower, upper, name, color):
+    """Previsione tratteggiata con la sua banda di incertezza."""
+    fig.add_trace(go.Scatter(x=list(x) + list(x)[::-1], y=list(upper) + list(lower)[::-1], fill='toself',
+                             fillcolor=color, opacity=0.2, line={'width': 0}, hoverinfo='skip',
+                             showlegend=False, legendgroup=name))
+    fig.add_trace(go.Scatter(x=list(x), y=list(y), name=name, mode='lines+markers', legendgroup=name,
+                             line={'color': color, 'dash': 'dash'}))
+
+def forecast_years(forecast, osmosi_filters):
+    """Anni delle previsioni da mostrare: quelli filtrati, più gli anni ancora senza dati."""
+    years = forecast[COLUMN_NAMES['anno']].unique()
+    if osmosi_filters['years'] and not forecast.empty:
+        # Ultimo anno con dati: quello del primo mese previsto, o il precedente se la previsione parte da gennaio
+        first = forecast.iloc[0]
+        last_year = first[COLUMN_NAMES['anno']] - (first[COLUMN_NAMES['mese']] == mesi_ordine[0])
+        years = [year for year in years if year in osmosi_filters['years'] or year > last_year]
+    return years
+
+def add_monthly_forecast(fig, forecast, y_axis_metric, osmosi_filters, df_grouped):
+    """Aggiunge al grafico a linee mensile la previsione della metrica, una traccia per anno."""
+    forecast = forecast[forecast[FORECAST_COLUMNS['series']] == y_axis_metric]
+    if osmosi_filters['months']:
+        forecast = forecast[forecast[COLUMN_NAMES['mese']].isin(osmosi_filters['months'])]
+    for year in forecast_years(forecast, osmosi_filters):
+        rows = forecast[forecast[COLUMN_NAMES['anno']] == year]
+        x, y = list(rows[COLUMN_NAMES['mese']]), list(rows[FORECAST_COLUMNS['forecast']])
+        lower, upper = list(rows[FORECAST_COLUMNS['lower']]), list(rows[FORECAST_COLUMNS['upper']])
+        # La previsione riparte dall'ultimo mese con dati dello stesso anno, se è quello subito prima
+        observed = df_grouped[df_grouped[COLUMN_NAMES['anno']] == year]
+        if not observed.empty and mesi_ordine.index(str(observed[COLUMN_NAMES['mese']].iloc[-1])) == mesi_ordine.index(x[0]) - 1:
+            last_value = observed[y_axis_metric].iloc[-1]
+            x, y = [str(observed[COLUMN_NAMES['mese']].iloc[-1])] + x, [last_value] + y
+            lower, upper = [last_value] + lower, [last_value] + upper
+        add_forecast_trace(fig, x, y, lower, upper, f"Previsione {year}", forecast_color(fig, str(year)))
+    fig.update_xaxes(categoryorder='array', categoryarray=mesi_ordine)
+
+def add_yearly_forecast(fig, forecast, y_axis_metric, osmosi_filters, df_filtered, df_yearly):
+    """
+    Aggiunge al grafico annuale il totale previsto degli anni che le previsioni
+    completano (mesi con dati più mesi previsti), con il suo intervallo.
+    """
+    forecast = forecast[forecast[FORECAST_COLUMNS['series']] == y_axis_metric]
+    wanted = set(osmosi_filters['months'] or mesi_ordine)
+    last_year = df_yearly[COLUMN_NAMES['anno']].max() if not df_yearly.empty else 0
+    totals = df_yearly.set_index(COLUMN_NAMES['anno'])[y_axis_metric]
+    x, y, lower, upper = [], [], [], []
+    for year in forecast_years(forecast, osmosi_filters):
+        rows = forecast[(forecast[COLUMN_NAMES['anno']] == year) & forecast[COLUMN_NAMES['mese']].isin(wanted)]
+        observed_months = set(df_filtered.loc[df_filtered[COLUMN_NAMES['anno']] == year, COLUMN_NAMES['mese']].astype(str))
+        if not wanted <= observed_months | set(rows[COLUMN_NAMES['mese']]):
+            continue
+        observed = float(totals.get(year, 0))
+        total, low, high = total_interval(rows)
+        x.append(year)
+        y.append(observed + total)
+        lower.append(observed + low)
+        upper.append(observed + high)
+    if not x:
+        return
+    # La previsione parte dall'ultimo totale con dati
+    if last_year in totals.index and last_year not in x:
+        x, y = [last_year] + x, [float(totals[last_year])] + y
+        lower, upper = [y[0]] + lower, [y[0]] + upper
+    # Un anno previsto è spesso un punto solo: l'intervallo si disegna come barra d'errore
+    fig.add_trace(go.Scatter(x=x, y=y, name="Previsione", mode='lines+markers',
+                             line={'color': forecast_color(fig, None), 'dash': 'dash'},
+                             error_y={'type': 'data', 'symmetric': False,
+                                      'array': [high - value for value, high in zip(y, upper)],
+                                      'arrayminus': [value - low for value, low in zip(y, lower)]}))
+
+# --- Fogli e colonne disponibili, senza caricare i dati ---
+@st.cache_data
+def get_sheet_names(file_source):
+    """Restituisce i fogli disponibili nel file Excel."""
+    return list_excel_sheets(file_source)
+
+@st.cache_data
+def get_column_names(file_source, sheet_name=None):
+    """Restituisce le colonne del foglio scelto."""
+    return list_columns(file_source, sheet_name)
 
 # --- Funzione esportazione Excel ---
 def to_excel(df):
@@ -65,19 +205,123 @@ def to_excel(df):
         df.to_excel(writer, index=False, sheet_name='Dati Filtrati')
     return output.getvalue()
 
-# --- Layout ---
-st.title("Dashboard Consumi Acqua (Osmosi)")
+# --- Filtri come tupla (chiave delle cache) e come dizionario (query) ---
+def view_filters(state):
+    """Tupla dei filtri di una vista (anni, mesi, lavaggi, intervallo di Totale MC)."""
+    return (tuple(state['years'] or ()), tuple(state['months'] or ()), tuple(state['lavaggio'] or ()),
+            tuple(state['mc_range']))
 
-uploaded_file = st.file_uploader("Trascina e rilascia o Seleziona un file", type=['xlsx'])
-LOCAL_FILE_PATH = "documents/osmosi_report.xlsx"
+def filters_dict(filters):
+    """Filtri per nome, nella forma usata dall'archivio locale."""
+    return {'years': list(filters[0]), 'months': list(filters[1]),
+            'lavaggio': list(filters[2]), 'mc_range': list(filters[3])}
 
-df = load_data(uploaded_file if uploaded_file else LOCAL_FILE_PATH)
+# --- Sezioni con aggiornamento indipendente ---
+# Grafici, esportazione e tabella sono fragment: cambiare metrica o tipo di grafico
+# riesegue solo i grafici, senza rifare filtri, metriche ed esportazione.
+@st.cache_data(max_entries=32)
+def get_filtered_data(data_key, filters, _df):
+    """
+    Applica i filtri, memorizzando il risultato per dataset e combinazione di filtri.
+    Ogni sessione riceve una propria copia del DataFrame.
+    """
+    osmosi_filters = filters_dict(filters)
+    if STORE is not None:
+        # Filtro eseguito come query SQL sull'archivio locale
+        df_filtered = STORE.osmosi_rows(osmosi_filters)
+    else:
+        df_filtered = _df
+        if osmosi_filters['months']:
+            df_filtered = df_filtered[df_filtered[COLUMN_NAMES['mese']].isin(osmosi_filters['months'])]
+        if osmosi_filters['years']:
+            df_filtered = df_filtered[df_filtered[COLUMN_NAMES['anno']].isin(osmosi_filters['years'])]
+        if osmosi_filters['lavaggio']:
+            df_filtered = df_filtered[df_filtered[COLUMN_NAMES['lavaggio']].isin(osmosi_filters['lavaggio'])]
+        mc_range = osmosi_filters['mc_range']
+        df_filtered = df_filtered[(df_filtered[COLUMN_NAMES['totale_mc']] >= mc_range[0]) &
+                                 (df_filtered[COLUMN_NAMES['totale_mc']] <= mc_range[1])].copy()
 
-if not df.empty:
-    st.sidebar.header("Filtri Dati")
+    # Ordina mesi
+    df_filtered[COLUMN_NAMES['mese']] = pd.Categorical(df_filtered[COLUMN_NAMES['mese']], categories=mesi_ordine, ordered=True)
+    return df_filtered.sort_values([COLUMN_NAMES['anno'], COLUMN_NAMES['mese']])
+
+@st.cache_resource(max_entries=8)
+def get_export_file(data_key, filters, _df_filtered):
+    """
+    Avvia la generazione dell'XLSX, una sola volta per combinazione di filtri, sul
+    pool dei compiti: intanto la pagina mostra metriche e grafici. Restituisce un Future;
+    se l'esportazione fallisce, export_section toglie il Future dalla cache.
+    """
+    return get_task_pool().submit(to_excel, _df_filtered)
+
+def osmosi_summary(osmosi_filters, df_filtered):
+    """Totale MC, media MC e numero di lavaggi dei dati filtrati."""
+    if STORE is not None:
+        summary = STORE.osmosi_summary(osmosi_filters)
+        return summary['total_mc'], summary['mean_mc'], int(summary['washes'])
+    return (df_filtered[COLUMN_NAMES['totale_mc']].sum(), df_filtered[COLUMN_NAMES['totale_mc']].mean(),
+            df_filtered[COLUMN_NAMES['lavaggio']].sum())
+
+def monthly_figure(df_filtered, osmosi_filters, chart_type, y_axis_metric, y_axis_metric_name, forecast=None):
+    """Grafico a barre o a linee della metrica per mese; il grafico a linee mostra anche la previsione."""
+    # --- Grafico a barre o linea per mesi ---
+    if chart_type == 'bar':
+        fig = px.bar(df_filtered, x=COLUMN_NAMES['mese'], y=y_axis_metric,
+                     color=COLUMN_NAMES['lavaggio'],
+                     title=f"Consumo Totale {y_axis_metric_name} per Mese",
+                     labels={y_axis_metric: f'{y_axis_metric_name}',
+                             COLUMN_NAMES['mese']: 'Mese',
+                             COLUMN_NAMES['lavaggio']:'Lavaggi'})
+    else: # Grafico a linee
+        if STORE is not None:
+            df_grouped = STORE.osmosi_totals(osmosi_filters, y_axis_metric, [COLUMN_NAMES['anno'], COLUMN_NAMES['mese']])
+        else:
+            df_grouped = df_filtered.groupby([COLUMN_NAMES['anno'], COLUMN_NAMES['mese']])[y_axis_metric].sum().reset_index()
+        df_grouped[COLUMN_NAMES['mese']] = pd.Categorical(df_grouped[COLUMN_NAMES['mese']], categories=mesi_ordine, ordered=True)
+        df_grouped = df_grouped.sort_values([COLUMN_NAMES['anno'], COLUMN_NAMES['mese']])
+        df_grouped["Mese_Label"] = df_grouped[COLUMN_NAMES['mese']]
+        
+        fig = px.line(df_grouped, x="Mese_Label", y=y_axis_metric, color=COLUMN_NAMES['anno'],
+                      title=f"Consumo Totale {y_axis_metric_name} per Mese",
+                      labels={y_axis_metric: f'{y_axis_metric_name}', "Mese_Label":"Mese", COLUMN_NAMES['anno']:'Anno'})
+        fig.update_traces(mode='lines+markers')
+        if forecast is not None:
+            add_monthly_forecast(fig, forecast, y_axis_metric, osmosi_filters, df_grouped)
+    return fig
 
-    # Tipo grafico
-    with st.sidebar.expander("Tipo di Grafico", expanded=True):
+def yearly_figure(df_filtered, osmosi_filters, y_axis_metric, y_axis_metric_name, forecast=None):
+    """Grafico a linee del totale della metrica per anno, con il totale previsto degli anni in corso."""
+    if STORE is not None:
+        df_yearly = STORE.osmosi_totals(osmosi_filters, y_axis_metric, [COLUMN_NAMES['anno']]).sort_values(COLUMN_NAMES['anno'])
+    else:
+        df_yearly = df_filtered.groupby(COLUMN_NAMES['anno'])[y_axis_metric].sum().reset_index()
+    fig_yearly = px.line(df_yearly, x=COLUMN_NAMES['anno'], y=y_axis_metric,
+                         title=f"Totale {y_axis_metric_name} per Anno",
+                         labels={COLUMN_NAMES['anno']:'Anno', y_axis_metric:y_axis_metric_name})
+    fig_yearly.update_traces(mode='lines+markers')
+    if forecast is not None:
+        add_yearly_forecast(fig_yearly, forecast, y_axis_metric, osmosi_filters, df_filtered, df_yearly)
+    return fig_yearly
+
+@st.cache_data(max_entries=32)
+def get_charts(data_key, filters, chart_type, y_axis_metric_name, _df_filtered, _forecast=None):
+    """
+    Grafici mensile e annuale per dataset, filtri, tipo di grafico e metrica.
+    Ogni sessione riceve una propria copia delle figure.
+    """
+    osmosi_filters = filters_dict(filters)
+    y_axis_metric = METRIC_OPTIONS[y_axis_metric_name]
+    # I due grafici sono indipendenti: vengono costruiti in parallelo
+    graph = TaskGraph()
+    graph.add('monthly', monthly_figure, _df_filtered, osmosi_filters, chart_type, y_axis_metric, y_axis_metric_name, _forecast)
+    graph.add('yearly', yearly_figure, _df_filtered, osmosi_filters, y_axis_metric, y_axis_metric_name, _forecast)
+    return graph.result('monthly'), graph.result('yearly')
+
+@st.fragment
+def chart_section(data_key, filters, df_filtered, view_state, view_defaults, forecast=None):
+    """Grafici mensile e annuale con i relativi controlli (tipo di grafico e metrica)."""
+    col_type, col_metric = st.columns(2)
+    with col_type:
         chart_type = st.selectbox(
             "Seleziona un tipo di grafico:",
             options=['bar', 'line'],
@@ -85,15 +329,81 @@ if not df.empty:
         )
 
     # Scelta della metrica
-    y_axis_metric_options = {
-        'Totale MC': COLUMN_NAMES['totale_mc'],
-        'Lavaggi': COLUMN_NAMES['lavaggio']
-    }
-    y_axis_metric_name = st.sidebar.selectbox(
-        "Seleziona la metrica da visualizzare:",
-        options=list(y_axis_metric_options.keys())
-    )
-    y_axis_metric = y_axis_metric_options[y_axis_metric_name]
+    with col_metric:
+        y_axis_metric_name = st.selectbox(
+            "Seleziona la metrica da visualizzare:",
+            options=list(METRIC_OPTIONS.keys())
+        )
+
+    # La vista viene contata: le più richieste vengono pre-calcolate dopo un riavvio o un aggiornamento dei dati
+    record_view('osmosi', {**view_state, 'chart_type': chart_type, 'metric': y_axis_metric_name}, view_defaults)
+    fig_monthly, fig_yearly = get_charts(data_key, filters, chart_type, y_axis_metric_name, df_filtered, forecast)
+
+    st.header(f"Consumo di {y_axis_metric_name} per Mese")
+    st.plotly_chart(fig_monthly, width='stretch')
+
+    # --- Grafico Totale annuale (ora dinamico) ---
+    st.markdown("---")
+    st.header(f"Consumo Totale {y_axis_metric_name} per Anno")
+    st.plotly_chart(fig_yearly, width='stretch')
+
+@st.fragment
+def export_section(data_key, filters, df_filtered):
+    """Pulsante per il download dei dati filtrati."""
+    with st.expander("Esporta Dati", expanded=False):
+        try:
+            excel_data = get_export_file(data_key, filters, df_filtered).result()
+        except Exception as e:
+            # Un'esportazione fallita non resta in cache: la prossima esecuzione la rigenera
+            get_export_file.clear(data_key, filters, None)
+            st.error(f"Esportazione non riuscita: {e}")
+            return
+        st.download_button("Esporta Dati Filtrati (XLSX)", excel_data,
+                           file_name="dati_osmosi_filtrati.xlsx",
+                           mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+
+@st.fragment
+def table_section(df_filtered):
+    """Tabella dei dati filtrati."""
+    st.markdown("---")
+    st.header("Tabella Dati Filtrati")
+    st.dataframe(df_filtered, column_config={
+        COLUMN_NAMES['data_inizio']: st.column_config.DateColumn(format="DD/MM/YYYY"),
+        COLUMN_NAMES['data_fine']: st.column_config.DateColumn(format="DD/MM/YYYY"),
+    })
+
+def warm_view(state, data_key, df):
+    """Riempie le cache di grafici ed esportazione per una vista, come quando la pagina la mostra (pre-calcolo)."""
+    warm_filters = view_filters(state)
+    warm_filtered = get_filtered_data(data_key, warm_filters, df)
+    if not warm_filtered.empty:
+        get_export_file(data_key, warm_filters, warm_filtered)
+        get_charts(data_key, warm_filters, state['chart_type'], state['metric'], warm_filtered,
+                   get_forecast(data_key, df)[0])
+
+# --- Layout ---
+st.title("Dashboard Consumi Acqua (Osmosi)")
+
+uploaded_file = st.file_uploader("Trascina e rilascia o Seleziona un file", type=['xlsx'])
+LOCAL_FILE_PATH = "documents/osmosi_report.xlsx"
+
+file_source = resolve_uploads([uploaded_file], 'osmosi_upload_ids')[0] if uploaded_file else LOCAL_FILE_PATH
+
+with st.expander("Opzioni di Lettura", expanded=False):
+    sheet_name = st.selectbox("Foglio:", get_sheet_names(file_source))
+    column_options = get_column_names(file_source, sheet_name)
+    selected_columns = st.multiselect("Colonne da caricare:", options=column_options, default=column_options,
+                                      help="Le colonne necessarie alla dashboard vengono sempre caricate.")
+
+usecols = None if set(selected_columns) == set(column_options) else tuple(selected_columns)
+df, validation_report = load_data(file_source, sheet_name, usecols)
+validation_section(validation_report)
+# Chiave economica del dataset, usata dalle cache delle sezioni al posto del contenuto
+data_key = (source_fingerprint([file_source]), sheet_name, usecols)
+hold_memory('osmosi_dataset', data_key, df, lambda: load_data.clear(file_source, sheet_name, usecols))
+
+if not df.empty:
+    st.sidebar.header("Filtri Dati")
 
     # --- FILTRO ANNO ---
     anno_corrente = datetime.now().year
@@ -111,70 +421,47 @@ if not df.empty:
     min_mc_val, max_mc_val = float(df[COLUMN_NAMES['totale_mc']].min()), float(df[COLUMN_NAMES['totale_mc']].max())
     mc_range = st.sidebar.slider("Totale MC:", min_mc_val, max_mc_val, [min_mc_val, max_mc_val], step=10000.0)
 
-    # --- FILTRO DATI ---
-    df_filtered = df.copy()
-    if selected_months:
-        df_filtered = df_filtered[df_filtered[COLUMN_NAMES['mese']].isin(selected_months)]
-    if selected_years:
-        df_filtered = df_filtered[df_filtered[COLUMN_NAMES['anno']].isin(selected_years)]
-    if selected_lavaggio:
-        df_filtered = df_filtered[df_filtered[COLUMN_NAMES['lavaggio']].isin(selected_lavaggio)]
-    df_filtered = df_filtered[(df_filtered[COLUMN_NAMES['totale_mc']] >= mc_range[0]) &
-                             (df_filtered[COLUMN_NAMES['totale_mc']] <= mc_range[1])]
-
-    # Ordina mesi
-    df_filtered[COLUMN_NAMES['mese']] = pd.Categorical(df_filtered[COLUMN_NAMES['mese']], categories=mesi_ordine, ordered=True)
-    df_filtered = df_filtered.sort_values([COLUMN_NAMES['anno'], COLUMN_NAMES['mese']])
+    # --- FILTRO DATI (memorizzato per dataset e combinazione di filtri) ---
+    view_state = {'years': selected_years, 'months': selected_months,
+                  'lavaggio': selected_lavaggio, 'mc_range': mc_range}
+    # La pagina come si apre: usata per normalizzare le viste registrate e ricostruire quelle più richieste
+    view_defaults = {'years': default_year, 'months': default_months, 'lavaggio': [],
+                     'mc_range': [min_mc_val, max_mc_val], 'chart_type': 'bar', 'metric': 'Totale MC'}
+    filters = view_filters(view_state)
+    osmosi_filters = filters_dict(filters)
+    df_filtered = get_filtered_data(data_key, filters, df)
+    hold_memory('osmosi_filtered', (data_key, filters), df_filtered,
+                lambda: get_filtered_data.clear(data_key, filters, None))
+    if page_profile is not None:
+        page_profile.details = str(filters)
 
     if df_filtered.empty:
         st.warning("Nessun dato trovato con i filtri selezionati.")
     else:
+        # L'esportazione non dipende da metriche e grafici: parte subito e prosegue in parallelo
+        get_export_file(data_key, filters, df_filtered)
+
+        total_mc, mean_mc, washes = osmosi_summary(osmosi_filters, df_filtered)
         col_total, col_avg, col_wash = st.columns(3)
-        col_total.metric("Totale MC Consumati", f"{df_filtered[COLUMN_NAMES['totale_mc']].sum():,.0f}")
-        col_avg.metric("Media MC al Mese", f"{df_filtered[COLUMN_NAMES['totale_mc']].mean():,.2f}")
-        col_wash.metric("Numero Totale di Lavaggi", df_filtered[COLUMN_NAMES['lavaggio']].sum())
+        col_total.metric("Totale MC Consumati", f"{total_mc:,.0f}")
+        col_avg.metric("Media MC al Mese", f"{mean_mc:,.2f}")
+        col_wash.metric("Numero Totale di Lavaggi", washes)
 
-        st.markdown("---")
-        st.header(f"Consumo di {y_axis_metric_name} per Mese")
-
-        # --- Grafico a barre o linea per mesi ---
-        if chart_type == 'bar':
-            fig = px.bar(df_filtered, x=COLUMN_NAMES['mese'], y=y_axis_metric,
-                         color=COLUMN_NAMES['lavaggio'],
-                         title=f"Consumo Totale {y_axis_metric_name} per Mese",
-                         labels={y_axis_metric: f'{y_axis_metric_name}',
-                                 COLUMN_NAMES['mese']: 'Mese',
-                                 COLUMN_NAMES['lavaggio']:'Lavaggi'})
-        else: # Grafico a linee
-            df_grouped = df_filtered.groupby([COLUMN_NAMES['anno'], COLUMN_NAMES['mese']])[y_axis_metric].sum().reset_index()
-            df_grouped[COLUMN_NAMES['mese']] = pd.Categorical(df_grouped[COLUMN_NAMES['mese']], categories=mesi_ordine, ordered=True)
-            df_grouped = df_grouped.sort_values([COLUMN_NAMES['anno'], COLUMN_NAMES['mese']])
-            df_grouped["Mese_Label"] = df_grouped[COLUMN_NAMES['mese']]
-            
-            fig = px.line(df_grouped, x="Mese_Label", y=y_axis_metric, color=COLUMN_NAMES['anno'],
-                          title=f"Consumo Totale {y_axis_metric_name} per Mese",
-                          labels={y_axis_metric: f'{y_axis_metric_name}', "Mese_Label":"Mese", COLUMN_NAMES['anno']:'Anno'})
-            fig.update_traces(mode='lines+markers')
-        
-        st.plotly_chart(fig, use_container_width=True)
+        # Previsioni per la manutenzione, stimate una volta per versione dei dati
+        forecast, wash = get_forecast(data_key, df)
+        forecast_section(forecast, wash)
 
-        # --- Grafico Totale annuale (ora dinamico) ---
         st.markdown("---")
-        st.header(f"Consumo Totale {y_axis_metric_name} per Anno")
-        df_yearly = df_filtered.groupby(COLUMN_NAMES['anno'])[y_axis_metric].sum().reset_index()
-        fig_yearly = px.line(df_yearly, x=COLUMN_NAMES['anno'], y=y_axis_metric,
-                             title=f"Totale {y_axis_metric_name} per Anno",
-                             labels={COLUMN_NAMES['anno']:'Anno', y_axis_metric:y_axis_metric_name})
-        fig_yearly.update_traces(mode='lines+markers')
-        st.plotly_chart(fig_yearly, use_container_width=True)
-
-        # --- Download ---
-        with st.expander("Esporta Dati", expanded=False):
-            excel_data = to_excel(df_filtered)
-            st.download_button("Esporta Dati Filtrati (XLSX)", excel_data,
-                               file_name="dati_osmosi_filtrati.xlsx",
-                               mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
 
-        st.markdown("---")
-        st.header("Tabella Dati Filtrati")
-        st.dataframe(df_filtered)
\ No newline at end of file
+        # Grafici, esportazione e tabella si aggiornano in modo indipendente
+        chart_section(data_key, filters, df_filtered, view_state, view_defaults, forecast)
+        export_section(data_key, filters, df_filtered)
+        table_section(df_filtered)
+
+    # Dati predefiniti appena (ri)caricati: le viste più richieste vengono preparate in background
+    if file_source == LOCAL_FILE_PATH:
+        start_prewarm('osmosi', warm_view, view_defaults, version=data_key, args=(data_key, df))
+
+# Salva il profilo della pagina, se è tra le esecuzioni più lente
+if page_profile is not None:
+    finish_profile(page_profile)
@@ -0,0 +1,23 @@
+"""Dati sintetici condivisi dai test."""
+import numpy as np
+import pandas as pd
+
+from core.schema import QUALITY_COLUMNS
+
+SAMPLES = ('CCA', 'CCB', 'OSMOSI')
+TESTS = ('COD', 'Surfattanti anionici')
+
+
+def quality_frame(rows, seed=0, start='2025-01-01', freq='10min'):
+    """Letture di Controllo Qualità sintetiche, ordinate per 'Time', una ogni `freq`."""
+    rng = np.random.default_rng(seed)
+    times = pd.date_range(start, periods=rows, freq=freq)
+    df = pd.DataFrame({
+        QUALITY_COLUMNS['date_time']: times,
+        QUALITY_COLUMNS['user_id']: rng.choice(['ARNEL KOVAC', 'MARIO ROSSI'], rows),
+        QUALITY_COLUMNS['sample_id']: rng.choice(SAMPLES, rows),
+        QUALITY_COLUMNS['test_name']: rng.choice(TESTS, rows),
+        QUALITY_COLUMNS['result']: rng.gamma(4.0, 400.0, rows).round(1),
+    })
+    df[QUALITY_COLUMNS['date']] = df[QUALITY_COLUMNS['date_time']].dt.floor('D')
+    return df
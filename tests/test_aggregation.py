@@ -0,0 +1,56 @@
+import pandas as pd
+import pytest
+
+from core.aggregation import (MAX_BUCKETS, PERIOD_END, PERIOD_START, aggregate_results, band_figure,
+                              choose_bucket)
+from helpers import quality_frame
+
+
+@pytest.mark.parametrize('start, end, bucket', [
+    ('2025-01-01', '2025-01-31', None),
+    ('2025-01-01', '2025-03-31', 'D'),
+    ('2025-01-01', '2026-12-31', 'W-MON'),
+    ('2020-01-01', '2029-12-31', 'MS'),
+    ('1990-01-01', '2029-12-31', 'QS'),
+    (None, '2025-01-31', None),
+])
+def test_choose_bucket(start, end, bucket):
+    assert choose_bucket(start, end) == bucket
+
+
+def test_bucket_keeps_series_short():
+    start = pd.Timestamp('2025-01-01')
+    for days in (40, 200, 800, 5000):
+        end = start + pd.Timedelta(days=days)
+        freq = choose_bucket(start, end)
+        assert len(pd.date_range(start, end, freq=freq)) <= MAX_BUCKETS + 1
+
+
+def test_aggregate_matches_groupby():
+    df = quality_frame(5000, freq='1h')
+    agg = aggregate_results(df, 'MS')
+    assert agg['count'].sum() == len(df)
+    month = df['Time'].dt.to_period('M').dt.start_time
+    expected = df.groupby(['Sample ID', 'Test Name', month])['Result'].agg(['mean', 'min', 'max', 'count'])
+    actual = agg.set_index(['Sample ID', 'Test Name', PERIOD_START])[['mean', 'min', 'max', 'count']]
+    pd.testing.assert_frame_equal(actual, expected, check_names=False, check_dtype=False)
+    assert (agg['p10'] <= agg['mean']).all() and (agg['mean'] <= agg['p90']).all()
+    first = agg.iloc[0]
+    assert first[PERIOD_END] == pd.Timestamp('2025-01-31')
+
+
+def test_weekly_periods_start_on_monday():
+    agg = aggregate_results(quality_frame(2000, freq='2h'), 'W-MON')
+    assert (agg[PERIOD_START].dt.dayofweek == 0).all()
+    assert ((agg[PERIOD_END] - agg[PERIOD_START]).dt.days == 6).all()
+
+
+def test_band_figure_carries_the_period_for_drill_down():
+    agg = aggregate_results(quality_frame(3000, freq='1h'), 'W-MON')
+    fig = band_figure(agg, 'W-MON', 'Risultati')
+    means = [trace for trace in fig.data if trace.mode == 'lines+markers']
+    assert len(means) == agg.groupby(['Sample ID', 'Test Name']).ngroups
+    assert len(fig.data) == 3 * len(means)
+    start, end = means[0].customdata[0][:2]
+    assert (pd.Timestamp(end) - pd.Timestamp(start)).days == 6
+    assert fig.layout.meta['bucket'] == 'W-MON'
@@ -0,0 +1,86 @@
+import numpy as np
+import pandas as pd
+
+from core.anomaly import (ANOMALY_CHANGE, ANOMALY_FLATLINE, ANOMALY_NONE, ANOMALY_SPIKE, FLATLINE_RUN,
+                          anomaly_summary, score_anomalies, update_anomalies)
+from helpers import quality_frame
+
+KIND = 'Anomalia'
+
+
+def _series(values, sample='CCA', test='COD', start='2025-01-01'):
+    """Una serie (campione × test) con una lettura all'ora."""
+    return pd.DataFrame({
+        'Time': pd.date_range(start, periods=len(values), freq='h'),
+        'Sample ID': sample,
+        'Test Name': test,
+        'Result': np.asarray(values, dtype='float64'),
+    })
+
+
+def _noise(rows, level=100.0, seed=0):
+    return level + np.random.default_rng(seed).normal(0, 2, rows).round(2)
+
+
+def test_spike_is_flagged_once():
+    values = _noise(60)
+    values[40] = 400.0
+    kinds = score_anomalies(_series(values))[KIND]
+    assert kinds[40] == ANOMALY_SPIKE
+    assert (kinds.drop(40) == ANOMALY_NONE).all()
+
+
+def test_stuck_instrument_is_flagged_from_the_run_length():
+    values = _noise(40)
+    values[20:30] = 101.5
+    kinds = score_anomalies(_series(values))[KIND]
+    stuck = 20 + FLATLINE_RUN - 1
+    assert (kinds[stuck:30] == ANOMALY_FLATLINE).all()
+    assert (kinds[20:stuck] != ANOMALY_FLATLINE).all()
+
+
+def test_level_change_is_flagged_on_its_first_reading_only():
+    values = np.concatenate([_noise(40), _noise(40, level=160.0, seed=1)])
+    kinds = score_anomalies(_series(values))[KIND]
+    assert (kinds == ANOMALY_CHANGE).sum() == 1
+    change = kinds[kinds == ANOMALY_CHANGE].index[0]
+    assert 40 <= change < 45
+    # Dal cambio in poi le letture del nuovo livello non sono picchi
+    assert (kinds[change:] != ANOMALY_SPIKE).all()
+
+
+def test_scores_keep_the_original_row_order():
+    df = quality_frame(300)
+    shuffled = df.sample(frac=1, random_state=0)
+    pd.testing.assert_frame_equal(score_anomalies(shuffled).loc[df.index], score_anomalies(df))
+
+
+def test_scores_only_use_previous_readings():
+    df = quality_frame(400)
+    full = score_anomalies(df)
+    pd.testing.assert_frame_equal(score_anomalies(df.iloc[:250]), full.iloc[:250])
+
+
+def test_update_matches_scoring_the_whole_history():
+    df = quality_frame(600)
+    df.loc[df.index[580], 'Result'] = 1e6
+    full = score_anomalies(df)
+    history, new_rows = df.iloc[:550], df.iloc[550:].reset_index(drop=True)
+    updated = update_anomalies(score_anomalies(history), new_rows)
+    pd.testing.assert_frame_equal(updated, full.iloc[550:].reset_index(drop=True))
+    assert anomaly_summary(updated)[ANOMALY_SPIKE] >= 1
+
+
+def test_update_with_a_new_series_or_no_history():
+    new_rows = _series(_noise(10), sample='NUOVO')
+    expected = score_anomalies(new_rows)
+    updated = update_anomalies(score_anomalies(quality_frame(50)), new_rows)
+    pd.testing.assert_frame_equal(updated[expected.columns], expected)
+    pd.testing.assert_frame_equal(update_anomalies(pd.DataFrame(), new_rows), score_anomalies(new_rows))
+
+
+def test_empty_frame_gets_the_columns():
+    scored = score_anomalies(_series([]))
+    assert scored.empty
+    assert KIND in scored.columns
+    assert anomaly_summary(scored) == {ANOMALY_SPIKE: 0, ANOMALY_FLATLINE: 0, ANOMALY_CHANGE: 0}
@@ -0,0 +1,49 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from core.approximate import QualitySketch
+from core.compliance import apply_limits, compliance_summary
+from core.filters import filter_quality
+from helpers import quality_frame
+
+LIMITS = pd.DataFrame({'Test Name': ['COD', 'Surfattanti anionici'], 'Sample ID': [None, None],
+                       'Valido Dal': pd.to_datetime(['2024-01-01', '2024-01-01']),
+                       'Limite Min': [np.nan, np.nan], 'Limite Max': [2000.0, 1800.0]})
+
+
+@pytest.fixture(scope='module')
+def readings():
+    return apply_limits(quality_frame(60_000, seed=3), LIMITS)
+
+
+@pytest.fixture(scope='module')
+def sketch(readings):
+    return QualitySketch(readings, sample_rows_target=6_000)
+
+
+@pytest.mark.parametrize('filters', [
+    {},
+    {'start_date': '2025-02-10', 'end_date': '2025-08-20'},
+    {'results_range': [800, 2500]},
+    {'start_date': '2025-03-05', 'end_date': '2025-06-12', 'results_range': [500, 3000]},
+    {'operators': ['MARIO ROSSI']},
+])
+def test_estimate_within_error(readings, sketch, filters):
+    exact = filter_quality(readings, **filters)
+    estimate = sketch.estimate(filters)
+    error = estimate['error']
+    tests = estimate['summary']['tests']
+    # Margine oltre l'intervallo al 95%: qualche caso su 20 ne resta fuori per costruzione
+    assert abs(tests - len(exact)) <= 2 * error['tests'] * len(exact) + 1
+    assert abs(estimate['summary']['avg_result'] - exact['Result'].mean()) <= 2 * error['avg_result'] + 1e-6
+    assert abs(estimate['compliance']['out'] - compliance_summary(exact)['out']) <= 2 * error['out'] + 1
+
+
+def test_estimate_is_exact_on_whole_months(readings, sketch):
+    filters = {'start_date': '2025-02-01', 'end_date': '2025-05-31'}
+    exact = filter_quality(readings, **filters)
+    estimate = sketch.estimate(filters)
+    assert estimate['summary']['tests'] == len(exact)
+    assert estimate['compliance']['out'] == compliance_summary(exact)['out']
+    assert estimate['error']['tests'] == 0
@@ -0,0 +1,94 @@
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from core.compliance import (CHECKED, OUT, RATE, STATUS_HIGH, STATUS_LOW, STATUS_NO_LIMIT, STATUS_OK, apply_limits,
+                             compliance_counts, compliance_summary, exceedance_rates, load_limits)
+from helpers import quality_frame
+
+LIMITS_CSV = """Test Name,Sample ID,Valido Dal,Limite Min,Limite Max
+COD,,2025-01-01,,2000
+COD,,2025-01-03,,1500
+COD,OSMOSI,2025-01-02,100,1000
+Surfattanti anionici, ,2025-01-01,500,
+"""
+
+
+def _limits():
+    return load_limits(io.StringIO(LIMITS_CSV))
+
+
+def _reading(time, sample, test, result):
+    return {'Time': pd.Timestamp(time), 'Sample ID': sample, 'Test Name': test, 'Result': result}
+
+
+def _expected_bounds(df, limits):
+    """Limiti in vigore lettura per lettura, con un ciclo semplice."""
+    bounds = []
+    for _, row in df.iterrows():
+        valid = limits[(limits['Test Name'] == row['Test Name']) & (limits['Valido Dal'] <= row['Time'])]
+        specific = valid[valid['Sample ID'] == row['Sample ID']]
+        general = valid[valid['Sample ID'].isna()]
+        version = specific if not specific.empty else general
+        bounds.append(tuple(version.iloc[-1][['Limite Min', 'Limite Max']]) if not version.empty else (np.nan, np.nan))
+    return np.array(bounds, dtype='float64')
+
+
+def test_load_limits_normalises_the_table():
+    limits = _limits()
+    assert limits['Valido Dal'].is_monotonic_increasing
+    assert limits['Sample ID'].isna().sum() == 3
+    assert limits.loc[limits['Test Name'] == 'Surfattanti anionici', 'Limite Min'].item() == 500
+
+
+def test_load_limits_requires_test_and_date(tmp_path):
+    assert load_limits(tmp_path / 'mancante.csv') is None
+    with pytest.raises(ValueError, match='Valido Dal'):
+        load_limits(io.StringIO('Test Name,Limite Max\nCOD,10\n'))
+
+
+def test_each_reading_takes_the_version_in_force():
+    df = pd.DataFrame([
+        _reading('2024-12-31 23:00', 'CCA', 'COD', 5000.0),   # prima di ogni versione
+        _reading('2025-01-01 10:00', 'CCA', 'COD', 1800.0),   # limite 2000
+        _reading('2025-01-03 00:00', 'CCA', 'COD', 1800.0),   # limite 1500 dalla mezzanotte
+        _reading('2025-01-01 10:00', 'OSMOSI', 'COD', 1800.0),  # limite specifico non ancora in vigore
+        _reading('2025-01-04 10:00', 'OSMOSI', 'COD', 50.0),  # il limite specifico resta anche dopo il 3
+        _reading('2025-01-02 10:00', 'CCB', 'Surfattanti anionici', 600.0),
+        _reading('2025-01-02 11:00', 'CCB', 'pH', 7.0),
+        _reading('2025-01-02 12:00', 'CCB', 'COD', np.nan),
+    ])
+    checked = apply_limits(df, _limits())
+    assert checked['Limite Max'].tolist()[:5] == pytest.approx([np.nan, 2000, 1500, 2000, 1000], nan_ok=True)
+    assert checked['Conformità'].tolist() == [STATUS_NO_LIMIT, STATUS_OK, STATUS_HIGH, STATUS_OK, STATUS_LOW,
+                                              STATUS_OK, STATUS_NO_LIMIT, STATUS_NO_LIMIT]
+    # Le letture restano nell'ordine originale, il DataFrame di partenza non cambia
+    assert checked['Time'].tolist() == df['Time'].tolist()
+    assert 'Conformità' not in df.columns
+
+
+def test_apply_limits_matches_a_row_by_row_lookup():
+    df = quality_frame(500, freq='17min').sample(frac=1, random_state=0)
+    limits = _limits()
+    bounds = apply_limits(df, limits)[['Limite Min', 'Limite Max']].to_numpy()
+    np.testing.assert_array_equal(bounds, _expected_bounds(df, limits))
+
+
+def test_without_limits_every_reading_is_unchecked():
+    checked = apply_limits(quality_frame(10), None)
+    assert (checked['Conformità'] == STATUS_NO_LIMIT).all()
+    assert compliance_summary(checked) == {'checked': 0, 'out': 0, 'rate': None}
+
+
+def test_summary_counts_and_rates_agree():
+    checked = apply_limits(quality_frame(2000, freq='30min'), _limits())
+    summary = compliance_summary(checked)
+    counts = compliance_counts(checked)
+    assert counts[CHECKED].sum() == summary['checked']
+    assert counts[OUT].sum() == summary['out']
+
+    rates = exceedance_rates(counts, 'W-MON')
+    assert rates[CHECKED].sum() == summary['checked']
+    assert (rates[RATE] == rates[OUT] / rates[CHECKED] * 100).all()
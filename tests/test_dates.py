@@ -0,0 +1,55 @@
+import pandas as pd
+
+from core.dates import DETECT_SAMPLE_ROWS, MIXED_FORMAT, detect_format, parse_dates
+
+
+def test_detect_format_iso():
+    assert detect_format(['2025-01-02 10:00:00', '2025-03-04 11:30:00']) == 'ISO8601'
+
+
+def test_detect_format_day_first():
+    assert detect_format(['02/01/2025 10:00', '25/03/2025 11:30']) == '%d/%m/%Y %H:%M'
+
+
+def test_detect_format_tolerates_dirty_cells():
+    # Una cella sporca su 40 non fa scartare il formato
+    values = [f'2025-01-{day:02d} 10:00' for day in range(1, 29)] * 2
+    assert detect_format(values[:39] + ['n/d']) == 'ISO8601'
+
+
+def test_detect_format_mixed():
+    assert detect_format(['2025-01-02', '02/01/2025', 'ieri', 'n/d']) == MIXED_FORMAT
+
+
+def test_parse_dates_dirty_cells_become_nat():
+    parsed = parse_dates(pd.Series(['2025-01-02 10:00', '2025-03-04 10:00', 'n/d']))
+    assert parsed.tolist()[:2] == [pd.Timestamp('2025-01-02 10:00'), pd.Timestamp('2025-03-04 10:00')]
+    assert pd.isna(parsed.iloc[2])
+
+
+def test_parse_dates_day_first():
+    parsed = parse_dates(pd.Series(['02/01/2025 10:00', '25/03/2025 11:30']))
+    assert parsed.tolist() == [pd.Timestamp('2025-01-02 10:00'), pd.Timestamp('2025-03-25 11:30')]
+
+
+def test_parse_dates_mixed_keeps_iso_year_month_day():
+    parsed = parse_dates(pd.Series(['2025-01-02', '03/04/2025', '2025-05-06', 'ieri']), fmt=MIXED_FORMAT)
+    assert parsed.tolist()[:3] == [pd.Timestamp('2025-01-02'), pd.Timestamp('2025-04-03'),
+                                   pd.Timestamp('2025-05-06')]
+    assert pd.isna(parsed.iloc[3])
+
+
+def test_parse_dates_with_offsets_to_local_time():
+    parsed = parse_dates(pd.Series(['2025-01-15T10:00:00+01:00', '2025-07-15T10:00:00+02:00']))
+    assert parsed.dt.tz is None
+    assert parsed.tolist() == [pd.Timestamp('2025-01-15 10:00'), pd.Timestamp('2025-07-15 10:00')]
+
+
+def test_parse_dates_day_first_late_unpadded_values():
+    # Il formato si riconosce sulle prime righe a due cifre; le righe successive
+    # senza zeri ('1/2/2025') non vengono riscritte come ISO ma restano valide
+    values = ['02/01/2025 10:00'] * (DETECT_SAMPLE_ROWS + 50) + ['1/2/2025 10:00', '25/03/2025 11:30', 'n/d']
+    parsed = parse_dates(pd.Series(values))
+    assert parsed.iloc[0] == pd.Timestamp('2025-01-02 10:00')
+    assert parsed.tolist()[-3:-1] == [pd.Timestamp('2025-02-01 10:00'), pd.Timestamp('2025-03-25 11:30')]
+    assert pd.isna(parsed.iloc[-1])
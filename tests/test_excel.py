@@ -0,0 +1,58 @@
+import datetime
+
+import openpyxl
+import pandas as pd
+import pytest
+
+from core import ingestion
+from core.ingestion import list_columns, list_excel_sheets, load_quality_file, read_excel_fast
+
+HEADER = ['Time', 'User ID', 'Sample ID', 'Test Name', 'Result', None, 'Unit']
+
+
+@pytest.fixture
+def workbook_path(tmp_path):
+    workbook = openpyxl.Workbook()
+    workbook.active.title = 'Note'
+    workbook.active.append(['solo testo'])
+    sheet = workbook.create_sheet('Letture')
+    sheet.append(HEADER)
+    for day in range(1, 11):
+        sheet.append([datetime.datetime(2025, 1, day, 10), 'ARNEL', 'CCA', 'COD', day * 10.0, 'x', 'mg/L'])
+    sheet.append([None] * len(HEADER))  # riga vuota: ignorata
+    sheet.append(['n/d', 'ARNEL', 'CCA', 'COD', 5.0, None, 'mg/L'])
+    path = tmp_path / 'letture.xlsx'
+    workbook.save(path)
+    return str(path)
+
+
+@pytest.fixture(params=['openpyxl', 'calamine'])
+def engine(request, monkeypatch):
+    if request.param == 'openpyxl':
+        monkeypatch.setattr(ingestion, 'python_calamine', None)
+    elif ingestion.python_calamine is None:
+        pytest.skip('python-calamine non installato')
+    return request.param
+
+
+def test_list_sheets_and_columns(workbook_path, engine):
+    assert list_excel_sheets(workbook_path) == ['Note', 'Letture']
+    assert list_columns(workbook_path, sheet_name='Letture') == ['Time', 'User ID', 'Sample ID', 'Test Name',
+                                                                 'Result', 'Unnamed: 5', 'Unit']
+
+
+def test_read_sheet_columns_and_rows(workbook_path, engine):
+    df = read_excel_fast(workbook_path, sheet_name='Letture', usecols=['Time', 'Result', 'Assente'], nrows=3)
+    assert list(df.columns) == ['Time', 'Result']
+    assert df['Result'].tolist() == [10.0, 20.0, 30.0]
+
+
+def test_first_sheet_by_default(workbook_path, engine):
+    assert list(read_excel_fast(workbook_path).columns) == ['solo testo']
+
+
+def test_load_quality_sheet(workbook_path, engine):
+    df = load_quality_file(workbook_path, sheet_name='Letture', usecols=['Unit'])
+    assert len(df) == 10
+    assert set(df.columns) == {'Time', 'User ID', 'Sample ID', 'Test Name', 'Result', 'Unit', 'Date'}
+    assert df['Time'].iloc[0] == pd.Timestamp('2025-01-01 10:00')
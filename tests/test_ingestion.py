@@ -0,0 +1,123 @@
+import io
+
+import pandas as pd
+import pytest
+
+from core import ingestion
+from core.ingestion import append_quality_rows, iter_quality_csv, load_quality_files, merge_quality_frames, read_quality_csv
+from core.validation import ValidationReport
+from helpers import quality_frame
+
+CSV_HEADER = 'Time,User ID,Sample ID,Test Number,Test Name,ABS,Result,Unit,Note\n'
+
+
+def _csv(lines, header=CSV_HEADER):
+    return io.BytesIO((header + ''.join(line + '\n' for line in lines)).encode())
+
+
+def _reading(day, result=None, note=''):
+    return f"2025-01-{day:02d} 10:00:00,ARNEL,CCA,LCK,COD,{day},{day * 10 if result is None else result},mg/L,{note}"
+
+
+@pytest.fixture(params=['pyarrow', 'pandas'])
+def parser(request, monkeypatch):
+    """Blocchi piccoli, così anche poche righe arrivano in più blocchi, con l'uno o l'altro parser."""
+    if request.param == 'pandas':
+        monkeypatch.setattr(ingestion, 'pa_csv', None)
+    elif ingestion.pa_csv is None:
+        pytest.skip('pyarrow non installato')
+    monkeypatch.setattr(ingestion, 'CSV_BLOCK_BYTES', 256)
+    return request.param
+
+
+def test_chunks_drop_invalid_times(parser):
+    lines = [_reading(day) for day in range(1, 29)] + ['n/d,ARNEL,CCA,LCK,COD,1,10,mg/L,']
+    progress = []
+    report = ValidationReport()
+    df = read_quality_csv(_csv(lines), chunksize=8, report=report,
+                          progress=lambda number, rows, fraction: progress.append(number))
+    assert len(progress) > 1
+    assert len(df) == 28
+    assert pd.api.types.is_datetime64_dtype(df['Time'])
+    assert df['Result'].dtype == 'float64'
+    assert df['Date'].tolist() == list(pd.date_range('2025-01-01', periods=28))
+    assert report.rows_read == 29
+
+
+def test_extra_column_changing_type_between_chunks(parser):
+    # 'Note' non è nello schema: numeri nei primi blocchi, testo più avanti
+    lines = [_reading(day, note=day) for day in range(1, 25)] + [_reading(day, note='rifatto') for day in range(25, 29)]
+    df = read_quality_csv(_csv(lines), chunksize=8)
+    assert len(df) == 28
+    assert df['Note'].tolist() == [str(day) for day in range(1, 25)] + ['rifatto'] * 4
+
+
+def test_non_numeric_results_are_read_as_empty(parser):
+    lines = [_reading(day) for day in range(1, 25)] + [_reading(25, result='abc')]
+    report = ValidationReport()
+    df = read_quality_csv(_csv(lines), chunksize=8, report=report)
+    assert len(df) == 25
+    assert pd.isna(df['Result'].iloc[-1])
+    assert sum(issue['rows'] for issue in report.issues) == 1
+
+
+def test_usecols_keeps_required_columns(parser):
+    df = read_quality_csv(_csv([_reading(day) for day in range(1, 10)]), chunksize=4,
+                          usecols=['Time', 'User ID', 'Sample ID', 'Test Name', 'Result'])
+    assert list(df.columns) == ['Time', 'User ID', 'Sample ID', 'Test Name', 'Result', 'Date']
+
+
+def test_iter_quality_csv_matches_read_quality_csv(parser):
+    lines = [_reading(day) for day in range(1, 29)]
+    lines += ['n/d,ARNEL,CCA,LCK,COD,1,10,mg/L,', '2025-02-01 10:00:00,ARNEL,CCB,LCK,COD,x,abc,mg/L,']
+    report = ValidationReport()
+    chunks = list(iter_quality_csv(_csv(lines), report=report, chunksize=8))
+    assert len(chunks) > 1
+    streamed = pd.concat(chunks, ignore_index=True)
+    whole = read_quality_csv(_csv(lines))
+    pd.testing.assert_frame_equal(streamed[whole.columns], whole, check_dtype=False)
+    assert len(streamed) == 29
+    assert pd.isna(streamed['Result'].iloc[-1])
+    assert report.rows_read == 30
+
+
+def test_merge_keeps_last_file_on_repeated_keys():
+    old = quality_frame(100)
+    new = old.iloc[50:].assign(Result=-1.0)
+    report = ValidationReport()
+    merged = merge_quality_frames([old, new], report=report)
+    assert len(merged) == 100
+    assert merged['Time'].is_monotonic_increasing
+    assert (merged['Result'].iloc[50:] == -1.0).all()
+    assert report.issues[0]['rows'] == 50
+
+
+def test_merge_single_frame_is_not_deduplicated():
+    df = quality_frame(10)
+    assert len(merge_quality_frames([pd.concat([df, df.iloc[:3]])])) == 13
+
+
+def test_load_overlapping_files_into_one_timeline(tmp_path):
+    # Due export sovrapposti, il secondo con risultati corretti per i giorni in comune
+    first, second = tmp_path / 'gennaio.csv', tmp_path / 'febbraio.csv'
+    first.write_text(CSV_HEADER + ''.join(_reading(day) + '\n' for day in range(1, 21)))
+    second.write_text(CSV_HEADER + ''.join(_reading(day, result=-1) + '\n' for day in range(15, 29)))
+    report = ValidationReport()
+    df = load_quality_files([str(first), str(second)], report=report)
+    assert len(df) == 28
+    assert df['Time'].is_monotonic_increasing
+    assert (df['Result'].iloc[14:] == -1).all()
+    assert any(issue['check'] == 'Duplicato' and issue['rows'] == 6 for issue in report.issues)
+
+
+def test_append_matches_full_merge():
+    df = merge_quality_frames([quality_frame(1000)])
+    new = pd.concat([df.iloc[-40:].assign(Result=-1.0), quality_frame(5, seed=1, start='2026-01-01')])
+    appended = append_quality_rows(df, new)
+    pd.testing.assert_frame_equal(appended, merge_quality_frames([df, new]))
+    assert len(appended) == 1005
+
+
+def test_append_to_empty_frame():
+    new = quality_frame(5)
+    pd.testing.assert_frame_equal(append_quality_rows(pd.DataFrame(), new), merge_quality_frames([new]))
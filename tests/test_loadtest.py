@@ -0,0 +1,99 @@
+import io
+import os
+
+import loadtest
+from core.ingestion import read_quality_csv
+
+
+class FakeUser:
+    """Sessione finta: ogni interazione fa due richieste e dura pochi millisecondi."""
+
+    def __init__(self, rng, fail_on=None):
+        self.rng = rng
+        self.fail_on = fail_on
+        self.steps = 0
+        self.closed = False
+
+    def open(self):
+        if self.fail_on == 0:
+            raise ConnectionError('pagina non caricata')
+        return 3, 0
+
+    def interact(self):
+        self.steps += 1
+        if self.steps == self.fail_on:
+            raise ConnectionError('server non raggiungibile')
+        return None, 2, 0
+
+    def close(self):
+        self.closed = True
+
+
+def test_run_level_counts_interactions_and_requests():
+    users = []
+
+    def make_user(rng):
+        users.append(FakeUser(rng))
+        return users[-1]
+
+    stats = loadtest.run_level(make_user, users=3, steps=4, think=0, pid=None, seed=1)
+    assert stats['interactions'] == 12
+    assert stats['requests'] == 3 * 3 + 12 * 2
+    assert stats['errors'] == 0
+    assert stats['p50_ms'] <= stats['p95_ms'] <= stats['p99_ms']
+    assert stats['peak_rss_mb'] is None
+    assert all(user.closed for user in users)
+
+
+def test_run_level_counts_a_failing_session_as_an_error():
+    stats = loadtest.run_level(lambda rng: FakeUser(rng, fail_on=2), users=2, steps=3, think=0, pid=None, seed=1)
+    assert stats['errors'] == 2
+    assert stats['interactions'] == 2
+
+
+def test_run_level_releases_the_others_when_a_page_does_not_load():
+    users = [FakeUser(None), FakeUser(None, fail_on=0)]
+    stats = loadtest.run_level(lambda rng: users.pop(), users=2, steps=3, think=0, pid=None, seed=1)
+    # L'altra sessione non resta ad aspettare: il suo avvio fallisce invece di bloccarsi
+    assert stats['errors'] == 2
+    assert stats['interactions'] == 0
+
+
+def test_run_level_samples_server_memory():
+    stats = loadtest.run_level(FakeUser, users=1, steps=1, think=0, pid=os.getpid(), seed=1)
+    assert stats['peak_rss_mb'] > 0
+
+
+def test_dash_callbacks_skip_what_the_script_does_not_drive():
+    dependencies = [
+        {'output': '..graph.figure...cards.children..', 'inputs': [{'id': 'chart', 'property': 'value'}],
+         'state': [{'id': 'store', 'property': 'data'}], 'prevent_initial_call': True},
+        {'output': 'table.data', 'inputs': [{'id': 'page', 'property': 'value'}]},
+        {'output': 'theme.className', 'inputs': [], 'clientside_function': {'function_name': 'f'}},
+        {'output': '{"index":["MATCH"],"type":"panel"}.figure', 'inputs': []},
+        {'output': 'graph.extendData@1234', 'inputs': []},
+    ]
+    callbacks = loadtest._dash_callbacks(dependencies)
+    assert [c['output'] for c in callbacks] == ['..graph.figure...cards.children..', 'table.data']
+    assert callbacks[0]['outputs'] == [('graph', 'figure'), ('cards', 'children')]
+    assert callbacks[0]['state'] == [('store', 'data')]
+    assert callbacks[1]['outputs'] == [('table', 'data')]
+
+
+def test_layout_props_walk_the_whole_tree():
+    layout = {'props': {'id': 'root', 'children': [
+        {'props': {'id': 'chart', 'value': 'line'}},
+        {'props': {'children': {'props': {'id': {'type': 'panel', 'index': 1}, 'figure': {}}}}},
+    ]}}
+    props = loadtest._layout_props(layout, {})
+    assert props[('chart', 'value')] == 'line'
+    assert props[('{"index":1,"type":"panel"}', 'figure')] == {}
+    assert ('root', 'children') in props
+
+
+def test_synthetic_readings_load_like_an_export():
+    df = loadtest.quality_frame(500, days=30)
+    loaded = read_quality_csv(io.BytesIO(df.to_csv(index=False).encode()))
+    assert len(loaded) == 500
+    assert loaded['Time'].is_monotonic_increasing
+    assert set(loaded['Sample ID']) <= set(loadtest.SYNTHETIC_SAMPLES)
@@ -0,0 +1,114 @@
+import io
+
+import pandas as pd
+import pytest
+
+from core import memory
+from core.memory import (MIN_SAMPLE_FRACTION, MODE_FULL, MODE_SAMPLED, MODE_STORE, MemoryGovernor, estimate_bytes,
+                         format_bytes, frame_bytes, get_memory_governor, sample_rows, value_bytes)
+from helpers import quality_frame
+
+
+class Released:
+    """Funzione di rilascio che ricorda quante volte è stata chiamata."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+
+
+def test_shared_item_counts_once_and_is_released_by_the_last_session():
+    governor = MemoryGovernor(budget=1000, session_budget_bytes=1000)
+    released = Released()
+    governor.hold('a', ('dataset', 'file'), 300, released, slot='dataset')
+    governor.hold('b', ('dataset', 'file'), 300, released, slot='dataset')
+    assert governor.total_bytes() == 300
+    assert governor.session_bytes('a') == governor.session_bytes('b') == 300
+    governor.close('a')
+    assert released.calls == 0
+    governor.close('b')
+    assert released.calls == 1
+    assert governor.total_bytes() == 0
+
+
+def test_new_item_in_a_slot_replaces_the_previous_one():
+    governor = MemoryGovernor(budget=1000, session_budget_bytes=1000)
+    old = Released()
+    governor.hold('a', ('filtered', 1), 200, old, slot='filtered')
+    governor.hold('a', ('filtered', 2), 50, Released(), slot='filtered')
+    assert old.calls == 1
+    assert governor.slot_bytes('a', 'filtered') == 50
+    governor.drop('a', 'filtered')
+    assert governor.session_bytes('a') == 0
+
+
+def test_over_budget_closes_the_least_recent_sessions_but_not_the_current():
+    governor = MemoryGovernor(budget=500, session_budget_bytes=500)
+    first = Released()
+    governor.hold('vecchia', 'x', 300, first)
+    closed = governor.hold('nuova', 'y', 300, Released())
+    assert closed == ['vecchia']
+    assert first.calls == 1
+    # Da sola la sessione che lavora resta aperta anche oltre il limite
+    assert governor.hold('nuova', 'z', 600) == []
+
+
+def test_idle_sessions_are_closed(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(memory.time, 'monotonic', lambda: clock[0])
+    governor = MemoryGovernor(budget=1000, session_budget_bytes=1000, idle_seconds=60)
+    governor.hold('ferma', 'x', 100)
+    clock[0] += 61
+    assert governor.enforce(current='attiva') == ['ferma']
+    assert governor.total_bytes() == 0
+
+
+def test_plan_picks_full_store_or_sampled_loading():
+    governor = MemoryGovernor(budget=1000, session_budget_bytes=400)
+    governor.hold('a', 'dataset', 300, slot='dataset')
+    assert governor.plan('a', 100) == (MODE_FULL, 1.0)
+    # Il nuovo dataset prende il posto di quello già caricato
+    assert governor.plan('a', 350, replaces=governor.slot_bytes('a', 'dataset')) == (MODE_FULL, 1.0)
+    assert governor.plan('a', 800, store_available=True) == (MODE_STORE, 1.0)
+    assert governor.plan('a', 1000) == (MODE_SAMPLED, pytest.approx(0.1))
+    assert governor.plan('a', 10 ** 9)[1] == MIN_SAMPLE_FRACTION
+
+
+def test_estimate_uses_the_file_type():
+    csv, xlsx = io.BytesIO(b'x' * 100), io.BytesIO(b'x' * 100)
+    csv.name, xlsx.name = 'dati.csv', 'dati.xlsx'
+    assert estimate_bytes([csv]) == 300
+    assert estimate_bytes([csv, xlsx]) == 900
+    assert estimate_bytes([io.BytesIO(b'x' * 100)], filenames=['dati.CSV']) == 300
+
+
+def test_sample_keeps_every_series_and_its_first_reading():
+    df = quality_frame(3000)
+    sampled = sample_rows(df, 0.1)
+    assert len(sampled) == pytest.approx(300, abs=6)
+    series = ['Sample ID', 'Test Name']
+    assert set(map(tuple, sampled[series].values)) == set(map(tuple, df[series].values))
+    pd.testing.assert_frame_equal(sampled.groupby(series).head(1), df.groupby(series).head(1))
+    assert sample_rows(df, 1.0) is df
+
+
+def test_sample_by_chunks_matches_the_whole_frame():
+    df = quality_frame(1000)
+    seen = {}
+    chunks = [sample_rows(df.iloc[start:start + 70], 0.15, seen=seen) for start in range(0, len(df), 70)]
+    pd.testing.assert_frame_equal(pd.concat(chunks), sample_rows(df, 0.15))
+
+
+def test_sizes_of_frames_and_export_files():
+    df = quality_frame(10)
+    assert value_bytes(df) == frame_bytes(df) > 0
+    assert value_bytes((b'abc', b'de')) == 5
+    assert value_bytes(None) == 0
+    assert format_bytes(512) == '512 B'
+    assert format_bytes(3 * 1024 * 1024) == '3.0 MB'
+
+
+def test_governor_is_shared_by_the_process():
+    assert get_memory_governor() is get_memory_governor()
@@ -0,0 +1,64 @@
+from datetime import date
+
+import pandas as pd
+import pytest
+
+from core import prewarm
+from core.prewarm import ViewStats, normalize_view, restore_view, start_prewarm, view_dates, view_key
+
+DEFAULTS = {'start_date': pd.Timestamp('2025-01-01'), 'end_date': date(2025, 12, 31),
+            'samples': ['CCA', 'CCB'], 'chart_type': 'line'}
+
+
+@pytest.fixture
+def stats(tmp_path, monkeypatch):
+    stats = ViewStats(tmp_path / 'viste.json')
+    monkeypatch.setattr(prewarm, '_stats', stats)
+    return stats
+
+
+def test_views_keep_only_what_differs_from_the_defaults():
+    view = normalize_view({**DEFAULTS, 'samples': ['CCB', 'CCA'], 'chart_type': 'box'}, DEFAULTS)
+    assert view == {'chart_type': 'box'}
+    assert normalize_view({**DEFAULTS, 'samples': []}, DEFAULTS) == {'samples': None}
+    assert view_key({'samples': ['B', 'A']}) == view_key({'samples': ['A', 'B']})
+
+
+def test_restored_view_dates():
+    state = restore_view({'end_date': '2025-06-30'}, DEFAULTS)
+    assert view_dates(state) == (date(2025, 1, 1), date(2025, 6, 30))
+    assert view_dates({'start_date': None, 'end_date': ''}) == (None, None)
+
+
+def test_most_requested_views_survive_a_flush(stats):
+    for _ in range(3):
+        stats.record('pagina', {'chart_type': 'box'})
+    stats.record('pagina', {'samples': ['CCA']})
+    stats.flush()
+    stats.record('pagina', {'samples': ['CCA']})
+    assert ViewStats(stats.path).top('pagina', 5) == [{'chart_type': 'box'}, {'samples': ['CCA']}]
+    assert stats.top('pagina', 1) == [{'chart_type': 'box'}]
+
+
+def test_prewarm_passes_the_page_data_explicitly(stats):
+    stats.record('pagina', {'chart_type': 'box'})
+    warmed = []
+    thread = start_prewarm('pagina', lambda state, key, df: warmed.append((state['chart_type'], key, df)),
+                           DEFAULTS, version='v1', n=3, wait=True, args=('v1', 'dati'))
+    assert thread is not None
+    assert warmed == [('line', 'v1', 'dati'), ('box', 'v1', 'dati')]
+    # Una sola volta per versione dei dati
+    assert start_prewarm('pagina', warmed.append, DEFAULTS, version='v1', wait=True) is None
+
+
+def test_a_failing_view_does_not_stop_the_others(stats):
+    stats.record('errori', {'chart_type': 'box'})
+    warmed = []
+
+    def warm(state):
+        if state['chart_type'] == 'line':
+            raise ValueError('vista non valida')
+        warmed.append(state['chart_type'])
+
+    start_prewarm('errori', warm, DEFAULTS, n=2, wait=True)
+    assert warmed == ['box']
@@ -0,0 +1,76 @@
+import os
+
+from core.registry import UploadRegistry
+
+
+def _registry(tmp_path, **kwargs):
+    return UploadRegistry(root=tmp_path / 'uploads', **kwargs)
+
+
+def test_same_content_is_saved_once(tmp_path):
+    registry = _registry(tmp_path)
+    first = registry.register(b'a,b\n1,2\n', 'dati.csv')
+    second = registry.register(memoryview(b'a,b\n1,2\n'), 'copia.csv')
+    assert first == second
+    assert os.listdir(registry.root) == [first]
+    assert registry.register(b'a,b\n1,3\n', 'dati.csv') != first
+
+
+def test_path_points_to_the_saved_file(tmp_path):
+    registry = _registry(tmp_path)
+    upload_id = registry.register(bytearray(b'contenuto'), '../cartella/dati.csv')
+    path = registry.path(upload_id)
+    assert os.path.basename(path) == 'dati.csv'
+    assert os.path.dirname(path) == os.path.join(registry.root, upload_id)
+    with open(path, 'rb') as handle:
+        assert handle.read() == b'contenuto'
+
+    assert registry.path('sconosciuto') is None
+    os.remove(path)
+    assert registry.path(upload_id) is None
+
+
+def test_idle_uploads_are_evicted_except_kept_ones(tmp_path):
+    registry = _registry(tmp_path, idle_seconds=60)
+    old = registry.register(b'vecchio', 'a.csv')
+    kept = registry.register(b'in uso', 'b.csv')
+    recent = registry.register(b'recente', 'c.csv')
+    now = registry._entries[recent]['last_used']
+    registry._entries[old]['last_used'] = now - 120
+    registry._entries[kept]['last_used'] = now - 120
+
+    assert registry.evict(keep=[kept], now=now) == [old]
+    assert registry.path(old) is None
+    assert not os.path.exists(os.path.join(registry.root, old))
+    assert registry.path(kept) is not None
+    assert registry.path(recent) is not None
+
+
+def test_least_recently_used_uploads_go_over_the_size_limit(tmp_path):
+    registry = _registry(tmp_path, max_bytes=25)
+    first = registry.register(b'0' * 10, 'a.csv')
+    second = registry.register(b'1' * 10, 'b.csv')
+    # Letto per ultimo: diventa il più recente
+    registry._entries[first]['last_used'] = registry._entries[second]['last_used'] + 1
+
+    third = registry.register(b'2' * 10, 'c.csv')
+    assert registry.path(second) is None
+    assert registry.path(first) is not None
+    assert registry.path(third) is not None
+
+
+def test_new_upload_is_kept_even_over_the_size_limit(tmp_path):
+    registry = _registry(tmp_path, max_bytes=5)
+    upload_id = registry.register(b'0' * 10, 'grande.csv')
+    assert registry.path(upload_id) is not None
+
+
+def test_uploads_survive_a_restart(tmp_path):
+    upload_id = _registry(tmp_path).register(b'contenuto', 'dati.csv')
+    # File temporaneo di una scrittura interrotta: ignorato
+    (tmp_path / 'uploads' / 'parziale').mkdir()
+    (tmp_path / 'uploads' / 'parziale' / '.tmp123').write_bytes(b'x')
+
+    registry = _registry(tmp_path)
+    assert set(registry._entries) == {upload_id}
+    assert registry.path(upload_id).endswith('dati.csv')
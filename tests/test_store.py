@@ -0,0 +1,144 @@
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import pandas as pd
+import pytest
+
+from core import ingestion
+from core.ingestion import load_quality_files
+from core.store import DataStore, duckdb
+from core.validation import ValidationReport, validate_quality
+from helpers import quality_frame
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+BACKENDS = ['sqlite'] + (['duckdb'] if duckdb is not None else [])
+
+
+@pytest.fixture(params=BACKENDS)
+def store(request, tmp_path):
+    return DataStore(tmp_path / f'avs.{request.param}', backend=request.param)
+
+
+def test_append_replaces_rows_with_the_same_key(store):
+    df = quality_frame(100)
+    store.write_quality(df)
+    store.write_quality(df.iloc[80:].assign(Result=-1.0), mode='append')
+    rows = store.quality_rows({})
+    assert len(rows) == 100
+    assert (rows['Result'].iloc[80:] == -1.0).all()
+    assert (rows['Result'].iloc[:80] == df['Result'].iloc[:80]).all()
+
+
+def test_replace_drops_previous_rows(store):
+    store.write_quality(quality_frame(100))
+    store.write_quality(quality_frame(10, seed=1))
+    assert len(store.quality_rows({})) == 10
+
+
+def test_filters_and_summary_match_pandas(store):
+    df = quality_frame(500)
+    store.write_quality(df)
+    filters = {'start_date': '2025-01-02', 'end_date': '2025-01-03', 'results_range': [500, 2500],
+               'samples': ['CCA', 'OSMOSI'], 'tests': ['COD']}
+    expected = df[(df['Date'] >= '2025-01-02') & (df['Date'] <= '2025-01-03') & df['Result'].between(500, 2500)
+                  & df['Sample ID'].isin(['CCA', 'OSMOSI']) & (df['Test Name'] == 'COD')]
+    rows = store.quality_rows(filters)
+    assert rows['Time'].tolist() == expected['Time'].tolist()
+    summary = store.quality_summary(filters)
+    assert summary['tests'] == len(expected)
+    assert summary['avg_result'] == pytest.approx(expected['Result'].mean())
+
+
+def test_duplicates_are_counted_as_in_memory(store):
+    df = quality_frame(50)
+    repeated = pd.concat([df, df.iloc[:4], df.iloc[4:6].assign(Result=-1.0)], ignore_index=True)
+    store.write_table('quality', repeated)
+    expected = validate_quality(repeated, ValidationReport())
+    same, conflicting = store.quality_duplicates(5)
+    assert [same[0], conflicting[0]] == [issue['rows'] for issue in expected.issues if issue['check'] == 'Duplicato']
+    assert len(same[1]) == 4 and len(conflicting[1]) == 2
+    store.write_quality(df)
+    assert store.quality_duplicates(5) == ((0, []), (0, []))
+
+
+@pytest.mark.parametrize('block_bytes', [256, 8 * 1024 * 1024])
+@pytest.mark.parametrize('files', [1, 2])
+def test_streamed_files_keep_the_rows_of_a_full_load(store, tmp_path, monkeypatch, block_bytes, files):
+    # Le stesse letture ripetute, che i file arrivino in un blocco o in tanti
+    import app_export
+    monkeypatch.setattr(app_export, 'STORE', store)
+    monkeypatch.setattr(ingestion, 'CSV_BLOCK_BYTES', block_bytes)
+    df = quality_frame(60).drop(columns='Date')
+    parts = [pd.concat([df.iloc[:40], df.iloc[:3]]), df.iloc[30:].assign(Result=-1.0)]
+    paths = []
+    for number, part in enumerate(parts if files == 2 else [pd.concat(parts)]):
+        paths.append(str(tmp_path / f'{number}.csv'))
+        part.to_csv(paths[-1], index=False, date_format='%Y-%m-%d %H:%M:%S')
+    expected = ValidationReport()
+    loaded = load_quality_files(paths, report=expected)
+    report = ValidationReport()
+    assert app_export.stream_to_store(paths, report=report) == len(loaded)
+    # A parità di 'Time' l'archivio non garantisce l'ordine
+    readings = ['Time', 'Sample ID', 'Test Name', 'Result']
+    assert (store.quality_rows({})[readings].sort_values(readings).values.tolist()
+            == loaded[readings].sort_values(readings).values.tolist())
+    duplicates = sorted((issue['message'], issue['rows']) for issue in expected.issues if issue['check'] == 'Duplicato')
+    assert sorted((issue['message'], issue['rows']) for issue in report.issues if issue['check'] == 'Duplicato') == duplicates
+    assert (report.rows_read, report.rows_kept) == (expected.rows_read, expected.rows_kept)
+
+
+def test_data_version_changes_on_every_write(store):
+    assert store.data_version() == ''
+    store.write_quality(quality_frame(10))
+    first = store.data_version()
+    store.write_quality(quality_frame(10, seed=1), mode='append')
+    assert first and store.data_version() != first
+
+
+def test_quality_options(store):
+    df = quality_frame(50)
+    store.write_quality(df)
+    options = store.quality_options()
+    assert options['min_date'] == df['Date'].min()
+    assert set(options['samples']) == set(df['Sample ID'])
+    assert options['has_abs'] is False
+
+
+def test_write_checks_the_table_on_its_own_connection(store, monkeypatch):
+    store.write_quality(quality_frame(10))
+    # Un append non deve aprire una seconda connessione per sapere se la tabella esiste
+    monkeypatch.setattr(DataStore, 'has_table', lambda self, table: pytest.fail('seconda connessione'))
+    store.write_quality(quality_frame(10, seed=1, start='2026-01-01'), mode='append')
+    assert len(store.quality_rows({})) == 20
+
+
+@pytest.mark.skipif(duckdb is None, reason='DuckDB non installato')
+def test_duckdb_query_waits_for_a_writer(tmp_path):
+    store = DataStore(tmp_path / 'avs.duckdb', backend='duckdb')
+    store.write_quality(quality_frame(10))
+    # Una connessione in scrittura aperta altrove: la query in sola lettura riprova finché non si chiude
+    writer = duckdb.connect(store.path)
+    timer = threading.Timer(0.3, writer.close)
+    timer.start()
+    started = time.monotonic()
+    assert len(store.quality_rows({})) == 10
+    assert time.monotonic() - started >= 0.2
+    timer.join()
+
+
+@pytest.mark.skipif(duckdb is None, reason='DuckDB non installato')
+def test_duckdb_readers_share_the_file_across_processes(tmp_path):
+    store = DataStore(tmp_path / 'avs.duckdb', backend='duckdb')
+    store.write_quality(quality_frame(10))
+    reader = duckdb.connect(store.path, read_only=True)
+    try:
+        code = ("import sys; from core.store import DataStore; "
+                f"sys.exit(0 if len(DataStore({store.path!r}).quality_rows({{}})) == 10 else 1)")
+        result = subprocess.run([sys.executable, '-c', code], cwd=REPO_DIR, capture_output=True, timeout=60)
+        assert result.returncode == 0, result.stderr
+    finally:
+        reader.close()
@@ -0,0 +1,84 @@
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from core.tasks import TaskGraph
+
+REQUEST = contextvars.ContextVar('request', default=None)
+
+
+@pytest.fixture
+def executor():
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        yield pool
+
+
+def test_dependencies_come_first_then_arguments(executor):
+    graph = TaskGraph(executor)
+    graph.add('a', lambda: 2)
+    graph.add('b', lambda: 3)
+    graph.add('c', lambda a, b, scale, offset=0: (a * b) * scale + offset, 10, deps=['a', 'b'], offset=1)
+    graph.add('d', lambda b, a: b - a, deps=['b', 'a'])
+    assert graph.results() == {'a': 2, 'b': 3, 'c': 61, 'd': 1}
+
+
+def test_independent_tasks_run_in_parallel(executor):
+    # Ognuno dei due compiti aspetta l'altro: terminano solo se girano insieme
+    barrier = threading.Barrier(2, timeout=5)
+    graph = TaskGraph(executor)
+    graph.add('left', barrier.wait)
+    graph.add('right', barrier.wait)
+    assert sorted(graph.results(timeout=10).values()) == [0, 1]
+
+
+def test_task_with_several_finished_dependencies_runs_once(executor):
+    calls = []
+    graph = TaskGraph(executor)
+    for name in ('a', 'b', 'c'):
+        graph.add(name, lambda name=name: name)
+    graph.add('join', lambda *values: calls.append(values) or ''.join(values), deps=['a', 'b', 'c'])
+    assert graph.result('join') == 'abc'
+    assert calls == [('a', 'b', 'c')]
+
+
+def test_failure_reaches_dependent_tasks(executor):
+    def broken():
+        raise KeyError('colonna')
+
+    graph = TaskGraph(executor)
+    graph.add('broken', broken)
+    graph.add('figure', lambda value: value, deps=['broken'])
+    graph.add('other', lambda: 'ok')
+    with pytest.raises(KeyError):
+        graph.result('figure')
+    with pytest.raises(KeyError):
+        graph.result('broken')
+    assert graph.result('other') == 'ok'
+
+
+def test_tasks_see_the_context_of_the_caller(executor):
+    REQUEST.set('richiesta-1')
+    graph = TaskGraph(executor)
+    graph.add('seen', REQUEST.get)
+    REQUEST.set('richiesta-2')
+    assert graph.result('seen') == 'richiesta-1'
+
+
+def test_invalid_additions_are_rejected(executor):
+    graph = TaskGraph(executor)
+    graph.add('a', lambda: 1)
+    with pytest.raises(ValueError):
+        graph.add('a', lambda: 2)
+    with pytest.raises(ValueError):
+        graph.add('b', lambda x: x, deps=['mancante'])
+    graph.start()
+    with pytest.raises(RuntimeError):
+        graph.add('c', lambda: 3)
+
+
+def test_shared_pool_is_used_by_default():
+    graph = TaskGraph()
+    graph.add('thread', lambda: threading.current_thread().name)
+    assert graph.result('thread').startswith('avs-task')
@@ -0,0 +1,47 @@
+import numpy as np
+import pandas as pd
+import plotly.express as px
+
+from core.transport import compact_figure, epoch_ms, hover_columns, hover_rows
+from helpers import quality_frame
+
+
+def _frame(rows):
+    df = quality_frame(rows)
+    return df.assign(Registrata=df['Date'] + pd.Timedelta(hours=1))
+
+
+def _figure(df):
+    return px.scatter(df, x='Date', y='Result', color='Sample ID', hover_data=['User ID', 'Test Name', 'Registrata'])
+
+
+def test_epoch_ms_keeps_missing_dates():
+    values = np.array(['2025-01-01T00:00:01', 'NaT'], dtype='datetime64[ns]')
+    out = epoch_ms(values)
+    assert out[0] == pd.Timestamp('2025-01-01 00:00:01').value / 1e6
+    assert np.isnan(out[1])
+
+
+def test_compact_figure_keeps_dates_and_tooltips():
+    df = _frame(60).assign(**{'User ID': 'operatore'})
+    fig = compact_figure(_figure(df))
+    assert fig.layout.xaxis.type == 'date'
+    for trace in fig.data:
+        rows = df[df['Sample ID'] == trace.name]
+        assert trace.x.dtype == np.float64
+        assert (pd.to_datetime(trace.x, unit='ms') == rows['Date'].to_numpy()).all()
+        # Colonna costante scritta nel tooltip, le altre restano in customdata
+        assert 'operatore' in trace.hovertemplate
+        assert trace.customdata.shape == (len(rows), 2)
+        assert list(trace.customdata[:, 0]) == rows['Test Name'].tolist()
+        assert list(trace.customdata[:, 1]) == rows['Registrata'].dt.strftime('%Y-%m-%d %H:%M:%S').tolist()
+
+
+def test_hover_rows_extend_an_extendable_figure():
+    df = _frame(30)
+    fig = compact_figure(_figure(df), extendable=True)
+    trace = fig.data[0]
+    columns = hover_columns(trace)
+    assert columns == ['User ID', 'Test Name', 'Registrata']
+    rows = df[df['Sample ID'] == trace.name]
+    assert hover_rows(rows, columns) == trace.customdata.tolist()
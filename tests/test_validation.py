@@ -0,0 +1,107 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from core.validation import (MAX_EXAMPLES, SEVERITY_INFO, SchemaError, ValidationReport, check_columns,
+                             coerce_numeric, count_invalid_dates, validate_osmosi, validate_quality)
+from helpers import quality_frame
+
+
+def _issue(report, check, message_part=''):
+    matches = [issue for issue in report.issues if issue['check'] == check and message_part in issue['message']]
+    assert len(matches) == 1, report.issues
+    return matches[0]
+
+
+def _osmosi(totals, first=1000):
+    starts = pd.date_range('2025-01-01', periods=len(totals), freq='MS')
+    meter = first + np.concatenate([[0], np.cumsum(totals)[:-1]])
+    return pd.DataFrame({
+        'Data Inizio': starts, 'MC Inizio': meter, 'Data Fine': starts + pd.offsets.MonthEnd(0),
+        'MC Fine': meter + np.asarray(totals), 'Totale MC': totals,
+        'Mese': starts.month, 'Lavaggio': 0, 'Anno': starts.year,
+    })
+
+
+def test_check_columns_names_the_missing_ones():
+    check_columns(['Time', 'Result', 'Altro'], ['Time', 'Result'])
+    with pytest.raises(SchemaError, match='Sample ID, Result'):
+        check_columns(['Time'], ['Time', 'Sample ID', 'Result'])
+
+
+def test_coerce_numeric_accepts_decimal_commas():
+    df = pd.DataFrame({'Result': ['1,5', ' 2 ', 'n/d', None, '-3,25'], 'Anno': ['2024', '2025', '2025', '2025', '2025']})
+    report = ValidationReport()
+    coerce_numeric(df, ['Result', 'Anno', 'Mancante'], report)
+    assert df['Result'].tolist()[:3] == [1.5, 2.0, pytest.approx(np.nan, nan_ok=True)]
+    assert df['Result'].iloc[4] == -3.25
+    assert df['Anno'].dtype == 'int64'
+    issue = _issue(report, 'Valore non numerico')
+    assert (issue['rows'], issue['column'], issue['examples']) == (1, 'Result', ['n/d'])
+
+
+def test_invalid_dates_are_counted_with_examples():
+    original = pd.Series(['2025-01-01', 'ieri', None, 'ieri'])
+    report = ValidationReport()
+    valid = count_invalid_dates(original, pd.to_datetime(original, errors='coerce', format='ISO8601'), 'Time', report)
+    assert valid.tolist() == [True, False, False, False]
+    issue = _issue(report, 'Data non valida')
+    assert issue['rows'] == 3
+    assert issue['examples'] == ['ieri']
+
+
+def test_repeated_readings_are_split_by_value():
+    df = quality_frame(50)
+    repeated = pd.concat([df, df.iloc[:4], df.iloc[4:6].assign(Result=-1.0)], ignore_index=True)
+    report = validate_quality(repeated, ValidationReport())
+    assert report.rows_kept == 56
+    assert _issue(report, 'Duplicato', 'stesso valore')['rows'] == 4
+    assert _issue(report, 'Duplicato', 'Result diverso')['rows'] == 2
+
+
+def test_impossible_results_follow_the_test_range():
+    df = pd.DataFrame({
+        'Time': pd.date_range('2025-01-01', periods=5, freq='h'),
+        'Sample ID': 'CCA',
+        'Test Name': ['pH', 'pH', 'COD', 'COD', 'COD'],
+        'Result': [15.0, 7.0, -2.0, 100.0, np.nan],
+    })
+    report = validate_quality(df, ValidationReport())
+    assert _issue(report, 'Valore impossibile', 'intervallo')['examples'] == ['pH: 15']
+    assert _issue(report, 'Valore impossibile', 'negativi')['examples'] == ['COD: -2']
+    missing = _issue(report, 'Valore mancante')
+    assert (missing['rows'], missing['severity']) == (1, SEVERITY_INFO)
+    # Senza 'ABS' la matrice di correlazione non c'è: solo un'informazione
+    assert _issue(report, 'Colonna assente')['severity'] == SEVERITY_INFO
+    assert len(report.warnings) == 2
+
+
+def test_clean_quality_data_has_no_warnings():
+    report = validate_quality(quality_frame(200).assign(ABS=0.1), ValidationReport())
+    assert report.issues == []
+    assert report.summary() == '0 righe lette, 200 caricate, nessun problema'
+
+
+def test_osmosi_meter_checks():
+    df = _osmosi([100, 200, 150, 120])
+    df.loc[2, 'Totale MC'] = 180          # non torna con le letture del contatore
+    df.loc[3, 'MC Inizio'] -= 50          # riparte sotto la lettura precedente
+    df.loc[3, 'Totale MC'] = 170
+    df.loc[1, 'Data Fine'] = pd.Timestamp('2024-12-31')
+    report = validate_osmosi(df, ValidationReport())
+    assert _issue(report, 'Contatore', 'diverso')['rows'] == 1
+    assert _issue(report, 'Contatore', 'periodo precedente')['rows'] == 1
+    assert _issue(report, 'Periodo non valido')['examples'] == ['2025-02-01']
+    assert validate_osmosi(_osmosi([100, 200, 150]), ValidationReport()).issues == []
+
+
+def test_repeated_issues_add_up_and_keep_few_examples():
+    report = ValidationReport(source='a.csv')
+    for chunk in range(3):
+        report.add('Data non valida', 'Date non riconosciute', 4, column='Time',
+                   examples=[f'{chunk}-{i}' for i in range(4)])
+    issue = _issue(report, 'Data non valida')
+    assert issue['rows'] == 12
+    assert len(issue['examples']) == MAX_EXAMPLES
+    report.add('Data non valida', 'Date non riconosciute', 0)
+    assert report.to_frame()['Dettaglio'].tolist() == ['Date non riconosciute (a.csv)']
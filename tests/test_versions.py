@@ -0,0 +1,53 @@
+import pandas as pd
+import pytest
+
+from core.anomaly import score_anomalies
+from core.compliance import apply_limits
+from core.schema import QUALITY_DEDUP_KEYS, QUALITY_DERIVED_COLUMNS
+from core.versions import ADDED, CHANGED, REMOVED, VersionStore, previous_version
+from helpers import quality_frame
+
+
+@pytest.fixture
+def store(tmp_path):
+    return VersionStore('quality', QUALITY_DEDUP_KEYS, root=tmp_path)
+
+
+def test_same_content_is_one_version(store):
+    df = quality_frame(200)
+    first = store.record(df, 'a.csv')
+    again = store.record(df.sample(frac=1, random_state=0), 'b.csv')
+    assert again['id'] == first['id']
+    assert len(store.versions()) == 1
+
+
+def test_diff_counts_changes(store):
+    old = quality_frame(200)
+    new = pd.concat([old.iloc[10:], quality_frame(5, seed=1, start='2026-01-01')], ignore_index=True)
+    new.loc[0, 'Result'] = -1.0
+    first, second = store.record(old), store.record(new)
+    assert (second[ADDED], second[REMOVED], second[CHANGED]) == (5, 10, 1)
+    counts, table = store.compare(first['id'], second['id'])
+    assert counts == {ADDED: 5, REMOVED: 10, CHANGED: 1}
+    reverse, _ = store.compare(second['id'], first['id'])
+    assert reverse == {ADDED: 10, REMOVED: 5, CHANGED: 1}
+    assert previous_version(store.versions(), second['id']) == first['id']
+
+
+def test_load_rebuilds_each_version(store):
+    frames = [quality_frame(100 + 10 * step) for step in range(4)]
+    metas = [store.record(df) for df in frames]
+    for df, meta in zip(frames, metas):
+        loaded = store.load(meta['id'])
+        expected = df.sort_values(list(QUALITY_DEDUP_KEYS), kind='stable').reset_index(drop=True)
+        pd.testing.assert_frame_equal(loaded[expected.columns], expected, check_dtype=False)
+
+
+def test_derived_columns_are_not_part_of_the_version(store):
+    # Le pagine registrano la versione dopo limiti e anomalie, togliendo le colonne calcolate
+    df = quality_frame(300)
+    limits = pd.DataFrame({'Test Name': ['COD'], 'Sample ID': [None], 'Valido Dal': [pd.Timestamp('2025-01-01')],
+                           'Limite Min': [float('nan')], 'Limite Max': [1500.0]})
+    scored = score_anomalies(apply_limits(df, limits))
+    loaded = scored.drop(columns=[col for col in QUALITY_DERIVED_COLUMNS if col in scored.columns])
+    assert store.record(loaded)['id'] == store.record(df)['id']
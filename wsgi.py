@@ -0,0 +1,23 @@
+"""
+Production entry point for the Dash dashboard (app_export.py).
+
+    gunicorn wsgi:server                       # settings from gunicorn.conf.py
+    waitress-serve --listen=0.0.0.0:8050 --threads=8 wsgi:server
+
+Debug tooling and the reloader stay off. The default datasets (AVS_DEFAULT_DATA)
+are loaded here, at import time: with gunicorn's preload_app the master process
+loads them once and the forked workers share those pages copy-on-write. The
+most requested views are built here too, so every worker starts with them cached.
+"""
+import gc
+
+from app_export import prewarm_views, preload_default_data, server
+
+preload_default_data()
+prewarm_views(wait=True)
+
+# Move everything loaded so far out of the garbage collector's reach, so the
+# collector running in the workers doesn't touch (and copy) the shared pages
+gc.freeze()
+
+__all__ = ['server']